@@ -43,18 +43,26 @@ logger.debug('%s', f'loading {__name__}')
 # Configure logging based on configfile, then handle collected logrecords.
 mylogging.configure()
 
+# The headless commands (like 'analyze') run on machines without a
+# display, so the GUI modules (and wx) are only imported for the GUI.
+from LabGym import myargparse
+headless = myargparse.get_command() is not None
+
 # Related third party imports.
 from packaging import version  # Core utilities for Python packages
 import requests  # Python HTTP for Humans.
-from LabGym import mywx  # on load, monkeypatch wx.App to be a strict-singleton
-import wx  # wxPython, Cross platform GUI toolkit for Python, "Phoenix" version
+if not headless:
+	from LabGym import mywx  # on load, monkeypatch wx.App to be a strict-singleton
+	import wx  # wxPython, Cross platform GUI toolkit for Python, "Phoenix" version
 
 # Local application/library specific imports.
 # pylint: disable=ungrouped-imports
 # pylint: disable-next=unused-import
 from LabGym import mypkg_resources  # replace deprecated pkg_resources
-from LabGym import __version__, gui_main, probes
-from LabGym import config, selftest
+from LabGym import __version__
+from LabGym import config
+if not headless:
+	from LabGym import gui_main, probes, selftest
 
 
 logger.debug('%s: %r', '(__name__, __package__)', (__name__, __package__))
@@ -64,7 +72,17 @@ def main() -> None:
 	"""Perform some pre-op probing, then display the main window."""
 
 	# Get all of the values needed from config.get_config().
-	flag_selftest: bool = config.get_config()['selftest']
+	_config = config.get_config()
+	flag_selftest: bool = _config['selftest']
+	command = _config.get('command')
+
+	if command == 'analyze':
+		# Headless batch analysis, without the GUI.
+		from LabGym import analyzecli
+		logger.info('%s -- %s', 'analyzecli.analyze()', 'calling...')
+		result = analyzecli.analyze(_config['jobfile'])
+		logger.info('%s -- %s', f'sys.exit({result!r})', 'calling...')
+		sys.exit(result)
 
 	if flag_selftest:
 		logger.info('%s -- %s', 'run_selftests()', 'calling...')
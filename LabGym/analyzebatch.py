@@ -0,0 +1,448 @@
+'''
+Copyright (C)
+This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with this program. If not, see https://tldrlegal.com/license/gnu-general-public-license-v3-(gpl-3)#fulltext.
+
+For license issues, please contact:
+
+Dr. Bing Ye
+Life Sciences Institute
+University of Michigan
+210 Washtenaw Avenue, Room 5403
+Ann Arbor, MI 48109-2216
+USA
+
+Email: bingye@umich.edu
+'''
+
+
+# Standard library imports.
+from concurrent.futures import FIRST_COMPLETED,ProcessPoolExecutor,wait
+import json
+import logging
+import multiprocessing
+import os
+
+# Log the load of this module (by the module loader, on first import).
+# Intentionally positioning these statements before other imports, against the
+# guidance of PEP-8, to log the load before other imports log messages.
+logger = logging.getLogger(__name__)
+logger.debug('loading %s', __file__)
+
+# Related third party imports.
+import cv2
+import matplotlib as mpl
+import pandas as pd
+
+# Local application/library specific imports.
+from .tools import plot_events, write_events_npz
+
+
+# the analysis settings of a video, named as the attributes of the 'Analyze Behaviors' panel
+settings_names=(
+	'use_detector', # whether the Detector is used
+	'path_to_detector', # path to the Detector
+	'detector_batch', # for batch processing use if GPU is available
+	'animal_kinds', # the total categories of animals / objects in a Detector
+	'behavior_mode', # 0--non-interactive, 1--interactive basic, 2--interactive advanced
+	'background_path', # if not None, load background images from path in 'background subtraction' detection method
+	'path_to_categorizer', # path to the Categorizer, None for tracking only
+	'framewidth', # if not None, will resize the video frame keeping the original w:h ratio
+	'delta', # the fold changes in illumination that determines the optogenetic stimulation onset
+	'animal_number', # the number of animals / objects in the video
+	'autofind_t', # whether to find stimulation onset automatically (only for optogenetics)
+	't', # the start_t for analysis
+	'duration', # the duration of the analysis
+	'ex_start', # start time for background extraction
+	'ex_end', # end time for background extraction
+	'behaviornames_and_colors', # behavior names in the Categorizer and their representative colors for annotation
+	'dim_tconv', # input dimension for Animation Analyzer in Categorizer
+	'dim_conv', # input dimension for Pattern Recognizer in Categorizer
+	'channel', # input channel for Animation Analyzer, 1--gray scale, 3--RGB scale
+	'length', # input time step for Animation Analyzer
+	'animal_vs_bg', # 0: animals birghter than the background; 1: animals darker than the background; 2: hard to tell
+	'stable_illumination', # whether the illumination in videos is stable
+	'animation_analyzer', # whether to include Animation Analyzer in the Categorizers
+	'animal_to_include', # the animals / obejcts that will be annotated in the annotated videos / behavior plots
+	'ID_colors', # the colors for animals / obejcts identities that will be annotated in the annotated videos
+	'behavior_to_include', # behaviors that will be annotated in the annotated videos / behavior plots
+	'parameter_to_analyze', # quantitative measures that will be included in the quantification
+	'include_bodyparts', # whether to include body parts in the pattern images
+	'std', # a value between 0 and 255, higher value, less body parts will be included in the pattern images
+	'uncertain', # a threshold between the highest the 2nd highest probablity of behaviors to determine if output an 'NA' in behavior classification
+	'min_length', # the minimum length (in frames) a behavior should last
+	'show_legend', # whether to show legend of behavior names in the annotated videos
+	'background_free', # whether to include background in animations
+	'black_background', # whether to set background black
+	'normalize_distance', # whether to normalize the distance (in pixel) to the animal contour area
+	'social_distance', # a threshold (folds of size of a single animal) on whether to include individuals that are not main character in behavior examples
+	'color_costar', # in 'interactive advanced' mode, whether to make the supporting roles RGB scale in animations
+	'specific_behaviors', # sex or identity-specific behaviors
+	'correct_ID', # whether to use sex or identity-specific behaviors to guide ID correction
+	'binary_results', # whether to also export the centers, behavior events and frame-wise parameters as compressed .npz files
+	'tracker', # how to match the tracked animals / objects to the detected ones, 'greedy' or 'hungarian'
+	'track_gate', # the maximum distance (in pixels) an animal / object can move between two frames to be matched, 0 for no limit
+	'detection_regions', # if not None, the [left,right,top,bottom] windows (like arenas) that the Detector runs on instead of the whole frame
+	'tile_size', # if >0, the Detector runs on overlapping tiles of this size (in pixels) instead of the whole frame
+	'tile_overlap', # the overlap (in pixels) of the tiles
+	'detection_stride', # run the Detector on every detection_stride-th frame and propagate the masks to the frames in between
+	'background_samples', # if >0, extract the background from at most this many frames spread across the extraction window instead of every frame
+	'constants_cache', # the folder that caches the backgrounds and animal sizes of the analyzed videos, '' for no caching
+	'segment_scale', # if <1, segment the animals at this fraction of the frame size (background subtraction only)
+	'segment_gray', # whether to subtract the background in grayscale instead of in each color channel
+	'single_pass', # whether to decode the video only once for both constant estimation and analysis (background subtraction only)
+	'streaming_categorizer', # whether to categorize behaviors in micro-batches during information acquisition, so that animations and pattern images are not kept in memory
+	)
+
+
+def categorizer_settings(path_to_categorizer):
+
+	'''
+	This function is used to read the analysis settings that
+	are determined by a Categorizer from its 'model_parameters.txt'.
+
+	return: a dict of the settings (see 'settings_names') that the Categorizer specifies
+	'''
+
+	parameters=pd.read_csv(os.path.join(path_to_categorizer,'model_parameters.txt'))
+	settings={}
+
+	complete_colors=list(mpl.colors.cnames.values())
+	colors=[]
+	for c in complete_colors:
+		colors.append(['#ffffff',c])
+	behaviornames_and_colors={}
+	for behavior_name in list(parameters['classnames']):
+		index=list(parameters['classnames']).index(behavior_name)
+		if index<len(colors):
+			behaviornames_and_colors[behavior_name]=colors[index]
+		else:
+			behaviornames_and_colors[behavior_name]=['#ffffff','#ffffff']
+	settings['behaviornames_and_colors']=behaviornames_and_colors
+
+	if 'dim_conv' in parameters:
+		settings['dim_conv']=int(parameters['dim_conv'][0])
+	if 'dim_tconv' in parameters:
+		settings['dim_tconv']=int(parameters['dim_tconv'][0])
+	settings['channel']=int(parameters['channel'][0])
+	settings['length']=max(int(parameters['time_step'][0]),3)
+	settings['animation_analyzer']=int(parameters['network'][0])==2
+	settings['include_bodyparts']=int(parameters['inner_code'][0])==0
+	settings['std']=int(parameters['std'][0])
+	settings['background_free']=int(parameters['background_free'][0])==0
+	if 'behavior_kind' in parameters:
+		settings['behavior_mode']=int(parameters['behavior_kind'][0])
+	else:
+		settings['behavior_mode']=0
+	if settings['behavior_mode']==2:
+		settings['social_distance']=int(parameters['social_distance'][0])
+		if settings['social_distance']==0:
+			settings['social_distance']=float('inf')
+		if 'color_code' in parameters:
+			settings['color_costar']=int(parameters['color_code'][0])==0
+	if 'black_background' in parameters:
+		if int(parameters['black_background'][0])==1:
+			settings['black_background']=False
+
+	return settings
+
+
+def detector_animal_names(path_to_detector):
+
+	'''
+	This function is used to read the names of the animals /
+	objects that a Detector detects.
+	'''
+
+	with open(os.path.join(path_to_detector,'model_parameters.txt')) as f:
+		model_parameters=f.read()
+
+	return json.loads(model_parameters)['animal_names']
+
+
+def analyze_video(path_to_video,result_path,settings):
+
+	'''
+	This function is used to run the whole analysis pipeline
+	(tracking, categorization, annotation and quantification)
+	on one video, without any GUI, so that it can run in a
+	worker process.
+
+	settings: a dict of the analysis settings, see 'settings_names'
+
+	return: (event_probability,all_time), event_probability is None if no Categorizer is used
+	'''
+
+	if settings['path_to_categorizer'] is None:
+		categorize_behavior=False
+	else:
+		categorize_behavior=True
+	if categorize_behavior and settings['streaming_categorizer']:
+		streaming_categorizer=settings['path_to_categorizer']
+	else:
+		streaming_categorizer=None
+
+	# the analyzers are imported here so that the Detector dependencies are only loaded when needed
+	if settings['use_detector'] is False:
+
+		from .analyzebehavior import AnalyzeAnimal
+
+		AA=AnalyzeAnimal()
+		AA.prepare_analysis(path_to_video,result_path,settings['animal_number'],delta=settings['delta'],names_and_colors=settings['behaviornames_and_colors'],
+			framewidth=settings['framewidth'],stable_illumination=settings['stable_illumination'],dim_tconv=settings['dim_tconv'],dim_conv=settings['dim_conv'],channel=settings['channel'],
+			include_bodyparts=settings['include_bodyparts'],std=settings['std'],categorize_behavior=categorize_behavior,animation_analyzer=settings['animation_analyzer'],
+			path_background=settings['background_path'],autofind_t=settings['autofind_t'],t=settings['t'],duration=settings['duration'],ex_start=settings['ex_start'],ex_end=settings['ex_end'],
+			length=settings['length'],animal_vs_bg=settings['animal_vs_bg'],binary_results=settings['binary_results'],
+			tracker=settings['tracker'],track_gate=settings['track_gate'] or None,background_samples=settings['background_samples'],
+			constants_cache=settings['constants_cache'] or None,segment_scale=settings['segment_scale'],segment_gray=settings['segment_gray'],
+			single_pass=settings['single_pass'],streaming_categorizer=streaming_categorizer)
+		if settings['behavior_mode']==0:
+			AA.acquire_information(background_free=settings['background_free'],black_background=settings['black_background'])
+			AA.craft_data()
+			interact_all=False
+		else:
+			AA.acquire_information_interact_basic(background_free=settings['background_free'],black_background=settings['black_background'])
+			interact_all=True
+		if categorize_behavior:
+			AA.categorize_behaviors(settings['path_to_categorizer'],uncertain=settings['uncertain'],min_length=settings['min_length'])
+		AA.annotate_video(settings['ID_colors'],settings['behavior_to_include'],show_legend=settings['show_legend'],interact_all=interact_all)
+		AA.export_results(normalize_distance=settings['normalize_distance'],parameter_to_analyze=settings['parameter_to_analyze'])
+
+		if categorize_behavior:
+			return (AA.event_probability,AA.all_time)
+		else:
+			return (None,AA.all_time)
+
+	else:
+
+		from .analyzebehavior_dt import AnalyzeAnimalDetector
+
+		AAD=AnalyzeAnimalDetector()
+		AAD.prepare_analysis(settings['path_to_detector'],path_to_video,result_path,settings['animal_number'],settings['animal_kinds'],settings['behavior_mode'],
+			names_and_colors=settings['behaviornames_and_colors'],framewidth=settings['framewidth'],dim_tconv=settings['dim_tconv'],dim_conv=settings['dim_conv'],channel=settings['channel'],
+			include_bodyparts=settings['include_bodyparts'],std=settings['std'],categorize_behavior=categorize_behavior,animation_analyzer=settings['animation_analyzer'],
+			t=settings['t'],duration=settings['duration'],length=settings['length'],social_distance=settings['social_distance'],binary_results=settings['binary_results'],
+			tracker=settings['tracker'],track_gate=settings['track_gate'] or None,
+			detection_regions=settings['detection_regions'],tile_size=settings['tile_size'],tile_overlap=settings['tile_overlap'],streaming_categorizer=streaming_categorizer)
+		if settings['behavior_mode']==1:
+			AAD.acquire_information_interact_basic(batch_size=settings['detector_batch'],background_free=settings['background_free'],black_background=settings['black_background'],
+				detection_stride=settings['detection_stride'])
+		else:
+			AAD.acquire_information(batch_size=settings['detector_batch'],background_free=settings['background_free'],black_background=settings['black_background'],color_costar=settings['color_costar'],
+				detection_stride=settings['detection_stride'])
+		if settings['behavior_mode']!=1:
+			AAD.craft_data()
+		if categorize_behavior:
+			AAD.categorize_behaviors(settings['path_to_categorizer'],uncertain=settings['uncertain'],min_length=settings['min_length'])
+		if settings['correct_ID']:
+			AAD.correct_identity(settings['specific_behaviors'])
+		AAD.annotate_video(settings['animal_to_include'],settings['ID_colors'],settings['behavior_to_include'],show_legend=settings['show_legend'])
+		AAD.export_results(normalize_distance=settings['normalize_distance'],parameter_to_analyze=settings['parameter_to_analyze'])
+
+		if categorize_behavior:
+			return (AAD.event_probability,AAD.all_time)
+		else:
+			return (None,AAD.all_time)
+
+
+def estimate_memory(path_to_video,settings):
+
+	'''
+	This function is used to roughly estimate the peak memory
+	(in bytes) that the analysis of a video takes, for scheduling
+	the worker processes within a memory budget.
+
+	settings: a dict of the analysis settings, see 'settings_names'
+	'''
+
+	capture=cv2.VideoCapture(path_to_video)
+	fps=round(capture.get(cv2.CAP_PROP_FPS))
+	total_frames=int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+	width=int(capture.get(cv2.CAP_PROP_FRAME_WIDTH))
+	height=int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+	capture.release()
+
+	if settings['framewidth'] is not None and width>0:
+		height=int(height*settings['framewidth']/width)
+		width=settings['framewidth']
+	if settings['duration']>0:
+		total_frames=min(total_frames,int(fps*settings['duration'])+1)
+
+	if settings['use_detector']:
+		animal_number=sum(settings['animal_number'].values())
+		# the runtime, the Categorizer and the Detector
+		memory=3.5*1024**3
+	else:
+		animal_number=settings['animal_number']
+		# the runtime and the Categorizer
+		memory=1.5*1024**3
+
+	# the frames in the animation window, the frame queue and the backgrounds
+	memory+=(settings['length']+32)*width*height*3
+
+	# the frames buffered for replay and for animal size estimation, each within the buffer budget of AnalyzeAnimal
+	if settings['single_pass'] and not settings['use_detector']:
+		memory+=2*1024**3
+
+	# the pattern images and the animations (float32) of each animal in each frame, kept until the categorization
+	# (in streaming mode only the behavior probabilities are kept)
+	if settings['path_to_categorizer'] is not None:
+		if settings['streaming_categorizer']:
+			per_frame=len(settings['behaviornames_and_colors'])*4
+		else:
+			per_frame=settings['dim_conv']**2*3
+			if settings['animation_analyzer']:
+				per_frame+=settings['length']*settings['dim_tconv']**2*settings['channel']*4
+		memory+=total_frames*animal_number*per_frame
+
+	return memory
+
+
+def init_worker(threads):
+
+	'''
+	This function is used to limit the threads each worker
+	process uses, so that parallel workers do not oversubscribe
+	the CPU cores.
+	'''
+
+	cv2.setNumThreads(threads)
+	import tensorflow as tf
+	tf.config.threading.set_intra_op_parallelism_threads(threads)
+	tf.config.threading.set_inter_op_parallelism_threads(threads)
+
+
+def run_batch(jobs,processes=1,memory_budget=0):
+
+	'''
+	This function is used to analyze a batch of videos. With
+	more than one process, each video is analyzed in a separate
+	worker process, and a video only starts when the estimated
+	memory of the running analyses plus its own fits in the
+	memory budget (at least one video always runs).
+
+	jobs: a list of (path_to_video,result_path,settings)
+	processes: the maximum number of videos analyzed at the same time
+	memory_budget: the memory (in GB) that the running analyses can take in total, 0 for no limit
+
+	return: the results of analyze_video, in the order of the jobs
+	'''
+
+	results=[None]*len(jobs)
+
+	if processes<=1 or len(jobs)<=1:
+		for n,job in enumerate(jobs):
+			results[n]=analyze_video(*job)
+		return results
+
+	processes=min(processes,len(jobs))
+	budget=memory_budget*1024**3
+	estimates=[estimate_memory(path_to_video,settings) for path_to_video,result_path,settings in jobs]
+	threads=max(1,(os.cpu_count() or 1)//processes)
+
+	print('Analyzing '+str(len(jobs))+' videos in up to '+str(processes)+' processes...')
+
+	# 'spawn' so that the workers do not inherit the GUI / TensorFlow state of the parent process
+	context=multiprocessing.get_context('spawn')
+
+	with ProcessPoolExecutor(max_workers=processes,mp_context=context,initializer=init_worker,initargs=(threads,)) as executor:
+
+		running={}
+		pending=list(range(len(jobs)))
+
+		while len(pending)>0 or len(running)>0:
+
+			while len(pending)>0 and len(running)<processes:
+				n=pending[0]
+				if budget>0 and len(running)>0 and sum(estimates[m] for m in running.values())+estimates[n]>budget:
+					break
+				pending.pop(0)
+				running[executor.submit(analyze_video,*jobs[n])]=n
+
+			done,_=wait(running,return_when=FIRST_COMPLETED)
+			for future in done:
+				n=running.pop(future)
+				results[n]=future.result()
+				print('Analysis of '+os.path.basename(jobs[n][0])+' completed!')
+
+	return results
+
+
+def merge_results(result_path,results,use_detector,animal_kinds,animal_to_include,names_and_colors,behavior_to_include,binary_results=False):
+
+	'''
+	This function is used to merge the behavior events of all
+	the analyzed videos into 'all_events.xlsx' and the behavior
+	plot, and concatenate the summaries of each video.
+
+	results: the results of analyze_video, in the order of the videos
+	binary_results: whether to also store the behavior events in 'all_events.npz'
+	'''
+
+	all_events={}
+	event_data={}
+	all_time=[]
+
+	if use_detector:
+		for animal_name in animal_kinds:
+			all_events[animal_name]={}
+
+	for event_probability,time in results:
+		if use_detector:
+			for animal_name in animal_kinds:
+				for n in event_probability[animal_name]:
+					all_events[animal_name][len(all_events[animal_name])]=event_probability[animal_name][n]
+		else:
+			for n in event_probability:
+				all_events[len(all_events)]=event_probability[n]
+		if len(all_time)<len(time):
+			all_time=time
+
+	max_length=len(all_time)
+
+	if use_detector is False:
+
+		for n in all_events:
+			event_data[len(event_data)]=all_events[n]+[['NA',-1]]*(max_length-len(all_events[n]))
+		all_events_df=pd.DataFrame(event_data,index=all_time)
+		all_events_df.to_excel(os.path.join(result_path,'all_events.xlsx'),float_format='%.2f',index_label='time/ID')
+		if binary_results:
+			write_events_npz(os.path.join(result_path,'all_events.npz'),event_data,all_time)
+		plot_events(result_path,event_data,all_time,names_and_colors,behavior_to_include,width=0,height=0)
+		folders=[i for i in os.listdir(result_path) if os.path.isdir(os.path.join(result_path,i))]
+		folders.sort()
+		for behavior_name in names_and_colors:
+			all_summary=[]
+			for folder in folders:
+				individual_summary=os.path.join(result_path,folder,behavior_name,'all_summary.xlsx')
+				if os.path.exists(individual_summary):
+					all_summary.append(pd.read_excel(individual_summary))
+			if len(all_summary)>=1:
+				all_summary=pd.concat(all_summary,ignore_index=True)
+				all_summary.to_excel(os.path.join(result_path,behavior_name+'_summary.xlsx'),float_format='%.2f',index_label='ID/parameter')
+
+	else:
+
+		for animal_name in animal_to_include:
+			for n in all_events[animal_name]:
+				event_data[len(event_data)]=all_events[animal_name][n]+[['NA',-1]]*(max_length-len(all_events[animal_name][n]))
+			event_data[len(event_data)]=[['NA',-1]]*max_length
+		del event_data[len(event_data)-1]
+		all_events_df=pd.DataFrame(event_data,index=all_time)
+		all_events_df.to_excel(os.path.join(result_path,'all_events.xlsx'),float_format='%.2f',index_label='time/ID')
+		if binary_results:
+			write_events_npz(os.path.join(result_path,'all_events.npz'),event_data,all_time)
+		plot_events(result_path,event_data,all_time,names_and_colors,behavior_to_include,width=0,height=0)
+		folders=[i for i in os.listdir(result_path) if os.path.isdir(os.path.join(result_path,i))]
+		folders.sort()
+		for animal_name in animal_kinds:
+			for behavior_name in names_and_colors:
+				all_summary=[]
+				for folder in folders:
+					individual_summary=os.path.join(result_path,folder,behavior_name,animal_name+'_all_summary.xlsx')
+					if os.path.exists(individual_summary):
+						all_summary.append(pd.read_excel(individual_summary))
+				if len(all_summary)>=1:
+					all_summary=pd.concat(all_summary,ignore_index=True)
+					all_summary.to_excel(os.path.join(result_path,animal_name+'_'+behavior_name+'_summary.xlsx'),float_format='%.2f',index_label='ID/parameter')
@@ -37,22 +37,38 @@ logger.debug('loading %s', __file__)
 import cv2
 import numpy as np
 import pandas as pd
-from scipy.spatial import distance
 import tensorflow as tf
 from tensorflow import keras  # pylint: disable=unused-import
-from keras.models import load_model
 from keras.utils import img_to_array
 
 # Local application/library specific imports.
+from .framesource import FrameSource
+from .modelcache import load_categorizer
+from .trackstore import TrackStore
 logger.debug('importing tools (starting...)')
 from .tools import (
 	estimate_constants,
+	cached_constants,
+	cached_luminance_track,
+	find_stim_t,
 	crop_frame,
 	extract_blob_background,
 	extract_blob_all,
+	working_image,
 	contour_frame,
 	generate_patternimage,
 	generate_patternimage_all,
+	assign_tracks,
+	categorized_frame,
+	track_array,
+	window_length_parameters,
+	window_locomotion_parameters,
+	window_acceleration,
+	window_areal_parameters,
+	fill_parameter,
+	write_events_npz,
+	write_centers_npz,
+	write_parameters_npz,
 	)
 logger.debug('importing tools (done)')
 
@@ -86,23 +102,41 @@ class AnalyzeAnimal():
 		self.background=None
 		self.background_low=None
 		self.background_high=None
+		self.luminance=None
+		self.segment_scale=1.0
+		self.segment_gray=False
 		self.skipped_frames=[]
 		self.all_time=[]
 		self.total_analysis_framecount=None
 		self.to_deregister={}
 		self.count_to_deregister=None
 		self.register_counts={}
+		self.tracks=None
 		self.animal_contours={}
 		self.animal_centers={}
 		self.animal_existingcenters={}
 		self.animal_heights={}
 		self.animal_inners={}
 		self.animal_blobs={}
+		self.blob_cache={}
 		self.animations={}
 		self.pattern_images={}
 		self.event_probability={}
 		self.all_behavior_parameters={}
 		self.log=[]
+		self.binary_results=False
+		self.tracker='greedy'
+		self.track_gate=None
+		self.single_pass=False
+		self.warmup_limit=1000
+		self.buffer_budget=1024**3
+		self.replay_frames=None
+		self.replay_bytes=0
+		self.frame_reader=None
+		self.categorizer=None
+		self.stream_batch_size=32
+		self.stream_queue=[]
+		self.streamed_predictions=None
 
 
 	def prepare_analysis(self,
@@ -127,7 +161,16 @@ class AnalyzeAnimal():
 		ex_start=0, # the start time point for background extraction
 		ex_end=None, # the end time point for background extraction, if None, use the entire video
 		length=15, # the duration (number of frames) of a behavior example (a behavior episode)
-		animal_vs_bg=0 # 0: animals brighter than the background; 1: animals darker than the background; 2: hard to tell
+		animal_vs_bg=0, # 0: animals brighter than the background; 1: animals darker than the background; 2: hard to tell
+		single_pass=False, # whether to decode the video only once for both constant estimation and analysis (the background is then extracted from a warm-up window of up to 1000 frames if ex_end is None and background_samples is 0), the decoded frames kept for replay and for animal size estimation are each limited to 'buffer_budget' bytes
+		streaming_categorizer=None, # if not None, the path to the Categorizer that categorizes behaviors in micro-batches during information acquisition (streaming mode), so that animations and pattern images are not kept in memory
+		binary_results=False, # whether to also export the centers, behavior events and frame-wise parameters as compressed .npz files
+		tracker='greedy', # how to match the tracked animals to the detected ones in each frame, 'greedy' (closest pairs first) or 'hungarian' (optimal assignment)
+		track_gate=None, # if not None, the maximum distance (in pixels) an animal can move between two frames to be matched
+		background_samples=0, # if >0, extract the background from at most this many frames spread across the extraction window (decoded by seeking) instead of from every frame in it
+		constants_cache=None, # if not None, the folder that caches the backgrounds, stimulation start time and animal size of the analyzed videos, so that re-analyzing a video with the same settings skips their estimation
+		segment_scale=1.0, # if <1, segment the animals at this fraction of the frame size and scale their contours back, which is faster for large animals
+		segment_gray=False # whether to subtract the background in grayscale instead of in each color channel
 		):
 
 		print('Preparation started...')
@@ -151,6 +194,11 @@ class AnalyzeAnimal():
 		self.t=t
 		self.duration=duration
 		self.length=length
+		self.binary_results=binary_results
+		self.tracker=tracker
+		self.track_gate=track_gate
+		self.segment_scale=segment_scale
+		self.segment_gray=segment_gray
 		os.makedirs(self.results_path,exist_ok=True)
 		capture=cv2.VideoCapture(self.path_to_video)
 		self.fps=round(capture.get(cv2.CAP_PROP_FPS))
@@ -198,7 +246,36 @@ class AnalyzeAnimal():
 			es_start=None
 		else:
 			es_start=self.t
-		constants=estimate_constants(self.path_to_video,self.delta,self.animal_number,framewidth=self.framewidth,frameheight=self.frameheight,stable_illumination=stable_illumination,ex_start=ex_start,ex_end=ex_end,t=es_start,duration=self.duration,animal_vs_bg=self.animal_vs_bg,path_background=path_background,kernel=self.kernel)
+		# with a cache, the stimulation start time is found in the luminance track of the video, which is computed only once
+		# the track takes a decoding pass of its own, so it is only built when finding the stimulation start time needs the whole video anyway
+		if constants_cache is not None and self.delta<10000 and self.autofind_t:
+			self.luminance=cached_luminance_track(constants_cache,self.path_to_video)
+			stim_t=find_stim_t(self.luminance,self.fps,self.delta)
+			self.t=2 if stim_t is None else stim_t
+		# without the luminance track, the analysis window is unknown before the stimulation start time is found, so autofind_t needs a second pass
+		self.single_pass=single_pass and (not self.autofind_t or self.luminance is not None)
+		if self.single_pass and ex_end is None and background_samples<=0:
+			ex_end=ex_start+self.warmup_limit/self.fps
+		def estimate():
+			# the frames are read (and buffered for the analysis) only when the constants are estimated, so that on a cache hit the analysis seeks to its window instead
+			if self.single_pass:
+				start_t,end_t=self.analysis_window()
+				self.replay_frames=deque()
+				self.replay_bytes=0
+				self.frame_reader=self.buffer_frames(FrameSource(self.path_to_video,framewidth=self.framewidth,frameheight=self.frameheight),start_t,end_t)
+				frames=(frame for frame_count,frame in self.frame_reader)
+			else:
+				frames=None
+			return estimate_constants(self.path_to_video,self.delta,self.animal_number,framewidth=self.framewidth,frameheight=self.frameheight,stable_illumination=stable_illumination,ex_start=ex_start,ex_end=ex_end,t=es_start,duration=self.duration,animal_vs_bg=self.animal_vs_bg,path_background=path_background,kernel=self.kernel,frames=frames,
+				background_samples=background_samples,luminance=self.luminance,segment_scale=segment_scale,segment_gray=segment_gray,buffer_bytes=self.buffer_budget if self.single_pass else 0)
+		# loaded backgrounds can change without the video changing, so they are not cached
+		if constants_cache is not None and path_background is None:
+			parameters={'delta':self.delta,'animal_number':self.animal_number,'framewidth':self.framewidth,'frameheight':self.frameheight,'stable_illumination':stable_illumination,'ex_start':ex_start,'ex_end':ex_end,
+				't':es_start,'duration':self.duration,'animal_vs_bg':self.animal_vs_bg,'kernel':self.kernel,'background_samples':background_samples,
+				'luminance':self.luminance is not None,'segment_scale':segment_scale,'segment_gray':segment_gray}
+			constants=cached_constants(constants_cache,self.path_to_video,parameters,estimate)
+		else:
+			constants=estimate()
 		self.animal_area=constants[4]
 		self.log.append('The area of single animal is: '+str(self.animal_area)+'.')
 		self.background=constants[0]
@@ -211,6 +288,9 @@ class AnalyzeAnimal():
 			self.t=constants[3]
 
 		if self.categorize_behavior:
+			if streaming_categorizer is not None:
+				self.categorizer=load_categorizer(streaming_categorizer)
+				self.streamed_predictions={}
 			for behavior_name in names_and_colors:
 				self.all_behavior_parameters[behavior_name]={}
 				self.all_behavior_parameters[behavior_name]['color']=names_and_colors[behavior_name]
@@ -222,13 +302,17 @@ class AnalyzeAnimal():
 			for parameter_name in ['acceleration','distance','intensity_area','intensity_length','magnitude_area','magnitude_length','speed','velocity','vigor_area','vigor_length']:
 				self.all_behavior_parameters[parameter_name]={}
 
+		# the contours, centers and heights of the animals in all the frames, kept in arrays
+		self.tracks=TrackStore(self.total_analysis_framecount,frame_size=self.background.shape[:2])
+		self.animal_contours=self.tracks.contours
+		self.animal_centers=self.tracks.centers
+		self.animal_heights=self.tracks.heights
+
 		for i in range(self.animal_number):
 			self.to_deregister[i]=0
 			self.register_counts[i]=None
-			self.animal_contours[i]=[None]*self.total_analysis_framecount
-			self.animal_centers[i]=[None]*self.total_analysis_framecount
+			self.tracks.add(i)
 			self.animal_existingcenters[i]=(-10000,-10000)
-			self.animal_heights[i]=[None]*self.total_analysis_framecount
 			if self.include_bodyparts:
 				self.animal_inners[i]=deque(maxlen=self.length)
 			if self.animation_analyzer:
@@ -240,6 +324,174 @@ class AnalyzeAnimal():
 		self.log.append('Preparation completed!')
 
 
+	def analysis_window(self):
+
+		# return the start and end time points of the analysis
+
+		start_t=round((self.t-self.length/self.fps),2)
+		if start_t<0:
+			start_t=0.00
+		if self.duration==0:
+			end_t=float('inf')
+		else:
+			end_t=start_t+self.duration
+
+		return (start_t,end_t)
+
+
+	def detection_backgrounds(self):
+
+		# return: (background,background_low,background_high,background_mean), the backgrounds (inverted if animals are darker than the background) converted to the resolution and color space of the segmentation, and the mean intensity of the converted background
+
+		background=self.background
+		background_low=self.background_low
+		background_high=self.background_high
+		if self.animal_vs_bg==1:
+			background=np.uint8(255-background)
+			background_low=np.uint8(255-background_low)
+			background_high=np.uint8(255-background_high)
+		(background,background_low,background_high)=[working_image(i,segment_scale=self.segment_scale,segment_gray=self.segment_gray) for i in (background,background_low,background_high)]
+		background_mean=np.mean(background)
+
+		return (background,background_low,background_high,background_mean)
+
+
+	def frame_mean(self,frame_count):
+
+		# frame_count: the index of a frame in the video
+
+		# return: the mean intensity of the frame (inverted if animals are darker than the background) in the luminance track, None if there is no luminance track or the segmentation is in grayscale (the luminance track is in color)
+
+		if self.luminance is None or self.segment_gray or frame_count>=len(self.luminance):
+			return None
+
+		if self.animal_vs_bg==1:
+			return 255-self.luminance[frame_count]
+
+		return self.luminance[frame_count]
+
+
+	def buffer_frames(self,frames,start_t,end_t):
+
+		# frames: the FrameSource of the video from its beginning
+		# start_t: the start time point of the analysis window
+		# end_t: the end time point of the analysis window
+
+		for frame_count,frame in frames:
+			# keep the frames in the analysis window that are decoded during constant estimation
+			if self.replay_frames is not None:
+				if start_t<=round((frame_count+1)/self.fps,2)<end_t:
+					if self.replay_bytes+frame.nbytes<=self.buffer_budget:
+						self.replay_frames.append((frame_count,frame))
+						self.replay_bytes+=frame.nbytes
+					else:
+						print('Too many frames to replay, the video will be decoded again for the analysis.')
+						self.replay_frames=None
+			yield (frame_count,frame)
+
+
+	def analysis_frames(self):
+
+		# yield the frame count and the (resized) frame of each frame in the analysis window
+		# in single-pass mode, the frames buffered during constant estimation are replayed first and decoding continues from there
+
+		if self.frame_reader is not None and self.replay_frames is not None:
+			frame_reader=self.frame_reader
+			replay_frames=self.replay_frames
+			self.frame_reader=self.replay_frames=None
+			while len(replay_frames)>0:
+				yield replay_frames.popleft()
+			yield from frame_reader
+		else:
+			if self.frame_reader is not None:
+				self.frame_reader.close()
+				self.frame_reader=None
+			start_t,end_t=self.analysis_window()
+			yield from FrameSource(self.path_to_video,framewidth=self.framewidth,frameheight=self.frameheight,start_t=start_t,end_t=end_t)
+
+
+	def stream_windows(self,frame_count_analyze):
+
+		# frame_count_analyze: the analyzed frame count, whose animations and pattern images have been generated
+
+		# queue the windows that will be categorized (see categorized_frame) and release the rest
+		for n in self.pattern_images:
+			i=frame_count_analyze
+			if categorized_frame(self.animal_contours[n],self.register_counts[n],i,self.length):
+				if self.animation_analyzer:
+					self.stream_queue.append((n,i,self.animations[n][i],self.pattern_images[n][i]))
+				else:
+					self.stream_queue.append((n,i,None,self.pattern_images[n][i]))
+			if self.animation_analyzer:
+				self.animations[n][i]=None
+			self.pattern_images[n][i]=None
+
+		if len(self.stream_queue)>=self.stream_batch_size:
+			self.predict_stream()
+
+
+	def predict_stream(self):
+
+		# categorize the queued windows in one micro-batch and store the predictions
+
+		if len(self.stream_queue)==0:
+			return
+
+		with tf.device('CPU'):
+			pattern_images=tf.convert_to_tensor(np.array([x[3] for x in self.stream_queue],dtype='float32')/255.0)
+			if self.animation_analyzer:
+				animations=tf.convert_to_tensor(np.array([x[2] for x in self.stream_queue],dtype='float32')/255.0)
+				inputs=[animations,pattern_images]
+			else:
+				inputs=pattern_images
+
+		predictions=self.categorizer.predict_on_batch(inputs)
+
+		for (n,i,animation,pattern_image),prediction in zip(self.stream_queue,predictions):
+			if n not in self.streamed_predictions:
+				self.streamed_predictions[n]=np.full((self.total_analysis_framecount,len(prediction)),np.nan,dtype='float32')
+			self.streamed_predictions[n][i]=prediction
+
+		self.stream_queue=[]
+
+
+	def window_blobs(self,ID,frames,contours,start,background_free=True,black_background=True):
+
+		# ID: the identity of the animal
+		# frames: the frames in the animation window
+		# contours: the contours of the animal in the animation window
+		# start: the analyzed frame count of the first frame in the window
+		# background_free: whether to include background in animations
+		# black_background: whether to set background black
+
+		# the blob of a frame only depends on its contour and the crop box of the window,
+		# so the blobs are reused until the crop box changes and only the newest frame is extracted
+
+		cache=self.blob_cache.setdefault(ID,{})
+		box=None
+		blobs=[]
+
+		for n,f in enumerate(frames):
+			contour=contours[n]
+			if contour is None:
+				blob=np.zeros((self.dim_tconv,self.dim_tconv,self.channel),dtype='uint8')
+			else:
+				if box is None:
+					box=crop_frame(f,contours)
+				if start+n in cache and cache[start+n][0]==box:
+					blob=cache[start+n][1]
+				else:
+					blob=extract_blob_background(f,contours,contour=contour,channel=self.channel,background_free=background_free,black_background=black_background)
+					blob=cv2.resize(blob,(self.dim_tconv,self.dim_tconv),interpolation=cv2.INTER_AREA)
+					cache[start+n]=(box,blob)
+			blobs.append(blob)
+
+		for frame_index in [x for x in cache if x<start]:
+			del cache[frame_index]
+
+		return blobs
+
+
 	def track_animal(self,frame_count_analyze,contours,centers,heights,inners=None):
 
 		# frame_count_analyze: the analyzed frame count
@@ -248,35 +500,27 @@ class AnalyzeAnimal():
 		# heights: the heights of detected animals
 		# inners: the inner contours of detected animals when body parts are included in pattern images
 
-		unused_existing_indices=list(self.animal_existingcenters)
-		existing_centers=list(self.animal_existingcenters.values())
-		unused_new_indices=list(range(len(centers)))
-		dt_flattened=distance.cdist(existing_centers,centers).flatten()
-		dt_sort_index=dt_flattened.argsort()
-		length=len(centers)
-
-		for idx in dt_sort_index:
-			index_in_existing=int(idx/length)
-			index_in_new=int(idx%length)
-			if index_in_existing in unused_existing_indices:
-				if index_in_new in unused_new_indices:
-					unused_existing_indices.remove(index_in_existing)
-					unused_new_indices.remove(index_in_new)
-					if self.register_counts[index_in_existing] is None:
-						self.register_counts[index_in_existing]=frame_count_analyze
-					self.to_deregister[index_in_existing]=0
-					self.animal_contours[index_in_existing][frame_count_analyze]=contours[index_in_new]
-					center=centers[index_in_new]
-					self.animal_centers[index_in_existing][frame_count_analyze]=center
-					self.animal_existingcenters[index_in_existing]=center
-					self.animal_heights[index_in_existing][frame_count_analyze]=heights[index_in_new]
-					if self.include_bodyparts:
-						self.animal_inners[index_in_existing].append(inners[index_in_new])
-						pattern_image=generate_patternimage(self.background,self.animal_contours[index_in_existing][max(0,(frame_count_analyze-self.length+1)):frame_count_analyze+1],inners=self.animal_inners[index_in_existing],std=self.std)
-					else:
-						pattern_image=generate_patternimage(self.background,self.animal_contours[index_in_existing][max(0,(frame_count_analyze-self.length+1)):frame_count_analyze+1],inners=None,std=0)
-					pattern_image=cv2.resize(pattern_image,(self.dim_conv,self.dim_conv),interpolation=cv2.INTER_AREA)
-					self.pattern_images[index_in_existing][frame_count_analyze]=np.array(pattern_image)
+		IDs=list(self.animal_existingcenters)
+		matched=set()
+		for index,index_in_new in assign_tracks(list(self.animal_existingcenters.values()),centers,method=self.tracker,gate=self.track_gate):
+			index_in_existing=IDs[index]
+			matched.add(index_in_existing)
+			if self.register_counts[index_in_existing] is None:
+				self.register_counts[index_in_existing]=frame_count_analyze
+			self.to_deregister[index_in_existing]=0
+			self.animal_contours[index_in_existing][frame_count_analyze]=contours[index_in_new]
+			center=centers[index_in_new]
+			self.animal_centers[index_in_existing][frame_count_analyze]=center
+			self.animal_existingcenters[index_in_existing]=center
+			self.animal_heights[index_in_existing][frame_count_analyze]=heights[index_in_new]
+			if self.include_bodyparts:
+				self.animal_inners[index_in_existing].append(inners[index_in_new])
+				pattern_image=generate_patternimage(self.background,self.animal_contours[index_in_existing][max(0,(frame_count_analyze-self.length+1)):frame_count_analyze+1],inners=self.animal_inners[index_in_existing],std=self.std)
+			else:
+				pattern_image=generate_patternimage(self.background,self.animal_contours[index_in_existing][max(0,(frame_count_analyze-self.length+1)):frame_count_analyze+1],inners=None,std=0)
+			pattern_image=cv2.resize(pattern_image,(self.dim_conv,self.dim_conv),interpolation=cv2.INTER_AREA)
+			self.pattern_images[index_in_existing][frame_count_analyze]=np.array(pattern_image)
+		unused_existing_indices=[i for i in IDs if i not in matched]
 
 		if len(unused_existing_indices)>0:
 			for i in unused_existing_indices:
@@ -298,34 +542,20 @@ class AnalyzeAnimal():
 		print(datetime.datetime.now())
 		self.log.append(str(datetime.datetime.now()))
 
-		capture=cv2.VideoCapture(self.path_to_video)
-
-		background=self.background
-		background_low=self.background_low
-		background_high=self.background_high
-		if self.animal_vs_bg==1:
-			background=np.uint8(255-background)
-			background_low=np.uint8(255-background_low)
-			background_high=np.uint8(255-background_high)
+		(background,background_low,background_high,background_mean)=self.detection_backgrounds()
 
-		frame_count=frame_count_analyze=0
+		frame_count_analyze=0
+		self.blob_cache={}
 		temp_frames=deque(maxlen=self.length)
 		animation=deque([np.zeros((self.dim_tconv,self.dim_tconv,self.channel),dtype='uint8')],maxlen=self.length)*self.length
 
-		start_t=round((self.t-self.length/self.fps),2)
-		if start_t<0:
-			start_t=0.00
-		if self.duration==0:
-			end_t=float('inf')
-		else:
-			end_t=start_t+self.duration
+		start_t,end_t=self.analysis_window()
 
-		while True:
+		for frame_count,frame in self.analysis_frames():
 
-			retval,frame=capture.read()
 			time=round((frame_count+1)/self.fps,2)
 
-			if time>=end_t or frame is None:
+			if time>=end_t:
 				break
 
 			if time>=start_t:
@@ -338,12 +568,10 @@ class AnalyzeAnimal():
 					print(datetime.datetime.now())
 					self.log.append(str(datetime.datetime.now()))
 
-				if self.framewidth is not None:
-					frame=cv2.resize(frame,(self.framewidth,self.frameheight),interpolation=cv2.INTER_AREA)
-
 				temp_frames.append(frame)
 
-				(contours,centers,heights,inners)=contour_frame(frame,self.animal_number,background,background_low,background_high,self.delta,self.animal_area,animal_vs_bg=self.animal_vs_bg,include_bodyparts=self.include_bodyparts,animation_analyzer=self.animation_analyzer,channel=self.channel,kernel=self.kernel,black_background=black_background)
+				(contours,centers,heights,inners)=contour_frame(frame,self.animal_number,background,background_low,background_high,self.delta,self.animal_area,animal_vs_bg=self.animal_vs_bg,include_bodyparts=self.include_bodyparts,animation_analyzer=self.animation_analyzer,channel=self.channel,kernel=self.kernel,black_background=black_background,
+					frame_mean=self.frame_mean(frame_count),background_mean=background_mean,segment_scale=self.segment_scale,segment_gray=self.segment_gray)
 
 				if len(contours)==0:
 
@@ -358,22 +586,19 @@ class AnalyzeAnimal():
 					self.track_animal(frame_count_analyze,contours,centers,heights,inners=inners)
 
 					if self.animation_analyzer:
+						start=max(0,(frame_count_analyze-self.length+1))
 						for i in self.animal_centers:
-							for n,f in enumerate(temp_frames):
-								contour=self.animal_contours[i][max(0,(frame_count_analyze-self.length+1)):frame_count_analyze+1][n]
-								if contour is None:
-									blob=np.zeros((self.dim_tconv,self.dim_tconv,self.channel),dtype='uint8')
-								else:
-									blob=extract_blob_background(f,self.animal_contours[i][max(0,(frame_count_analyze-self.length+1)):frame_count_analyze+1],contour=contour,channel=self.channel,background_free=background_free,black_background=black_background)
-									blob=cv2.resize(blob,(self.dim_tconv,self.dim_tconv),interpolation=cv2.INTER_AREA)
+							for blob in self.window_blobs(i,temp_frames,self.animal_contours[i][start:frame_count_analyze+1],start,background_free=background_free,black_background=black_background):
 								animation.append(img_to_array(blob))
 							self.animations[i][frame_count_analyze]=np.array(animation)
 
-				frame_count_analyze+=1
+				if self.categorizer is not None:
+					self.stream_windows(frame_count_analyze)
 
-			frame_count+=1
+				frame_count_analyze+=1
 
-		capture.release()
+		if self.categorizer is not None:
+			self.predict_stream()
 
 		print('Information acquisition completed!')
 		self.log.append('Information acquisition completed!')
@@ -401,35 +626,21 @@ class AnalyzeAnimal():
 		self.animal_centers={}
 		self.animal_centers[0]=[None]*self.total_analysis_framecount
 
-		background=self.background
-		background_low=self.background_low
-		background_high=self.background_high
-		if self.animal_vs_bg==1:
-			background=np.uint8(255-background)
-			background_low=np.uint8(255-background_low)
-			background_high=np.uint8(255-background_high)
+		(background,background_low,background_high,background_mean)=self.detection_backgrounds()
 
-		capture=cv2.VideoCapture(self.path_to_video)
-		frame_count=frame_count_analyze=0
+		frame_count_analyze=0
 		temp_frames=deque(maxlen=self.length)
 		temp_contours=deque(maxlen=self.length)
 		temp_inners=deque(maxlen=self.length)
 		animation=deque([np.zeros((self.dim_tconv,self.dim_tconv,self.channel),dtype='uint8')],maxlen=self.length)*self.length
 
-		start_t=round((self.t-self.length/self.fps),2)
-		if start_t<0:
-			start_t=0.00
-		if self.duration==0:
-			end_t=float('inf')
-		else:
-			end_t=start_t+self.duration
+		start_t,end_t=self.analysis_window()
 
-		while True:
+		for frame_count,frame in self.analysis_frames():
 
-			retval,frame=capture.read()
 			time=round((frame_count+1)/self.fps,2)
 
-			if time>=end_t or frame is None:
+			if time>=end_t:
 				break
 
 			if time>=start_t:
@@ -442,12 +653,10 @@ class AnalyzeAnimal():
 					print(datetime.datetime.now())
 					self.log.append(str(datetime.datetime.now()))
 
-				if self.framewidth is not None:
-					frame=cv2.resize(frame,(self.framewidth,self.frameheight),interpolation=cv2.INTER_AREA)
-
 				temp_frames.append(frame)
 
-				(contours,centers,heights,inners)=contour_frame(frame,self.animal_number,background,background_low,background_high,self.delta,self.animal_area,animal_vs_bg=self.animal_vs_bg,include_bodyparts=self.include_bodyparts,animation_analyzer=False,channel=self.channel,kernel=self.kernel,black_background=black_background)
+				(contours,centers,heights,inners)=contour_frame(frame,self.animal_number,background,background_low,background_high,self.delta,self.animal_area,animal_vs_bg=self.animal_vs_bg,include_bodyparts=self.include_bodyparts,animation_analyzer=False,channel=self.channel,kernel=self.kernel,black_background=black_background,
+					frame_mean=self.frame_mean(frame_count),background_mean=background_mean,segment_scale=self.segment_scale,segment_gray=self.segment_gray)
 
 				if len(contours)==0:
 
@@ -485,11 +694,13 @@ class AnalyzeAnimal():
 							animation.append(img_to_array(blob))
 							self.animations[0][frame_count_analyze]=np.array(animation)
 
-				frame_count_analyze+=1
+				if self.categorizer is not None:
+					self.stream_windows(frame_count_analyze)
 
-			frame_count+=1
+				frame_count_analyze+=1
 
-		capture.release()
+		if self.categorizer is not None:
+			self.predict_stream()
 
 		self.animations[0]=self.animations[0][:len(self.all_time)]
 		self.pattern_images[0]=self.pattern_images[0][:len(self.all_time)]
@@ -513,11 +724,7 @@ class AnalyzeAnimal():
 		IDs=list(self.animal_centers.keys())
 
 		for i in IDs:
-			check=0
-			for x in self.animal_heights[i]:
-				if x is not None:
-					check+=1
-			lengths.append(check)
+			lengths.append(int(np.count_nonzero(~np.isnan(self.animal_heights[i].to_array()))))
 			if self.register_counts[i] is None:
 				to_delete.append(i)
 
@@ -528,10 +735,8 @@ class AnalyzeAnimal():
 			if i in to_delete:
 				del self.to_deregister[i]
 				del self.register_counts[i]
-				del self.animal_centers[i]
+				self.tracks.remove(i)
 				del self.animal_existingcenters[i]
-				del self.animal_contours[i]
-				del self.animal_heights[i]
 				if self.include_bodyparts:
 					del self.animal_inners[i]
 				if self.animation_analyzer:
@@ -539,10 +744,9 @@ class AnalyzeAnimal():
 					del self.animations[i]
 				del self.pattern_images[i]
 
+		self.tracks.truncate(length)
+
 		for i in self.animal_centers:
-			self.animal_centers[i]=self.animal_centers[i][:length]
-			self.animal_contours[i]=self.animal_contours[i][:length]
-			self.animal_heights[i]=self.animal_heights[i][:length]
 			if self.animation_analyzer:
 				self.animations[i]=self.animations[i][:length]
 			self.pattern_images[i]=self.pattern_images[i][:length]
@@ -564,32 +768,43 @@ class AnalyzeAnimal():
 
 		IDs=list(self.pattern_images.keys())
 
-		if self.animation_analyzer:
-			animations=self.animations[IDs[0]]
-		pattern_images=self.pattern_images[IDs[0]]
+		if self.streamed_predictions is None:
 
-		if len(self.pattern_images)>1:
-			for n in IDs[1:]:
-				if self.animation_analyzer:
-					animations+=self.animations[n]
-				pattern_images+=self.pattern_images[n]
+			if self.animation_analyzer:
+				animations=self.animations[IDs[0]]
+			pattern_images=self.pattern_images[IDs[0]]
 
-		del self.animations
-		del self.pattern_images
-		gc.collect()
+			if len(self.pattern_images)>1:
+				for n in IDs[1:]:
+					if self.animation_analyzer:
+						animations+=self.animations[n]
+					pattern_images+=self.pattern_images[n]
+
+			del self.animations
+			del self.pattern_images
+			gc.collect()
+
+			with tf.device('CPU'):
+				if self.animation_analyzer:
+					animations=tf.convert_to_tensor(np.array(animations,dtype='float32')/255.0)
+				pattern_images=tf.convert_to_tensor(np.array(pattern_images,dtype='float32')/255.0)
 
-		with tf.device('CPU'):
 			if self.animation_analyzer:
-				animations=tf.convert_to_tensor(np.array(animations,dtype='float32')/255.0)
-			pattern_images=tf.convert_to_tensor(np.array(pattern_images,dtype='float32')/255.0)
+				inputs=[animations,pattern_images]
+			else:
+				inputs=pattern_images
+
+			categorizer=load_categorizer(path_to_categorizer)
+			predictions=categorizer.predict(inputs,batch_size=32)
 
-		if self.animation_analyzer:
-			inputs=[animations,pattern_images]
 		else:
-			inputs=pattern_images
 
-		categorizer=load_model(path_to_categorizer)
-		predictions=categorizer.predict(inputs,batch_size=32)
+			# the windows were categorized during information acquisition
+			self.predict_stream()
+			predictions=None
+			del self.animations
+			del self.pattern_images
+			gc.collect()
 
 		for behavior_name in self.all_behavior_parameters:
 			for i in IDs:
@@ -601,33 +816,31 @@ class AnalyzeAnimal():
 			i=self.length+self.register_counts[n]
 			idx+=i
 			while i<len(self.animal_contours[n]):
-				if self.animal_contours[n][i] is not None:
-					check=0
-					for c in self.animal_contours[n][i-self.length+1:i+1]:
-						if c is None:
-							check+=1
-					if check<=self.length/2:
+				if categorized_frame(self.animal_contours[n],self.register_counts[n],i,self.length):
+					if predictions is None:
+						prediction=self.streamed_predictions[n][i]
+					else:
 						prediction=predictions[idx]
-						behavior_names=list(self.all_behavior_parameters.keys())
-						for behavior_name in behavior_names:
-							if len(behavior_names)==2:
-								if behavior_names.index(behavior_name)==0:
-									probability=1-prediction[0]
-								else:
-									probability=prediction[0]
-							else:
-								probability=prediction[behavior_names.index(behavior_name)]
-							self.all_behavior_parameters[behavior_name]['probability'][n][i]=probability
+					behavior_names=list(self.all_behavior_parameters.keys())
+					for behavior_name in behavior_names:
 						if len(behavior_names)==2:
-							if prediction[0]>0.5:
-								if prediction[0]-(1-prediction[0])>uncertain:
-									self.event_probability[n][i]=[behavior_names[1],prediction[0]]
-							if prediction[0]<0.5:
-								if (1-prediction[0])-prediction[0]>uncertain:
-									self.event_probability[n][i]=[behavior_names[0],1-prediction[0]]
+							if behavior_names.index(behavior_name)==0:
+								probability=1-prediction[0]
+							else:
+								probability=prediction[0]
 						else:
-							if sorted(prediction)[-1]-sorted(prediction)[-2]>uncertain:
-								self.event_probability[n][i]=[behavior_names[np.argmax(prediction)],max(prediction)]
+							probability=prediction[behavior_names.index(behavior_name)]
+						self.all_behavior_parameters[behavior_name]['probability'][n][i]=probability
+					if len(behavior_names)==2:
+						if prediction[0]>0.5:
+							if prediction[0]-(1-prediction[0])>uncertain:
+								self.event_probability[n][i]=[behavior_names[1],prediction[0]]
+						if prediction[0]<0.5:
+							if (1-prediction[0])-prediction[0]>uncertain:
+								self.event_probability[n][i]=[behavior_names[0],1-prediction[0]]
+					else:
+						if sorted(prediction)[-1]-sorted(prediction)[-2]>uncertain:
+							self.event_probability[n][i]=[behavior_names[np.argmax(prediction)],max(prediction)]
 				idx+=1
 				i+=1
 
@@ -689,39 +902,31 @@ class AnalyzeAnimal():
 				else:
 					intvl=int(self.background.shape[0]/(len(colors)+1))
 
-		capture=cv2.VideoCapture(self.path_to_video)
 		writer=None
-		frame_count=frame_count_analyze=index=0
+		frame_count_analyze=index=0
 
 		total_animal_number=0
-		df=pd.DataFrame(self.animal_centers,index=self.all_time)
+		df=pd.DataFrame(dict(self.animal_centers.items()),index=self.all_time)
 		df.to_excel(os.path.join(self.results_path,'all_centers.xlsx'),index_label='time/ID')
+		if self.binary_results:
+			write_centers_npz(os.path.join(self.results_path,'all_centers.npz'),self.animal_centers,self.all_time)
 		for i in self.animal_centers:
 			total_animal_number+=1
 		if total_animal_number<=0:
 			total_animal_number=1
 		color_diff=int(510/total_animal_number)
 
-		start_t=round((self.t-self.length/self.fps),2)
-		if start_t<0:
-			start_t=0.00
-		if self.duration==0:
-			end_t=float('inf')
-		else:
-			end_t=start_t+self.duration
+		start_t,end_t=self.analysis_window()
+
+		for frame_count,frame in FrameSource(self.path_to_video,framewidth=self.framewidth,frameheight=self.frameheight,start_t=start_t,end_t=end_t):
 
-		while True:
-			retval,frame=capture.read()
 			time=round((frame_count+1)/self.fps,2)
 
-			if time>=end_t or frame is None:
+			if time>=end_t:
 				break
 
 			if time>=start_t:
 
-				if self.framewidth is not None:
-					frame=cv2.resize(frame,(self.framewidth,self.frameheight),interpolation=cv2.INTER_AREA)
-
 				if self.categorize_behavior:
 					if show_legend:
 						n=1
@@ -791,9 +996,6 @@ class AnalyzeAnimal():
 
 				frame_count_analyze+=1
 
-			frame_count+=1
-
-		capture.release()
 		writer.release()
 
 		cv2.imwrite(os.path.join(self.results_path,'Trajectory.jpg'),self.background)
@@ -843,249 +1045,78 @@ class AnalyzeAnimal():
 
 		if len(parameter_to_analyze)>0:
 
+			if normalize_distance:
+				calibrator=math.sqrt(self.animal_area)
+			else:
+				calibrator=None
+
 			for i in self.animal_contours:
 
-				n=self.length+self.register_counts[i]
+				frames=list(range(self.length+self.register_counts[i],len(self.animal_contours[i])))
 
-				while n<len(self.animal_contours[i]):
+				# the frames in which each behavior is analyzed
+				if self.categorize_behavior:
+					behavior_frames={}
+					for n in frames:
+						behavior_name=self.event_probability[i][n][0]
+						if behavior_name!='NA':
+							behavior_frames.setdefault(behavior_name,[]).append(n)
+				else:
+					behavior_frames={None:frames}
 
-					if self.categorize_behavior:
+				# the sliding-window parameters of all the frames, computed once for all the behaviors
+				if '3 length parameters' in parameter_to_analyze:
+					magnitude_length,vigor_length,intensity_length=window_length_parameters(track_array(self.animal_heights[i]),self.length,self.fps)
+				if '4 locomotion parameters' in parameter_to_analyze:
+					centers=track_array(self.animal_centers[i],dimension=2)
+					speed,velocity,steps=window_locomotion_parameters(centers,self.length,self.fps,calibrator=calibrator)
+				if '3 areal parameters' in parameter_to_analyze:
+					analyzed_frames=sorted(n for selected in behavior_frames.values() for n in selected)
+					magnitude_area,vigor_area,intensity_area=window_areal_parameters(self.animal_contours[i],analyzed_frames,self.length,self.fps)
 
-						behavior_name=self.event_probability[i][n][0]
+				for behavior_name,selected in behavior_frames.items():
 
-						if behavior_name!='NA':
+					if self.categorize_behavior:
 
-							if 'count' in parameter_to_analyze:
-								if behavior_name!=self.event_probability[i][n-1][0]:
-									self.all_behavior_parameters[behavior_name]['count'][i]+=1
+						parameters=self.all_behavior_parameters[behavior_name]
 
-							if 'duration' in parameter_to_analyze:
-								self.all_behavior_parameters[behavior_name]['duration'][i]+=1
+						if 'count' in parameter_to_analyze:
+							parameters['count'][i]+=sum(1 for n in selected if self.event_probability[i][n-1][0]!=behavior_name)
 
-							if 'latency' in parameter_to_analyze:
-								if self.all_behavior_parameters[behavior_name]['latency'][i]=='NA':
-									self.all_behavior_parameters[behavior_name]['latency'][i]=self.all_time[n]
+						if 'duration' in parameter_to_analyze:
+							parameters['duration'][i]+=len(selected)
 
-							if '3 length parameters' in parameter_to_analyze:
-								heights_diffs=[]
-								for h in self.animal_heights[i][n-self.length+1:n+1]:
-									if h is None or self.animal_heights[i][n] is None:
-										height_diff=0.0
-									else:
-										height_diff=abs(h-self.animal_heights[i][n])/h
-									heights_diffs.append(height_diff)
-								magnitude_length=max(heights_diffs)
-								vigor_length=magnitude_length/((self.length-np.argmax(heights_diffs))/self.fps)
-								intensity_length=sum(heights_diffs)/(self.length/self.fps)
-								if magnitude_length>0:
-									self.all_behavior_parameters[behavior_name]['magnitude_length'][i][n]=magnitude_length
-								if vigor_length>0:
-									self.all_behavior_parameters[behavior_name]['vigor_length'][i][n]=vigor_length
-								if intensity_length>0:
-									self.all_behavior_parameters[behavior_name]['intensity_length'][i][n]=intensity_length
-
-							if '4 locomotion parameters' in parameter_to_analyze:
-								distance_traveled=0.0
-								d=n-self.length
-								while d<n-1:
-									start_center=self.animal_centers[i][d]
-									end_center=self.animal_centers[i][d+1]
-									if start_center is None or end_center is None:
-										dt=0.0
-									else:
-										dt=math.dist(end_center,start_center)
-									distance_traveled+=dt
-									d+=1
-								if normalize_distance:
-									calibrator=math.sqrt(self.animal_area)
-									distance_traveled=distance_traveled/calibrator
-								self.all_behavior_parameters[behavior_name]['speed'][i][n]=distance_traveled/(self.length/self.fps)
-								end_center=self.animal_centers[i][n]
-								if end_center is not None:
-									displacements=[]
-									for ct in self.animal_centers[i][n-self.length+1:n+1]:
-										if ct is None:
-											displacements.append(0)
-										else:
-											displacements.append(math.dist(end_center,ct))
-									displacement=max(displacements)
-									if normalize_distance:
-										displacement=displacement/calibrator
-									velocity=displacement/((self.length-np.argmax(displacements))/self.fps)
-									self.all_behavior_parameters[behavior_name]['velocity'][i][n]=velocity
-									start_center=self.animal_centers[i][n-1]
-									if start_center is not None:
-										dt=math.dist(end_center,start_center)
-										if normalize_distance:
-											dt=dt/calibrator
-										self.all_behavior_parameters[behavior_name]['distance'][i]+=dt
-								velocities_max=[]
-								velocities_min=[]
-								for v in self.all_behavior_parameters[behavior_name]['velocity'][i][n-self.length+1:n+1]:
-									if v!=np.nan:
-										velocities_max.append(v)
-										velocities_min.append(v)
-									else:
-										velocities_max.append(-float('inf'))
-										velocities_min.append(float('inf'))
-								vmax=max(velocities_max)
-								vmin=min(velocities_min)
-								if vmax!=-float('inf') and vmin!=float('inf'):
-									if np.argmax(velocities_max)!=np.argmin(velocities_min):
-										t=abs(np.argmax(velocities_max)-np.argmin(velocities_min))/self.fps
-										self.all_behavior_parameters[behavior_name]['acceleration'][i][n]=(vmax-vmin)/t
-
-							if '3 areal parameters' in parameter_to_analyze:
-								mask=np.zeros_like(self.background)
-								contour=self.animal_contours[i][n]
-								if contour is not None:
-									cv2.drawContours(mask,[contour],0,(255,255,255),-1)
-									mask=cv2.cvtColor(mask,cv2.COLOR_BGR2GRAY)
-									area_diffs=[]
-									for ct in self.animal_contours[i][n-self.length+1:n+1]:
-										if ct is not None:
-											prev_mask=np.zeros_like(self.background)
-											cv2.drawContours(prev_mask,[ct],0,(255,255,255),-1)
-											prev_mask=cv2.cvtColor(prev_mask,cv2.COLOR_BGR2GRAY)
-											xlf1,ybt1,w,h=cv2.boundingRect(contour)
-											xrt1=xlf1+w
-											ytp1=ybt1+h
-											xlf2,ybt2,w,h=cv2.boundingRect(ct)
-											xrt2=xlf2+w
-											ytp2=ybt2+h
-											xlf=min(xlf1,xlf2)
-											xrt=max(xrt1,xrt2)
-											ybt=min(ybt1,ybt2)
-											ytp=max(ytp1,ytp2)
-											curr_mask=mask[ybt:ytp,xlf:xrt]
-											prev_mask=prev_mask[ybt:ytp,xlf:xrt]
-											diff=cv2.bitwise_xor(prev_mask,curr_mask)
-											#diff[diff!=0]=255
-											area_diff=(np.sum(diff)/255)/(np.sum(prev_mask)/255)
-											area_diffs.append(area_diff)
-									if len(area_diffs)>0:
-										magnitude_area=max(area_diffs)
-										vigor_area=magnitude_area/((self.length-np.argmax(area_diffs))/self.fps)
-										intensity_area=sum(area_diffs)/(self.length/self.fps)
-										if magnitude_area>0:
-											self.all_behavior_parameters[behavior_name]['magnitude_area'][i][n]=magnitude_area
-										if vigor_area>0:
-											self.all_behavior_parameters[behavior_name]['vigor_area'][i][n]=vigor_area
-										if intensity_area>0:
-											self.all_behavior_parameters[behavior_name]['intensity_area'][i][n]=intensity_area
+						if 'latency' in parameter_to_analyze:
+							if parameters['latency'][i]=='NA':
+								parameters['latency'][i]=self.all_time[selected[0]]
 
 					else:
 
-						if '3 length parameters' in parameter_to_analyze:
-							heights_diffs=[]
-							for h in self.animal_heights[i][n-self.length+1:n+1]:
-								if h is None or self.animal_heights[i][n] is None:
-									height_diff=0.0
-								else:
-									height_diff=abs(h-self.animal_heights[i][n])/h
-								heights_diffs.append(height_diff)
-							magnitude_length=max(heights_diffs)
-							vigor_length=magnitude_length/((self.length-np.argmax(heights_diffs))/self.fps)
-							intensity_length=sum(heights_diffs)/(self.length/self.fps)
-							if magnitude_length>0:
-								self.all_behavior_parameters['magnitude_length'][i][n]=magnitude_length
-							if vigor_length>0:
-								self.all_behavior_parameters['vigor_length'][i][n]=vigor_length
-							if intensity_length>0:
-								self.all_behavior_parameters['intensity_length'][i][n]=intensity_length
-
-						if '4 locomotion parameters' in parameter_to_analyze:
-							distance_traveled=0.0
-							d=n-self.length
-							while d<n-1:
-								start_center=self.animal_centers[i][d]
-								end_center=self.animal_centers[i][d+1]
-								if start_center is None or end_center is None:
-									dt=0.0
-								else:
-									dt=math.dist(end_center,start_center)
-								distance_traveled+=dt
-								d+=1
+						parameters=self.all_behavior_parameters
+
+					selected=np.array(selected,dtype=int)
+
+					if '3 length parameters' in parameter_to_analyze:
+						fill_parameter(parameters['magnitude_length'][i],selected,magnitude_length,positive=True)
+						fill_parameter(parameters['vigor_length'][i],selected,vigor_length,positive=True)
+						fill_parameter(parameters['intensity_length'][i],selected,intensity_length,positive=True)
+
+					if '4 locomotion parameters' in parameter_to_analyze:
+						fill_parameter(parameters['speed'][i],selected,speed)
+						fill_parameter(parameters['velocity'][i],selected,velocity)
+						# the steps from the previous frames, in the order of the frames
+						moved=selected[~np.isnan(steps[selected-1])]
+						for dt in steps[moved-1].tolist():
 							if normalize_distance:
-								calibrator=math.sqrt(self.animal_area)
-								distance_traveled=distance_traveled/calibrator
-							self.all_behavior_parameters['speed'][i][n]=distance_traveled/(self.length/self.fps)
-							end_center=self.animal_centers[i][n]
-							if end_center is not None:
-								displacements=[]
-								for ct in self.animal_centers[i][n-self.length+1:n+1]:
-									if ct is None:
-										displacements.append(0)
-									else:
-										displacements.append(math.dist(end_center,ct))
-								displacement=max(displacements)
-								if normalize_distance:
-									displacement=displacement/calibrator
-								velocity=displacement/((self.length-np.argmax(displacements))/self.fps)
-								self.all_behavior_parameters['velocity'][i][n]=velocity
-								start_center=self.animal_centers[i][n-1]
-								if start_center is not None:
-									dt=math.dist(end_center,start_center)
-									if normalize_distance:
-										dt=dt/calibrator
-									self.all_behavior_parameters['distance'][i]+=dt
-
-							velocities_max=[]
-							velocities_min=[]
-							for v in self.all_behavior_parameters['velocity'][i][n-self.length+1:n+1]:
-								if v!=np.nan:
-									velocities_max.append(v)
-									velocities_min.append(v)
-								else:
-									velocities_max.append(-float('inf'))
-									velocities_min.append(float('inf'))
-							vmax=max(velocities_max)
-							vmin=min(velocities_min)
-							if vmax!=-float('inf') and vmin!=float('inf'):
-								if np.argmax(velocities_max)!=np.argmin(velocities_min):
-									t=abs(np.argmax(velocities_max)-np.argmin(velocities_min))/self.fps
-									self.all_behavior_parameters['acceleration'][i][n]=(vmax-vmin)/t
-
-						if '3 areal parameters' in parameter_to_analyze:
-							mask=np.zeros_like(self.background)
-							contour=self.animal_contours[i][n]
-							if contour is not None:
-								cv2.drawContours(mask,[contour],0,(255,255,255),-1)
-								mask=cv2.cvtColor(mask,cv2.COLOR_BGR2GRAY)
-								area_diffs=[]
-								for ct in self.animal_contours[i][n-self.length+1:n+1]:
-									if ct is not None:
-										prev_mask=np.zeros_like(self.background)
-										cv2.drawContours(prev_mask,[ct],0,(255,255,255),-1)
-										prev_mask=cv2.cvtColor(prev_mask,cv2.COLOR_BGR2GRAY)
-										xlf1,ybt1,w,h=cv2.boundingRect(contour)
-										xrt1=xlf1+w
-										ytp1=ybt1+h
-										xlf2,ybt2,w,h=cv2.boundingRect(ct)
-										xrt2=xlf2+w
-										ytp2=ybt2+h
-										xlf=min(xlf1,xlf2)
-										xrt=max(xrt1,xrt2)
-										ybt=min(ybt1,ybt2)
-										ytp=max(ytp1,ytp2)
-										curr_mask=mask[ybt:ytp,xlf:xrt]
-										prev_mask=prev_mask[ybt:ytp,xlf:xrt]
-										diff=cv2.bitwise_xor(prev_mask,curr_mask)
-										#diff[diff!=0]=255
-										area_diff=(np.sum(diff)/255)/(np.sum(prev_mask)/255)
-										area_diffs.append(area_diff)
-								if len(area_diffs)>0:
-									magnitude_area=max(area_diffs)
-									vigor_area=magnitude_area/((self.length-np.argmax(area_diffs))/self.fps)
-									intensity_area=sum(area_diffs)/(self.length/self.fps)
-									if magnitude_area>0:
-										self.all_behavior_parameters['magnitude_area'][i][n]=magnitude_area
-									if vigor_area>0:
-										self.all_behavior_parameters['vigor_area'][i][n]=vigor_area
-									if intensity_area>0:
-										self.all_behavior_parameters['intensity_area'][i][n]=intensity_area
-
-					n+=1
+								dt=dt/calibrator
+							parameters['distance'][i]+=dt
+						acceleration=window_acceleration(np.array(parameters['velocity'][i],dtype=float),self.length,self.fps)
+						fill_parameter(parameters['acceleration'][i],selected,acceleration)
+
+					if '3 areal parameters' in parameter_to_analyze:
+						fill_parameter(parameters['magnitude_area'][i],selected,magnitude_area,positive=True)
+						fill_parameter(parameters['vigor_area'][i],selected,vigor_area,positive=True)
+						fill_parameter(parameters['intensity_area'][i],selected,intensity_area,positive=True)
 
 				if self.categorize_behavior:
 
@@ -1125,6 +1156,8 @@ class AnalyzeAnimal():
 		if self.categorize_behavior:
 			events_df=pd.DataFrame(self.event_probability,index=self.all_time)
 			events_df.to_excel(os.path.join(self.results_path,'all_event_probability.xlsx'),float_format='%.2f',index_label='time/ID')
+			if self.binary_results:
+				write_events_npz(os.path.join(self.results_path,'all_event_probability.npz'),self.event_probability,self.all_time)
 
 		all_parameters=[]
 
@@ -1150,6 +1183,7 @@ class AnalyzeAnimal():
 				os.makedirs(os.path.join(self.results_path,behavior_name),exist_ok=True)
 
 				summary=[]
+				frame_parameters={}
 
 				for parameter_name in all_parameters:
 					if parameter_name in ['count','duration','distance','latency']:
@@ -1162,6 +1196,10 @@ class AnalyzeAnimal():
 							summary.append(individual_df.min(axis=1,skipna=True).to_frame().reset_index(drop=True).rename(columns={0:parameter_name+'_min'}))
 						individual_df=pd.DataFrame(self.all_behavior_parameters[behavior_name][parameter_name],index=self.all_time)
 						individual_df.to_excel(os.path.join(self.results_path,behavior_name,parameter_name+'.xlsx'),float_format='%.2f',index_label='time/ID')
+						frame_parameters[parameter_name]=self.all_behavior_parameters[behavior_name][parameter_name]
+
+				if self.binary_results and len(frame_parameters)>0:
+					write_parameters_npz(os.path.join(self.results_path,behavior_name,'all_parameters.npz'),frame_parameters,self.all_time)
 
 				if len(summary)>=1:
 					pd.concat(summary,axis=1).to_excel(os.path.join(self.results_path,behavior_name,'all_summary.xlsx'),float_format='%.2f',index_label='ID/parameter')
@@ -1169,6 +1207,7 @@ class AnalyzeAnimal():
 		else:
 
 			summary=[]
+			frame_parameters={}
 
 			for parameter_name in all_parameters:
 				if parameter_name=='distance':
@@ -1180,6 +1219,10 @@ class AnalyzeAnimal():
 					summary.append(individual_df.min(axis=1,skipna=True).to_frame().reset_index(drop=True).rename(columns={0:parameter_name+'_min'}))
 					individual_df=pd.DataFrame(self.all_behavior_parameters[parameter_name],index=self.all_time)
 					individual_df.to_excel(os.path.join(self.results_path,parameter_name+'.xlsx'),float_format='%.2f',index_label='time/ID')
+					frame_parameters[parameter_name]=self.all_behavior_parameters[parameter_name]
+
+			if self.binary_results and len(frame_parameters)>0:
+				write_parameters_npz(os.path.join(self.results_path,'all_parameters.npz'),frame_parameters,self.all_time)
 
 			if len(summary)>=1:
 				pd.concat(summary,axis=1).to_excel(os.path.join(self.results_path,'all_summary.xlsx'),float_format='%.2f',index_label='ID/parameter')
@@ -1201,45 +1244,29 @@ class AnalyzeAnimal():
 		print('Generating behavior examples...')
 		print(datetime.datetime.now())
 
-		background=self.background
-		background_low=self.background_low
-		background_high=self.background_high
-		if self.animal_vs_bg==1:
-			background=np.uint8(255-background)
-			background_low=np.uint8(255-background_low)
-			background_high=np.uint8(255-background_high)
+		(background,background_low,background_high,background_mean)=self.detection_backgrounds()
 
-		capture=cv2.VideoCapture(self.path_to_video)
-		frame_count=frame_count_analyze=0
+		frame_count_analyze=0
 		temp_frames=deque(maxlen=self.length)
 
 		for i in range(self.animal_number):
 			os.makedirs(os.path.join(self.results_path,'examples',str(i)),exist_ok=True)
 
-		start_t=round((self.t-self.length/self.fps),2)
-		if start_t<0:
-			start_t=0.00
-		if self.duration==0:
-			end_t=float('inf')
-		else:
-			end_t=start_t+self.duration
+		start_t,end_t=self.analysis_window()
 
-		while True:
+		for frame_count,frame in self.analysis_frames():
 
-			retval,frame=capture.read()
 			time=round((frame_count+1)/self.fps,2)
 
-			if time>=end_t or frame is None:
+			if time>=end_t:
 				break
 
 			if time>=start_t:
 
-				if self.framewidth is not None:
-					frame=cv2.resize(frame,(self.framewidth,self.frameheight),interpolation=cv2.INTER_AREA)
-
 				temp_frames.append(frame)
 
-				(contours,centers,heights,inners)=contour_frame(frame,self.animal_number,background,background_low,background_high,self.delta,self.animal_area,animal_vs_bg=self.animal_vs_bg,include_bodyparts=self.include_bodyparts,animation_analyzer=False,kernel=self.kernel,black_background=black_background)
+				(contours,centers,heights,inners)=contour_frame(frame,self.animal_number,background,background_low,background_high,self.delta,self.animal_area,animal_vs_bg=self.animal_vs_bg,include_bodyparts=self.include_bodyparts,animation_analyzer=False,kernel=self.kernel,black_background=black_background,
+					frame_mean=self.frame_mean(frame_count),background_mean=background_mean,segment_scale=self.segment_scale,segment_gray=self.segment_gray)
 
 				if len(contours)>0:
 
@@ -1283,10 +1310,6 @@ class AnalyzeAnimal():
 
 				frame_count_analyze+=1
 
-			frame_count+=1
-
-		capture.release()
-
 		print('Behavior example generation completed!')
 
 
@@ -1299,46 +1322,30 @@ class AnalyzeAnimal():
 		print('Generating behavior examples...')
 		print(datetime.datetime.now())
 
-		background=self.background
-		background_low=self.background_low
-		background_high=self.background_high
-		if self.animal_vs_bg==1:
-			background=np.uint8(255-background)
-			background_low=np.uint8(255-background_low)
-			background_high=np.uint8(255-background_high)
+		(background,background_low,background_high,background_mean)=self.detection_backgrounds()
 
-		capture=cv2.VideoCapture(self.path_to_video)
-		frame_count=frame_count_analyze=0
+		frame_count_analyze=0
 		temp_frames=deque(maxlen=self.length)
 		temp_contours=deque(maxlen=self.length)
 		temp_inners=deque(maxlen=self.length)
 		animation=deque(maxlen=self.length)
 		os.makedirs(os.path.join(self.results_path,'examples','0'),exist_ok=True)
 
-		start_t=round((self.t-self.length/self.fps),2)
-		if start_t<0:
-			start_t=0.00
-		if self.duration==0:
-			end_t=float('inf')
-		else:
-			end_t=start_t+self.duration
+		start_t,end_t=self.analysis_window()
 
-		while True:
+		for frame_count,frame in self.analysis_frames():
 
-			retval,frame=capture.read()
 			time=round((frame_count+1)/self.fps,2)
 
-			if time>=end_t or frame is None:
+			if time>=end_t:
 				break
 
 			if time>=start_t:
 
-				if self.framewidth is not None:
-					frame=cv2.resize(frame,(self.framewidth,self.frameheight),interpolation=cv2.INTER_AREA)
-
 				temp_frames.append(frame)
 
-				(contours,centers,heights,inners)=contour_frame(frame,self.animal_number,background,background_low,background_high,self.delta,self.animal_area,animal_vs_bg=self.animal_vs_bg,include_bodyparts=self.include_bodyparts,animation_analyzer=False,kernel=self.kernel,black_background=black_background)
+				(contours,centers,heights,inners)=contour_frame(frame,self.animal_number,background,background_low,background_high,self.delta,self.animal_area,animal_vs_bg=self.animal_vs_bg,include_bodyparts=self.include_bodyparts,animation_analyzer=False,kernel=self.kernel,black_background=black_background,
+					frame_mean=self.frame_mean(frame_count),background_mean=background_mean,segment_scale=self.segment_scale,segment_gray=self.segment_gray)
 
 				if len(contours)==0:
 
@@ -1387,8 +1394,4 @@ class AnalyzeAnimal():
 
 				frame_count_analyze+=1
 
-			frame_count+=1
-
-		capture.release()
-
 		print('Behavior example generation completed!')
@@ -30,24 +30,42 @@ import os
 import cv2
 import numpy as np
 import pandas as pd
-from scipy.spatial import distance
 from skimage import exposure
 import tensorflow as tf
 from tensorflow import keras  # pylint: disable=unused-import
-from keras.models import load_model
 from keras.utils import img_to_array
 import torch
 
 # Local application/library specific imports.
-from .detector import Detector
+from .framesource import FrameSource
+from .modelcache import load_categorizer, load_detector
+from .trackstore import TrackStore
 from .tools import (
 	crop_frame,
 	extract_blob_background,
 	extract_blob_all,
+	extract_blob_interact,
+	mask_bounds,
+	tile_regions,
+	merge_region_detections,
+	propagate_masks,
 	get_inner,
+	suppress_duplicate_masks,
 	generate_patternimage,
 	generate_patternimage_all,
 	generate_patternimage_interact,
+	assign_tracks,
+	find_neighbors,
+	categorized_frame,
+	track_array,
+	window_length_parameters,
+	window_locomotion_parameters,
+	window_acceleration,
+	window_areal_parameters,
+	fill_parameter,
+	write_events_npz,
+	write_centers_npz,
+	write_parameters_npz,
 	)
 
 
@@ -85,6 +103,7 @@ class AnalyzeAnimalDetector():
 		self.to_deregister={}
 		self.count_to_deregister=None
 		self.register_counts={}
+		self.tracks={}
 		self.animal_contours={}
 		self.animal_other_contours={}
 		self.animal_centers={}
@@ -93,6 +112,7 @@ class AnalyzeAnimalDetector():
 		self.animal_inners={}
 		self.animal_other_inners={}
 		self.animal_blobs={}
+		self.blob_cache={}
 		self.animations={}
 		self.pattern_images={}
 		self.event_probability={}
@@ -100,6 +120,17 @@ class AnalyzeAnimalDetector():
 		self.animal_present={}
 		self.temp_frames=None
 		self.social_distance=0
+		self.categorizer=None
+		self.stream_batch_size=32
+		self.stream_queue=[]
+		self.streamed_predictions=None
+		self.binary_results=False
+		self.tracker='greedy'
+		self.track_gate=None
+		self.detection_regions=None
+		self.detection_stride=1
+		self.detect_count=0
+		self.last_detection=None
 		self.log=[]
 
 
@@ -122,7 +153,14 @@ class AnalyzeAnimalDetector():
 		t=0, # start time point
 		duration=5, # the duration for example generation / analysis
 		length=15, # the duration (number of frames) of a behavior example (a behavior episode)
-		social_distance=0 # the distance to determine which two animals / objects form a interactive pair / group
+		social_distance=0, # the distance to determine which two animals / objects form a interactive pair / group
+		streaming_categorizer=None, # if not None, the path to the Categorizer that categorizes behaviors in micro-batches during information acquisition (streaming mode), so that animations and pattern images are not kept in memory
+		binary_results=False, # whether to also export the centers, behavior events and frame-wise parameters as compressed .npz files
+		tracker='greedy', # how to match the tracked animals to the detected ones in each frame, 'greedy' (closest pairs first) or 'hungarian' (optimal assignment)
+		track_gate=None, # if not None, the maximum distance (in pixels) an animal can move between two frames to be matched
+		detection_regions=None, # if not None, a list of [left,right,top,bottom] windows (like the cropping window in 'Preprocess Videos', in the coordinates of the resized frames) that the Detector runs on instead of the whole frame, like the arenas in a multi-well recording
+		tile_size=0, # if detection_regions is None and tile_size>0, the Detector runs on tile_size X tile_size tiles of the frame instead of the whole frame, for small animals / objects in large frames
+		tile_overlap=64 # the overlap (in pixels) of the tiles, better larger than an animal / object
 		):
 
 		print('Preparation started...')
@@ -130,8 +168,7 @@ class AnalyzeAnimalDetector():
 		print(datetime.datetime.now())
 		self.log.append(str(datetime.datetime.now()))
 
-		self.detector=Detector()
-		self.detector.load(path_to_detector,animal_kinds)
+		self.detector=load_detector(path_to_detector,animal_kinds)
 		self.animal_mapping=self.detector.animal_mapping
 		self.path_to_video=path_to_video
 		self.basename=os.path.basename(self.path_to_video)
@@ -150,6 +187,9 @@ class AnalyzeAnimalDetector():
 		self.t=t
 		self.duration=duration
 		self.length=length
+		self.binary_results=binary_results
+		self.tracker=tracker
+		self.track_gate=track_gate
 		self.social_distance=social_distance
 		if self.social_distance==0:
 			self.social_distance=float('inf')
@@ -181,8 +221,22 @@ class AnalyzeAnimalDetector():
 		else:
 			self.background=frame
 		self.temp_frames=deque(maxlen=self.length)
+
+		if detection_regions is not None and len(detection_regions)>0:
+			self.detection_regions=[(max(int(left),0),min(int(right),self.background.shape[1]),max(int(top),0),min(int(bottom),self.background.shape[0])) for (left,right,top,bottom) in detection_regions]
+		elif tile_size>0:
+			self.detection_regions=tile_regions(self.background.shape[:2],int(tile_size),overlap=int(tile_overlap))
+		else:
+			self.detection_regions=None
+		if self.detection_regions is not None:
+			print('The Detector runs on '+str(len(self.detection_regions))+' regions of each frame.')
+			self.log.append('The Detector runs on '+str(len(self.detection_regions))+' regions of each frame.')
 		framesize=min(self.background.shape[0],self.background.shape[1])
 
+		if self.categorize_behavior and streaming_categorizer is not None:
+			self.categorizer=load_categorizer(streaming_categorizer)
+			self.streamed_predictions={}
+
 		total_number=0
 		for animal_name in self.animal_kinds:
 			total_number+=self.animal_number[animal_name]
@@ -203,12 +257,14 @@ class AnalyzeAnimalDetector():
 			self.animal_area[animal_name]=None
 			self.to_deregister[animal_name]={}
 			self.register_counts[animal_name]={}
-			self.animal_contours[animal_name]={}
+			# the contours, centers and heights of the animals / objects in all the frames, kept in arrays
+			self.tracks[animal_name]=TrackStore(self.total_analysis_framecount,frame_size=self.background.shape[:2])
+			self.animal_contours[animal_name]=self.tracks[animal_name].contours
 			if self.behavior_mode==2:
 				self.animal_other_contours[animal_name]={}
-			self.animal_centers[animal_name]={}
+			self.animal_centers[animal_name]=self.tracks[animal_name].centers
 			self.animal_existingcenters[animal_name]={}
-			self.animal_heights[animal_name]={}
+			self.animal_heights[animal_name]=self.tracks[animal_name].heights
 			self.pattern_images[animal_name]={}
 			if self.include_bodyparts:
 				self.animal_inners[animal_name]={}
@@ -220,12 +276,10 @@ class AnalyzeAnimalDetector():
 			for i in range(self.animal_number[animal_name]):
 				self.to_deregister[animal_name][i]=0
 				self.register_counts[animal_name][i]=None
-				self.animal_contours[animal_name][i]=[None]*self.total_analysis_framecount
+				self.tracks[animal_name].add(i)
 				if self.behavior_mode==2:
 					self.animal_other_contours[animal_name][i]=deque(maxlen=self.length)
-				self.animal_centers[animal_name][i]=[None]*self.total_analysis_framecount
 				self.animal_existingcenters[animal_name][i]=(-10000,-10000)
-				self.animal_heights[animal_name][i]=[None]*self.total_analysis_framecount
 				if self.include_bodyparts:
 					self.animal_inners[animal_name][i]=deque(maxlen=self.length)
 					if self.behavior_mode==2:
@@ -251,6 +305,106 @@ class AnalyzeAnimalDetector():
 		self.log.append('Preparation completed!')
 
 
+	def analysis_window(self):
+
+		# return the start and end time points of the analysis
+
+		start_t=round((self.t-self.length/self.fps),2)
+		if start_t<0:
+			start_t=0.00
+		if self.duration==0:
+			end_t=float('inf')
+		else:
+			end_t=start_t+self.duration
+
+		return (start_t,end_t)
+
+
+	def stream_windows(self,frame_count_analyze):
+
+		# frame_count_analyze: the analyzed frame count, whose animations and pattern images have been generated
+
+		# queue the windows that will be categorized (see categorized_frame) and release the rest
+		for animal_name in self.pattern_images:
+			for n in self.pattern_images[animal_name]:
+				i=frame_count_analyze
+				if categorized_frame(self.animal_contours[animal_name][n],self.register_counts[animal_name][n],i,self.length):
+					if self.animation_analyzer:
+						self.stream_queue.append((animal_name,n,i,self.animations[animal_name][n][i],self.pattern_images[animal_name][n][i]))
+					else:
+						self.stream_queue.append((animal_name,n,i,None,self.pattern_images[animal_name][n][i]))
+				if self.animation_analyzer:
+					self.animations[animal_name][n][i]=None
+				self.pattern_images[animal_name][n][i]=None
+
+		if len(self.stream_queue)>=self.stream_batch_size:
+			self.predict_stream()
+
+
+	def predict_stream(self):
+
+		# categorize the queued windows in one micro-batch and store the predictions
+
+		if len(self.stream_queue)==0:
+			return
+
+		with tf.device('CPU'):
+			pattern_images=tf.convert_to_tensor(np.array([x[4] for x in self.stream_queue],dtype='float32')/255.0)
+			if self.animation_analyzer:
+				animations=tf.convert_to_tensor(np.array([x[3] for x in self.stream_queue],dtype='float32')/255.0)
+				inputs=[animations,pattern_images]
+			else:
+				inputs=pattern_images
+
+		predictions=self.categorizer.predict_on_batch(inputs)
+
+		for (animal_name,n,i,animation,pattern_image),prediction in zip(self.stream_queue,predictions):
+			if animal_name not in self.streamed_predictions:
+				self.streamed_predictions[animal_name]={}
+			if n not in self.streamed_predictions[animal_name]:
+				self.streamed_predictions[animal_name][n]=np.full((self.total_analysis_framecount,len(prediction)),np.nan,dtype='float32')
+			self.streamed_predictions[animal_name][n][i]=prediction
+
+		self.stream_queue=[]
+
+
+	def window_blobs(self,ID,frames,contours,start,background_free=True,black_background=True):
+
+		# ID: the (animal_name,identity) of the animal
+		# frames: the frames in the animation window
+		# contours: the contours of the animal in the animation window
+		# start: the analyzed frame count of the first frame in the window
+		# background_free: whether to include background in animations
+		# black_background: whether to set background black
+
+		# the blob of a frame only depends on its contour and the crop box of the window,
+		# so the blobs are reused until the crop box changes and only the newest frame is extracted
+
+		cache=self.blob_cache.setdefault(ID,{})
+		box=None
+		blobs=[]
+
+		for n,f in enumerate(frames):
+			contour=contours[n]
+			if contour is None:
+				blob=np.zeros((self.dim_tconv,self.dim_tconv,self.channel),dtype='uint8')
+			else:
+				if box is None:
+					box=crop_frame(f,contours)
+				if start+n in cache and cache[start+n][0]==box:
+					blob=cache[start+n][1]
+				else:
+					blob=extract_blob_background(f,contours,contour=contour,channel=self.channel,background_free=background_free,black_background=black_background)
+					blob=cv2.resize(blob,(self.dim_tconv,self.dim_tconv),interpolation=cv2.INTER_AREA)
+					cache[start+n]=(box,blob)
+			blobs.append(blob)
+
+		for frame_index in [x for x in cache if x<start]:
+			del cache[frame_index]
+
+		return blobs
+
+
 	def track_animal(self,frame_count_analyze,animal_name,contours,centers,heights,inners=None):
 
 		# animal_name: the name of animals / objects that are included in the analysis
@@ -259,35 +413,27 @@ class AnalyzeAnimalDetector():
 		# heights: the heights of detected animals / objects
 		# inners: the inner contours of detected animals / objects when body parts are included in pattern images
 
-		unused_existing_indices=list(self.animal_existingcenters[animal_name])
-		existing_centers=list(self.animal_existingcenters[animal_name].values())
-		unused_new_indices=list(range(len(centers)))
-		dt_flattened=distance.cdist(existing_centers,centers).flatten()
-		dt_sort_index=dt_flattened.argsort()
-		length=len(centers)
-
-		for idx in dt_sort_index:
-			index_in_existing=int(idx/length)
-			index_in_new=int(idx%length)
-			if index_in_existing in unused_existing_indices:
-				if index_in_new in unused_new_indices:
-					unused_existing_indices.remove(index_in_existing)
-					unused_new_indices.remove(index_in_new)
-					if self.register_counts[animal_name][index_in_existing] is None:
-						self.register_counts[animal_name][index_in_existing]=frame_count_analyze
-					self.to_deregister[animal_name][index_in_existing]=0
-					self.animal_contours[animal_name][index_in_existing][frame_count_analyze]=contours[index_in_new]
-					center=centers[index_in_new]
-					self.animal_centers[animal_name][index_in_existing][frame_count_analyze]=center
-					self.animal_existingcenters[animal_name][index_in_existing]=center
-					self.animal_heights[animal_name][index_in_existing][frame_count_analyze]=heights[index_in_new]
-					if self.include_bodyparts:
-						self.animal_inners[animal_name][index_in_existing].append(inners[index_in_new])
-						pattern_image=generate_patternimage(self.background,self.animal_contours[animal_name][index_in_existing][max(0,(frame_count_analyze-self.length+1)):frame_count_analyze+1],inners=self.animal_inners[animal_name][index_in_existing],std=self.std)
-					else:
-						pattern_image=generate_patternimage(self.background,self.animal_contours[animal_name][index_in_existing][max(0,(frame_count_analyze-self.length+1)):frame_count_analyze+1],inners=None,std=0)
-					pattern_image=cv2.resize(pattern_image,(self.dim_conv,self.dim_conv),interpolation=cv2.INTER_AREA)
-					self.pattern_images[animal_name][index_in_existing][frame_count_analyze]=np.array(pattern_image)
+		IDs=list(self.animal_existingcenters[animal_name])
+		matched=set()
+		for index,index_in_new in assign_tracks(list(self.animal_existingcenters[animal_name].values()),centers,method=self.tracker,gate=self.track_gate):
+			index_in_existing=IDs[index]
+			matched.add(index_in_existing)
+			if self.register_counts[animal_name][index_in_existing] is None:
+				self.register_counts[animal_name][index_in_existing]=frame_count_analyze
+			self.to_deregister[animal_name][index_in_existing]=0
+			self.animal_contours[animal_name][index_in_existing][frame_count_analyze]=contours[index_in_new]
+			center=centers[index_in_new]
+			self.animal_centers[animal_name][index_in_existing][frame_count_analyze]=center
+			self.animal_existingcenters[animal_name][index_in_existing]=center
+			self.animal_heights[animal_name][index_in_existing][frame_count_analyze]=heights[index_in_new]
+			if self.include_bodyparts:
+				self.animal_inners[animal_name][index_in_existing].append(inners[index_in_new])
+				pattern_image=generate_patternimage(self.background,self.animal_contours[animal_name][index_in_existing][max(0,(frame_count_analyze-self.length+1)):frame_count_analyze+1],inners=self.animal_inners[animal_name][index_in_existing],std=self.std)
+			else:
+				pattern_image=generate_patternimage(self.background,self.animal_contours[animal_name][index_in_existing][max(0,(frame_count_analyze-self.length+1)):frame_count_analyze+1],inners=None,std=0)
+			pattern_image=cv2.resize(pattern_image,(self.dim_conv,self.dim_conv),interpolation=cv2.INTER_AREA)
+			self.pattern_images[animal_name][index_in_existing][frame_count_analyze]=np.array(pattern_image)
+		unused_existing_indices=[i for i in IDs if i not in matched]
 
 		if len(unused_existing_indices)>0:
 			for i in unused_existing_indices:
@@ -327,42 +473,34 @@ class AnalyzeAnimalDetector():
 				if self.animation_analyzer:
 					animal_blobs=blobs[n:animal_length]
 
-				unused_existing_indices=list(self.animal_existingcenters[animal_name])
-				existing_centers=list(self.animal_existingcenters[animal_name].values())
-				unused_new_indices=list(range(len(animal_centers)))
-				dt_flattened=distance.cdist(existing_centers,animal_centers).flatten()
-				dt_sort_index=dt_flattened.argsort()
-				length=len(animal_centers)
-
-				for idx in dt_sort_index:
-					index_in_existing=int(idx/length)
-					index_in_new=int(idx%length)
-					if index_in_existing in unused_existing_indices:
-						if index_in_new in unused_new_indices:
-							unused_existing_indices.remove(index_in_existing)
-							unused_new_indices.remove(index_in_new)
-							if self.register_counts[animal_name][index_in_existing] is None:
-								self.register_counts[animal_name][index_in_existing]=frame_count_analyze
-							self.to_deregister[animal_name][index_in_existing]=0
-							contour=animal_contours[index_in_new]
-							self.animal_contours[animal_name][index_in_existing][frame_count_analyze]=contour
-							center=animal_centers[index_in_new]
-							self.animal_centers[animal_name][index_in_existing][frame_count_analyze]=center
-							self.animal_existingcenters[animal_name][index_in_existing]=center
-							self.animal_heights[animal_name][index_in_existing][frame_count_analyze]=animal_heights[index_in_new]
-							self.animal_other_contours[animal_name][index_in_existing].append(animal_other_contours[index_in_new])
-							if self.animation_analyzer:
-								blob=img_to_array(cv2.resize(animal_blobs[index_in_new],(self.dim_tconv,self.dim_tconv),interpolation=cv2.INTER_AREA))
-								self.animal_blobs[animal_name][index_in_existing].append(blob)
-								self.animations[animal_name][index_in_existing][frame_count_analyze]=np.array(self.animal_blobs[animal_name][index_in_existing])
-							if self.include_bodyparts:
-								self.animal_inners[animal_name][index_in_existing].append(animal_inners[index_in_new])
-								self.animal_other_inners[animal_name][index_in_existing].append(animal_other_inners[index_in_new])
-								pattern_image=generate_patternimage_interact(self.background,self.animal_contours[animal_name][index_in_existing][max(0,(frame_count_analyze-self.length+1)):frame_count_analyze+1],self.animal_other_contours[animal_name][index_in_existing],inners=self.animal_inners[animal_name][index_in_existing],other_inners=self.animal_other_inners[animal_name][index_in_existing],std=self.std)
-							else:
-								pattern_image=generate_patternimage_interact(self.background,self.animal_contours[animal_name][index_in_existing][max(0,(frame_count_analyze-self.length+1)):frame_count_analyze+1],self.animal_other_contours[animal_name][index_in_existing],inners=None,other_inners=None,std=0)
-							pattern_image=cv2.resize(pattern_image,(self.dim_conv,self.dim_conv),interpolation=cv2.INTER_AREA)
-							self.pattern_images[animal_name][index_in_existing][frame_count_analyze]=np.array(pattern_image)
+				IDs=list(self.animal_existingcenters[animal_name])
+				matched=set()
+				for index,index_in_new in assign_tracks(list(self.animal_existingcenters[animal_name].values()),animal_centers,method=self.tracker,gate=self.track_gate):
+					index_in_existing=IDs[index]
+					matched.add(index_in_existing)
+					if self.register_counts[animal_name][index_in_existing] is None:
+						self.register_counts[animal_name][index_in_existing]=frame_count_analyze
+					self.to_deregister[animal_name][index_in_existing]=0
+					contour=animal_contours[index_in_new]
+					self.animal_contours[animal_name][index_in_existing][frame_count_analyze]=contour
+					center=animal_centers[index_in_new]
+					self.animal_centers[animal_name][index_in_existing][frame_count_analyze]=center
+					self.animal_existingcenters[animal_name][index_in_existing]=center
+					self.animal_heights[animal_name][index_in_existing][frame_count_analyze]=animal_heights[index_in_new]
+					self.animal_other_contours[animal_name][index_in_existing].append(animal_other_contours[index_in_new])
+					if self.animation_analyzer:
+						blob=img_to_array(cv2.resize(animal_blobs[index_in_new],(self.dim_tconv,self.dim_tconv),interpolation=cv2.INTER_AREA))
+						self.animal_blobs[animal_name][index_in_existing].append(blob)
+						self.animations[animal_name][index_in_existing][frame_count_analyze]=np.array(self.animal_blobs[animal_name][index_in_existing])
+					if self.include_bodyparts:
+						self.animal_inners[animal_name][index_in_existing].append(animal_inners[index_in_new])
+						self.animal_other_inners[animal_name][index_in_existing].append(animal_other_inners[index_in_new])
+						pattern_image=generate_patternimage_interact(self.background,self.animal_contours[animal_name][index_in_existing][max(0,(frame_count_analyze-self.length+1)):frame_count_analyze+1],self.animal_other_contours[animal_name][index_in_existing],inners=self.animal_inners[animal_name][index_in_existing],other_inners=self.animal_other_inners[animal_name][index_in_existing],std=self.std)
+					else:
+						pattern_image=generate_patternimage_interact(self.background,self.animal_contours[animal_name][index_in_existing][max(0,(frame_count_analyze-self.length+1)):frame_count_analyze+1],self.animal_other_contours[animal_name][index_in_existing],inners=None,other_inners=None,std=0)
+					pattern_image=cv2.resize(pattern_image,(self.dim_conv,self.dim_conv),interpolation=cv2.INTER_AREA)
+					self.pattern_images[animal_name][index_in_existing][frame_count_analyze]=np.array(pattern_image)
+				unused_existing_indices=[i for i in IDs if i not in matched]
 
 				if len(unused_existing_indices)>0:
 					for i in unused_existing_indices:
@@ -380,6 +518,70 @@ class AnalyzeAnimalDetector():
 				n+=self.animal_present[animal_name]
 
 
+	def detect(self,frames,batch_size):
+
+		# frames: frames that the Detector runs on
+		# batch_size: for batch inferencing by the Detector
+
+		# return: for each frame, (masks,classes,scores) of the detected animals / objects, masks are full-frame uint8 arrays and classes are the animal names
+
+		if self.detection_stride<=1:
+			return self.run_detector(frames,batch_size)
+
+		# the Detector runs on every detection_stride-th frame, and the masks are propagated to the frames in between unless the propagation is not reliable
+		keyframes=[n for n in range(len(frames)) if (self.detect_count+n)%self.detection_stride==0]
+		detections=dict(zip(keyframes,self.run_detector([frames[n] for n in keyframes],batch_size)))
+		self.detect_count+=len(frames)
+
+		for n,frame in enumerate(frames):
+			gray=cv2.cvtColor(frame,cv2.COLOR_BGR2GRAY)
+			if n not in detections:
+				masks=None
+				if self.last_detection is not None and len(self.last_detection[1][0])>0:
+					(previous_gray,(previous_masks,classes,scores))=self.last_detection
+					masks=propagate_masks(previous_gray,gray,previous_masks)
+				if masks is None:
+					detections[n]=self.run_detector([frame],1)[0]
+				else:
+					detections[n]=(masks,classes,scores)
+			self.last_detection=(gray,detections[n])
+
+		return [detections[n] for n in range(len(frames))]
+
+
+	def run_detector(self,frames,batch_size):
+
+		# frames: frames that the Detector runs on
+		# batch_size: for batch inferencing by the Detector
+
+		# return: see detect
+
+		if len(frames)==0:
+			return []
+
+		if self.detection_regions is None:
+			tensor_frames=[torch.as_tensor(frame.astype('float32').transpose(2,0,1)) for frame in frames]
+			inputs=[{'image':tensor_frame} for tensor_frame in tensor_frames]
+			outputs=self.detector.inference(inputs)
+			detections=[]
+			for output in outputs:
+				instances=output['instances'].to('cpu')
+				detections.append((instances.pred_masks.numpy().astype(np.uint8),instances.pred_classes.numpy(),instances.scores.numpy()))
+		else:
+			# the regions of all the frames are inferenced in batches, and the masks are put back into the frames
+			crops=[frame[top:bottom,left:right] for frame in frames for (left,right,top,bottom) in self.detection_regions]
+			region_detections=[]
+			for start in range(0,len(crops),batch_size):
+				inputs=[{'image':torch.as_tensor(crop.astype('float32').transpose(2,0,1))} for crop in crops[start:start+batch_size]]
+				for output in self.detector.inference(inputs):
+					instances=output['instances'].to('cpu')
+					region_detections.append((instances.pred_masks.numpy().astype(np.uint8),instances.pred_classes.numpy(),instances.scores.numpy()))
+			region_count=len(self.detection_regions)
+			detections=[merge_region_detections(frame.shape,self.detection_regions,region_detections[n*region_count:(n+1)*region_count]) for n,frame in enumerate(frames)]
+
+		return [(masks,[self.animal_mapping[str(x)] for x in classes],scores) for (masks,classes,scores) in detections]
+
+
 	def detect_track_individuals(self,frames,batch_size,frame_count_analyze,background_free=True,black_background=True,animation=None):
 
 		# frames: frames that the Detector runs on
@@ -388,20 +590,10 @@ class AnalyzeAnimalDetector():
 		# background_free: whether to include background in animations
 		# black_background: whether to set background black
 
-		tensor_frames=[torch.as_tensor(frame.astype('float32').transpose(2,0,1)) for frame in frames]
-		inputs=[{'image':tensor_frame} for tensor_frame in tensor_frames]
-
-		outputs=self.detector.inference(inputs)
-
-		for batch_count,output in enumerate(outputs):
+		for batch_count,(masks,classes,scores) in enumerate(self.detect(frames,batch_size)):
 
 			frame=frames[batch_count]
 			self.temp_frames.append(frame)
-			instances=outputs[batch_count]['instances'].to('cpu')
-			masks=instances.pred_masks.numpy().astype(np.uint8)
-			classes=instances.pred_classes.numpy()
-			classes=[self.animal_mapping[str(x)] for x in classes]
-			scores=instances.scores.numpy()
 
 			if len(masks)==0:
 
@@ -435,9 +627,7 @@ class AnalyzeAnimalDetector():
 
 					else:
 
-						mask_area=np.sum(np.array(animal_masks),axis=(1,2))
-						exclusion_mask=np.zeros(len(animal_masks),dtype=bool)
-						exclusion_mask[np.where((np.sum(np.logical_and(np.array(animal_masks)[:,None],animal_masks),axis=(2,3))/mask_area[:,None]>0.8) & (mask_area[:,None]<mask_area[None,:]))[0]]=True
+						exclusion_mask=suppress_duplicate_masks(animal_masks)
 						animal_masks=[m for m,exclude in zip(animal_masks,exclusion_mask) if not exclude]
 						animal_scores=[s for s,exclude in zip(animal_scores,exclusion_mask) if not exclude]
 
@@ -480,14 +670,9 @@ class AnalyzeAnimalDetector():
 							self.track_animal(frame_count_analyze+1-batch_size+batch_count,animal_name,contours,centers,heights,inners=inners)
 
 							if self.animation_analyzer:
+								start=max(0,frame_count_analyze+1-batch_size+batch_count-self.length+1)
 								for i in self.animal_centers[animal_name]:
-									for n,f in enumerate(self.temp_frames):
-										contour=self.animal_contours[animal_name][i][max(0,frame_count_analyze+1-batch_size+batch_count-self.length+1):frame_count_analyze+1-batch_size+batch_count+1][n]
-										if contour is None:
-											blob=np.zeros((self.dim_tconv,self.dim_tconv,self.channel),dtype='uint8')
-										else:
-											blob=extract_blob_background(f,self.animal_contours[animal_name][i][max(0,frame_count_analyze+1-batch_size+batch_count-self.length+1):frame_count_analyze+1-batch_size+batch_count+1],contour=contour,channel=self.channel,background_free=background_free,black_background=black_background)
-											blob=cv2.resize(blob,(self.dim_tconv,self.dim_tconv),interpolation=cv2.INTER_AREA)
+									for blob in self.window_blobs((animal_name,i),self.temp_frames,self.animal_contours[animal_name][i][start:frame_count_analyze+1-batch_size+batch_count+1],start,background_free=background_free,black_background=black_background):
 										animation.append(img_to_array(blob))
 									self.animations[animal_name][i][frame_count_analyze+1-batch_size+batch_count]=np.array(animation)
 
@@ -501,19 +686,9 @@ class AnalyzeAnimalDetector():
 		# black_background: whether to set background black
 		# color_costar: in 'interactive advanced' mode, whether to make the supporting roles RGB scale in animations
 
-		tensor_frames=[torch.as_tensor(frame.astype('float32').transpose(2,0,1)) for frame in frames]
-		inputs=[{'image':tensor_frame} for tensor_frame in tensor_frames]
-
-		outputs=self.detector.inference(inputs)
-
-		for batch_count,output in enumerate(outputs):
+		for batch_count,(masks,classes,scores) in enumerate(self.detect(frames,batch_size)):
 
 			frame=frames[batch_count]
-			instances=outputs[batch_count]['instances'].to('cpu')
-			masks=instances.pred_masks.numpy().astype(np.uint8)
-			classes=instances.pred_classes.numpy()
-			classes=[self.animal_mapping[str(x)] for x in classes]
-			scores=instances.scores.numpy()
 
 			if len(masks)==0:
 
@@ -560,9 +735,7 @@ class AnalyzeAnimalDetector():
 
 					else:
 
-						mask_area=np.sum(np.array(animal_masks),axis=(1,2))
-						exclusion_mask=np.zeros(len(animal_masks),dtype=bool)
-						exclusion_mask[np.where((np.sum(np.logical_and(np.array(animal_masks)[:,None],animal_masks),axis=(2,3))/mask_area[:,None]>0.8) & (mask_area[:,None]<mask_area[None,:]))[0]]=True
+						exclusion_mask=suppress_duplicate_masks(animal_masks)
 						animal_masks=[m for m,exclude in zip(animal_masks,exclusion_mask) if not exclude]
 						animal_scores=[s for s,exclude in zip(animal_scores,exclusion_mask) if not exclude]
 
@@ -609,40 +782,26 @@ class AnalyzeAnimalDetector():
 
 				if len(all_centers)>1:
 
-					centers_array=np.array(all_centers)
-					distances_squared=np.sum((centers_array[:,None]-centers_array)**2,axis=2)
-					determine=np.logical_and(distances_squared>0,distances_squared<(math.sqrt(sum(average_area)/len(average_area))*self.social_distance)**2)
-					other_contours=[[all_contours[x] for x,determ in enumerate(determine[y]) if determ] for y,c in enumerate(all_centers)]
+					neighbors=find_neighbors(all_centers,math.sqrt(sum(average_area)/len(average_area))*self.social_distance)
+					other_contours=[[all_contours[x] for x in neighbors[y]] for y in range(len(all_centers))]
 					if self.include_bodyparts:
-						other_inners=[[all_inners[x] for x,determ in enumerate(determine[y]) if determ] for y,c in enumerate(all_centers)]
+						other_inners=[[all_inners[x] for x in neighbors[y]] for y in range(len(all_centers))]
 					else:
 						other_inners=None
 					if self.animation_analyzer:
-						other_masks=[np.bitwise_or.reduce(np.stack(np.array(all_masks)[determine[x]])) if len(c)>0 else None for x,c in enumerate(other_contours)]
-						for i,other_mask in enumerate(other_masks):
-							contour=all_contours[i]
+						# the blobs are made around the crop boxes, so the full-frame masks are only scanned once for their bounds
+						if background_free:
+							bounds=[mask_bounds(mask) for mask in all_masks]
+							frame_range=None
+						else:
+							bounds=None
+							frame_range=(int(frame.min()),int(frame.max()))
+						for i,contour in enumerate(all_contours):
 							total_contours=other_contours[i]
 							total_contours.append(contour)
 							(y_bt,y_tp,x_lf,x_rt)=crop_frame(self.background,total_contours)
-							if background_free:
-								blob=frame*cv2.cvtColor(all_masks[i],cv2.COLOR_GRAY2BGR)
-								if other_mask is not None:
-									if color_costar:
-										other_blob=frame*cv2.cvtColor(other_mask,cv2.COLOR_GRAY2BGR)
-									else:
-										other_blob=cv2.cvtColor(cv2.cvtColor(frame,cv2.COLOR_BGR2GRAY)*other_mask,cv2.COLOR_GRAY2BGR)
-									blob=cv2.add(blob,other_blob)
-								if black_background is False:
-									if other_mask is not None:
-										complete_masks=all_masks[i]|other_mask
-									else:
-										complete_masks=all_masks[i]
-									blob[complete_masks==0]=255
-								blob=np.uint8(exposure.rescale_intensity(blob,out_range=(0,255)))
-							else:
-								blob=np.uint8(exposure.rescale_intensity(frame,out_range=(0,255)))
-							cv2.drawContours(blob,[contour],0,(255,0,255),2)
-							all_blobs.append(blob[y_bt:y_tp,x_lf:x_rt])
+							blob=extract_blob_interact(frame,all_masks,bounds,i,neighbors[i],contour,y_bt,y_tp,x_lf,x_rt,background_free=background_free,black_background=black_background,color_costar=color_costar,frame_range=frame_range)
+							all_blobs.append(blob)
 
 					self.track_animal_interact(frame_count_analyze+1-batch_size+batch_count,all_contours,other_contours,all_centers,all_heights,inners=all_inners,other_inners=other_inners,blobs=all_blobs)
 
@@ -681,37 +840,35 @@ class AnalyzeAnimalDetector():
 						self.track_animal_interact(frame_count_analyze+1-batch_size+batch_count,all_contours,other_contours,all_centers,all_heights,inners=all_inners,other_inners=other_inners,blobs=all_blobs)
 
 
-	def acquire_information(self,batch_size=1,background_free=True,black_background=True,color_costar=False):
+	def acquire_information(self,batch_size=1,background_free=True,black_background=True,color_costar=False,detection_stride=1):
 
 		# batch_size: for batch inferencing by the Detector
 		# background_free: whether to include background in animations
 		# black_background: whether to set background black
 		# color_costar: in 'interactive advanced' mode, whether to make the supporting roles RGB scale in animations
+		# detection_stride: run the Detector on every detection_stride-th frame and propagate the masks to the frames in between by optical flow, the Detector still runs on the frames where the propagation is not reliable
 
 		print('Acquiring information in each frame...')
 		self.log.append('Acquiring information in each frame...')
 		print(datetime.datetime.now())
 		self.log.append(str(datetime.datetime.now()))
 
-		capture=cv2.VideoCapture(self.path_to_video)
+		self.detection_stride=detection_stride
+		self.detect_count=0
+		self.last_detection=None
+
+		self.blob_cache={}
 		batch=[]
-		batch_count=frame_count=frame_count_analyze=0
+		batch_count=frame_count_analyze=0
 		animation=deque([np.zeros((self.dim_tconv,self.dim_tconv,self.channel),dtype='uint8')],maxlen=self.length)*self.length
 
-		start_t=round((self.t-self.length/self.fps),2)
-		if start_t<0:
-			start_t=0.00
-		if self.duration==0:
-			end_t=float('inf')
-		else:
-			end_t=start_t+self.duration
+		start_t,end_t=self.analysis_window()
 
-		while True:
+		for frame_count,frame in FrameSource(self.path_to_video,framewidth=self.framewidth,frameheight=self.frameheight,start_t=start_t,end_t=end_t):
 
-			retval,frame=capture.read()
 			time=round((frame_count+1)/self.fps,2)
 
-			if time>=end_t or frame is None:
+			if time>=end_t:
 				break
 
 			if time>=start_t:
@@ -724,9 +881,6 @@ class AnalyzeAnimalDetector():
 					print(datetime.datetime.now())
 					self.log.append(str(datetime.datetime.now()))
 
-				if self.framewidth is not None:
-					frame=cv2.resize(frame,(self.framewidth,self.frameheight),interpolation=cv2.INTER_AREA)
-
 				batch.append(frame)
 				batch_count+=1
 
@@ -737,12 +891,14 @@ class AnalyzeAnimalDetector():
 					else:
 						self.detect_track_individuals(batch,batch_size,frame_count_analyze,background_free=background_free,black_background=black_background,animation=animation)
 					batch=[]
+					if self.categorizer is not None:
+						for count in range(frame_count_analyze+1-batch_size,frame_count_analyze+1):
+							self.stream_windows(count)
 
 				frame_count_analyze+=1
 
-			frame_count+=1
-
-		capture.release()
+		if self.categorizer is not None:
+			self.predict_stream()
 
 		for animal_name in self.animal_kinds:
 			print('The area of '+str(animal_name)+' is: '+str(self.animal_area[animal_name])+'.')
@@ -752,17 +908,22 @@ class AnalyzeAnimalDetector():
 		self.log.append('Information acquisition completed!')
 
 
-	def acquire_information_interact_basic(self,batch_size=1,background_free=True,black_background=True):
+	def acquire_information_interact_basic(self,batch_size=1,background_free=True,black_background=True,detection_stride=1):
 
 		# batch_size: for batch inferencing by the Detector
 		# background_free: whether to include background in animations
 		# black_background: whether to set background black
+		# detection_stride: run the Detector on every detection_stride-th frame and propagate the masks to the frames in between by optical flow, the Detector still runs on the frames where the propagation is not reliable
 
 		print('Acquiring information in each frame...')
 		self.log.append('Acquiring information in each frame...')
 		print(datetime.datetime.now())
 		self.log.append(str(datetime.datetime.now()))
 
+		self.detection_stride=detection_stride
+		self.detect_count=0
+		self.last_detection=None
+
 		name=self.animal_kinds[0]
 		self.register_counts={}
 		self.register_counts[name]={}
@@ -780,27 +941,19 @@ class AnalyzeAnimalDetector():
 		self.animal_centers[name]={}
 		self.animal_centers[name][0]=[None]*self.total_analysis_framecount
 
-		capture=cv2.VideoCapture(self.path_to_video)
 		batch=[]
-		batch_count=frame_count=frame_count_analyze=0
+		batch_count=frame_count_analyze=0
 		temp_contours=deque(maxlen=self.length)
 		temp_inners=deque(maxlen=self.length)
 		animation=deque([np.zeros((self.dim_tconv,self.dim_tconv,self.channel),dtype='uint8')],maxlen=self.length)*self.length
 
-		start_t=round((self.t-self.length/self.fps),2)
-		if start_t<0:
-			start_t=0.00
-		if self.duration==0:
-			end_t=float('inf')
-		else:
-			end_t=start_t+self.duration
+		start_t,end_t=self.analysis_window()
 
-		while True:
+		for frame_count,frame in FrameSource(self.path_to_video,framewidth=self.framewidth,frameheight=self.frameheight,start_t=start_t,end_t=end_t):
 
-			retval,frame=capture.read()
 			time=round((frame_count+1)/self.fps,2)
 
-			if time>=end_t or frame is None:
+			if time>=end_t:
 				break
 
 			if time>=start_t:
@@ -813,28 +966,15 @@ class AnalyzeAnimalDetector():
 					print(datetime.datetime.now())
 					self.log.append(str(datetime.datetime.now()))
 
-				if self.framewidth is not None:
-					frame=cv2.resize(frame,(self.framewidth,self.frameheight),interpolation=cv2.INTER_AREA)
-
 				batch.append(frame)
 				batch_count+=1
 
 				if batch_count==batch_size:
 
-					tensor_frames=[torch.as_tensor(frame.astype('float32').transpose(2,0,1)) for frame in batch]
-					inputs=[{'image':tensor_frame} for tensor_frame in tensor_frames]
-
-					outputs=self.detector.inference(inputs)
-
-					for batch_count,output in enumerate(outputs):
+					for batch_count,(masks,classes,scores) in enumerate(self.detect(batch,batch_size)):
 
 						frame=batch[batch_count]
 						self.temp_frames.append(frame)
-						instances=outputs[batch_count]['instances'].to('cpu')
-						masks=instances.pred_masks.numpy().astype(np.uint8)
-						classes=instances.pred_classes.numpy()
-						classes=[self.animal_mapping[str(x)] for x in classes]
-						scores=instances.scores.numpy()
 
 						if len(masks)==0:
 
@@ -859,9 +999,7 @@ class AnalyzeAnimalDetector():
 								animal_masks=[masks[a] for a,n in enumerate(classes) if n==animal_name]
 								animal_scores=[scores[a] for a,n in enumerate(classes) if n==animal_name]
 								if len(animal_masks)>0:
-									mask_area=np.sum(np.array(animal_masks),axis=(1,2))
-									exclusion_mask=np.zeros(len(animal_masks),dtype=bool)
-									exclusion_mask[np.where((np.sum(np.logical_and(np.array(animal_masks)[:,None],animal_masks),axis=(2,3))/mask_area[:,None]>0.8) & (mask_area[:,None]<mask_area[None,:]))[0]]=True
+									exclusion_mask=suppress_duplicate_masks(animal_masks)
 									animal_masks=[m for m,exclude in zip(animal_masks,exclusion_mask) if not exclude]
 									animal_scores=[s for s,exclude in zip(animal_scores,exclusion_mask) if not exclude]
 									if len(animal_masks)>0:
@@ -907,14 +1045,17 @@ class AnalyzeAnimalDetector():
 									animation.append(img_to_array(blob))
 									self.animations[name][0][frame_count_analyze+1-batch_size+batch_count]=np.array(animation)
 
+					if self.categorizer is not None:
+						for count in range(frame_count_analyze+1-batch_size,frame_count_analyze+1):
+							self.stream_windows(count)
+
 					batch=[]
 					batch_count=0
 
 				frame_count_analyze+=1
 
-			frame_count+=1
-
-		capture.release()
+		if self.categorizer is not None:
+			self.predict_stream()
 
 		length=len(self.all_time)
 		self.animations[name][0]=self.animations[name][0][:length]
@@ -941,11 +1082,7 @@ class AnalyzeAnimalDetector():
 			IDs=list(self.animal_centers[animal_name].keys())
 
 			for i in IDs:
-				check=0
-				for x in self.animal_heights[animal_name][i]:
-					if x is not None:
-						check+=1
-				lengths.append(check)
+				lengths.append(int(np.count_nonzero(~np.isnan(self.animal_heights[animal_name][i].to_array()))))
 				if self.register_counts[animal_name][i] is None:
 					to_delete.append(i)
 
@@ -956,12 +1093,10 @@ class AnalyzeAnimalDetector():
 				if i in to_delete:
 					del self.to_deregister[animal_name][i]
 					del self.register_counts[animal_name][i]
-					del self.animal_centers[animal_name][i]
+					self.tracks[animal_name].remove(i)
 					del self.animal_existingcenters[animal_name][i]
-					del self.animal_contours[animal_name][i]
 					if self.behavior_mode==2:
 						del self.animal_other_contours[animal_name][i]
-					del self.animal_heights[animal_name][i]
 					if self.include_bodyparts:
 						del self.animal_inners[animal_name][i]
 						if self.behavior_mode==2:
@@ -971,10 +1106,9 @@ class AnalyzeAnimalDetector():
 						del self.animations[animal_name][i]
 					del self.pattern_images[animal_name][i]
 
+			self.tracks[animal_name].truncate(length)
+
 			for i in self.animal_centers[animal_name]:
-				self.animal_centers[animal_name][i]=self.animal_centers[animal_name][i][:length]
-				self.animal_contours[animal_name][i]=self.animal_contours[animal_name][i][:length]
-				self.animal_heights[animal_name][i]=self.animal_heights[animal_name][i][:length]
 				if self.animation_analyzer:
 					self.animations[animal_name][i]=self.animations[animal_name][i][:length]
 				self.pattern_images[animal_name][i]=self.pattern_images[animal_name][i][:length]
@@ -994,7 +1128,11 @@ class AnalyzeAnimalDetector():
 		print(datetime.datetime.now())
 		self.log.append(str(datetime.datetime.now()))
 
-		categorizer=load_model(path_to_categorizer)
+		if self.streamed_predictions is None:
+			categorizer=load_categorizer(path_to_categorizer)
+		else:
+			# the windows were categorized during information acquisition
+			self.predict_stream()
 
 		if self.behavior_mode==1:
 			self.animal_kinds=[self.animal_kinds[0]]
@@ -1003,32 +1141,40 @@ class AnalyzeAnimalDetector():
 
 			IDs=list(self.pattern_images[animal_name].keys())
 
-			if self.animation_analyzer:
-				animations=self.animations[animal_name][IDs[0]]
-			pattern_images=self.pattern_images[animal_name][IDs[0]]
+			if self.streamed_predictions is None:
 
-			if len(self.pattern_images[animal_name])>1:
-				for n in IDs[1:]:
-					if self.animation_analyzer:
-						animations+=self.animations[animal_name][n]
-					pattern_images+=self.pattern_images[animal_name][n]
+				if self.animation_analyzer:
+					animations=self.animations[animal_name][IDs[0]]
+				pattern_images=self.pattern_images[animal_name][IDs[0]]
+
+				if len(self.pattern_images[animal_name])>1:
+					for n in IDs[1:]:
+						if self.animation_analyzer:
+							animations+=self.animations[animal_name][n]
+						pattern_images+=self.pattern_images[animal_name][n]
 
 			if self.animation_analyzer:
 				del self.animations[animal_name]
 			del self.pattern_images[animal_name]
 			gc.collect()
 
-			with tf.device('CPU'):
+			if self.streamed_predictions is None:
+
+				with tf.device('CPU'):
+					if self.animation_analyzer:
+						animations=tf.convert_to_tensor(np.array(animations,dtype='float32')/255.0)
+					pattern_images=tf.convert_to_tensor(np.array(pattern_images,dtype='float32')/255.0)
+
 				if self.animation_analyzer:
-					animations=tf.convert_to_tensor(np.array(animations,dtype='float32')/255.0)
-				pattern_images=tf.convert_to_tensor(np.array(pattern_images,dtype='float32')/255.0)
+					inputs=[animations,pattern_images]
+				else:
+					inputs=pattern_images
+
+				predictions=categorizer.predict(inputs,batch_size=32)
 
-			if self.animation_analyzer:
-				inputs=[animations,pattern_images]
 			else:
-				inputs=pattern_images
 
-			predictions=categorizer.predict(inputs,batch_size=32)
+				predictions=None
 
 			for behavior_name in self.all_behavior_parameters[animal_name]:
 				for i in IDs:
@@ -1040,33 +1186,31 @@ class AnalyzeAnimalDetector():
 				i=self.length+self.register_counts[animal_name][n]
 				idx+=i
 				while i<len(self.animal_contours[animal_name][n]):
-					if self.animal_contours[animal_name][n][i] is not None:
-						check=0
-						for c in self.animal_contours[animal_name][n][i-self.length+1:i+1]:
-							if c is None:
-								check+=1
-						if check<=self.length/2:
+					if categorized_frame(self.animal_contours[animal_name][n],self.register_counts[animal_name][n],i,self.length):
+						if predictions is None:
+							prediction=self.streamed_predictions[animal_name][n][i]
+						else:
 							prediction=predictions[idx]
-							behavior_names=list(self.all_behavior_parameters[animal_name].keys())
-							for name_index,behavior_name in enumerate(behavior_names):
-								if len(behavior_names)==2:
-									if name_index==0:
-										probability=1-prediction[0]
-									else:
-										probability=prediction[0]
-								else:
-									probability=prediction[name_index]
-								self.all_behavior_parameters[animal_name][behavior_name]['probability'][n][i]=probability
+						behavior_names=list(self.all_behavior_parameters[animal_name].keys())
+						for name_index,behavior_name in enumerate(behavior_names):
 							if len(behavior_names)==2:
-								if prediction[0]>0.5:
-									if prediction[0]-(1-prediction[0])>uncertain:
-										self.event_probability[animal_name][n][i]=[behavior_names[1],prediction[0]]
-								if prediction[0]<0.5:
-									if (1-prediction[0])-prediction[0]>uncertain:
-										self.event_probability[animal_name][n][i]=[behavior_names[0],1-prediction[0]]
+								if name_index==0:
+									probability=1-prediction[0]
+								else:
+									probability=prediction[0]
 							else:
-								if sorted(prediction)[-1]-sorted(prediction)[-2]>uncertain:
-									self.event_probability[animal_name][n][i]=[behavior_names[np.argmax(prediction)],max(prediction)]
+								probability=prediction[name_index]
+							self.all_behavior_parameters[animal_name][behavior_name]['probability'][n][i]=probability
+						if len(behavior_names)==2:
+							if prediction[0]>0.5:
+								if prediction[0]-(1-prediction[0])>uncertain:
+									self.event_probability[animal_name][n][i]=[behavior_names[1],prediction[0]]
+							if prediction[0]<0.5:
+								if (1-prediction[0])-prediction[0]>uncertain:
+									self.event_probability[animal_name][n][i]=[behavior_names[0],1-prediction[0]]
+						else:
+							if sorted(prediction)[-1]-sorted(prediction)[-2]>uncertain:
+								self.event_probability[animal_name][n][i]=[behavior_names[np.argmax(prediction)],max(prediction)]
 					idx+=1
 					i+=1
 
@@ -1182,44 +1326,35 @@ class AnalyzeAnimalDetector():
 				else:
 					intvl=int(self.background.shape[0]/(len(colors)+1))
 
-		capture=cv2.VideoCapture(self.path_to_video)
 		writer=None
-		frame_count=frame_count_analyze=0
+		frame_count_analyze=0
 
 		if self.behavior_mode==1:
 			total_animal_number=1
 		else:
 			total_animal_number=0
 			for animal_name in self.animal_kinds:
-				df=pd.DataFrame(self.animal_centers[animal_name],index=self.all_time)
+				df=pd.DataFrame(dict(self.animal_centers[animal_name].items()),index=self.all_time)
 				df.to_excel(os.path.join(self.results_path,animal_name+'_'+'all_centers.xlsx'),index_label='time/ID')
+				if self.binary_results:
+					write_centers_npz(os.path.join(self.results_path,animal_name+'_'+'all_centers.npz'),self.animal_centers[animal_name],self.all_time)
 				for i in self.animal_centers[animal_name]:
 					total_animal_number+=1
 			if total_animal_number<=0:
 				total_animal_number=1
 		color_diff=int(510/total_animal_number)
 
-		start_t=round((self.t-self.length/self.fps),2)
-		if start_t<0:
-			start_t=0.00
-		if self.duration==0:
-			end_t=float('inf')
-		else:
-			end_t=start_t+self.duration
+		start_t,end_t=self.analysis_window()
 
-		while True:
+		for frame_count,frame in FrameSource(self.path_to_video,framewidth=self.framewidth,frameheight=self.frameheight,start_t=start_t,end_t=end_t):
 
-			retval,frame=capture.read()
 			time=round((frame_count+1)/self.fps,2)
 
-			if time>=end_t or frame is None:
+			if time>=end_t:
 				break
 
 			if time>=start_t:
 
-				if self.framewidth is not None:
-					frame=cv2.resize(frame,(self.framewidth,self.frameheight),interpolation=cv2.INTER_AREA)
-
 				if self.categorize_behavior:
 					if show_legend:
 						n=1
@@ -1295,9 +1430,6 @@ class AnalyzeAnimalDetector():
 
 				frame_count_analyze+=1
 
-			frame_count+=1
-
-		capture.release()
 		writer.release()
 
 		cv2.imwrite(os.path.join(self.results_path,'Trajectory_background.jpg'),self.background)
@@ -1347,248 +1479,78 @@ class AnalyzeAnimalDetector():
 
 			for animal_name in self.animal_kinds:
 
+				if normalize_distance:
+					calibrator=math.sqrt(self.animal_area[animal_name])
+				else:
+					calibrator=None
+
 				for i in self.animal_contours[animal_name]:
 
-					n=self.length+self.register_counts[animal_name][i]
+					frames=list(range(self.length+self.register_counts[animal_name][i],len(self.animal_contours[animal_name][i])))
 
-					while n<len(self.animal_contours[animal_name][i]):
+					# the frames in which each behavior is analyzed
+					if self.categorize_behavior:
+						behavior_frames={}
+						for n in frames:
+							behavior_name=self.event_probability[animal_name][i][n][0]
+							if behavior_name!='NA':
+								behavior_frames.setdefault(behavior_name,[]).append(n)
+					else:
+						behavior_frames={None:frames}
 
-						if self.categorize_behavior:
+					# the sliding-window parameters of all the frames, computed once for all the behaviors
+					if '3 length parameters' in parameter_to_analyze:
+						magnitude_length,vigor_length,intensity_length=window_length_parameters(track_array(self.animal_heights[animal_name][i]),self.length,self.fps)
+					if '4 locomotion parameters' in parameter_to_analyze:
+						centers=track_array(self.animal_centers[animal_name][i],dimension=2)
+						speed,velocity,steps=window_locomotion_parameters(centers,self.length,self.fps,calibrator=calibrator)
+					if '3 areal parameters' in parameter_to_analyze:
+						analyzed_frames=sorted(n for selected in behavior_frames.values() for n in selected)
+						magnitude_area,vigor_area,intensity_area=window_areal_parameters(self.animal_contours[animal_name][i],analyzed_frames,self.length,self.fps)
 
-							behavior_name=self.event_probability[animal_name][i][n][0]
+					for behavior_name,selected in behavior_frames.items():
 
-							if behavior_name!='NA':
+						if self.categorize_behavior:
 
-								if 'count' in parameter_to_analyze:
-									if behavior_name!=self.event_probability[animal_name][i][n-1][0]:
-										self.all_behavior_parameters[animal_name][behavior_name]['count'][i]+=1
+							parameters=self.all_behavior_parameters[animal_name][behavior_name]
 
-								if 'duration' in parameter_to_analyze:
-									self.all_behavior_parameters[animal_name][behavior_name]['duration'][i]+=1
+							if 'count' in parameter_to_analyze:
+								parameters['count'][i]+=sum(1 for n in selected if self.event_probability[animal_name][i][n-1][0]!=behavior_name)
 
-								if 'latency' in parameter_to_analyze:
-									if self.all_behavior_parameters[animal_name][behavior_name]['latency'][i]=='NA':
-										self.all_behavior_parameters[animal_name][behavior_name]['latency'][i]=self.all_time[n]
+							if 'duration' in parameter_to_analyze:
+								parameters['duration'][i]+=len(selected)
 
-								if '3 length parameters' in parameter_to_analyze:
-									heights_diffs=[]
-									for h in self.animal_heights[animal_name][i][n-self.length+1:n+1]:
-										if h is None or self.animal_heights[animal_name][i][n] is None:
-											height_diff=0.0
-										else:
-											height_diff=abs(h-self.animal_heights[animal_name][i][n])/h
-										heights_diffs.append(height_diff)
-									magnitude_length=max(heights_diffs)
-									vigor_length=magnitude_length/((self.length-np.argmax(heights_diffs))/self.fps)
-									intensity_length=sum(heights_diffs)/(self.length/self.fps)
-									if magnitude_length>0:
-										self.all_behavior_parameters[animal_name][behavior_name]['magnitude_length'][i][n]=magnitude_length
-									if vigor_length>0:
-										self.all_behavior_parameters[animal_name][behavior_name]['vigor_length'][i][n]=vigor_length
-									if intensity_length>0:
-										self.all_behavior_parameters[animal_name][behavior_name]['intensity_length'][i][n]=intensity_length
-
-								if '4 locomotion parameters' in parameter_to_analyze:
-									distance_traveled=0.0
-									d=n-self.length
-									while d<n-1:
-										start_center=self.animal_centers[animal_name][i][d]
-										end_center=self.animal_centers[animal_name][i][d+1]
-										if start_center is None or end_center is None:
-											dt=0.0
-										else:
-											dt=math.dist(end_center,start_center)
-										distance_traveled+=dt
-										d+=1
-									if normalize_distance:
-										calibrator=math.sqrt(self.animal_area[animal_name])
-										distance_traveled=distance_traveled/calibrator
-									self.all_behavior_parameters[animal_name][behavior_name]['speed'][i][n]=distance_traveled/(self.length/self.fps)
-									end_center=self.animal_centers[animal_name][i][n]
-									if end_center is not None:
-										displacements=[]
-										for ct in self.animal_centers[animal_name][i][n-self.length+1:n+1]:
-											if ct is None:
-												displacements.append(0)
-											else:
-												displacements.append(math.dist(end_center,ct))
-										displacement=max(displacements)
-										if normalize_distance:
-											displacement=displacement/calibrator
-										velocity=displacement/((self.length-np.argmax(displacements))/self.fps)
-										self.all_behavior_parameters[animal_name][behavior_name]['velocity'][i][n]=velocity
-										start_center=self.animal_centers[animal_name][i][n-1]
-										if start_center is not None:
-											dt=math.dist(end_center,start_center)
-											if normalize_distance:
-												dt=dt/calibrator
-											self.all_behavior_parameters[animal_name][behavior_name]['distance'][i]+=dt
-									velocities_max=[]
-									velocities_min=[]
-									for v in self.all_behavior_parameters[animal_name][behavior_name]['velocity'][i][n-self.length+1:n+1]:
-										if v!=np.nan:
-											velocities_max.append(v)
-											velocities_min.append(v)
-										else:
-											velocities_max.append(-float('inf'))
-											velocities_min.append(float('inf'))
-									vmax=max(velocities_max)
-									vmin=min(velocities_min)
-									if vmax!=-float('inf') and vmin!=float('inf'):
-										if np.argmax(velocities_max)!=np.argmin(velocities_min):
-											t=abs(np.argmax(velocities_max)-np.argmin(velocities_min))/self.fps
-											self.all_behavior_parameters[animal_name][behavior_name]['acceleration'][i][n]=(vmax-vmin)/t
-
-								if '3 areal parameters' in parameter_to_analyze:
-									mask=np.zeros_like(self.background)
-									contour=self.animal_contours[animal_name][i][n]
-									if contour is not None:
-										cv2.drawContours(mask,[contour],0,(255,255,255),-1)
-										mask=cv2.cvtColor(mask,cv2.COLOR_BGR2GRAY)
-										area_diffs=[]
-										for ct in self.animal_contours[animal_name][i][n-self.length+1:n+1]:
-											if ct is not None:
-												prev_mask=np.zeros_like(self.background)
-												cv2.drawContours(prev_mask,[ct],0,(255,255,255),-1)
-												prev_mask=cv2.cvtColor(prev_mask,cv2.COLOR_BGR2GRAY)
-												xlf1,ybt1,w,h=cv2.boundingRect(contour)
-												xrt1=xlf1+w
-												ytp1=ybt1+h
-												xlf2,ybt2,w,h=cv2.boundingRect(ct)
-												xrt2=xlf2+w
-												ytp2=ybt2+h
-												xlf=min(xlf1,xlf2)
-												xrt=max(xrt1,xrt2)
-												ybt=min(ybt1,ybt2)
-												ytp=max(ytp1,ytp2)
-												curr_mask=mask[ybt:ytp,xlf:xrt]
-												prev_mask=prev_mask[ybt:ytp,xlf:xrt]
-												diff=cv2.bitwise_xor(prev_mask,curr_mask)
-												#diff[diff!=0]=255
-												area_diff=(np.sum(diff)/255)/(np.sum(prev_mask)/255)
-												area_diffs.append(area_diff)
-										if len(area_diffs)>0:
-											magnitude_area=max(area_diffs)
-											vigor_area=magnitude_area/((self.length-np.argmax(area_diffs))/self.fps)
-											intensity_area=sum(area_diffs)/(self.length/self.fps)
-											if magnitude_area>0:
-												self.all_behavior_parameters[animal_name][behavior_name]['magnitude_area'][i][n]=magnitude_area
-											if vigor_area>0:
-												self.all_behavior_parameters[animal_name][behavior_name]['vigor_area'][i][n]=vigor_area
-											if intensity_area>0:
-												self.all_behavior_parameters[animal_name][behavior_name]['intensity_area'][i][n]=intensity_area
+							if 'latency' in parameter_to_analyze:
+								if parameters['latency'][i]=='NA':
+									parameters['latency'][i]=self.all_time[selected[0]]
 
 						else:
 
-							if '3 length parameters' in parameter_to_analyze:
-								heights_diffs=[]
-								for h in self.animal_heights[animal_name][i][n-self.length+1:n+1]:
-									if h is None or self.animal_heights[animal_name][i][n] is None:
-										height_diff=0.0
-									else:
-										height_diff=abs(h-self.animal_heights[animal_name][i][n])/h
-									heights_diffs.append(height_diff)
-								magnitude_length=max(heights_diffs)
-								vigor_length=magnitude_length/((self.length-np.argmax(heights_diffs))/self.fps)
-								intensity_length=sum(heights_diffs)/(self.length/self.fps)
-								if magnitude_length>0:
-									self.all_behavior_parameters[animal_name]['magnitude_length'][i][n]=magnitude_length
-								if vigor_length>0:
-									self.all_behavior_parameters[animal_name]['vigor_length'][i][n]=vigor_length
-								if intensity_length>0:
-									self.all_behavior_parameters[animal_name]['intensity_length'][i][n]=intensity_length
-
-							if '4 locomotion parameters' in parameter_to_analyze:
-								distance_traveled=0.0
-								d=n-self.length
-								while d<n-1:
-									start_center=self.animal_centers[animal_name][i][d]
-									end_center=self.animal_centers[animal_name][i][d+1]
-									if start_center is None or end_center is None:
-										dt=0.0
-									else:
-										dt=math.dist(end_center,start_center)
-									distance_traveled+=dt
-									d+=1
+							parameters=self.all_behavior_parameters[animal_name]
+
+						selected=np.array(selected,dtype=int)
+
+						if '3 length parameters' in parameter_to_analyze:
+							fill_parameter(parameters['magnitude_length'][i],selected,magnitude_length,positive=True)
+							fill_parameter(parameters['vigor_length'][i],selected,vigor_length,positive=True)
+							fill_parameter(parameters['intensity_length'][i],selected,intensity_length,positive=True)
+
+						if '4 locomotion parameters' in parameter_to_analyze:
+							fill_parameter(parameters['speed'][i],selected,speed)
+							fill_parameter(parameters['velocity'][i],selected,velocity)
+							# the steps from the previous frames, in the order of the frames
+							moved=selected[~np.isnan(steps[selected-1])]
+							for dt in steps[moved-1].tolist():
 								if normalize_distance:
-									calibrator=math.sqrt(self.animal_area[animal_name])
-									distance_traveled=distance_traveled/calibrator
-								self.all_behavior_parameters[animal_name]['speed'][i][n]=distance_traveled/(self.length/self.fps)
-								end_center=self.animal_centers[animal_name][i][n]
-								if end_center is not None:
-									displacements=[]
-									for ct in self.animal_centers[animal_name][i][n-self.length+1:n+1]:
-										if ct is None:
-											displacements.append(0)
-										else:
-											displacements.append(math.dist(end_center,ct))
-									displacement=max(displacements)
-									if normalize_distance:
-										displacement=displacement/calibrator
-									velocity=displacement/((self.length-np.argmax(displacements))/self.fps)
-									self.all_behavior_parameters[animal_name]['velocity'][i][n]=velocity
-									start_center=self.animal_centers[animal_name][i][n-1]
-									if start_center is not None:
-										dt=math.dist(end_center,start_center)
-										if normalize_distance:
-											dt=dt/calibrator
-										self.all_behavior_parameters[animal_name]['distance'][i]+=dt
-								velocities_max=[]
-								velocities_min=[]
-								for v in self.all_behavior_parameters[animal_name]['velocity'][i][n-self.length+1:n+1]:
-									if v!=np.nan:
-										velocities_max.append(v)
-										velocities_min.append(v)
-									else:
-										velocities_max.append(-float('inf'))
-										velocities_min.append(float('inf'))
-								vmax=max(velocities_max)
-								vmin=min(velocities_min)
-								if vmax!=-float('inf') and vmin!=float('inf'):
-									if np.argmax(velocities_max)!=np.argmin(velocities_min):
-										t=abs(np.argmax(velocities_max)-np.argmin(velocities_min))/self.fps
-										self.all_behavior_parameters[animal_name]['acceleration'][i][n]=(vmax-vmin)/t
-
-							if '3 areal parameters' in parameter_to_analyze:
-								mask=np.zeros_like(self.background)
-								contour=self.animal_contours[animal_name][i][n]
-								if contour is not None:
-									cv2.drawContours(mask,[contour],0,(255,255,255),-1)
-									mask=cv2.cvtColor(mask,cv2.COLOR_BGR2GRAY)
-									area_diffs=[]
-									for ct in self.animal_contours[animal_name][i][n-self.length+1:n+1]:
-										if ct is not None:
-											prev_mask=np.zeros_like(self.background)
-											cv2.drawContours(prev_mask,[ct],0,(255,255,255),-1)
-											prev_mask=cv2.cvtColor(prev_mask,cv2.COLOR_BGR2GRAY)
-											xlf1,ybt1,w,h=cv2.boundingRect(contour)
-											xrt1=xlf1+w
-											ytp1=ybt1+h
-											xlf2,ybt2,w,h=cv2.boundingRect(ct)
-											xrt2=xlf2+w
-											ytp2=ybt2+h
-											xlf=min(xlf1,xlf2)
-											xrt=max(xrt1,xrt2)
-											ybt=min(ybt1,ybt2)
-											ytp=max(ytp1,ytp2)
-											curr_mask=mask[ybt:ytp,xlf:xrt]
-											prev_mask=prev_mask[ybt:ytp,xlf:xrt]
-											diff=cv2.bitwise_xor(prev_mask,curr_mask)
-											#diff[diff!=0]=255
-											area_diff=(np.sum(diff)/255)/(np.sum(prev_mask)/255)
-											area_diffs.append(area_diff)
-									if len(area_diffs)>0:
-										magnitude_area=max(area_diffs)
-										vigor_area=magnitude_area/((self.length-np.argmax(area_diffs))/self.fps)
-										intensity_area=sum(area_diffs)/(self.length/self.fps)
-										if magnitude_area>0:
-											self.all_behavior_parameters[animal_name]['magnitude_area'][i][n]=magnitude_area
-										if vigor_area>0:
-											self.all_behavior_parameters[animal_name]['vigor_area'][i][n]=vigor_area
-										if intensity_area>0:
-											self.all_behavior_parameters[animal_name]['intensity_area'][i][n]=intensity_area
+									dt=dt/calibrator
+								parameters['distance'][i]+=dt
+							acceleration=window_acceleration(np.array(parameters['velocity'][i],dtype=float),self.length,self.fps)
+							fill_parameter(parameters['acceleration'][i],selected,acceleration)
 
-						n+=1
+						if '3 areal parameters' in parameter_to_analyze:
+							fill_parameter(parameters['magnitude_area'][i],selected,magnitude_area,positive=True)
+							fill_parameter(parameters['vigor_area'][i],selected,vigor_area,positive=True)
+							fill_parameter(parameters['intensity_area'][i],selected,intensity_area,positive=True)
 
 					if self.categorize_behavior:
 
@@ -1630,6 +1592,8 @@ class AnalyzeAnimalDetector():
 			if self.categorize_behavior:
 				events_df=pd.DataFrame(self.event_probability[animal_name],index=self.all_time)
 				events_df.to_excel(os.path.join(self.results_path,animal_name+'_all_event_probability.xlsx'),float_format='%.2f',index_label='time/ID')
+				if self.binary_results:
+					write_events_npz(os.path.join(self.results_path,animal_name+'_all_event_probability.npz'),self.event_probability[animal_name],self.all_time)
 
 			all_parameters=[]
 
@@ -1655,6 +1619,7 @@ class AnalyzeAnimalDetector():
 					os.makedirs(os.path.join(self.results_path,behavior_name),exist_ok=True)
 
 					summary=[]
+					frame_parameters={}
 
 					for parameter_name in all_parameters:
 						if parameter_name in ['count','duration','distance','latency']:
@@ -1667,6 +1632,10 @@ class AnalyzeAnimalDetector():
 								summary.append(individual_df.min(axis=1,skipna=True).to_frame().reset_index(drop=True).rename(columns={0:parameter_name+'_min'}))
 							individual_df=pd.DataFrame(self.all_behavior_parameters[animal_name][behavior_name][parameter_name],index=self.all_time)
 							individual_df.to_excel(os.path.join(self.results_path,behavior_name,animal_name+'_'+parameter_name+'.xlsx'),float_format='%.2f',index_label='time/ID')
+							frame_parameters[parameter_name]=self.all_behavior_parameters[animal_name][behavior_name][parameter_name]
+
+					if self.binary_results and len(frame_parameters)>0:
+						write_parameters_npz(os.path.join(self.results_path,behavior_name,animal_name+'_all_parameters.npz'),frame_parameters,self.all_time)
 
 					if len(summary)>=1:
 						pd.concat(summary,axis=1).to_excel(os.path.join(self.results_path,behavior_name,animal_name+'_all_summary.xlsx'),float_format='%.2f',index_label='ID/parameter')
@@ -1674,6 +1643,7 @@ class AnalyzeAnimalDetector():
 			else:
 
 				summary=[]
+				frame_parameters={}
 
 				for parameter_name in all_parameters:
 					if parameter_name=='distance':
@@ -1685,6 +1655,10 @@ class AnalyzeAnimalDetector():
 						summary.append(individual_df.min(axis=1,skipna=True).to_frame().reset_index(drop=True).rename(columns={0:parameter_name+'_min'}))
 						individual_df=pd.DataFrame(self.all_behavior_parameters[animal_name][parameter_name],index=self.all_time)
 						individual_df.to_excel(os.path.join(self.results_path,animal_name+'_'+parameter_name+'.xlsx'),float_format='%.2f',index_label='time/ID')
+						frame_parameters[parameter_name]=self.all_behavior_parameters[animal_name][parameter_name]
+
+				if self.binary_results and len(frame_parameters)>0:
+					write_parameters_npz(os.path.join(self.results_path,animal_name+'_all_parameters.npz'),frame_parameters,self.all_time)
 
 				if len(summary)>=1:
 					pd.concat(summary,axis=1).to_excel(os.path.join(self.results_path,animal_name+'_all_summary.xlsx'),float_format='%.2f',index_label='ID/parameter')
@@ -1707,34 +1681,23 @@ class AnalyzeAnimalDetector():
 		print('Generating behavior examples...')
 		print(datetime.datetime.now())
 
-		capture=cv2.VideoCapture(self.path_to_video)
-		frame_count=frame_count_analyze=0
+		frame_count_analyze=0
 		animation=deque(maxlen=self.length)
 		for animal_name in self.animal_kinds:
 			for i in range(self.animal_number[animal_name]):
 				os.makedirs(os.path.join(self.results_path,str(animal_name)+'_'+str(i)),exist_ok=True)
 
-		start_t=round((self.t-self.length/self.fps),2)
-		if start_t<0:
-			start_t=0.00
-		if self.duration==0:
-			end_t=float('inf')
-		else:
-			end_t=start_t+self.duration
+		start_t,end_t=self.analysis_window()
 
-		while True:
+		for frame_count,frame in FrameSource(self.path_to_video,framewidth=self.framewidth,frameheight=self.frameheight,start_t=start_t,end_t=end_t):
 
-			retval,frame=capture.read()
 			time=round((frame_count+1)/self.fps,2)
 
-			if time>=end_t or frame is None:
+			if time>=end_t:
 				break
 
 			if time>=start_t:
 
-				if self.framewidth is not None:
-					frame=cv2.resize(frame,(self.framewidth,self.frameheight),interpolation=cv2.INTER_AREA)
-
 				self.detect_track_individuals([frame],1,frame_count_analyze,background_free=background_free,black_background=black_background,animation=animation)
 
 				for animal_name in self.animal_kinds:
@@ -1777,10 +1740,6 @@ class AnalyzeAnimalDetector():
 
 				frame_count_analyze+=1
 
-			frame_count+=1
-
-		capture.release()
-
 		print('Behavior example generation completed!')
 
 
@@ -1793,42 +1752,25 @@ class AnalyzeAnimalDetector():
 		print('Generating behavior examples...')
 		print(datetime.datetime.now())
 
-		frame_count=frame_count_analyze=0
+		frame_count_analyze=0
 		temp_contours=deque(maxlen=self.length)
 		temp_inners=deque(maxlen=self.length)
 		animation=deque(maxlen=self.length)
-		capture=cv2.VideoCapture(self.path_to_video)
 		os.makedirs(os.path.join(self.results_path,'0'),exist_ok=True)
 
-		start_t=round((self.t-self.length/self.fps),2)
-		if start_t<0:
-			start_t=0.00
-		if self.duration==0:
-			end_t=float('inf')
-		else:
-			end_t=start_t+self.duration
+		start_t,end_t=self.analysis_window()
 
-		while True:
+		for frame_count,frame in FrameSource(self.path_to_video,framewidth=self.framewidth,frameheight=self.frameheight,start_t=start_t,end_t=end_t):
 
-			retval,frame=capture.read()
 			time=round((frame_count+1)/self.fps,2)
 
-			if time>=end_t or frame is None:
+			if time>=end_t:
 				break
 
 			if time>=start_t:
 
-				if self.framewidth is not None:
-					frame=cv2.resize(frame,(self.framewidth,self.frameheight),interpolation=cv2.INTER_AREA)
-
 				self.temp_frames.append(frame)
-				tensor_frame=torch.as_tensor(frame.astype('float32').transpose(2,0,1))
-				output=self.detector.inference([{'image':tensor_frame}])
-				instances=output[0]['instances'].to('cpu')
-				masks=instances.pred_masks.numpy().astype(np.uint8)
-				classes=instances.pred_classes.numpy()
-				classes=[self.animal_mapping[str(x)] for x in classes]
-				scores=instances.scores.numpy()
+				(masks,classes,scores)=self.detect([frame],1)[0]
 
 				if len(masks)==0:
 
@@ -1848,9 +1790,7 @@ class AnalyzeAnimalDetector():
 						animal_masks=[masks[a] for a,name in enumerate(classes) if name==animal_name]
 						animal_scores=[scores[a] for a,name in enumerate(classes) if name==animal_name]
 						if len(animal_masks)>0:
-							mask_area=np.sum(np.array(animal_masks),axis=(1,2))
-							exclusion_mask=np.zeros(len(animal_masks),dtype=bool)
-							exclusion_mask[np.where((np.sum(np.logical_and(np.array(animal_masks)[:,None],animal_masks),axis=(2,3))/mask_area[:,None]>0.8) & (mask_area[:,None]<mask_area[None,:]))[0]]=True
+							exclusion_mask=suppress_duplicate_masks(animal_masks)
 							animal_masks=[m for m,exclude in zip(animal_masks,exclusion_mask) if not exclude]
 							animal_scores=[s for s,exclude in zip(animal_scores,exclusion_mask) if not exclude]
 							if len(animal_masks)>0:
@@ -1913,10 +1853,6 @@ class AnalyzeAnimalDetector():
 
 				frame_count_analyze+=1
 
-			frame_count+=1
-
-		capture.release()
-
 		print('Behavior example generation completed!')
 
 
@@ -1930,11 +1866,13 @@ class AnalyzeAnimalDetector():
 		print('Generating behavior examples...')
 		print(datetime.datetime.now())
 
-		capture=cv2.VideoCapture(self.path_to_video)
-		frame_count=frame_count_analyze=0
+		frame_count_analyze=0
 		animation=deque(maxlen=self.length)
 		for animal_name in self.animal_kinds:
 			self.animal_blobs[animal_name]={}
+			# the tracks are kept in rolling windows instead
+			self.animal_contours[animal_name]={}
+			self.animal_centers[animal_name]={}
 			for i in range(self.animal_number[animal_name]):
 				self.to_deregister[animal_name][i]=0
 				self.animal_contours[animal_name][i]=deque(maxlen=self.length)
@@ -1947,34 +1885,18 @@ class AnalyzeAnimalDetector():
 					self.animal_other_inners[animal_name][i]=deque(maxlen=self.length)
 				os.makedirs(os.path.join(self.results_path,str(animal_name)+'_'+str(i)),exist_ok=True)
 
-		start_t=round((self.t-self.length/self.fps),2)
-		if start_t<0:
-			start_t=0.00
-		if self.duration==0:
-			end_t=float('inf')
-		else:
-			end_t=start_t+self.duration
+		start_t,end_t=self.analysis_window()
 
-		while True:
+		for frame_count,frame in FrameSource(self.path_to_video,framewidth=self.framewidth,frameheight=self.frameheight,start_t=start_t,end_t=end_t):
 
-			retval,frame=capture.read()
 			time=round((frame_count+1)/self.fps,2)
 
-			if time>=end_t or frame is None:
+			if time>=end_t:
 				break
 
 			if time>=start_t:
 
-				if self.framewidth is not None:
-					frame=cv2.resize(frame,(self.framewidth,self.frameheight),interpolation=cv2.INTER_AREA)
-
-				tensor_frame=torch.as_tensor(frame.astype('float32').transpose(2,0,1))
-				output=self.detector.inference([{'image':tensor_frame}])
-				instances=output[0]['instances'].to('cpu')
-				masks=instances.pred_masks.numpy().astype(np.uint8)
-				classes=instances.pred_classes.numpy()
-				classes=[self.animal_mapping[str(x)] for x in classes]
-				scores=instances.scores.numpy()
+				(masks,classes,scores)=self.detect([frame],1)[0]
 
 				if len(masks)==0:
 
@@ -2020,9 +1942,7 @@ class AnalyzeAnimalDetector():
 
 						else:
 
-							mask_area=np.sum(np.array(animal_masks),axis=(1,2))
-							exclusion_mask=np.zeros(len(animal_masks),dtype=bool)
-							exclusion_mask[np.where((np.sum(np.logical_and(np.array(animal_masks)[:,None],animal_masks),axis=(2,3))/mask_area[:,None]>0.8) & (mask_area[:,None]<mask_area[None,:]))[0]]=True
+							exclusion_mask=suppress_duplicate_masks(animal_masks)
 							animal_masks=[m for m,exclude in zip(animal_masks,exclusion_mask) if not exclude]
 							animal_scores=[s for s,exclude in zip(animal_scores,exclusion_mask) if not exclude]
 
@@ -2068,13 +1988,11 @@ class AnalyzeAnimalDetector():
 
 					if len(all_centers)>1:
 
-						centers_array=np.array(all_centers)
-						distances_squared=np.sum((centers_array[:,None]-centers_array)**2,axis=2)
-						determine=np.logical_and(distances_squared>0,distances_squared<(math.sqrt(sum(average_area)/len(average_area))*self.social_distance)**2)
-						other_contours=[[all_contours[x] for x,determ in enumerate(determine[y]) if determ] for y,c in enumerate(all_centers)]
+						neighbors=find_neighbors(all_centers,math.sqrt(sum(average_area)/len(average_area))*self.social_distance)
+						other_contours=[[all_contours[x] for x in neighbors[y]] for y in range(len(all_centers))]
 						if self.include_bodyparts:
-							other_inners=[[all_inners[x] for x,determ in enumerate(determine[y]) if determ] for y,c in enumerate(all_centers)]
-						other_masks=[np.bitwise_or.reduce(np.stack(np.array(all_masks)[determine[x]])) if len(c)>0 else None for x,c in enumerate(other_contours)]
+							other_inners=[[all_inners[x] for x in neighbors[y]] for y in range(len(all_centers))]
+						other_masks=[np.bitwise_or.reduce(np.stack([all_masks[x] for x in neighbors[y]])) if len(neighbors[y])>0 else None for y in range(len(all_centers))]
 						for i,other_mask in enumerate(other_masks):
 							if background_free:
 								blob=frame*cv2.cvtColor(all_masks[i],cv2.COLOR_GRAY2BGR)
@@ -2128,32 +2046,24 @@ class AnalyzeAnimalDetector():
 								animal_inners=all_inners[n:animal_length]
 								animal_other_inners=other_inners[n:animal_length]
 
-							unused_existing_indices=list(self.animal_existingcenters[animal_name])
-							existing_centers=list(self.animal_existingcenters[animal_name].values())
-							unused_new_indices=list(range(len(animal_centers)))
-							dt_flattened=distance.cdist(existing_centers,animal_centers).flatten()
-							dt_sort_index=dt_flattened.argsort()
-							length=len(animal_centers)
-
-							for idx in dt_sort_index:
-								index_in_existing=int(idx/length)
-								index_in_new=int(idx%length)
-								if index_in_existing in unused_existing_indices:
-									if index_in_new in unused_new_indices:
-										unused_existing_indices.remove(index_in_existing)
-										unused_new_indices.remove(index_in_new)
-										self.to_deregister[animal_name][index_in_existing]=0
-										contour=animal_contours[index_in_new]
-										self.animal_contours[animal_name][index_in_existing].append(contour)
-										center=animal_centers[index_in_new]
-										self.animal_centers[animal_name][index_in_existing].append(center)
-										self.animal_existingcenters[animal_name][index_in_existing]=center
-										self.animal_other_contours[animal_name][index_in_existing].append(animal_other_contours[index_in_new])
-
-										self.animal_blobs[animal_name][index_in_existing].append(animal_blobs[index_in_new])
-										if self.include_bodyparts:
-											self.animal_inners[animal_name][index_in_existing].append(animal_inners[index_in_new])
-											self.animal_other_inners[animal_name][index_in_existing].append(animal_other_inners[index_in_new])
+							IDs=list(self.animal_existingcenters[animal_name])
+							matched=set()
+							for index,index_in_new in assign_tracks(list(self.animal_existingcenters[animal_name].values()),animal_centers,method=self.tracker,gate=self.track_gate):
+								index_in_existing=IDs[index]
+								matched.add(index_in_existing)
+								self.to_deregister[animal_name][index_in_existing]=0
+								contour=animal_contours[index_in_new]
+								self.animal_contours[animal_name][index_in_existing].append(contour)
+								center=animal_centers[index_in_new]
+								self.animal_centers[animal_name][index_in_existing].append(center)
+								self.animal_existingcenters[animal_name][index_in_existing]=center
+								self.animal_other_contours[animal_name][index_in_existing].append(animal_other_contours[index_in_new])
+
+								self.animal_blobs[animal_name][index_in_existing].append(animal_blobs[index_in_new])
+								if self.include_bodyparts:
+									self.animal_inners[animal_name][index_in_existing].append(animal_inners[index_in_new])
+									self.animal_other_inners[animal_name][index_in_existing].append(animal_other_inners[index_in_new])
+							unused_existing_indices=[i for i in IDs if i not in matched]
 
 							if len(unused_existing_indices)>0:
 								for i in unused_existing_indices:
@@ -2226,10 +2136,6 @@ class AnalyzeAnimalDetector():
 
 				frame_count_analyze+=1
 
-			frame_count+=1
-
-		capture.release()
-
 		print('Behavior example generation completed!')
 
 
@@ -2256,8 +2162,7 @@ class AnalyzeAnimalDetector():
 		print('Preparation started...')
 		print(datetime.datetime.now())
 
-		self.detector=Detector()
-		self.detector.load(path_to_detector,animal_kinds)
+		self.detector=load_detector(path_to_detector,animal_kinds)
 		self.animal_mapping=self.detector.animal_mapping
 
 		if social_distance==0:
@@ -2268,7 +2173,7 @@ class AnalyzeAnimalDetector():
 		if generate:
 			print('Generating behavior examples...')
 		else:
-			categorizer=load_model(path_to_categorizer)
+			categorizer=load_categorizer(path_to_categorizer)
 			animal_information={}
 			colors={}
 			for behavior_name in names_and_colors:
@@ -2338,9 +2243,7 @@ class AnalyzeAnimalDetector():
 
 			if len(masks)>0:
 
-				mask_area=np.sum(np.array(masks),axis=(1,2))
-				exclusion_mask=np.zeros(len(masks),dtype=bool)
-				exclusion_mask[np.where((np.sum(np.logical_and(np.array(masks)[:,None],masks),axis=(2,3))/mask_area[:,None]>0.8) & (mask_area[:,None]<mask_area[None,:]))[0]]=True
+				exclusion_mask=suppress_duplicate_masks(masks)
 				masks=[m for m,exclude in zip(masks,exclusion_mask) if not exclude]
 				classes=[c for c,exclude in zip(classes,exclusion_mask) if not exclude]
 				scores=[s for s,exclude in zip(scores,exclusion_mask) if not exclude]
@@ -0,0 +1,363 @@
+'''
+Copyright (C)
+This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with this program. If not, see https://tldrlegal.com/license/gnu-general-public-license-v3-(gpl-3)#fulltext.
+
+For license issues, please contact:
+
+Dr. Bing Ye
+Life Sciences Institute
+University of Michigan
+210 Washtenaw Avenue, Room 5403
+Ann Arbor, MI 48109-2216
+USA
+
+Email: bingye@umich.edu
+
+
+
+The 'analyze' command: the 'Analyze Behaviors' functional unit
+without the GUI, for running batch analyses on machines without a
+display, like the nodes of a compute cluster.
+
+	LabGym analyze JOBFILE
+
+JOBFILE is a TOML file that describes the batch, for example:
+
+	result_path='/data/results'  # the folder for storing analysis outputs
+	videos=['/data/videos/*.avi']  # paths to the videos, or glob patterns
+	categorizer='mouse_behaviors'  # optional, a Categorizer in the 'models' folder, or a path
+	detector='mouse_detector'  # optional, a Detector in the 'detectors' folder, or a path
+	processes=4  # optional, overrides the 'analysis_processes' config setting
+	memory_budget=32  # optional, overrides the 'analysis_memory_budget' config setting
+	decode_t=true  # optional, decode start_t from '_bNN_' in video file names
+	decode_animalnumber=false  # optional, decode animal numbers from '_nNN_' in video file names
+	decode_extraction=false  # optional, decode background extraction windows from '_xsNN_' and '_xeNN_' in video file names
+
+	[settings]  # optional, any of the analysis settings in analyzebatch.settings_names
+	framewidth=640
+	duration=60
+	uncertain=0.1
+	parameter_to_analyze=['3 length parameters','4 locomotion parameters']
+
+Without a Detector, the background subtraction-based method is used.
+Without a Categorizer, the animals are only tracked and quantified.
+The settings that a Categorizer determines (like 'length' or
+'behavior_mode') are read from the Categorizer, as in the GUI.
+'''
+
+
+# Standard library imports.
+import copy
+import glob
+import logging
+import os
+import sys
+try:
+	# tomllib is included in the Python Standard Library since version 3.11
+	import tomllib  # type: ignore
+except ModuleNotFoundError:
+	import tomli as tomllib  # A lil' TOML parser
+
+# Log the load of this module (by the module loader, on first import).
+# Intentionally positioning these statements before other imports, against the
+# guidance of PEP-8, to log the load before other imports log messages.
+logger = logging.getLogger(__name__)
+logger.debug('loading %s', __file__)
+
+# Local application/library specific imports.
+from LabGym import config
+from .analyzebatch import categorizer_settings, detector_animal_names, merge_results, run_batch, settings_names
+
+
+# the default analysis settings, the same as those of the 'Analyze Behaviors' panel
+default_settings={
+	'use_detector':False,
+	'path_to_detector':None,
+	'detector_batch':1,
+	'animal_kinds':[],
+	'behavior_mode':0,
+	'background_path':None,
+	'path_to_categorizer':None,
+	'framewidth':None,
+	'delta':10000,
+	'animal_number':None,
+	'autofind_t':False,
+	't':0,
+	'duration':0,
+	'ex_start':0,
+	'ex_end':None,
+	'behaviornames_and_colors':{},
+	'dim_tconv':8,
+	'dim_conv':8,
+	'channel':1,
+	'length':15,
+	'animal_vs_bg':0,
+	'stable_illumination':True,
+	'animation_analyzer':True,
+	'animal_to_include':[],
+	'ID_colors':[(255,255,255)],
+	'behavior_to_include':['all'],
+	'parameter_to_analyze':[],
+	'include_bodyparts':False,
+	'std':0,
+	'uncertain':0,
+	'min_length':None,
+	'show_legend':True,
+	'background_free':True,
+	'black_background':True,
+	'normalize_distance':True,
+	'social_distance':0,
+	'color_costar':False,
+	'specific_behaviors':{},
+	'correct_ID':False,
+	'binary_results':False,
+	'tracker':'greedy',
+	'track_gate':0,
+	'detection_regions':None,
+	'tile_size':0,
+	'tile_overlap':64,
+	'detection_stride':1,
+	'background_samples':0,
+	'constants_cache':'',
+	'segment_scale':1.0,
+	'segment_gray':False,
+	'single_pass':False,
+	'streaming_categorizer':False,
+	}
+
+# the keys a jobfile can have besides the [settings] table
+jobfile_keys=('result_path','videos','categorizer','detector','processes','memory_budget','decode_animalnumber','decode_t','decode_extraction','settings')
+
+# the settings that are determined by the 'categorizer' and 'detector' keys instead of the [settings] table
+derived_settings=('use_detector','path_to_detector','path_to_categorizer')
+
+
+def read_jobfile(jobfile):
+
+	'''
+	This function is used to read a TOML jobfile.
+
+	return: the job spec, a dict
+	'''
+
+	with open(jobfile,'rb') as f:
+		spec=tomllib.load(f)
+
+	unknown=[key for key in spec if key not in jobfile_keys]
+	if len(unknown)>0:
+		raise ValueError('unknown jobfile keys '+str(unknown))
+	unknown=[key for key in spec.get('settings',{}) if key not in settings_names or key in derived_settings]
+	if len(unknown)>0:
+		raise ValueError('unknown settings '+str(unknown))
+	for key in ('result_path','videos'):
+		if key not in spec:
+			raise ValueError('missing '+repr(key))
+
+	return spec
+
+
+def find_model(name,model_path):
+
+	'''
+	This function is used to find a Categorizer / Detector by
+	its name in the 'models' / 'detectors' folder, or by its path.
+	'''
+
+	if os.path.isdir(name):
+		return name
+	path=os.path.join(model_path,name)
+	if os.path.isdir(path):
+		return path
+	raise ValueError('no model '+repr(name)+' in '+str(model_path))
+
+
+def find_videos(patterns):
+
+	'''
+	This function is used to expand the video paths / glob
+	patterns in a jobfile, in their order (each pattern sorted).
+	'''
+
+	if isinstance(patterns,str):
+		patterns=[patterns]
+
+	path_to_videos=[]
+	for pattern in patterns:
+		paths=sorted(glob.glob(os.path.expanduser(pattern)))
+		if len(paths)==0:
+			raise ValueError('no video matches '+repr(pattern))
+		path_to_videos+=[path for path in paths if path not in path_to_videos]
+	if len(path_to_videos)==0:
+		raise ValueError('no videos')
+
+	return path_to_videos
+
+
+def make_settings(spec,model_path,detector_path):
+
+	'''
+	This function is used to resolve the analysis settings of a
+	job spec the same way as the 'Analyze Behaviors' panel does,
+	before the per-video decoding of the file names.
+
+	model_path: the 'models' folder that stores the Categorizers
+	detector_path: the 'detectors' folder that stores the Detectors
+
+	return: a dict of the settings, see 'settings_names'
+	'''
+
+	settings=copy.deepcopy(default_settings)
+	user_settings=spec.get('settings',{})
+
+	if spec.get('categorizer') is not None:
+		settings['path_to_categorizer']=find_model(spec['categorizer'],model_path)
+		settings.update(categorizer_settings(settings['path_to_categorizer']))
+	if spec.get('detector') is not None:
+		settings['path_to_detector']=find_model(spec['detector'],detector_path)
+		settings['use_detector']=True
+		settings['animal_kinds']=detector_animal_names(settings['path_to_detector'])
+
+	settings.update(copy.deepcopy(user_settings))
+
+	if settings['path_to_categorizer'] is None:
+		settings['behavior_mode']=0
+		settings['behavior_to_include']=[]
+	elif settings['behavior_to_include']==['all']:
+		settings['behavior_to_include']=list(settings['behaviornames_and_colors'].keys())
+	if settings['behavior_mode']==3:
+		raise ValueError("the 'Static images' behavior mode is not supported by the 'analyze' command")
+	if settings['behavior_mode']==2 and settings['use_detector'] is False:
+		raise ValueError("the 'Interactive advanced' behavior mode needs a Detector")
+
+	if settings['use_detector']:
+		if 'animal_to_include' not in user_settings:
+			if settings['behavior_mode']==1:
+				settings['animal_to_include']=[settings['animal_kinds'][0]]
+			else:
+				settings['animal_to_include']=settings['animal_kinds']
+		if 'ID_colors' not in user_settings:
+			settings['ID_colors']=[(255,255,255)]*max(len(settings['animal_to_include']),1)
+		if isinstance(settings['animal_number'],int):
+			settings['animal_number']={animal_name:settings['animal_number'] for animal_name in settings['animal_kinds']}
+		if settings['detector_batch']<=0:
+			settings['detector_batch']=1
+	else:
+		settings['animal_kinds']=[]
+		settings['animal_to_include']=[]
+
+	settings['ID_colors']=[tuple(color) for color in settings['ID_colors']]
+	if settings['ex_end']==0:
+		settings['ex_end']=None
+
+	return settings
+
+
+def decode_filename(path_to_video,settings,decode_animalnumber=False,decode_t=False,decode_extraction=False):
+
+	'''
+	This function is used to decode the per-video settings from
+	the video file name ('_nNN_': animal number, '_bNN_': start_t,
+	'_xsNN_' / '_xeNN_': background extraction window), the same way
+	as the 'Analyze Behaviors' panel does.
+
+	return: a copy of settings with the decoded values
+	'''
+
+	settings=copy.deepcopy(settings)
+	filename=os.path.splitext(os.path.basename(path_to_video))[0].split('_')
+
+	if decode_animalnumber:
+		if settings['use_detector']:
+			settings['animal_number']={}
+			number=[x[1:] for x in filename if len(x)>1 and x[0]=='n']
+			for a,animal_name in enumerate(settings['animal_kinds']):
+				settings['animal_number'][animal_name]=int(number[a])
+		else:
+			for x in filename:
+				if len(x)>1:
+					if x[0]=='n':
+						settings['animal_number']=int(x[1:])
+	if decode_t:
+		for x in filename:
+			if len(x)>1:
+				if x[0]=='b':
+					settings['t']=float(x[1:])
+	if decode_extraction:
+		for x in filename:
+			if len(x)>2:
+				if x[:2]=='xs':
+					settings['ex_start']=int(x[2:])
+				if x[:2]=='xe':
+					settings['ex_end']=int(x[2:])
+
+	if settings['animal_number'] is None:
+		if settings['use_detector']:
+			settings['animal_number']={animal_name:1 for animal_name in settings['animal_kinds']}
+		else:
+			settings['animal_number']=1
+
+	return settings
+
+
+def make_jobs(spec,model_path,detector_path):
+
+	'''
+	This function is used to turn a job spec into the jobs of
+	analyzebatch.run_batch.
+
+	return: (settings,jobs), settings are the resolved settings
+	before the per-video decoding, jobs are a list of
+	(path_to_video,result_path,settings)
+	'''
+
+	settings=make_settings(spec,model_path,detector_path)
+	result_path=os.path.expanduser(spec['result_path'])
+	jobs=[]
+
+	for path_to_video in find_videos(spec['videos']):
+		video_settings=decode_filename(path_to_video,settings,decode_animalnumber=spec.get('decode_animalnumber',False),
+			decode_t=spec.get('decode_t',False),decode_extraction=spec.get('decode_extraction',False))
+		jobs.append((path_to_video,result_path,video_settings))
+
+	return (settings,jobs)
+
+
+def analyze(jobfile):
+
+	'''
+	This function is used to run the batch analysis that a
+	jobfile describes.
+
+	return: the exit status, 0 for success
+	'''
+
+	_config=config.get_config('detectors','models','analysis_processes','analysis_memory_budget','binary_results','tracker','track_gate','constants_cache','single_pass','streaming_categorizer')
+
+	try:
+		spec=read_jobfile(jobfile)
+		spec.setdefault('settings',{}).setdefault('binary_results',config.as_bool(_config['binary_results']))
+		spec['settings'].setdefault('tracker',str(_config['tracker']))
+		spec['settings'].setdefault('track_gate',float(_config['track_gate']))
+		spec['settings'].setdefault('constants_cache',str(_config['constants_cache']))
+		spec['settings'].setdefault('single_pass',config.as_bool(_config['single_pass']))
+		spec['settings'].setdefault('streaming_categorizer',config.as_bool(_config['streaming_categorizer']))
+		settings,jobs=make_jobs(spec,_config['models'],_config['detectors'])
+	except (OSError,ValueError,tomllib.TOMLDecodeError) as e:
+		logger.error(e)
+		sys.exit(f'Trouble reading jobfile ({jobfile}): {e}')
+
+	result_path=os.path.expanduser(spec['result_path'])
+	os.makedirs(result_path,exist_ok=True)
+	processes=int(spec.get('processes',_config['analysis_processes']))
+	memory_budget=float(spec.get('memory_budget',_config['analysis_memory_budget']))
+
+	results=run_batch(jobs,processes=processes,memory_budget=memory_budget)
+
+	if settings['path_to_categorizer'] is not None:
+		merge_results(result_path,results,settings['use_detector'],settings['animal_kinds'],settings['animal_to_include'],settings['behaviornames_and_colors'],settings['behavior_to_include'],binary_results=settings['binary_results'])
+
+	print('Analysis completed!')
+
+	return 0
@@ -0,0 +1,175 @@
+'''
+Copyright (C)
+This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with this program. If not, see https://tldrlegal.com/license/gnu-general-public-license-v3-(gpl-3)#fulltext.
+
+For license issues, please contact:
+
+Dr. Bing Ye
+Life Sciences Institute
+University of Michigan
+210 Washtenaw Avenue, Room 5403
+Ann Arbor, MI 48109-2216
+USA
+
+Email: bingye@umich.edu
+'''
+
+
+# Standard library imports.
+import logging
+
+# Log the load of this module (by the module loader, on first import).
+# Intentionally positioning these statements before other imports, against the
+# guidance of PEP-8, to log the load before other imports log messages.
+logger = logging.getLogger(__name__)
+logger.debug('loading %s', __file__)
+
+# Related third party imports.
+import numpy as np
+
+
+class BackgroundEstimator():
+
+	'''
+	A streaming version of the static background extraction in
+	'background subtraction based detection method'. The frames are
+	added one at a time and are not kept, so the memory does not grow
+	with the number of frames:
+
+		stable illumination: the running per-pixel minimum (animals
+		brighter than the background) or maximum (animals darker)
+
+		unstable illumination: the frames are grouped into 100-frame
+		windows starting every 30 frames, whose per-pixel sums and sums
+		of squares are accumulated in integers (at most 4 windows are
+		open at a time); a finished window is compared with the best one
+		so far, and the background is the mean of the window with the
+		lowest mean+std (of the inverted frames if animals are darker)
+
+		animals hard to tell from the background: as above but the
+		windows are ranked by |mean-overall mean|+std, which is only
+		known at the end, so the sum (uint16) and std (float32) of each
+		window are kept, 6 bytes per pixel per 30 frames; with no more
+		than 101 frames, the median of the (uint8) frames is used
+
+	stable_illumination: whether the illumination is stable
+	animal_vs_bg: 0--animals brighter than the background
+				  1--animals darker than the background
+				  2--hard to tell
+	'''
+
+	window_length=100
+	window_step=30
+
+	def __init__(self,stable_illumination=True,animal_vs_bg=0):
+
+		self.stable_illumination=stable_illumination
+		self.animal_vs_bg=animal_vs_bg
+		self.count=0
+		self.extreme=None # the running minimum / maximum
+		self.total=None # the running sum, for the overall mean when animal_vs_bg==2
+		self.first_frames=[] # the frames for the median when animal_vs_bg==2 and there are no more than 101 frames
+		self.open_windows=[] # [start,sums,sums of squares] of the windows being accumulated
+		self.finished_windows=[] # (start,sums,stds) of the accumulated windows not yet counted in
+		self.best_sums=None # the sums of the best window so far, per pixel
+		self.best_checks=None
+		self.window_sums=[] # the sums and stds of all the counted windows when animal_vs_bg==2
+		self.window_stds=[]
+
+
+	def add(self,frame):
+
+		# frame: a uint8 frame
+
+		frame=np.asarray(frame,dtype=np.uint8)
+
+		if self.animal_vs_bg!=2:
+			if self.extreme is None:
+				self.extreme=frame.copy()
+			elif self.animal_vs_bg==1:
+				np.maximum(self.extreme,frame,out=self.extreme)
+			else:
+				np.minimum(self.extreme,frame,out=self.extreme)
+
+		if self.animal_vs_bg==2:
+			if self.total is None:
+				self.total=np.zeros(frame.shape,dtype=np.uint64)
+			self.total+=frame
+			if self.count<=101:
+				self.first_frames.append(frame.copy())
+			else:
+				self.first_frames=[]
+
+		if self.animal_vs_bg==2 or not self.stable_illumination:
+			if self.count%self.window_step==0:
+				self.open_windows.append([self.count,np.zeros(frame.shape,dtype=np.uint16),np.zeros(frame.shape,dtype=np.uint32)])
+			squares=np.square(frame,dtype=np.uint32)
+			for window in self.open_windows:
+				window[1]+=frame
+				window[2]+=squares
+			if self.count+1-self.open_windows[0][0]==self.window_length:
+				(start,sums,sums_squares)=self.open_windows.pop(0)
+				sums_float=sums.astype(np.float64)
+				variances=np.maximum(sums_squares/self.window_length-(sums_float/self.window_length)**2,0)
+				self.finished_windows.append((start,sums,np.sqrt(variances).astype(np.float32)))
+
+		self.count+=1
+
+		# like in extract_background, a window counts only when there are at least 2 frames after it
+		while len(self.finished_windows)>0 and self.finished_windows[0][0]+self.window_length+2<=self.count:
+			self.count_window(*self.finished_windows.pop(0)[1:])
+
+
+	def count_window(self,sums,stds):
+
+		# sums: the per-pixel sums of the frames in the window
+		# stds: the per-pixel stds of the frames in the window
+
+		if self.animal_vs_bg==2:
+			self.window_sums.append(sums)
+			self.window_stds.append(stds)
+			return
+
+		if self.animal_vs_bg==1:
+			checks=np.float32(255*self.window_length-sums)/np.float32(self.window_length)+stds
+		else:
+			checks=np.float32(sums)/np.float32(self.window_length)+stds
+
+		if self.best_sums is None:
+			self.best_sums=sums
+			self.best_checks=checks
+		else:
+			better=checks<self.best_checks
+			self.best_sums[better]=sums[better]
+			self.best_checks[better]=checks[better]
+
+
+	def background(self):
+
+		# return: the uint8 background of the frames added so far, None if there are no more than 3 frames
+
+		if self.count<=3:
+			return None
+
+		if self.animal_vs_bg==2:
+			if len(self.window_sums)>0:
+				mean_overall=np.float32(self.total)/np.float32(self.count)
+				best_checks=best_sums=None
+				for sums,stds in zip(self.window_sums,self.window_stds):
+					checks=np.abs(np.float32(sums)/np.float32(self.window_length)-mean_overall)+stds
+					if best_sums is None:
+						best_sums=sums.copy()
+						best_checks=checks
+					else:
+						better=checks<best_checks
+						best_sums[better]=sums[better]
+						best_checks[better]=checks[better]
+				return np.uint8(np.float32(best_sums)/np.float32(self.window_length))
+			return np.uint8(np.median(np.array(self.first_frames),axis=0))
+
+		if not self.stable_illumination and self.best_sums is not None:
+			return np.uint8(np.float32(self.best_sums)/np.float32(self.window_length))
+
+		return self.extreme.copy()
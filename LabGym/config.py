@@ -74,6 +74,26 @@ defaults = {
 
 	'detectors': str(Path(__file__).parent.joinpath('detectors')),
 	'models': str(Path(__file__).parent.joinpath('models')),
+
+	# batch analysis of videos in parallel worker processes
+	'analysis_processes': 1,  # the number of videos analyzed at the same time
+	'analysis_memory_budget': 0,  # the memory (in GB) the analyses can take in total, 0 for no limit
+
+	# also export the centers, behavior events and frame-wise parameters as compressed .npz files
+	'binary_results': False,
+
+	# how the tracked animals are matched to the detected ones in each frame
+	'tracker': 'greedy',  # 'greedy' (closest pairs first) or 'hungarian' (optimal assignment)
+	'track_gate': 0,  # the maximum distance (in pixels) an animal can move between two frames to be matched, 0 for no limit
+
+	# the folder that caches the backgrounds and animal sizes of the analyzed videos, '' for no caching
+	'constants_cache': '',
+
+	# decode each video only once for both constant estimation and analysis (background subtraction only)
+	'single_pass': False,
+
+	# categorize the behaviors in micro-batches during the analysis, so that the animations and pattern images are not kept in memory
+	'streaming_categorizer': False,
 }
 
 logger = logging.getLogger(__name__)
@@ -276,3 +296,17 @@ def mypathexpand(target: dict) -> None:
 			files[i] = configdir.joinpath(files[i])
 
 	return
+
+
+def as_bool(value) -> bool:
+	"""Return a boolean config value as a bool.
+
+	Values from environment variables arrive as strings, where
+	bool('False') and bool('0') would be True, so strings are True
+	only if they spell '1', 'true', 'yes' or 'on' (case-insensitive).
+	"""
+
+	if isinstance(value, str):
+		return value.strip().lower() in ['1', 'true', 'yes', 'on']
+
+	return bool(value)
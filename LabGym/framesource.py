@@ -0,0 +1,350 @@
+'''
+Copyright (C)
+This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with this program. If not, see https://tldrlegal.com/license/gnu-general-public-license-v3-(gpl-3)#fulltext.
+
+For license issues, please contact:
+
+Dr. Bing Ye
+Life Sciences Institute
+University of Michigan
+210 Washtenaw Avenue, Room 5403
+Ann Arbor, MI 48109-2216
+USA
+
+Email: bingye@umich.edu
+'''
+
+
+# Standard library imports.
+import logging
+import queue
+import threading
+
+# Log the load of this module (by the module loader, on first import).
+# Intentionally positioning these statements before other imports, against the
+# guidance of PEP-8, to log the load before other imports log messages.
+logger = logging.getLogger(__name__)
+logger.debug('loading %s', __file__)
+
+# Related third party imports.
+import cv2
+
+# Local application/library specific imports.
+# (none)
+
+
+class FrameSource():
+
+	'''
+	A video reader that decodes and resizes frames in a background thread
+	and queues them, so that decoding overlaps with the processing of the
+	frames. Iterating a FrameSource yields (frame_count,frame) pairs, where
+	frame_count is the index of the frame in the video (starting from 0).
+
+	The time point of a frame is (frame_count+1)/fps, the convention of the
+	analyses in LabGym.
+
+	path_to_video: the path to the video
+	framewidth: if not None, the frames are resized to this width
+	frameheight: the height of the resized frames, if None, keep the aspect ratio
+	start_t: only yield the frames whose time point is at or after start_t (in seconds)
+	end_t: stop at the first frame whose time point is at or after end_t (in seconds), if None, read to the end of the video
+	skip: yield one in every 'skip' frames (counted from the first yielded frame), the others are grabbed but not retrieved
+	decimals: the number of decimals the time points are rounded to before being compared with start_t and end_t, if None, do not round
+	seek: whether to seek to start_t instead of decoding every frame before it, the video jumps to 'seek_margin' frames
+	before the first frame to yield and is then decoded forward frame by frame, the seek is checked with the timestamp
+	of the frame it lands on (see seek_frame) and the video is decoded from the beginning if the seek is inaccurate
+	seek_margin: the number of frames to decode forward after seeking (at least 1, the frame the seek lands on)
+	queue_size: the maximum number of decoded frames waiting in the queue
+	'''
+
+	def __init__(self,path_to_video,framewidth=None,frameheight=None,start_t=0,end_t=None,skip=1,decimals=2,seek=True,seek_margin=None,queue_size=16):
+
+		self.path_to_video=path_to_video
+		self.framewidth=framewidth
+		self.frameheight=frameheight
+		self.start_t=start_t
+		self.end_t=end_t
+		self.skip=max(int(skip),1)
+		self.decimals=decimals
+		self.seek=seek
+		self.seek_margin=seek_margin
+		self.queue_size=queue_size
+		self.queue=None
+		self.thread=None
+		self.stop_event=threading.Event()
+		self.error=None
+
+		capture=cv2.VideoCapture(self.path_to_video)
+		self.fps=round(capture.get(cv2.CAP_PROP_FPS))
+		self.total_frames=int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+		self.width=int(capture.get(cv2.CAP_PROP_FRAME_WIDTH))
+		self.height=int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+		capture.release()
+
+		if self.framewidth is not None and self.frameheight is None and self.width>0:
+			self.frameheight=int(self.height*self.framewidth/self.width)
+		if self.seek_margin is None:
+			self.seek_margin=self.fps
+
+
+	def time_point(self,frame_count):
+
+		# frame_count: the index of a frame in the video
+
+		time=(frame_count+1)/self.fps
+		if self.decimals is not None:
+			time=round(time,self.decimals)
+
+		return time
+
+
+	def start_frame(self):
+
+		# return the index of the first frame whose time point is at or after start_t
+
+		if self.start_t<=0 or self.fps<=0:
+			return 0
+
+		frame_count=max(0,int((self.start_t-0.01)*self.fps)-2)
+		while self.time_point(frame_count)<self.start_t:
+			frame_count+=1
+
+		return frame_count
+
+
+	def seek_to(self,capture,frame_count):
+
+		# capture: the cv2.VideoCapture positioned at the beginning of the video
+		# frame_count: the index of the frame to seek to, which is decoded and dropped
+		# return the index of the frame the capture is positioned at
+
+		time_initial=first_frame_time(self.path_to_video)
+
+		if time_initial is None or seek_frame(capture,frame_count,time_initial) is None:
+			# the container does not support accurate seeking, decode from the beginning
+			logger.debug('%s: seeking to frame %d failed, decoding from the beginning',self.path_to_video,frame_count)
+			capture.release()
+			capture.open(self.path_to_video)
+			return 0
+
+		return frame_count+1
+
+
+	def decode(self):
+
+		# decode the frames and put them into the queue, the end is marked by None
+
+		capture=cv2.VideoCapture(self.path_to_video)
+		frame_count=0
+		first_count=None
+
+		try:
+
+			if self.seek:
+				target=self.start_frame()-max(self.seek_margin,1)
+				if target>0 and target<self.total_frames:
+					frame_count=self.seek_to(capture,target)
+
+			while not self.stop_event.is_set():
+
+				time=self.time_point(frame_count)
+
+				if self.end_t is not None and time>=self.end_t:
+					break
+
+				if time<self.start_t or (first_count is not None and (frame_count-first_count)%self.skip!=0):
+					if not capture.grab():
+						break
+				else:
+					retval,frame=capture.read()
+					if frame is None:
+						break
+					if first_count is None:
+						first_count=frame_count
+					if self.framewidth is not None:
+						frame=cv2.resize(frame,(self.framewidth,self.frameheight),interpolation=cv2.INTER_AREA)
+					self.put((frame_count,frame))
+
+				frame_count+=1
+
+		except Exception as e:
+			self.error=e
+
+		finally:
+			capture.release()
+			self.put(None)
+
+
+	def put(self,item):
+
+		# put an item into the queue without blocking forever once the source is closed
+
+		while not self.stop_event.is_set():
+			try:
+				self.queue.put(item,timeout=0.1)
+				return
+			except queue.Full:
+				pass
+
+
+	def start(self):
+
+		self.stop_event.clear()
+		self.error=None
+		self.queue=queue.Queue(maxsize=self.queue_size)
+		self.thread=threading.Thread(target=self.decode,daemon=True)
+		self.thread.start()
+
+
+	def close(self):
+
+		# stop the decoding thread and release the video
+
+		self.stop_event.set()
+		if self.thread is not None:
+			self.thread.join()
+			self.thread=None
+		self.queue=None
+
+
+	def __iter__(self):
+
+		self.start()
+
+		try:
+			while True:
+				item=self.queue.get()
+				if item is None:
+					break
+				yield item
+			if self.error is not None:
+				raise self.error
+		finally:
+			self.close()
+
+
+	def __enter__(self):
+
+		return self
+
+
+	def __exit__(self,exc_type,exc_value,traceback):
+
+		self.close()
+
+
+def first_frame_time(path_to_video):
+
+	'''
+	This function is used to read the timestamp (in milliseconds) of
+	the first frame of a video, which the timestamps of the other
+	frames are compared with after seeking.
+
+	return: the timestamp, None if the video cannot be decoded
+	'''
+
+	capture=cv2.VideoCapture(path_to_video)
+	retval,frame=capture.read()
+	time_initial=capture.get(cv2.CAP_PROP_POS_MSEC) if frame is not None else None
+	capture.release()
+
+	return time_initial
+
+
+def seek_frame(capture,frame_count,time_initial):
+
+	'''
+	This function is used to seek a video to a frame and decode it.
+	Reading CAP_PROP_POS_FRAMES back after setting it only reports the
+	requested position, so the seek is checked with the timestamp of the
+	decoded frame instead, which is off when the demuxer lands on a
+	keyframe before the requested frame.
+
+	capture: the cv2.VideoCapture
+	frame_count: the index of the frame to seek to
+	time_initial: the timestamp of the first frame of the video, see first_frame_time
+
+	return: the decoded frame, None if the seek fails or does not land on the frame
+	'''
+
+	fps=capture.get(cv2.CAP_PROP_FPS)
+	if fps<=0 or not capture.set(cv2.CAP_PROP_POS_FRAMES,frame_count):
+		return None
+
+	retval,frame=capture.read()
+	if frame is None:
+		return None
+
+	# within half a frame of the expected time point
+	if abs(capture.get(cv2.CAP_PROP_POS_MSEC)-time_initial-frame_count*1000/fps)>500/fps:
+		return None
+
+	return frame
+
+
+def read_frames_at(path_to_video,frame_counts,framewidth=None,frameheight=None,max_grab=None):
+
+	'''
+	This function is used to decode only the frames at the given
+	indices (in increasing order), seeking to a frame when it is more
+	than 'max_grab' frames after the previous one and grabbing the
+	frames in between otherwise. It yields (frame_count,frame) pairs,
+	and stops at the end of the video.
+
+	framewidth: if not None, the frames are resized to this width
+	frameheight: the height of the resized frames, if None, keep the aspect ratio
+	max_grab: the largest gap that is decoded through instead of seeking, if None, the fps of the video
+	'''
+
+	capture=cv2.VideoCapture(path_to_video)
+	if max_grab is None:
+		max_grab=round(capture.get(cv2.CAP_PROP_FPS))
+	if framewidth is not None and frameheight is None:
+		width=capture.get(cv2.CAP_PROP_FRAME_WIDTH)
+		if width>0:
+			frameheight=int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)*framewidth/width)
+	position=0
+	seekable=True
+	time_initial=None
+
+	try:
+
+		for frame_count in frame_counts:
+
+			if frame_count<position:
+				continue
+
+			frame=None
+
+			if seekable and frame_count-position>max_grab:
+				if time_initial is None:
+					time_initial=first_frame_time(path_to_video)
+				if time_initial is not None:
+					frame=seek_frame(capture,frame_count,time_initial)
+				if frame is None:
+					# the container does not support accurate seeking, decode through the gap
+					logger.debug('%s: seeking to frame %d failed, decoding through the gap',path_to_video,frame_count)
+					capture.release()
+					capture.open(path_to_video)
+					position=0
+					seekable=False
+
+			if frame is None:
+				while position<frame_count:
+					if not capture.grab():
+						return
+					position+=1
+				retval,frame=capture.read()
+				if frame is None:
+					return
+			position=frame_count+1
+			if framewidth is not None:
+				frame=cv2.resize(frame,(framewidth,frameheight),interpolation=cv2.INTER_AREA)
+
+			yield (frame_count,frame)
+
+	finally:
+		capture.release()
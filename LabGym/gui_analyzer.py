@@ -18,7 +18,7 @@ Email: bingye@umich.edu
 
 
 # Standard library imports.
-import json
+import copy
 import logging
 import os
 from pathlib import Path
@@ -36,7 +36,7 @@ import torch
 import wx
 
 # Local application/library specific imports.
-from .analyzebehavior import AnalyzeAnimal
+from .analyzebatch import categorizer_settings, detector_animal_names, merge_results, run_batch, settings_names
 from .analyzebehavior_dt import AnalyzeAnimalDetector
 from LabGym import config
 from .minedata import data_mining
@@ -85,7 +85,7 @@ class PanelLv2_AnalyzeBehaviors(wx.Panel):
 		self.notebook = parent
 
 		# Get all of the values needed from config.get_config().
-		self.config = config.get_config('detectors', 'models')
+		self.config = config.get_config('detectors', 'models', 'analysis_processes', 'analysis_memory_budget', 'binary_results', 'tracker', 'track_gate', 'constants_cache', 'single_pass', 'streaming_categorizer')
 
 		self.behavior_mode=0 # 0--non-interactive, 1--interactive basic, 2--interactive advanced, 3--static images
 		self.use_detector=False # whether the Detector is used
@@ -134,6 +134,19 @@ class PanelLv2_AnalyzeBehaviors(wx.Panel):
 		self.color_costar=False # in 'interactive advanced' mode, whether to make the supporting roles RGB scale in animations
 		self.specific_behaviors={} # sex or identity-specific behaviors
 		self.correct_ID=False # whether to use sex or identity-specific behaviors to guide ID correction when ID switching is likely to happen
+		self.binary_results=config.as_bool(self.config['binary_results']) # whether to also export the results as compressed .npz files
+		self.tracker=str(self.config['tracker']) # how to match the tracked animals / objects to the detected ones, 'greedy' or 'hungarian'
+		self.track_gate=float(self.config['track_gate']) # the maximum distance (in pixels) an animal / object can move between two frames to be matched, 0 for no limit
+		self.constants_cache=str(self.config['constants_cache']) # the folder that caches the backgrounds and animal sizes of the analyzed videos, '' for no caching
+		self.detection_regions=None # if not None, the [left,right,top,bottom] windows (like arenas) that the Detector runs on instead of the whole frame
+		self.tile_size=0 # if >0, the Detector runs on overlapping tiles of this size (in pixels) instead of the whole frame
+		self.tile_overlap=64 # the overlap (in pixels) of the tiles
+		self.detection_stride=1 # run the Detector on every detection_stride-th frame and propagate the masks to the frames in between
+		self.background_samples=0 # if >0, extract the background from at most this many frames spread across the extraction window instead of every frame
+		self.segment_scale=1.0 # if <1, segment the animals at this fraction of the frame size (background subtraction only)
+		self.segment_gray=False # whether to subtract the background in grayscale instead of in each color channel
+		self.single_pass=config.as_bool(self.config['single_pass']) # whether to decode the video only once for both constant estimation and analysis (background subtraction only)
+		self.streaming_categorizer=config.as_bool(self.config['streaming_categorizer']) # whether to categorize behaviors in micro-batches during information acquisition, so that animations and pattern images are not kept in memory
 
 		self.display_window()
 
@@ -357,56 +370,9 @@ class PanelLv2_AnalyzeBehaviors(wx.Panel):
 
 			if self.path_to_categorizer is not None:
 
-				parameters=pd.read_csv(os.path.join(self.path_to_categorizer,'model_parameters.txt'))
-				complete_colors=list(mpl.colors.cnames.values())
-				colors=[]
-				for c in complete_colors:
-					colors.append(['#ffffff',c])
-				self.behaviornames_and_colors={}
-
-				for behavior_name in list(parameters['classnames']):
-					index=list(parameters['classnames']).index(behavior_name)
-					if index<len(colors):
-						self.behaviornames_and_colors[behavior_name]=colors[index]
-					else:
-						self.behaviornames_and_colors[behavior_name]=['#ffffff','#ffffff']
-
-				if 'dim_conv' in parameters:
-					self.dim_conv=int(parameters['dim_conv'][0])
-				if 'dim_tconv' in parameters:
-					self.dim_tconv=int(parameters['dim_tconv'][0])
-				self.channel=int(parameters['channel'][0])
-				self.length=int(parameters['time_step'][0])
-				if self.length<3:
-					self.length=3
-				categorizer_type=int(parameters['network'][0])
-				if categorizer_type==2:
-					self.animation_analyzer=True
-				else:
-					self.animation_analyzer=False
-				if int(parameters['inner_code'][0])==0:
-					self.include_bodyparts=True
-				else:
-					self.include_bodyparts=False
-				self.std=int(parameters['std'][0])
-				if int(parameters['background_free'][0])==0:
-					self.background_free=True
-				else:
-					self.background_free=False
-				if 'behavior_kind' in parameters:
-					self.behavior_mode=int(parameters['behavior_kind'][0])
-				else:
-					self.behavior_mode=0
+				for name,value in categorizer_settings(self.path_to_categorizer).items():
+					setattr(self,name,value)
 				if self.behavior_mode==2:
-					self.social_distance=int(parameters['social_distance'][0])
-					if self.social_distance==0:
-						self.social_distance=float('inf')
-					if 'color_code' in parameters:
-						color_code=int(parameters['color_code'][0])
-						if color_code==0:
-							self.color_costar=True
-						else:
-							self.color_costar=False
 					self.text_detection.SetLabel('Only Detector-based detection method is available for the selected Categorizer.')
 				if self.behavior_mode==3:
 					self.text_detection.SetLabel('Only Detector-based detection method is available for the selected Categorizer.')
@@ -414,9 +380,6 @@ class PanelLv2_AnalyzeBehaviors(wx.Panel):
 					self.text_duration.SetLabel('No need to specify this since the selected behavior mode is "Static images".')
 					self.text_animalnumber.SetLabel('No need to specify this since the selected behavior mode is "Static images".')
 					self.text_selectparameters.SetLabel('No need to specify this since the selected behavior mode is "Static images".')
-				if 'black_background' in parameters:
-					if int(parameters['black_background'][0])==1:
-						self.black_background=False
 
 		dialog.Destroy()
 
@@ -592,9 +555,7 @@ class PanelLv2_AnalyzeBehaviors(wx.Panel):
 						dialog2.Destroy()
 					else:
 						self.path_to_detector=os.path.join(self.detector_path,detector)
-					with open(os.path.join(self.path_to_detector,'model_parameters.txt')) as f:
-						model_parameters=f.read()
-					animal_names=json.loads(model_parameters)['animal_names']
+					animal_names=detector_animal_names(self.path_to_detector)
 					if len(animal_names)>1:
 						dialog2=wx.MultiChoiceDialog(self,message='Specify which animals/objects involved in analysis',caption='Animal/Object kind',choices=animal_names)
 						if dialog2.ShowModal()==wx.ID_OK:
@@ -946,13 +907,7 @@ class PanelLv2_AnalyzeBehaviors(wx.Panel):
 
 			else:
 
-				all_events={}
-				event_data={}
-				all_time=[]
-
 				if self.use_detector:
-					for animal_name in self.animal_kinds:
-						all_events[animal_name]={}
 					if len(self.animal_to_include)==0:
 						self.animal_to_include=self.animal_kinds
 					if self.detector_batch<=0:
@@ -964,6 +919,8 @@ class PanelLv2_AnalyzeBehaviors(wx.Panel):
 					if self.behavior_to_include[0]=='all':
 						self.behavior_to_include=list(self.behaviornames_and_colors.keys())
 
+				jobs=[]
+
 				for i in self.path_to_videos:
 
 					filename=os.path.splitext(os.path.basename(i))[0].split('_')
@@ -1001,108 +958,14 @@ class PanelLv2_AnalyzeBehaviors(wx.Panel):
 
 					if self.path_to_categorizer is None:
 						self.behavior_mode=0
-						categorize_behavior=False
-					else:
-						categorize_behavior=True
-
-					if self.use_detector is False:
-
-						AA=AnalyzeAnimal()
-						AA.prepare_analysis(i,self.result_path,self.animal_number,delta=self.delta,names_and_colors=self.behaviornames_and_colors,
-							framewidth=self.framewidth,stable_illumination=self.stable_illumination,dim_tconv=self.dim_tconv,dim_conv=self.dim_conv,channel=self.channel,
-							include_bodyparts=self.include_bodyparts,std=self.std,categorize_behavior=categorize_behavior,animation_analyzer=self.animation_analyzer,
-							path_background=self.background_path,autofind_t=self.autofind_t,t=self.t,duration=self.duration,ex_start=self.ex_start,ex_end=self.ex_end,
-							length=self.length,animal_vs_bg=self.animal_vs_bg)
-						if self.behavior_mode==0:
-							AA.acquire_information(background_free=self.background_free,black_background=self.black_background)
-							AA.craft_data()
-							interact_all=False
-						else:
-							AA.acquire_information_interact_basic(background_free=self.background_free,black_background=self.black_background)
-							interact_all=True
-						if self.path_to_categorizer is not None:
-							AA.categorize_behaviors(self.path_to_categorizer,uncertain=self.uncertain,min_length=self.min_length)
-						AA.annotate_video(self.ID_colors,self.behavior_to_include,show_legend=self.show_legend,interact_all=interact_all)
-						AA.export_results(normalize_distance=self.normalize_distance,parameter_to_analyze=self.parameter_to_analyze)
-
-						if self.path_to_categorizer is not None:
-							for n in AA.event_probability:
-								all_events[len(all_events)]=AA.event_probability[n]
-							if len(all_time)<len(AA.all_time):
-								all_time=AA.all_time
 
-					else:
+					settings={name:copy.deepcopy(getattr(self,name)) for name in settings_names}
+					jobs.append((i,self.result_path,settings))
 
-						AAD=AnalyzeAnimalDetector()
-						AAD.prepare_analysis(self.path_to_detector,i,self.result_path,self.animal_number,self.animal_kinds,self.behavior_mode,
-							names_and_colors=self.behaviornames_and_colors,framewidth=self.framewidth,dim_tconv=self.dim_tconv,dim_conv=self.dim_conv,channel=self.channel,
-							include_bodyparts=self.include_bodyparts,std=self.std,categorize_behavior=categorize_behavior,animation_analyzer=self.animation_analyzer,
-							t=self.t,duration=self.duration,length=self.length,social_distance=self.social_distance)
-						if self.behavior_mode==1:
-							AAD.acquire_information_interact_basic(batch_size=self.detector_batch,background_free=self.background_free,black_background=self.black_background)
-						else:
-							AAD.acquire_information(batch_size=self.detector_batch,background_free=self.background_free,black_background=self.black_background,color_costar=self.color_costar)
-						if self.behavior_mode!=1:
-							AAD.craft_data()
-						if self.path_to_categorizer is not None:
-							AAD.categorize_behaviors(self.path_to_categorizer,uncertain=self.uncertain,min_length=self.min_length)
-						if self.correct_ID:
-							AAD.correct_identity(self.specific_behaviors)
-						AAD.annotate_video(self.animal_to_include,self.ID_colors,self.behavior_to_include,show_legend=self.show_legend)
-						AAD.export_results(normalize_distance=self.normalize_distance,parameter_to_analyze=self.parameter_to_analyze)
-
-						if self.path_to_categorizer is not None:
-							for animal_name in self.animal_kinds:
-								for n in AAD.event_probability[animal_name]:
-									all_events[animal_name][len(all_events[animal_name])]=AAD.event_probability[animal_name][n]
-							if len(all_time)<len(AAD.all_time):
-								all_time=AAD.all_time
+				results=run_batch(jobs,processes=int(self.config['analysis_processes']),memory_budget=float(self.config['analysis_memory_budget']))
 
 				if self.path_to_categorizer is not None:
-
-					max_length=len(all_time)
-
-					if self.use_detector is False:
-
-						for n in all_events:
-							event_data[len(event_data)]=all_events[n]+[['NA',-1]]*(max_length-len(all_events[n]))
-						all_events_df=pd.DataFrame(event_data,index=all_time)
-						all_events_df.to_excel(os.path.join(self.result_path,'all_events.xlsx'),float_format='%.2f',index_label='time/ID')
-						plot_events(self.result_path,event_data,all_time,self.behaviornames_and_colors,self.behavior_to_include,width=0,height=0)
-						folders=[i for i in os.listdir(self.result_path) if os.path.isdir(os.path.join(self.result_path,i))]
-						folders.sort()
-						for behavior_name in self.behaviornames_and_colors:
-							all_summary=[]
-							for folder in folders:
-								individual_summary=os.path.join(self.result_path,folder,behavior_name,'all_summary.xlsx')
-								if os.path.exists(individual_summary):
-									all_summary.append(pd.read_excel(individual_summary))
-							if len(all_summary)>=1:
-								all_summary=pd.concat(all_summary,ignore_index=True)
-								all_summary.to_excel(os.path.join(self.result_path,behavior_name+'_summary.xlsx'),float_format='%.2f',index_label='ID/parameter')
-
-					else:
-
-						for animal_name in self.animal_to_include:
-							for n in all_events[animal_name]:
-								event_data[len(event_data)]=all_events[animal_name][n]+[['NA',-1]]*(max_length-len(all_events[animal_name][n]))
-							event_data[len(event_data)]=[['NA',-1]]*max_length
-						del event_data[len(event_data)-1]
-						all_events_df=pd.DataFrame(event_data,index=all_time)
-						all_events_df.to_excel(os.path.join(self.result_path,'all_events.xlsx'),float_format='%.2f',index_label='time/ID')
-						plot_events(self.result_path,event_data,all_time,self.behaviornames_and_colors,self.behavior_to_include,width=0,height=0)
-						folders=[i for i in os.listdir(self.result_path) if os.path.isdir(os.path.join(self.result_path,i))]
-						folders.sort()
-						for animal_name in self.animal_kinds:
-							for behavior_name in self.behaviornames_and_colors:
-								all_summary=[]
-								for folder in folders:
-									individual_summary=os.path.join(self.result_path,folder,behavior_name,animal_name+'_all_summary.xlsx')
-									if os.path.exists(individual_summary):
-										all_summary.append(pd.read_excel(individual_summary))
-								if len(all_summary)>=1:
-									all_summary=pd.concat(all_summary,ignore_index=True)
-									all_summary.to_excel(os.path.join(self.result_path,animal_name+'_'+behavior_name+'_summary.xlsx'),float_format='%.2f',index_label='ID/parameter')
+					merge_results(self.result_path,results,self.use_detector,self.animal_kinds,self.animal_to_include,self.behaviornames_and_colors,self.behavior_to_include,binary_results=self.binary_results)
 
 			print('Analysis completed!')
 
@@ -1356,7 +1219,7 @@ class PanelLv2_PlotBehaviors(wx.Panel):
 
 	def input_file(self,event):
 
-		dialog=wx.FileDialog(self,'Select the all_events.xlsx file.','',wildcard='all_events file (*.xlsx)|*.xlsx',style=wx.FD_OPEN)
+		dialog=wx.FileDialog(self,'Select the all_events.xlsx file.','',wildcard='all_events file (*.xlsx;*.npz)|*.xlsx;*.npz',style=wx.FD_OPEN)
 		if dialog.ShowModal()==wx.ID_OK:
 			all_events_file=Path(dialog.GetPath())
 			names_and_colors={}
@@ -0,0 +1,129 @@
+'''
+Copyright (C)
+This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with this program. If not, see https://tldrlegal.com/license/gnu-general-public-license-v3-(gpl-3)#fulltext.
+
+For license issues, please contact:
+
+Dr. Bing Ye
+Life Sciences Institute
+University of Michigan
+210 Washtenaw Avenue, Room 5403
+Ann Arbor, MI 48109-2216
+USA
+
+Email: bingye@umich.edu
+'''
+
+
+# Standard library imports.
+from collections import OrderedDict
+import logging
+import os
+import threading
+
+# Log the load of this module (by the module loader, on first import).
+# Intentionally positioning these statements before other imports, against the
+# guidance of PEP-8, to log the load before other imports log messages.
+logger = logging.getLogger(__name__)
+logger.debug('loading %s', __file__)
+
+
+# the maximum number of models kept loaded in a process, the least recently used one is released first
+capacity=4
+
+# the loaded models, (kind,path,mtime) -> model, the most recently used last
+models=OrderedDict()
+models_lock=threading.Lock()
+
+
+def model_mtime(path):
+
+	'''
+	This function is used to get the latest modification time of
+	a model file, or of any file in a model folder, so that a
+	retrained model at the same path is loaded again.
+	'''
+
+	mtime=os.path.getmtime(path)
+	if os.path.isdir(path):
+		for root,_,files in os.walk(path):
+			for file in files:
+				mtime=max(mtime,os.path.getmtime(os.path.join(root,file)))
+
+	return mtime
+
+
+def get_model(kind,path,loader):
+
+	'''
+	This function is used to get a model from the cache, or load
+	it with 'loader' and keep it in the cache.
+
+	kind: the kind of the model, like 'categorizer' or 'detector'
+	path: the path to the model
+	loader: a function that loads the model from path
+	'''
+
+	path=os.path.abspath(path)
+	key=(kind,path,model_mtime(path))
+
+	with models_lock:
+
+		if key in models:
+			models.move_to_end(key)
+			logger.debug('reusing the loaded %s %s', kind, path)
+			return models[key]
+
+		# an outdated version of the same model will not be used again
+		for outdated in [k for k in models if k[:2]==key[:2]]:
+			del models[outdated]
+
+		model=loader(path)
+		models[key]=model
+		while len(models)>capacity:
+			models.popitem(last=False)
+
+	return model
+
+
+def clear():
+
+	'''
+	This function is used to release all the loaded models.
+	'''
+
+	with models_lock:
+		models.clear()
+
+
+def load_categorizer(path_to_categorizer):
+
+	'''
+	This function is used to get a loaded Categorizer (a Keras
+	model), loading it only if it is not in the cache.
+	'''
+
+	from keras.models import load_model
+
+	return get_model('categorizer',path_to_categorizer,load_model)
+
+
+def load_detector(path_to_detector,animal_kinds):
+
+	'''
+	This function is used to get a loaded Detector, loading it
+	only if it is not in the cache.
+
+	animal_kinds: the catgories of animals / objects to be analyzed
+	'''
+
+	from .detector import Detector
+
+	def loader(path):
+		detector=Detector()
+		detector.load(path,animal_kinds)
+		return detector
+
+	return get_model('detector',path_to_detector,loader)
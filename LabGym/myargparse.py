@@ -10,6 +10,11 @@ What about repeated settings within command-line args?
 		--enable F1 --enable F2 --disable F1
 	accumulates to enable dict {'F1': False, 'F2': True}
 	Two -v args does not select more verbosity.
+
+Commands
+*   Without a command, LabGym starts the GUI.
+*   'analyze JOBFILE' runs a batch analysis described by a TOML job
+	file, without the GUI.
 """
 
 # Allow use of newer syntax Python 3.10 type hints in Python 3.9.
@@ -42,6 +47,31 @@ ResultType = Dict[str, Union[
 	Dict[str, bool],  # enable
 	]]
 
+# The commands, and the number of positional args each one takes.
+commands = {
+	'analyze': 1,  # analyze JOBFILE
+	}
+
+# The options, and the number of values following each one.
+# parse_args shifts by this table, and get_command uses it to skip
+# option values during its look-ahead.
+options = {
+	'--anonymous': 0,
+	'--configdir': 1,
+	'--configfile': 1,
+	'--enable': 1,
+	'--disable': 1,
+	'--logging_configfile': 1,
+	'--logging_level': 1,
+	'--debug': 0,
+	'-v': 0,
+	'--verbose': 0,
+	'--selftest': 0,
+	'-h': 0,
+	'--help': 0,
+	'--version': 0,
+	}
+
 def parse_args() -> ResultType:
 	"""Parse command-line args and return a dict.
 
@@ -72,6 +102,10 @@ def parse_args() -> ResultType:
 		begin with '-', it is considered the first positional command-
 		line arg, and ends the option processing.
 
+	*   The positional command-line args, if any, are a command and its
+		args, like 'analyze JOBFILE', which are returned as
+		result['command'] and result['jobfile'].
+
 	*   A '--' arg is recognized as separating options from positional
 		command-line args.  The '--' arg is necessary if the first
 		positional command-line arg starts with '-', to prevent
@@ -86,6 +120,11 @@ def parse_args() -> ResultType:
 
 	helpmsg = textwrap.dedent(f"""\
 		Usage: {basename} [options]
+		       {basename} [options] analyze JOBFILE
+
+		Commands:
+		  analyze JOBFILE       Analyze the videos listed in the TOML
+		                        JOBFILE without the GUI, then exit.
 
 		Options:
 		  --anonymous           Send only anonymized stats to the
@@ -113,6 +152,7 @@ def parse_args() -> ResultType:
 
 	while len(args) > 0:
 		arg = args[0]
+		shift = 1 + options.get(arg, 0)  # the option and its value, if any
 
 		# For arg value match expressions below, prefer value-in-list
 		# instead of value-in-tuple.
@@ -134,31 +174,31 @@ def parse_args() -> ResultType:
 
 		elif arg in ['--configdir']:
 			result['configdir'] = args[1]
-			args = args[2:]  # shift 2
+			args = args[shift:]  # shift past the option and its value
 
 		elif arg in ['--configfile']:
 			result['configfile'] = args[1]
-			args = args[2:]  # shift 2
+			args = args[shift:]  # shift past the option and its value
 
 		elif arg in ['--enable']:
 			if result.get('enable') is None:
 				 result['enable'] = {}
 			result.get('enable').update({args[1]: True})
-			args = args[2:]  # shift 2
+			args = args[shift:]  # shift past the option and its value
 
 		elif arg in ['--disable']:
 			if result.get('enable') is None:
 				 result['enable'] = {}
 			result.get('enable').update({args[1]: False})
-			args = args[2:]  # shift 2
+			args = args[shift:]  # shift past the option and its value
 
 		elif arg in ['--logging_configfile']:
 			result['logging_configfile'] = args[1]
-			args = args[2:]  # shift 2
+			args = args[shift:]  # shift past the option and its value
 
 		elif arg in ['--logging_level']:
 			result['logging_level'] = args[1]
-			args = args[2:]  # shift 2
+			args = args[shift:]  # shift past the option and its value
 
 		elif arg in ['--debug', '-v', '--verbose']:
 			result['logging_level'] = 'DEBUG'
@@ -203,7 +243,19 @@ def parse_args() -> ResultType:
 
 	# Sanity check remaining args before returning.
 	nargs = len(args)
-	if nargs != 0:
+	if nargs != 0 and args[0] in commands:
+		command = args[0]
+		if nargs - 1 != commands[command]:
+			# wrong number of command args.  Print msgs to stderr and exit 1.
+			sys.exit(
+				f'{basename}: bad usage -- {command!r} '
+				f'takes {commands[command]} args, but {nargs - 1} were found.'
+				f'\n{helpmsg}')
+		result['command'] = command
+		if command == 'analyze':
+			result['jobfile'] = args[1]
+
+	elif nargs != 0:
 		# unexpected args.  Print msgs to stderr and exit 1.
 		sys.exit(
 			f'{basename}: bad usage -- '
@@ -211,3 +263,26 @@ def parse_args() -> ResultType:
 			f'\n{helpmsg}')
 
 	return result
+
+
+def get_command() -> Union[str, None]:
+	"""Return the command named in the command-line args, or None.
+
+	This is a lightweight look-ahead for deciding, at import time,
+	whether the GUI modules are needed.  Unlike parse_args, it never
+	prints or exits; usage errors are left for parse_args to report.
+	"""
+
+	args = sys.argv[1:]  # operate on a copy of sys.argv
+
+	while len(args) > 0 and args[0].startswith('-') and args[0] != '--':
+		shift = 1 + options.get(args[0], 0)
+		args = args[shift:]  # shift past the option and its value, if any
+
+	if args[:1] == ['--']:
+		args = args[1:]  # shift 1
+
+	if len(args) > 0 and args[0] in commands:
+		return args[0]
+
+	return None
@@ -18,15 +18,19 @@ Email: bingye@umich.edu
 
 
 # Standard library imports.
+import ast
 from collections import deque
 import datetime
 import functools
 import gc
+import hashlib
 import logging
 import math
 import operator
 import os
 import shutil
+import threading
+import zipfile
 
 # Log the load of this module (by the module loader, on first import).
 # Intentionally positioning these statements before other imports, against the
@@ -42,6 +46,8 @@ import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 from PIL import Image,ImageEnhance
+from scipy.optimize import linear_sum_assignment
+from scipy.spatial import KDTree,distance
 import seaborn as sb
 from skimage import exposure
 logger.debug('importing tensorflow.keras.preprocessing.image (starting...)')
@@ -50,7 +56,13 @@ from keras.utils import img_to_array
 logger.debug('importing tensorflow.keras.preprocessing.image (done)')
 
 # Local application/library specific imports.
-# (none)
+from .background import BackgroundEstimator
+from .framesource import FrameSource,read_frames_at
+from .trackstore import Track
+
+
+# the reusable scratch buffer for the masks of blobs (one per thread)
+mask_buffer=threading.local()
 
 
 def extract_background(frames,stable_illumination=True,animal_vs_bg=0):
@@ -59,271 +71,213 @@ def extract_background(frames,stable_illumination=True,animal_vs_bg=0):
 	This function is used in 'background subtraction based detection method',
 	which extract the static background of a video.
 
+	The frames are fed to a BackgroundEstimator one at a time, so no float copy of all the frames is made.
+
+	frames: the frames, or a BackgroundEstimator that the frames have been added to
 	animal_vs_bg: 0--animals brighter than the background
 				  1--animals darker than the background
 				  2--hard to tell
 	'''
 
-	len_frames=len(frames)
-
-	if len_frames<=3:
-
-		background=None
-
+	if isinstance(frames,BackgroundEstimator):
+		estimator=frames
 	else:
+		estimator=BackgroundEstimator(stable_illumination=stable_illumination,animal_vs_bg=animal_vs_bg)
+		for frame in frames:
+			estimator.add(frame)
 
-		frames=np.array(frames,dtype='float32')
-
-		if animal_vs_bg==2:
-
-			if len_frames>101:
+	return estimator.background()
 
-				frames_mean=[]
-				check_frames=[]
-				mean_overall=frames.mean(0)
-				n=0
 
-				while n<len_frames-101:
-					frames_temp=frames[n:n+100]
-					mean=frames_temp.mean(0)
-					frames_mean.append(mean)
-					check_frames.append(abs(mean-mean_overall)+frames_temp.std(0))
-					n+=30
+def merge_backgrounds(frames,backgrounds,frame_count,stable_illumination=True,animal_vs_bg=0):
 
-				frames_mean=np.array(frames_mean,dtype='float32')
-				check_frames=np.array(check_frames,dtype='float32')
-				background=np.uint8(np.take_along_axis(frames_mean,np.argsort(check_frames,axis=0),axis=0)[0])
+	'''
+	This function is in 'background subtraction based detection method',
+	which merges the backgrounds extracted from every 1000 frames with
+	the background of the remaining frames.
 
-				del frames_mean
-				del check_frames
-				del frames_temp
-				gc.collect()
+	frames: the remaining frames that have not been used for background extraction, or a BackgroundEstimator of them
+	backgrounds: the backgrounds extracted from every 1000 frames
+	frame_count: the count of the remaining frames (plus 1)
+	'''
 
+	if len(backgrounds)>0:
+		if frame_count>600:
+			background=extract_background(frames,stable_illumination=stable_illumination,animal_vs_bg=animal_vs_bg)
+			backgrounds.append(background)
+		if len(backgrounds)==1:
+			background=backgrounds[0]
+		else:
+			backgrounds=np.array(backgrounds,dtype='float32')
+			if animal_vs_bg==1:
+				background=np.uint8(backgrounds.max(0))
+			elif animal_vs_bg==2:
+				background=np.uint8(np.median(backgrounds,axis=0))
 			else:
+				background=np.uint8(backgrounds.min(0))
+	else:
+		background=extract_background(frames,stable_illumination=stable_illumination,animal_vs_bg=animal_vs_bg)
 
-				background=np.uint8(np.median(frames,axis=0))
-
-		else:
+	return background
 
-			if stable_illumination:
 
-				if animal_vs_bg==1:
-					background=np.uint8(frames.max(0))
-				else:
-					background=np.uint8(frames.min(0))
+def sample_background(path_to_video,samples,framewidth=None,frameheight=None,stable_illumination=True,ex_start=0,ex_end=None,delta=10000,animal_vs_bg=0,tolerance=20,min_samples=32,luminance=None):
 
-			else:
+	'''
+	This function is in 'background subtraction based detection method',
+	which extracts the static backgrounds from a fixed number of frames
+	spread evenly across the time window for background extraction,
+	seeking to each of them instead of decoding every frame.
+
+	With stable illumination (and animal_vs_bg 0 or 1), the frames are
+	read in coarse-to-fine rounds that each halve the spacing of the
+	previous ones, and the sampling stops once a round changes the
+	background by more than 'tolerance' gray levels in no more than
+	0.01% of the pixels (smaller changes are the noise that keeps
+	lowering / raising the running minimum / maximum). Otherwise, all
+	the frames are read in order, and the windows of the estimation
+	span the sampled frames.
+
+	samples: the maximum number of frames to read
+	ex_start and ex_end: determines the time window (in second) for extracting background
+	delta: the fold change of illumination that splits the frames into normal, low and high illumination
+	tolerance: see above
+	min_samples: the number of frames in the first round
+	luminance: if not None, the luminance track of the video (see luminance_track) that splits the frames instead of their means
 
-				if len_frames>101:
+	return: (background,background_low,background_high,frame_initial), frame_initial is the first frame of the video
+	'''
 
-					frames_mean=[]
-					check_frames=[]
-					n=0
+	capture=cv2.VideoCapture(path_to_video)
+	fps=round(capture.get(cv2.CAP_PROP_FPS))
+	total_frames=int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+	capture.release()
 
-					while n<len_frames-101:
-						frames_temp=frames[n:n+100]
-						mean=frames_temp.mean(0)
-						frames_mean.append(mean)
-						if animal_vs_bg==1:
-							frames_temp_inv=255-frames_temp
-							check_frames.append(frames_temp_inv.mean(0)+frames_temp_inv.std(0))
-						else:
-							check_frames.append(mean+frames_temp.std(0))
-						n+=30
+	# the frames (counted from 1) at or after ex_start*fps and before ex_end*fps, as in estimate_constants
+	first=max(math.ceil(ex_start*fps)-1,0)
+	last=total_frames if ex_end is None else min(math.ceil(ex_end*fps)-1,total_frames)
+	frame_counts=np.unique(np.linspace(first,last-1,num=max(min(samples,last-first),0)).round().astype(int))
 
-					frames_mean=np.array(frames_mean,dtype='float32')
-					check_frames=np.array(check_frames,dtype='float32')
-					background=np.uint8(np.take_along_axis(frames_mean,np.argsort(check_frames,axis=0),axis=0)[0])
+	frame_initial=None
+	for frame_count,frame in read_frames_at(path_to_video,[0],framewidth=framewidth,frameheight=frameheight):
+		frame_initial=frame
+	if luminance is None:
+		mean_initial=np.mean(frame_initial)
+	else:
+		mean_initial=luminance[0]
+
+	if stable_illumination and animal_vs_bg!=2:
+		step=1
+		while len(frame_counts)/(step*2)>=min_samples:
+			step*=2
+		rounds=[frame_counts[::step]]
+		while step>1:
+			rounds.append(frame_counts[step//2::step])
+			step//=2
+	else:
+		rounds=[frame_counts]
 
-					del frames_mean
-					del check_frames
-					del frames_temp
-					gc.collect()
+	estimator=BackgroundEstimator(stable_illumination=stable_illumination,animal_vs_bg=animal_vs_bg)
+	estimator_low=BackgroundEstimator(stable_illumination=stable_illumination,animal_vs_bg=animal_vs_bg)
+	estimator_high=BackgroundEstimator(stable_illumination=stable_illumination,animal_vs_bg=animal_vs_bg)
+	previous=None
 
-				else:
+	for frame_counts_round in rounds:
+		for frame_count,frame in read_frames_at(path_to_video,frame_counts_round,framewidth=framewidth,frameheight=frameheight):
+			if luminance is None or frame_count>=len(luminance):
+				frame_mean=np.mean(frame)
+			else:
+				frame_mean=luminance[frame_count]
+			if frame_mean<mean_initial/delta:
+				estimator_low.add(frame)
+			elif frame_mean>delta*mean_initial:
+				estimator_high.add(frame)
+			else:
+				estimator.add(frame)
+		if len(rounds)>1:
+			current=estimator.background()
+			if previous is not None and current is not None and np.count_nonzero(cv2.absdiff(previous,current)>tolerance)<=0.0001*current.size:
+				break
+			previous=current
 
-					if animal_vs_bg==1:
-						background=np.uint8(frames.max(0))
-					else:
-						background=np.uint8(frames.min(0))
+	print('Background extracted from '+str(estimator.count+estimator_low.count+estimator_high.count)+' sampled frames.')
 
-	return background
+	return (estimator.background(),estimator_low.background(),estimator_high.background(),frame_initial)
 
 
-def estimate_constants(path_to_video,delta,animal_number,framewidth=None,frameheight=None,stable_illumination=True,ex_start=0,ex_end=None,t=None,duration=10,animal_vs_bg=0,path_background=None,kernel=3):
+def estimate_constants(path_to_video,delta,animal_number,framewidth=None,frameheight=None,stable_illumination=True,ex_start=0,ex_end=None,t=None,duration=10,animal_vs_bg=0,path_background=None,kernel=3,frames=None,background_samples=0,luminance=None,
+	segment_scale=1.0,segment_gray=False,buffer_bytes=0):
 
 	'''
 	This function is in 'background subtraction based detection method',
 	which determines the time windows for background extraction and
 	estimating animal size, as well as finding the stimulation start time.
 
+	Background extraction, stimulation start time finding and animal size estimation are all fed from the same pass.
+	The frames for animal size estimation that arrive before the background is ready are buffered only within
+	'buffer_bytes', otherwise the estimation window is decoded again once the background is ready.
+
 	delta: a float number that detemines fold changes of illumination when it's considered as stimulation start time point
 	ex_start and ex_end: determines the time window (in second) for extracting background
 	path_to_background: the path to the extracted background, which can be reused for background subtraction
 	kernel: determines how fine the erosion or dilation operation is
+	frames: if not None, an iterator of the (resized) frames of the video from its beginning, used instead of decoding the video,
+	which is consumed only as far as needed so that the caller can continue with the rest of the frames
+	background_samples: if >0, extract the background from at most this many frames spread across the extraction window
+	(see sample_background) before the pass over the frames, which then only finds the stimulation start time and estimates the animal size
+	luminance: if not None, the luminance track of the video (see luminance_track), the illumination of each frame is read from it and compared with
+	that of the first frame, and the stimulation start time is found in it instead of by decoding the video
+	segment_scale and segment_gray: see contour_frame, the animal size is estimated with the same segmentation as the analysis
+	buffer_bytes: the maximum bytes of frames kept for animal size estimation until the background is ready,
+	0 keeps only one frame at a time and decodes the estimation window again
 	'''
 
 	capture=cv2.VideoCapture(path_to_video)
 	fps=round(capture.get(cv2.CAP_PROP_FPS))
+	total_frames=capture.get(cv2.CAP_PROP_FRAME_COUNT)
 	capture.release()
+	if frames is None:
+		frames=(frame for frame_count,frame in FrameSource(path_to_video,framewidth=framewidth,frameheight=frameheight))
 	frame_initial=None
+	mean_initial=None
 	stim_t=None
+	stim_t_search=None
 
 	if path_background is None:
 
 		print('Extracting the static background...')
 
-		capture=cv2.VideoCapture(path_to_video)
-
-		if ex_start>=capture.get(cv2.CAP_PROP_FRAME_COUNT)/fps:
+		if ex_start>=total_frames/fps:
 			print('The beginning time for background extraction is later than the end of the video!')
 			print('Will use the 1st second of the video as the beginning time for background extraction!')
 			ex_start=0
 		if ex_start==ex_end:
 			ex_end=ex_start+1
 
-		frames=deque(maxlen=1000)
-		frames_low=deque(maxlen=1000)
-		frames_high=deque(maxlen=1000)
+		# the frames are not kept, each BackgroundEstimator holds per-pixel statistics of the frames in the current 1000-frame chunk
+		frames_normal=BackgroundEstimator(stable_illumination=stable_illumination,animal_vs_bg=animal_vs_bg)
+		frames_low=BackgroundEstimator(stable_illumination=stable_illumination,animal_vs_bg=animal_vs_bg)
+		frames_high=BackgroundEstimator(stable_illumination=stable_illumination,animal_vs_bg=animal_vs_bg)
 		backgrounds=deque(maxlen=1000)
 		backgrounds_low=deque(maxlen=1000)
 		backgrounds_high=deque(maxlen=1000)
-		frame_number=1
 		frame_count=1
 		frame_low_count=1
 		frame_high_count=1
-
-		while True:
-
-			retval,frame=capture.read()
-
-			if frame is None:
-				break
-
-			if ex_end is not None:
-				if frame_number>=ex_end*fps:
-					break
-
-			if frame_initial is None:
-				frame_initial=frame
-				if framewidth is not None:
-					frame_initial=cv2.resize(frame,(framewidth,frameheight),interpolation=cv2.INTER_AREA)
-
-			if frame_number>=ex_start*fps:
-
-				if framewidth is not None:
-					frame=cv2.resize(frame,(framewidth,frameheight),interpolation=cv2.INTER_AREA)
-
-				if np.mean(frame)<np.mean(frame_initial)/delta:
-					if stim_t is None:
-						stim_t=frame_number/fps
-					frames_low.append(frame)
-					frame_low_count+=1
-				elif np.mean(frame)>delta*np.mean(frame_initial):
-					if stim_t is None:
-						stim_t=frame_number/fps
-					frames_high.append(frame)
-					frame_high_count+=1
-				else:
-					frames.append(frame)
-					frame_count+=1
-
-			if frame_count==1001:
-				frame_count=1
-				background=extract_background(frames,stable_illumination=stable_illumination,animal_vs_bg=animal_vs_bg)
-				backgrounds.append(background)
-
-			if frame_low_count==1001:
-				frame_low_count=1
-				background_low=extract_background(frames_low,stable_illumination=stable_illumination,animal_vs_bg=animal_vs_bg)
-				backgrounds_low.append(background_low)
-
-			if frame_high_count==1001:
-				frame_high_count=1
-				background_high=extract_background(frames_high,stable_illumination=stable_illumination,animal_vs_bg=animal_vs_bg)
-				backgrounds_high.append(background_high)
-
-			frame_number+=1
-
-		capture.release()
-
-		if len(backgrounds)>0:
-			if frame_count>600:
-				background=extract_background(frames,stable_illumination=stable_illumination,animal_vs_bg=animal_vs_bg)
-				del frames
-				gc.collect()
-				backgrounds.append(background)
-			if len(backgrounds)==1:
-				background=backgrounds[0]
-			else:
-				backgrounds=np.array(backgrounds,dtype='float32')
-				if animal_vs_bg==1:
-					background=np.uint8(backgrounds.max(0))
-				elif animal_vs_bg==2:
-					background=np.uint8(np.median(backgrounds,axis=0))
-				else:
-					background=np.uint8(backgrounds.min(0))
-				del backgrounds
-				gc.collect()
-		else:
-			background=extract_background(frames,stable_illumination=stable_illumination,animal_vs_bg=animal_vs_bg)
-			del frames
-			gc.collect()
-
-		if len(backgrounds_low)>0:
-			if frame_low_count>600:
-				background_low=extract_background(frames_low,stable_illumination=stable_illumination,animal_vs_bg=animal_vs_bg)
-				del frames_low
-				gc.collect()
-				backgrounds_low.append(background_low)
-			if len(backgrounds_low)==1:
-				background_low=backgrounds_low[0]
-			else:
-				backgrounds_low=np.array(backgrounds_low,dtype='float32')
-				if animal_vs_bg==1:
-					background_low=np.uint8(backgrounds_low.max(0))
-				elif animal_vs_bg==2:
-					background_low=np.uint8(np.median(backgrounds_low,axis=0))
-				else:
-					background_low=np.uint8(backgrounds_low.min(0))
-				del backgrounds_low
-				gc.collect()
-		else:
-			background_low=extract_background(frames_low,stable_illumination=stable_illumination,animal_vs_bg=animal_vs_bg)
-			del frames_low
-			gc.collect()
-
-		if len(backgrounds_high)>0:
-			if frame_high_count>600:
-				background_high=extract_background(frames_high,stable_illumination=stable_illumination,animal_vs_bg=animal_vs_bg)
-				del frames_high
-				gc.collect()
-				backgrounds_high.append(background_high)
-			if len(backgrounds_high)==1:
-				background_high=backgrounds_high[0]
-			else:
-				backgrounds_high=np.array(backgrounds_high,dtype='float32')
-				if animal_vs_bg==1:
-					background_high=np.uint8(backgrounds_high.max(0))
-				elif animal_vs_bg==2:
-					background_high=np.uint8(np.median(backgrounds_high,axis=0))
-				else:
-					background_high=np.uint8(backgrounds_high.min(0))
-				del backgrounds_high
-				gc.collect()
-		else:
-			background_high=extract_background(frames_high,stable_illumination=stable_illumination,animal_vs_bg=animal_vs_bg)
-			del frames_high
-			gc.collect()
-
-		if background is None:
-			background=frame_initial
-		if background_low is None:
-			background_low=background
-		if background_high is None:
-			background_high=background
-
-		print('Background extraction completed!')
+		background=background_low=background_high=None
+		background_ready=False
+
+		if background_samples>0:
+			(background,background_low,background_high,frame_initial)=sample_background(path_to_video,background_samples,framewidth=framewidth,frameheight=frameheight,
+				stable_illumination=stable_illumination,ex_start=ex_start,ex_end=ex_end,delta=delta,animal_vs_bg=animal_vs_bg,luminance=luminance)
+			if background is None:
+				background=frame_initial
+			if background_low is None:
+				background_low=background
+			if background_high is None:
+				background_high=background
+			background_ready=True
+			print('Background extraction completed!')
 
 	else:
 
@@ -336,125 +290,213 @@ def estimate_constants(path_to_video,delta,animal_number,framewidth=None,framehe
 			background_high=cv2.resize(background_high,(framewidth,frameheight),interpolation=cv2.INTER_AREA)
 
 		frame_initial=background
+		background_ready=True
 
-	print('Estimating the animal size...')
-	print(datetime.datetime.now())
-
-	if delta<10000:
-
-		if ex_start!=0 or path_background is not None:
-
-			capture=cv2.VideoCapture(path_to_video)
-			frame_count=1
-
-			while True:
-
-				retval,frame=capture.read()
-
-				if frame is None:
-					break
-
-				if framewidth is not None:
-					frame=cv2.resize(frame,(framewidth,frameheight),interpolation=cv2.INTER_AREA)
+	# search the stimulation start time from the beginning of the video when background extraction does not start from it, or in the luminance track
+	search_stim=delta<10000 and (ex_start!=0 or path_background is not None or background_samples>0 or luminance is not None)
+	stim_found=not search_stim
 
-				if frame_initial is None:
-					frame_initial=frame
-				else:
-					if np.mean(frame)<np.mean(frame_initial)/delta:
-						stim_t=frame_count/fps
-						break
-					if np.mean(frame)>delta*np.mean(frame_initial):
-						stim_t=frame_count/fps
-						break
-
-				frame_count+=1
-
-			capture.release()
+	def mean_of(frame_number,frame,inverted=False):
+		# frame_number: counted from 1
+		# frame: the frame, inverted if 'inverted'
+		if luminance is not None and frame_number<=len(luminance):
+			if inverted:
+				return 255-luminance[frame_number-1]
+			return luminance[frame_number-1]
+		return np.mean(frame)
 
+	if duration>30 or duration<=0:
+		duration=30
 	if t is None:
-		if stim_t is None:
-			es_start=0
-		else:
-			es_start=stim_t
+		es_start=None
 	else:
 		es_start=t
 
-	if duration>30 or duration<=0:
-		duration=30
-	es_end=es_start+duration
-
-	capture=cv2.VideoCapture(path_to_video)
+	if luminance is not None:
+		mean_initial=luminance[0]
+		if search_stim:
+			stim_t_search=find_stim_t(luminance,fps,delta)
+			stim_found=True
+			if es_start is None and stim_t_search is None:
+				# no illumination change in the whole video
+				es_start=0
+
+	estimation_frames=[]
+	estimation_bytes=0
 	total_contour_area=[]
-	frame_count=1
-	min_area=(background.shape[1]/100)*(background.shape[0]/100)
-	max_area=(background.shape[1]*background.shape[0])*3/4
-
-	if animal_vs_bg==1:
-		background_estimation=np.uint8(255-background)
-		background_low_estimation=np.uint8(255-background_low)
-		background_high_estimation=np.uint8(255-background_high)
-	else:
-		background_estimation=background
-		background_low_estimation=background_low
-		background_high_estimation=background_high
+	area_done=False
+	redecode=False
+
+	def keep(frame_number,frame):
+		# keep a frame for animal size estimation, or give up buffering when the frames exceed 'buffer_bytes'
+		nonlocal estimation_frames,estimation_bytes,redecode,area_done
+		if redecode:
+			return
+		if not (background_ready and es_start is not None) and estimation_bytes+frame.nbytes>buffer_bytes:
+			estimation_frames=[]
+			estimation_bytes=0
+			redecode=area_done=True
+			return
+		estimation_frames.append((frame_number,frame))
+		estimation_bytes+=frame.nbytes
+
+	def finish_background():
+		nonlocal background,background_low,background_high,background_ready,frames_normal,frames_low,frames_high
+		background=merge_backgrounds(frames_normal,backgrounds,frame_count,stable_illumination=stable_illumination,animal_vs_bg=animal_vs_bg)
+		background_low=merge_backgrounds(frames_low,backgrounds_low,frame_low_count,stable_illumination=stable_illumination,animal_vs_bg=animal_vs_bg)
+		background_high=merge_backgrounds(frames_high,backgrounds_high,frame_high_count,stable_illumination=stable_illumination,animal_vs_bg=animal_vs_bg)
+		frames_normal=frames_low=frames_high=None
+		gc.collect()
+		if background is None:
+			background=frame_initial
+		if background_low is None:
+			background_low=background
+		if background_high is None:
+			background_high=background
+		background_ready=True
+		print('Background extraction completed!')
+		print('Estimating the animal size...')
+		print(datetime.datetime.now())
+
+	def estimate_area(frame_number,frame):
+		if animal_vs_bg==1:
+			frame=np.uint8(255-frame)
+			background_estimation=np.uint8(255-background)
+			background_low_estimation=np.uint8(255-background_low)
+			background_high_estimation=np.uint8(255-background_high)
+		else:
+			background_estimation=background
+			background_low_estimation=background_low
+			background_high_estimation=background_high
+		min_area=(background.shape[1]/100)*(background.shape[0]/100)
+		max_area=(background.shape[1]*background.shape[0])*3/4
+		contour_area=0
+		frame_mean=mean_of(frame_number,frame,inverted=animal_vs_bg==1)
+		if frame_mean<mean_initial/delta:
+			background_dt=background_low_estimation
+		elif frame_mean>delta*mean_initial:
+			background_dt=background_high_estimation
+		else:
+			background_dt=background_estimation
+		frame_working=working_image(frame,segment_scale=segment_scale,segment_gray=segment_gray)
+		if frame_working is not frame:
+			background_dt=working_image(background_dt,segment_scale=segment_scale,segment_gray=segment_gray)
+		contours=segment_foreground(frame_working,background_dt,animal_vs_bg=animal_vs_bg,kernel=kernel,frame_shape=frame.shape if frame_working is not frame else None)
+		for i in contours:
+			if min_area<cv2.contourArea(i)<max_area:
+				contour_area+=cv2.contourArea(i)
+		total_contour_area.append(contour_area)
 
-	while True:
+	if background_ready:
+		print('Estimating the animal size...')
+		print(datetime.datetime.now())
 
-		retval,frame=capture.read()
+	for frame_number,frame in enumerate(frames,start=1):
 
 		if frame_initial is None:
 			frame_initial=frame
+		if mean_initial is None:
+			mean_initial=np.mean(frame_initial)
+		frame_mean=mean_of(frame_number,frame)
 
-		if frame is None:
-			break
-
-		if es_end is not None:
-			if frame_count>=es_end*fps:
-				break
-
-		if frame_count>=es_start*fps:
-
-			if framewidth is not None:
-				frame=cv2.resize(frame,(framewidth,frameheight),interpolation=cv2.INTER_AREA)
+		if not background_ready:
 
-			if animal_vs_bg==1:
-				frame=np.uint8(255-frame)
+			if ex_end is not None and frame_number>=ex_end*fps:
 
-			contour_area=0
+				finish_background()
 
-			if np.mean(frame)<np.mean(frame_initial)/delta:
-				if animal_vs_bg==2:
-					foreground=cv2.absdiff(frame,background_low_estimation)
-				else:
-					foreground=cv2.subtract(frame,background_low_estimation)
-			elif np.mean(frame)>delta*np.mean(frame_initial):
-				if animal_vs_bg==2:
-					foreground=cv2.absdiff(frame,background_high_estimation)
-				else:
-					foreground=cv2.subtract(frame,background_high_estimation)
 			else:
-				if animal_vs_bg==2:
-					foreground=cv2.absdiff(frame,background_estimation)
-				else:
-					foreground=cv2.subtract(frame,background_estimation)
-
-			foreground=cv2.cvtColor(foreground,cv2.COLOR_BGR2GRAY)
-			thred=cv2.threshold(foreground,0,255,cv2.THRESH_BINARY+cv2.THRESH_OTSU)[1]
-			thred=cv2.morphologyEx(thred,cv2.MORPH_CLOSE,np.ones((kernel,kernel),np.uint8))
 
-			if animal_vs_bg==2:
-				kernel_erode=max(kernel-4,1)
-				thred=cv2.erode(thred,np.ones((kernel_erode,kernel_erode),np.uint8))
-			contours,_=cv2.findContours(thred,cv2.RETR_LIST,cv2.CHAIN_APPROX_NONE)
-
-			for i in contours:
-				if min_area<cv2.contourArea(i)<max_area:
-					contour_area+=cv2.contourArea(i)
-			total_contour_area.append(contour_area)
+				if frame_number>=ex_start*fps:
+
+					if frame_mean<mean_initial/delta:
+						if stim_t is None:
+							stim_t=frame_number/fps
+						frames_low.add(frame)
+						frame_low_count+=1
+					elif frame_mean>delta*mean_initial:
+						if stim_t is None:
+							stim_t=frame_number/fps
+						frames_high.add(frame)
+						frame_high_count+=1
+					else:
+						frames_normal.add(frame)
+						frame_count+=1
+
+				if frame_count==1001:
+					frame_count=1
+					backgrounds.append(extract_background(frames_normal,stable_illumination=stable_illumination,animal_vs_bg=animal_vs_bg))
+					frames_normal=BackgroundEstimator(stable_illumination=stable_illumination,animal_vs_bg=animal_vs_bg)
+
+				if frame_low_count==1001:
+					frame_low_count=1
+					backgrounds_low.append(extract_background(frames_low,stable_illumination=stable_illumination,animal_vs_bg=animal_vs_bg))
+					frames_low=BackgroundEstimator(stable_illumination=stable_illumination,animal_vs_bg=animal_vs_bg)
+
+				if frame_high_count==1001:
+					frame_high_count=1
+					backgrounds_high.append(extract_background(frames_high,stable_illumination=stable_illumination,animal_vs_bg=animal_vs_bg))
+					frames_high=BackgroundEstimator(stable_illumination=stable_illumination,animal_vs_bg=animal_vs_bg)
+
+		if not stim_found:
+			if frame_mean<mean_initial/delta or frame_mean>delta*mean_initial:
+				stim_t_search=frame_number/fps
+				stim_found=True
+
+		if es_start is None:
+			if stim_found and stim_t_search is not None:
+				es_start=stim_t_search
+			elif not search_stim and stim_t is not None:
+				es_start=stim_t
+			elif not search_stim and background_ready:
+				es_start=0
+			if es_start is not None:
+				# keep only the buffered frames that fall into the determined window
+				estimation_frames=[(n,f) for n,f in estimation_frames if es_start*fps<=n<(es_start+duration)*fps]
+				estimation_bytes=sum(f.nbytes for n,f in estimation_frames)
+
+		if es_start is None:
+			# the stimulation start time is not found yet, keep the frames in case the estimation starts from the beginning
+			if frame_number<duration*fps:
+				keep(frame_number,frame)
+		elif not area_done:
+			if frame_number>=(es_start+duration)*fps:
+				area_done=True
+			elif frame_number>=es_start*fps:
+				keep(frame_number,frame)
+
+		if background_ready and es_start is not None:
+			for n,f in estimation_frames:
+				estimate_area(n,f)
+			estimation_frames=[]
+			estimation_bytes=0
+
+		if background_ready and stim_found and area_done:
+			break
 
-		frame_count+=1
+	if not background_ready:
+		finish_background()
 
-	capture.release()
+	if search_stim and stim_t_search is not None:
+		stim_t=stim_t_search
+	if es_start is None:
+		if stim_t is None:
+			es_start=0
+		else:
+			es_start=stim_t
+		estimation_frames=[(n,f) for n,f in estimation_frames if es_start*fps<=n<(es_start+duration)*fps]
+	for n,f in estimation_frames:
+		estimate_area(n,f)
+	del estimation_frames
+	gc.collect()
+
+	if redecode:
+		# decode the estimation window again, one frame at a time (seeking a second before it)
+		for frame_count,frame in FrameSource(path_to_video,framewidth=framewidth,frameheight=frameheight,start_t=max(es_start-1,0),decimals=None):
+			if frame_count+1>=(es_start+duration)*fps:
+				break
+			if frame_count+1>=es_start*fps:
+				estimate_area(frame_count+1,frame)
 
 	print('Estimation completed!')
 
@@ -476,6 +518,140 @@ def estimate_constants(path_to_video,delta,animal_number,framewidth=None,framehe
 	return (background,background_low,background_high,stim_t,animal_area)
 
 
+def video_fingerprint(path_to_video,blocks=16,block_size=65536):
+
+	'''
+	This function is used to identify the content of a video by
+	hashing its size and 'blocks' blocks of 'block_size' bytes
+	spread evenly over the file, without reading the whole file.
+
+	return: the hexadecimal SHA-256 digest
+	'''
+
+	size=os.path.getsize(path_to_video)
+	digest=hashlib.sha256(str(size).encode())
+
+	with open(path_to_video,'rb') as f:
+		for n in range(blocks):
+			f.seek(max(size-block_size,0)*n//max(blocks-1,1))
+			digest.update(f.read(block_size))
+
+	return digest.hexdigest()
+
+
+def cached_constants(path_to_cache,path_to_video,parameters,estimate):
+
+	'''
+	This function is used to reuse the constants of 'estimate_constants'
+	(backgrounds, stimulation start time and animal size) of a video
+	from earlier analyses. They are stored losslessly in
+	'<path_to_cache>/<key>.npz', the key is the hash of the content of
+	the video (see video_fingerprint) and the parameters.
+
+	path_to_cache: the folder that stores the cached constants
+	parameters: a dict of all the parameters of 'estimate_constants' that the constants depend on
+	estimate: a function that estimates the constants when they are not cached
+
+	return: (background,background_low,background_high,stim_t,animal_area)
+	'''
+
+	parameters=repr(sorted(parameters.items()))
+	key=hashlib.sha256((video_fingerprint(path_to_video)+parameters).encode()).hexdigest()
+	path_to_file=os.path.join(path_to_cache,key+'.npz')
+
+	try:
+		with np.load(path_to_file) as data:
+			if str(data['parameters'])==parameters:
+				print('Reusing the background and animal size from an earlier analysis of this video.')
+				return (data['background'],data['background_low'],data['background_high'],data['stim_t'].item(),data['animal_area'].item())
+	except (OSError,KeyError,ValueError,zipfile.BadZipFile):
+		# not cached yet, or an unusable file that will be replaced
+		pass
+
+	constants=estimate()
+
+	try:
+		os.makedirs(path_to_cache,exist_ok=True)
+		path_to_temp=path_to_file+'.'+str(os.getpid())+'.tmp'
+		with open(path_to_temp,'wb') as f:
+			np.savez_compressed(f,background=constants[0],background_low=constants[1],background_high=constants[2],
+				stim_t=np.asarray(constants[3]),animal_area=np.asarray(constants[4]),parameters=np.asarray(parameters))
+		os.replace(path_to_temp,path_to_file)
+	except OSError as e:
+		logger.debug('not caching the constants of %s: %s',path_to_video,e)
+
+	return constants
+
+
+def luminance_track(path_to_video,width=64):
+
+	'''
+	This function is used to get the luminance track of a video, the
+	mean intensity of each frame computed on the frame downscaled to
+	'width', for finding the illumination changes (like optogenetic
+	stimulation) without decoding the video again.
+
+	return: a float64 array, the mean intensity of frame n (counted from 0) at n
+	'''
+
+	return np.array([np.mean(frame) for frame_count,frame in FrameSource(path_to_video,framewidth=width)],dtype=np.float64)
+
+
+def cached_luminance_track(path_to_cache,path_to_video,width=64):
+
+	'''
+	This function is used to get the luminance track of a video (see
+	luminance_track), computed once per video and stored in
+	'<path_to_cache>/<key>.npz', the key is the hash of the content of
+	the video (see video_fingerprint) and 'width'.
+
+	path_to_cache: the folder that stores the cached constants
+	'''
+
+	key=hashlib.sha256((video_fingerprint(path_to_video)+'luminance'+str(width)).encode()).hexdigest()
+	path_to_file=os.path.join(path_to_cache,key+'.npz')
+
+	try:
+		with np.load(path_to_file) as data:
+			return data['luminance']
+	except (OSError,KeyError,ValueError,zipfile.BadZipFile):
+		# not cached yet, or an unusable file that will be replaced
+		pass
+
+	print('Computing the luminance track of the video...')
+	luminance=luminance_track(path_to_video,width=width)
+
+	try:
+		os.makedirs(path_to_cache,exist_ok=True)
+		path_to_temp=path_to_file+'.'+str(os.getpid())+'.tmp'
+		with open(path_to_temp,'wb') as f:
+			np.savez_compressed(f,luminance=luminance)
+		os.replace(path_to_temp,path_to_file)
+	except OSError as e:
+		logger.debug('not caching the luminance track of %s: %s',path_to_video,e)
+
+	return luminance
+
+
+def find_stim_t(luminance,fps,delta):
+
+	'''
+	This function is used to find the stimulation start time in the
+	luminance track of a video (see luminance_track), the time point of
+	the first frame whose mean intensity is 'delta' fold lower or
+	higher than that of the first frame.
+
+	return: the stimulation start time (in seconds), None if the illumination does not change
+	'''
+
+	changed=np.flatnonzero((luminance<luminance[0]/delta)|(luminance>delta*luminance[0]))
+
+	if len(changed)==0:
+		return None
+
+	return (changed[0]+1)/fps
+
+
 def crop_frame(frame,contours):
 
 	'''
@@ -509,6 +685,88 @@ def crop_frame(frame,contours):
 	return (y_bt,y_tp,x_lf,x_rt)
 
 
+def canvas_region(frame,y_bt,y_tp,x_lf,x_rt,contours,margin=0):
+
+	'''
+	This function is used to get the region of a frame that
+	covers the y_bt,y_tp,x_lf,x_rt region and a (nested) list of
+	contours widened by 'margin', so that the contours can be
+	drawn in a canvas of this region (offset into it) exactly
+	as they are drawn in the full frame.
+	'''
+
+	points=[]
+	to_flatten=[contours]
+	while len(to_flatten)>0:
+		for ct in to_flatten.pop():
+			if isinstance(ct,np.ndarray):
+				points.append(ct.reshape(-1,2))
+			elif ct is not None:
+				to_flatten.append(ct)
+
+	if len(points)>0:
+		points=np.concatenate(points)
+		(x_min,y_min)=points.min(0)-margin
+		(x_max,y_max)=points.max(0)+margin+1
+		x_min=min(x_min,x_lf)
+		y_min=min(y_min,y_bt)
+		x_max=max(x_max,x_rt)
+		y_max=max(y_max,y_tp)
+	else:
+		(x_min,y_min,x_max,y_max)=(x_lf,y_bt,x_rt,y_tp)
+
+	return (int(max(y_min,0)),int(min(y_max,frame.shape[0])),int(max(x_min,0)),int(min(x_max,frame.shape[1])))
+
+
+def get_mask(h,w):
+
+	'''
+	This function is used to get a zeroed h X w uint8 mask
+	from a scratch buffer that is reused across calls and
+	only grows when a larger mask is needed.
+	'''
+
+	buffer=getattr(mask_buffer,'array',None)
+	if buffer is None or buffer.shape[0]<h or buffer.shape[1]<w:
+		if buffer is not None:
+			h_buffer=max(h,buffer.shape[0])
+			w_buffer=max(w,buffer.shape[1])
+		else:
+			h_buffer=h
+			w_buffer=w
+		buffer=np.zeros((h_buffer,w_buffer),dtype='uint8')
+		mask_buffer.array=buffer
+	mask=buffer[:h,:w]
+	mask[:]=0
+
+	return mask
+
+
+def mask_blob(frame,y_bt,y_tp,x_lf,x_rt,contours,black_background=True):
+
+	'''
+	This function is used to keep the pixels for the area
+	inside a list of contours within the y_bt,y_tp,x_lf,x_rt
+	region of a frame. The masking is done in uint8 and only
+	around the region: the contours are drawn in a mask that
+	covers the region and the contours (so that no contour is
+	clipped other than by the frame borders), offset into it.
+
+	black_background: whether to set background black
+	'''
+
+	(c_bt,c_tp,c_lf,c_rt)=canvas_region(frame,y_bt,y_tp,x_lf,x_rt,contours)
+	mask=get_mask(c_tp-c_bt,c_rt-c_lf)
+	cv2.drawContours(mask,contours,-1,255,-1,offset=(-c_lf,-c_bt))
+	mask=mask[y_bt-c_bt:y_tp-c_bt,x_lf-c_lf:x_rt-c_lf]
+	region=frame[y_bt:y_tp,x_lf:x_rt]
+	blob=cv2.bitwise_and(region,region,mask=mask)
+	if black_background is False:
+		blob[mask==0]=255
+
+	return blob
+
+
 def extract_blob_background(frame,contours,contour=None,channel=1,background_free=False,black_background=True):
 
 	'''
@@ -523,14 +781,9 @@ def extract_blob_background(frame,contours,contour=None,channel=1,background_fre
 
 	(y_bt,y_tp,x_lf,x_rt)=crop_frame(frame,contours)
 	if background_free:
-		mask=np.zeros_like(frame)
-		cv2.drawContours(mask,[contour],0,(255,255,255),-1)
-		masked_frame=frame*(mask/255.0)
-		if black_background is False:
-			masked_frame[mask==0]=255
+		blob=mask_blob(frame,y_bt,y_tp,x_lf,x_rt,[contour],black_background=black_background)
 	else:
-		masked_frame=frame
-	blob=masked_frame[y_bt:y_tp,x_lf:x_rt]
+		blob=frame[y_bt:y_tp,x_lf:x_rt]
 	blob=np.uint8(exposure.rescale_intensity(blob,out_range=(0,255)))
 
 	if channel==1:
@@ -553,14 +806,9 @@ def extract_blob_all(frame,y_bt,y_tp,x_lf,x_rt,contours=None,channel=1,backgroun
 	'''
 
 	if background_free:
-		mask=np.zeros_like(frame)
-		cv2.drawContours(mask,contours,-1,(255,255,255),-1)
-		masked_frame=frame*(mask/255.0)
-		if black_background is False:
-			masked_frame[mask==0]=255
+		blob=mask_blob(frame,y_bt,y_tp,x_lf,x_rt,contours,black_background=black_background)
 	else:
-		masked_frame=frame
-	blob=masked_frame[y_bt:y_tp,x_lf:x_rt]
+		blob=frame[y_bt:y_tp,x_lf:x_rt]
 	blob=np.uint8(exposure.rescale_intensity(blob,out_range=(0,255)))
 
 	if channel==1:
@@ -570,6 +818,233 @@ def extract_blob_all(frame,y_bt,y_tp,x_lf,x_rt,contours=None,channel=1,backgroun
 	return blob
 
 
+def mask_bounds(mask):
+
+	'''
+	This function is used to get the region (y_bt,y_tp,x_lf,x_rt)
+	that covers the non-zero pixels of a mask, None if there is none.
+	'''
+
+	(x,y,w,h)=cv2.boundingRect(mask)
+	if w==0 or h==0:
+		return None
+
+	return (y,y+h,x,x+w)
+
+
+def extract_blob_interact(frame,masks,bounds,index,other_indices,contour,y_bt,y_tp,x_lf,x_rt,background_free=True,black_background=True,color_costar=False,frame_range=None):
+
+	'''
+	This function is used to make the blob of a main character in
+	'interactive advanced' mode: keep the pixels of the main
+	character and its supporting roles, rescale the intensity, draw
+	the contour of the main character and crop the frame to fit the
+	y_bt,y_tp,x_lf,x_rt coordinates. The result is the same as doing
+	so in the full frame, but the pixels are only processed in a
+	window that covers the region, the contour and the masks.
+
+	masks: the full-frame masks of all the detected animals / objects
+	bounds: the mask_bounds of the masks
+	index: the index of the main character in masks
+	other_indices: the indices of the supporting roles in masks
+	background_free: whether to include background in animations
+	black_background: whether to set background black
+	color_costar: whether to make the supporting roles RGB scale
+	frame_range: the (min,max) intensities of the frame, used when background_free is False, computed if None
+	'''
+
+	(w_bt,w_tp,w_lf,w_rt)=canvas_region(frame,y_bt,y_tp,x_lf,x_rt,[contour],margin=4)
+
+	if background_free:
+
+		for i in [index]+list(other_indices):
+			if bounds[i] is not None:
+				w_bt=min(w_bt,bounds[i][0])
+				w_tp=max(w_tp,bounds[i][1])
+				w_lf=min(w_lf,bounds[i][2])
+				w_rt=max(w_rt,bounds[i][3])
+		window=(slice(w_bt,w_tp),slice(w_lf,w_rt))
+		region=frame[window]
+		mask=masks[index][window]
+		blob=region*cv2.cvtColor(mask,cv2.COLOR_GRAY2BGR)
+		if len(other_indices)>0:
+			other_mask=np.bitwise_or.reduce(np.stack([masks[i][window] for i in other_indices]))
+			if color_costar:
+				other_blob=region*cv2.cvtColor(other_mask,cv2.COLOR_GRAY2BGR)
+			else:
+				other_blob=cv2.cvtColor(cv2.cvtColor(region,cv2.COLOR_BGR2GRAY)*other_mask,cv2.COLOR_GRAY2BGR)
+			blob=cv2.add(blob,other_blob)
+			mask=mask|other_mask
+		if black_background:
+			background=0
+		else:
+			background=255
+			blob[mask==0]=255
+		(i_min,i_max)=(int(blob.min()),int(blob.max()))
+		# outside the window there are only background pixels, which count in the intensity range of the full frame
+		if (w_tp-w_bt,w_rt-w_lf)!=frame.shape[:2]:
+			(i_min,i_max)=(min(i_min,background),max(i_max,background))
+
+	else:
+
+		window=(slice(w_bt,w_tp),slice(w_lf,w_rt))
+		blob=frame[window]
+		if frame_range is None:
+			frame_range=(int(frame.min()),int(frame.max()))
+		(i_min,i_max)=frame_range
+
+	blob=np.uint8(exposure.rescale_intensity(blob,in_range=(i_min,i_max),out_range=(0,255)))
+	cv2.drawContours(blob,[contour],0,(255,0,255),2,offset=(-w_lf,-w_bt))
+
+	return blob[y_bt-w_bt:y_tp-w_bt,x_lf-w_lf:x_rt-w_lf]
+
+
+def tile_regions(frame_shape,tile_size,overlap=64):
+
+	'''
+	This function is used to split a frame into square tiles that
+	overlap by 'overlap' pixels, for running the Detector on tiles
+	of a large frame instead of the downscaled frame.
+
+	frame_shape: the (height,width) of the frame
+	tile_size: the width / height (in pixels) of a tile
+
+	return: the (left,right,top,bottom) of each tile
+	'''
+
+	(height,width)=frame_shape[:2]
+	step=max(tile_size-overlap,1)
+
+	def starts(length):
+		if length<=tile_size:
+			return [0]
+		return list(range(0,length-tile_size,step))+[length-tile_size]
+
+	return [(x,min(x+tile_size,width),y,min(y+tile_size,height)) for y in starts(height) for x in starts(width)]
+
+
+def merge_region_detections(frame_shape,regions,detections,overlap_ratio=0.5):
+
+	'''
+	This function is used to put the detections of the Detector in
+	regions of a frame (arena ROIs or overlapping tiles) back into
+	the frame. An animal / object cut by the border of a tile is also
+	detected, in part or in whole, in the overlapping tile, so the
+	masks of the same category from different regions that overlap
+	by at least overlap_ratio of the smaller one are merged into one,
+	with the highest of their scores.
+
+	frame_shape: the (height,width) of the frame
+	regions: the (left,right,top,bottom) of each region
+	detections: the (masks,classes,scores) in each region, the masks are in the region coordinates
+
+	return: (masks,classes,scores) in the frame, the masks are full-frame uint8 arrays
+	'''
+
+	pieces=[]
+	for r,((left,right,top,bottom),(masks,classes,scores)) in enumerate(zip(regions,detections)):
+		for mask,category,score in zip(masks,classes,scores):
+			bounds=mask_bounds(mask)
+			if bounds is not None:
+				(y_bt,y_tp,x_lf,x_rt)=bounds
+				pieces.append((r,category,score,(top+y_bt,top+y_tp,left+x_lf,left+x_rt),mask[y_bt:y_tp,x_lf:x_rt]>0))
+
+	groups=list(range(len(pieces)))
+
+	def find(i):
+		while groups[i]!=i:
+			groups[i]=groups[groups[i]]
+			i=groups[i]
+		return i
+
+	areas=[np.count_nonzero(piece[4]) for piece in pieces]
+	for i,(r_i,category_i,_,box_i,mask_i) in enumerate(pieces):
+		for j in range(i+1,len(pieces)):
+			(r_j,category_j,_,box_j,mask_j)=pieces[j]
+			if r_i==r_j or category_i!=category_j:
+				continue
+			(y_bt,y_tp,x_lf,x_rt)=(max(box_i[0],box_j[0]),min(box_i[1],box_j[1]),max(box_i[2],box_j[2]),min(box_i[3],box_j[3]))
+			if y_bt>=y_tp or x_lf>=x_rt:
+				continue
+			overlap=np.count_nonzero(mask_i[y_bt-box_i[0]:y_tp-box_i[0],x_lf-box_i[2]:x_rt-box_i[2]]&mask_j[y_bt-box_j[0]:y_tp-box_j[0],x_lf-box_j[2]:x_rt-box_j[2]])
+			if overlap>0 and overlap>=overlap_ratio*min(areas[i],areas[j]):
+				groups[find(j)]=find(i)
+
+	(height,width)=frame_shape[:2]
+	merged={}
+	masks=[]
+	classes=[]
+	scores=[]
+	for i,(r,category,score,(y_bt,y_tp,x_lf,x_rt),mask) in enumerate(pieces):
+		root=find(i)
+		if root not in merged:
+			merged[root]=len(masks)
+			masks.append(np.zeros((height,width),dtype=np.uint8))
+			classes.append(category)
+			scores.append(score)
+		n=merged[root]
+		masks[n][y_bt:y_tp,x_lf:x_rt][mask]=1
+		scores[n]=max(scores[n],score)
+
+	return (np.array(masks,dtype=np.uint8).reshape(-1,height,width),np.array(classes,dtype=np.int64),np.array(scores,dtype=np.float32))
+
+
+def propagate_masks(previous_frame,frame,masks,margin=16,max_difference=20,max_area_change=0.3):
+
+	'''
+	This function is used to move the masks of the animals / objects
+	in the previous frame to the current frame by the dense optical
+	flow around each mask, for the frames that the Detector skips.
+
+	previous_frame: the previous frame, gray scale
+	frame: the current frame, gray scale
+	masks: the full-frame uint8 masks in the previous frame
+	margin: the pixels around a mask in which the flow is computed,
+	an animal / object moving farther than that between two frames is
+	not propagated
+	max_difference: the maximum mean absolute difference (in gray
+	levels) inside a mask between the current frame and the previous
+	frame moved by the flow, for the propagation to be reliable
+	max_area_change: the maximum fraction by which the area of a mask
+	can change, for the propagation to be reliable
+
+	return: the masks in the current frame, None if any of them
+	cannot be reliably propagated
+	'''
+
+	(height,width)=frame.shape[:2]
+	propagated=np.zeros_like(masks)
+
+	for n,mask in enumerate(masks):
+
+		bounds=mask_bounds(mask)
+		if bounds is None:
+			return None
+		(y_bt,y_tp,x_lf,x_rt)=bounds
+		region=(slice(max(y_bt-margin,0),min(y_tp+margin,height)),slice(max(x_lf-margin,0),min(x_rt+margin,width)))
+
+		# the flow from the current frame to the previous one, so that each pixel looks up where it was
+		flow=cv2.calcOpticalFlowFarneback(frame[region],previous_frame[region],None,0.5,3,15,3,5,1.2,0)
+		(h,w)=flow.shape[:2]
+		(grid_x,grid_y)=np.meshgrid(np.arange(w,dtype=np.float32),np.arange(h,dtype=np.float32))
+		map_x=grid_x+flow[...,0]
+		map_y=grid_y+flow[...,1]
+
+		moved_mask=cv2.remap(mask[region].astype(np.float32),map_x,map_y,cv2.INTER_LINEAR)>0.5
+		area=np.count_nonzero(mask[region])
+		moved_area=np.count_nonzero(moved_mask)
+		if moved_area==0 or abs(moved_area-area)>max_area_change*area:
+			return None
+
+		moved_frame=cv2.remap(previous_frame[region],map_x,map_y,cv2.INTER_LINEAR)
+		if np.abs(frame[region].astype(np.int16)-moved_frame)[moved_mask].mean()>max_difference:
+			return None
+
+		propagated[n][region][moved_mask]=1
+
+	return propagated
+
+
 def get_inner(masked_frame_gray,contour):
 
 	'''
@@ -589,7 +1064,115 @@ def get_inner(masked_frame_gray,contour):
 	return inner
 
 
-def contour_frame(frame,animal_number,background,background_low,background_high,delta,contour_area,animal_vs_bg=0,include_bodyparts=False,animation_analyzer=False,channel=1,kernel=5,black_background=True):
+def suppress_duplicate_masks(masks,threshold=0.8):
+
+	'''
+	This function is used to find the duplicated detections
+	among the masks output by a Detector: a mask is excluded
+	if more than 'threshold' of its area overlaps with a larger
+	mask. Only the pairs whose bounding boxes overlap enough are
+	compared, within the overlap of the boxes, so the memory does
+	not scale with the number of pairs times the frame size.
+
+	masks: the list of binary masks (H X W) in a frame
+	threshold: the fraction of the area of a mask that needs to be covered by a larger mask to exclude it
+
+	return: a boolean array, True for the masks to exclude
+	'''
+
+	exclusion_mask=np.zeros(len(masks),dtype=bool)
+	areas=np.zeros(len(masks),dtype='int64')
+	boxes=np.zeros((len(masks),4),dtype='int64')
+
+	for n,mask in enumerate(masks):
+		rows=np.flatnonzero(mask.any(axis=1))
+		if len(rows)>0:
+			cols=np.flatnonzero(mask.any(axis=0))
+			boxes[n]=(rows[0],rows[-1]+1,cols[0],cols[-1]+1)
+			areas[n]=np.count_nonzero(mask[rows[0]:rows[-1]+1,cols[0]:cols[-1]+1])
+
+	# the overlap of the boxes bounds the intersection of the masks
+	y_bt=np.maximum(boxes[:,None,0],boxes[None,:,0])
+	y_tp=np.minimum(boxes[:,None,1],boxes[None,:,1])
+	x_lf=np.maximum(boxes[:,None,2],boxes[None,:,2])
+	x_rt=np.minimum(boxes[:,None,3],boxes[None,:,3])
+	overlaps=np.clip(y_tp-y_bt,0,None)*np.clip(x_rt-x_lf,0,None)
+	candidates=(areas[:,None]>0)&(areas[:,None]<areas[None,:])&(overlaps/np.maximum(areas,1)[:,None]>threshold)
+
+	for i,j in zip(*np.nonzero(candidates)):
+		if not exclusion_mask[i]:
+			region=(slice(y_bt[i,j],y_tp[i,j]),slice(x_lf[i,j],x_rt[i,j]))
+			intersection=np.count_nonzero(np.logical_and(masks[i][region],masks[j][region]))
+			if intersection/areas[i]>threshold:
+				exclusion_mask[i]=True
+
+	return exclusion_mask
+
+
+def working_image(image,segment_scale=1.0,segment_gray=False):
+
+	'''
+	This function is used to convert a frame / background to the
+	resolution and color space that contour_frame segments in.
+
+	segment_scale: the fraction of the frame size to segment at
+	segment_gray: whether to segment in grayscale
+
+	return: the converted image, the same image if there is nothing to convert
+	'''
+
+	if segment_gray and image.ndim==3:
+		image=cv2.cvtColor(image,cv2.COLOR_BGR2GRAY)
+	if segment_scale<1:
+		size=(max(round(image.shape[1]*segment_scale),1),max(round(image.shape[0]*segment_scale),1))
+		image=cv2.resize(image,size,interpolation=cv2.INTER_AREA)
+
+	return image
+
+
+def segment_foreground(frame,background,animal_vs_bg=0,kernel=5,frame_shape=None):
+
+	'''
+	This function is used in 'background subtraction based detection method',
+	which subtracts the background from a frame, thresholds the difference
+	(Otsu) and finds the contours of the foreground.
+
+	frame: the frame (inverted if animals are darker than the background), or its working image (see working_image)
+	background: the background to subtract, the same size and color space as frame
+	frame_shape: if not None, the shape of the full frame when frame is a working image, the kernel is scaled to
+	the working image and the contours are mapped back to the full frame
+
+	return: the contours of the foreground
+	'''
+
+	scale=(1.0,1.0) if frame_shape is None else (frame_shape[1]/frame.shape[1],frame_shape[0]/frame.shape[0])
+	if scale!=(1.0,1.0):
+		# an odd kernel, so that the closing does not shift the foreground
+		kernel=int(kernel/scale[0])//2*2+1
+
+	if animal_vs_bg==2:
+		foreground=cv2.absdiff(frame,background)
+	else:
+		foreground=cv2.subtract(frame,background)
+
+	if foreground.ndim==3:
+		foreground=cv2.cvtColor(foreground,cv2.COLOR_BGR2GRAY)
+	thred=cv2.threshold(foreground,0,255,cv2.THRESH_BINARY+cv2.THRESH_OTSU)[1]
+	thred=cv2.morphologyEx(thred,cv2.MORPH_CLOSE,np.ones((kernel,kernel),np.uint8))
+	if animal_vs_bg==2:
+		kernel_erode=max(kernel-4,1)
+		thred=cv2.erode(thred,np.ones((kernel_erode,kernel_erode),np.uint8))
+	cnts,_=cv2.findContours(thred,cv2.RETR_LIST,cv2.CHAIN_APPROX_NONE)
+
+	if scale!=(1.0,1.0):
+		# each pixel of the working image is mapped to the center of the block of frame pixels it covers
+		cnts=[np.int32(np.round((i+0.5)*scale-0.5)) for i in cnts]
+
+	return cnts
+
+
+def contour_frame(frame,animal_number,background,background_low,background_high,delta,contour_area,animal_vs_bg=0,include_bodyparts=False,animation_analyzer=False,channel=1,kernel=5,black_background=True,frame_mean=None,background_mean=None,
+	segment_scale=1.0,segment_gray=False):
 
 	'''
 	This function is used in 'background subtraction based detection method',
@@ -604,36 +1187,35 @@ def contour_frame(frame,animal_number,background,background_low,background_high,
 			 3--RGB scale blob
 	kernel: determines how fine the erosion or dilation operation is
 	black_background: whether to set background black
+	frame_mean: if not None, the mean intensity of the frame (inverted if animal_vs_bg==1), like from a luminance track
+	background_mean: if not None, the mean intensity of 'background', which is the same for all the frames
+	segment_scale: if <1, segment at this fraction of the frame size (see working_image) and map the contours back to the frame
+	segment_gray: whether to subtract the background in grayscale instead of in each color channel
+	(the backgrounds can be passed already converted by working_image to convert them only once, frame_mean and background_mean are then those of the converted images)
 	'''
 
 	if animal_vs_bg==1:
 		frame_dt=np.uint8(255-frame)
 	else:
 		frame_dt=frame
+	frame_working=working_image(frame_dt,segment_scale=segment_scale,segment_gray=segment_gray)
 
-	if np.mean(frame_dt)<np.mean(background)/delta:
-		if animal_vs_bg==2:
-			foreground=cv2.absdiff(frame_dt,background_low)
-		else:
-			foreground=cv2.subtract(frame_dt,background_low)
-	elif np.mean(frame_dt)>delta*np.mean(background):
-		if animal_vs_bg==2:
-			foreground=cv2.absdiff(frame_dt,background_high)
-		else:
-			foreground=cv2.subtract(frame_dt,background_high)
+	if frame_mean is None:
+		frame_mean=np.mean(frame_working)
+	if background_mean is None:
+		background_mean=np.mean(background)
+
+	if frame_mean<background_mean/delta:
+		background_dt=background_low
+	elif frame_mean>delta*background_mean:
+		background_dt=background_high
 	else:
-		if animal_vs_bg==2:
-			foreground=cv2.absdiff(frame_dt,background)
-		else:
-			foreground=cv2.subtract(frame_dt,background)
+		background_dt=background
 
-	foreground=cv2.cvtColor(foreground,cv2.COLOR_BGR2GRAY)
-	thred=cv2.threshold(foreground,0,255,cv2.THRESH_BINARY+cv2.THRESH_OTSU)[1]
-	thred=cv2.morphologyEx(thred,cv2.MORPH_CLOSE,np.ones((kernel,kernel),np.uint8))
-	if animal_vs_bg==2:
-		kernel_erode=max(kernel-4,1)
-		thred=cv2.erode(thred,np.ones((kernel_erode,kernel_erode),np.uint8))
-	cnts,_=cv2.findContours(thred,cv2.RETR_LIST,cv2.CHAIN_APPROX_NONE)
+	if background_dt.shape!=frame_working.shape:
+		background_dt=working_image(background_dt,segment_scale=segment_scale,segment_gray=segment_gray)
+
+	cnts=segment_foreground(frame_working,background_dt,animal_vs_bg=animal_vs_bg,kernel=kernel,frame_shape=frame_dt.shape if frame_working is not frame_dt else None)
 
 	contours=[]
 	centers=[]
@@ -666,6 +1248,23 @@ def contour_frame(frame,animal_number,background,background_low,background_high,
 	return (contours,centers,heights,inners)
 
 
+def filter_inners(inners_image,std_count,std_length,std):
+
+	'''
+	This function is used to remove the inners whose pixels are
+	static in the pattern images.
+
+	std_count: the number of frames each pixel is inside an inner contour
+	std_length: the number of frames
+	std: a integer between 0 and 255, the pixels whose std (across the frames) is lower than std are removed
+	'''
+
+	# the pixels are 0 or 255 in each frame, so the std only depends on how many frames a pixel is inside an inner contour
+	counts=np.arange(std_length+1)
+	static=255*np.sqrt(counts*(std_length-counts))/std_length<std
+	inners_image[static[std_count]]=0
+
+
 def generate_patternimage(frame,outlines,inners=None,std=0):
 
 	'''
@@ -676,61 +1275,66 @@ def generate_patternimage(frame,outlines,inners=None,std=0):
 	std: a integer between 0 and 255, higher std, less inners are included in the pattern images
 	'''
 
-	if inners is not None:
-		background_inners=np.zeros_like(frame)
-		background_outers=np.zeros_like(frame)
-		backgrounds_std=[]
-
-	background_outlines=np.zeros_like(frame)
-
 	(y_bt,y_tp,x_lf,x_rt)=crop_frame(frame,outlines)
 
 	length=len(outlines)
 	p_size=int(max(abs(y_bt-y_tp),abs(x_lf-x_rt))/150+1)
 
+	# render in a canvas around the crop instead of the full frame
+	(c_bt,c_tp,c_lf,c_rt)=canvas_region(frame,y_bt,y_tp,x_lf,x_rt,[outlines,inners],margin=2*p_size+2)
+	shape=(c_tp-c_bt,c_rt-c_lf)+frame.shape[2:]
+	offset=(-c_lf,-c_bt)
+
+	if inners is not None:
+		background_inners=np.zeros(shape,dtype=frame.dtype)
+		background_outers=np.zeros(shape,dtype=frame.dtype)
+		std_count=np.zeros(shape[:2],dtype='uint16')
+		std_length=0
+
+	background_outlines=np.zeros(shape,dtype=frame.dtype)
+
 	for n,outline in enumerate(outlines):
 
 		if outline is not None:
 
 			if inners is not None:
-				background_std=np.zeros_like(frame)
-				cv2.drawContours(background_std,inners[n],-1,(255,255,255),-1)
-				backgrounds_std.append(background_std)
+				background_std=get_mask(shape[0],shape[1])
+				cv2.drawContours(background_std,inners[n],-1,1,-1,offset=offset)
+				std_count+=background_std
+				std_length+=1
 
 			if n<length/4:
 				d=n*int((255*4/length))
-				cv2.drawContours(background_outlines,[outline],0,(255,d,0),p_size)
+				cv2.drawContours(background_outlines,[outline],0,(255,d,0),p_size,offset=offset)
 				if inners is not None:
-					cv2.drawContours(background_inners,inners[n],-1,(255,d,0),p_size)
+					cv2.drawContours(background_inners,inners[n],-1,(255,d,0),p_size,offset=offset)
 			elif n<length/2:
 				d=int((n-length/4)*(255*4/length))
-				cv2.drawContours(background_outlines,[outline],0,(255,255,d),p_size)
+				cv2.drawContours(background_outlines,[outline],0,(255,255,d),p_size,offset=offset)
 				if inners is not None:
-					cv2.drawContours(background_inners,inners[n],-1,(255,255,d),p_size)
+					cv2.drawContours(background_inners,inners[n],-1,(255,255,d),p_size,offset=offset)
 			elif n<3*length/4:
 				d=int((n-length/2)*(255*4/length))
-				cv2.drawContours(background_outlines,[outline],0,(255,255-d,255),p_size)
+				cv2.drawContours(background_outlines,[outline],0,(255,255-d,255),p_size,offset=offset)
 				if inners is not None:
-					cv2.drawContours(background_inners,inners[n],-1,(255,255-d,255),p_size)
+					cv2.drawContours(background_inners,inners[n],-1,(255,255-d,255),p_size,offset=offset)
 			else:
 				d=int((n-3*length/4)*(255*4/length))
-				cv2.drawContours(background_outlines,[outline],0,(255-d,0,255),p_size)
+				cv2.drawContours(background_outlines,[outline],0,(255-d,0,255),p_size,offset=offset)
 				if inners is not None:
-					cv2.drawContours(background_inners,inners[n],-1,(255-d,0,255),p_size)
+					cv2.drawContours(background_inners,inners[n],-1,(255-d,0,255),p_size,offset=offset)
 
 			if inners is not None:
-				cv2.drawContours(background_outers,[outline],0,(255,255,255),int(2*p_size))
+				cv2.drawContours(background_outers,[outline],0,(255,255,255),int(2*p_size),offset=offset)
 
-	outlines_image=background_outlines[y_bt:y_tp,x_lf:x_rt]
+	crop=(slice(y_bt-c_bt,y_tp-c_bt),slice(x_lf-c_lf,x_rt-c_lf))
+	outlines_image=background_outlines[crop]
 
 	if inners is not None:
-		inners_image=background_inners[y_bt:y_tp,x_lf:x_rt]
-		outers_image=background_outers[y_bt:y_tp,x_lf:x_rt]
+		inners_image=background_inners[crop]
+		outers_image=background_outers[crop]
 		inners_image=cv2.subtract(inners_image,outers_image)
-		backgrounds_std=np.array(backgrounds_std,dtype='float32')
-		std_images=backgrounds_std[:,y_bt:y_tp,x_lf:x_rt]
-		std_image=std_images.std(0)
-		inners_image[std_image<std]=0
+		filter_inners(inners_image,std_count[crop],std_length,std)
 		pattern_image=cv2.add(inners_image,outlines_image)
 	else:
 		pattern_image=outlines_image
@@ -755,162 +1359,562 @@ def generate_patternimage_all(frame,y_bt,y_tp,x_lf,x_rt,outlines_list,inners_lis
 	else:
 		inners_length=len(inners_list[0])
 
+	length=len(outlines_list)
+	p_size=int(max(abs(y_bt-y_tp),abs(x_lf-x_rt))/150+1)
+
+	# render in a canvas around the crop instead of the full frame
+	(c_bt,c_tp,c_lf,c_rt)=canvas_region(frame,y_bt,y_tp,x_lf,x_rt,[outlines_list,inners_list],margin=2*p_size+2)
+	shape=(c_tp-c_bt,c_rt-c_lf)+frame.shape[2:]
+	offset=(-c_lf,-c_bt)
+
 	if inners_list is not None:
-		background_inners=np.zeros_like(frame)
-		background_outers=np.zeros_like(frame)
-		backgrounds_std=[]
+		background_inners=np.zeros(shape,dtype=frame.dtype)
+		background_outers=np.zeros(shape,dtype=frame.dtype)
+		std_count=np.zeros(shape[:2],dtype='uint16')
+		std_length=0
 
-	background_outlines=np.zeros_like(frame)
+	background_outlines=np.zeros(shape,dtype=frame.dtype)
 
-	length=len(outlines_list)
+	for n,outlines in enumerate(outlines_list):
+
+		if inners_list is not None:
+			if inners_length>0:
+				background_std=get_mask(shape[0],shape[1])
+				for inners in inners_list[n]:
+					cv2.drawContours(background_std,inners,-1,1,-1,offset=offset)
+				std_count+=background_std
+			std_length+=1
+
+		if n<length/4:
+			d=n*int((255*4/length))
+			cv2.drawContours(background_outlines,outlines,-1,(255,d,0),p_size,offset=offset)
+			if inners_length>0:
+				for inners in inners_list[n]:
+					cv2.drawContours(background_inners,inners,-1,(255,d,0),p_size,offset=offset)
+		elif n<length/2:
+			d=int((n-length/4)*(255*4/length))
+			cv2.drawContours(background_outlines,outlines,-1,(255,255,d),p_size,offset=offset)
+			if inners_length>0:
+				for inners in inners_list[n]:
+					cv2.drawContours(background_inners,inners,-1,(255,255,d),p_size,offset=offset)
+		elif n<3*length/4:
+			d=int((n-length/2)*(255*4/length))
+			cv2.drawContours(background_outlines,outlines,-1,(255,255-d,255),p_size,offset=offset)
+			if inners_length>0:
+				for inners in inners_list[n]:
+					cv2.drawContours(background_inners,inners,-1,(255,255-d,255),p_size,offset=offset)
+		else:
+			d=int((n-3*length/4)*(255*4/length))
+			cv2.drawContours(background_outlines,outlines,-1,(255-d,0,255),p_size,offset=offset)
+			if inners_length>0:
+				for inners in inners_list[n]:
+					cv2.drawContours(background_inners,inners,-1,(255-d,0,255),p_size,offset=offset)
+
+		if inners_list is not None:
+			cv2.drawContours(background_outers,outlines,-1,(255,255,255),int(2*p_size),offset=offset)
+
+	crop=(slice(y_bt-c_bt,y_tp-c_bt),slice(x_lf-c_lf,x_rt-c_lf))
+	outlines_image=background_outlines[crop]
+
+	if inners_list is not None:
+		inners_image=background_inners[crop]
+		outers_image=background_outers[crop]
+		inners_image=cv2.subtract(inners_image,outers_image)
+		filter_inners(inners_image,std_count[crop],std_length,std)
+
+	if inners_list is not None:
+		pattern_image=cv2.add(inners_image,outlines_image)
+	else:
+		pattern_image=outlines_image
+
+	return pattern_image
+
+
+def generate_patternimage_interact(frame,outlines,other_outlines,inners=None,other_inners=None,std=0):
+
+	'''
+	This function is used to generate pattern images
+	in 'interactive advanced' behavior mode.
+
+	other_outlines: the contours of animals / objects that are not the 'main character'
+	other_inners: the inner contours of animals / objects that are not the 'main character' when body parts are inlcuded
+	std: a integer between 0 and 255, higher std, less inners are included in the pattern images
+	'''
+
+	total_outlines=functools.reduce(operator.iconcat,[ol for ol in other_outlines if ol is not None],[])
+	total_outlines+=outlines
+	(y_bt,y_tp,x_lf,x_rt)=crop_frame(frame,total_outlines)
+
+	length=len(outlines)
 	p_size=int(max(abs(y_bt-y_tp),abs(x_lf-x_rt))/150+1)
 
-	for n,outlines in enumerate(outlines_list):
+	# render in a canvas around the crop instead of the full frame
+	(c_bt,c_tp,c_lf,c_rt)=canvas_region(frame,y_bt,y_tp,x_lf,x_rt,[total_outlines,inners,other_inners],margin=2*p_size+2)
+	shape=(c_tp-c_bt,c_rt-c_lf)+frame.shape[2:]
+	offset=(-c_lf,-c_bt)
+
+	if inners is not None:
+		background_inners=np.zeros(shape,dtype=frame.dtype)
+		background_outers=np.zeros(shape,dtype=frame.dtype)
+		std_count=np.zeros(shape[:2],dtype='uint16')
+		std_length=0
+
+	background_outlines=np.zeros(shape,dtype=frame.dtype)
+
+	for n,outline in enumerate(outlines):
+
+		other_outline=other_outlines[n]
+		if len(other_outline)>0:
+			if other_outline[0] is not None:
+				cv2.drawContours(background_outlines,other_outline,-1,(150,150,150),p_size,offset=offset)
+
+		if outline is not None:
+
+			if inners is not None:
+				background_std=get_mask(shape[0],shape[1])
+				inner=inners[n]
+				other_inner=functools.reduce(operator.iconcat,[ir for ir in other_inners[n] if ir is not None],[])
+				if other_inner is not None:
+					cv2.drawContours(background_inners,other_inner,-1,(150,150,150),p_size,offset=offset)
+				if inner is not None:
+					cv2.drawContours(background_std,inner,-1,1,-1,offset=offset)
+				if other_inner is not None:
+					cv2.drawContours(background_std,other_inner,-1,1,-1,offset=offset)
+				std_count+=background_std
+				std_length+=1
+			else:
+				inner=None
+
+			if n<length/4:
+				d=n*int((255*4/length))
+				cv2.drawContours(background_outlines,[outline],0,(255,d,0),p_size,offset=offset)
+				if inner is not None:
+					cv2.drawContours(background_inners,inner,-1,(255,d,0),p_size,offset=offset)
+			elif n<length/2:
+				d=int((n-length/4)*(255*4/length))
+				cv2.drawContours(background_outlines,[outline],0,(255,255,d),p_size,offset=offset)
+				if inner is not None:
+					cv2.drawContours(background_inners,inner,-1,(255,255,d),p_size,offset=offset)
+			elif n<3*length/4:
+				d=int((n-length/2)*(255*4/length))
+				cv2.drawContours(background_outlines,[outline],0,(255,255-d,255),p_size,offset=offset)
+				if inner is not None:
+					cv2.drawContours(background_inners,inner,-1,(255,255-d,255),p_size,offset=offset)
+			else:
+				d=int((n-3*length/4)*(255*4/length))
+				cv2.drawContours(background_outlines,[outline],0,(255-d,0,255),p_size,offset=offset)
+				if inner is not None:
+					cv2.drawContours(background_inners,inner,-1,(255-d,0,255),p_size,offset=offset)
+
+			if inners is not None:
+				cv2.drawContours(background_outers,[outline],0,(255,255,255),int(2*p_size),offset=offset)
+				if len(other_outline)>0:
+					if other_outline[0] is not None:
+						cv2.drawContours(background_outers,other_outline,-1,(150,150,150),int(2*p_size),offset=offset)
+
+	crop=(slice(y_bt-c_bt,y_tp-c_bt),slice(x_lf-c_lf,x_rt-c_lf))
+	outlines_image=background_outlines[crop]
+
+	if inners is not None:
+		inners_image=background_inners[crop]
+		outers_image=background_outers[crop]
+		inners_image=cv2.subtract(inners_image,outers_image)
+		filter_inners(inners_image,std_count[crop],std_length,std)
+		pattern_image=cv2.add(inners_image,outlines_image)
+	else:
+		pattern_image=outlines_image
+
+	return pattern_image
+
+
+def assign_tracks(existing_centers,centers,method='greedy',gate=None):
+
+	'''
+	This function is used to match the tracked animals to the
+	animals detected in a frame by the distances between their
+	centers.
+
+	existing_centers: the latest centers of the tracked animals,
+	(-10000,-10000) for the IDs that are not registered yet or are
+	deregistered, which can take any of the detected animals
+	centers: the centers of the detected animals
+	method: 'greedy': match the closest pair first, then the closest
+	of the rest, and so on; 'hungarian': minimize the total distance
+	of the matched pairs (optimal assignment), better for crowded
+	arenas where the greedy matching can swap the IDs of neighbors
+	gate: if not None, the maximum distance (in pixels) between a
+	tracked animal and the detected animal it is matched to, the
+	animals farther than that are left unmatched
+
+	return: a list of (index in existing_centers, index in centers)
+	'''
+
+	distances=distance.cdist(existing_centers,centers)
+	(existing_count,new_count)=distances.shape
+	if existing_count==0 or new_count==0:
+		return []
+
+	if gate is None:
+		gated=None
+	else:
+		untracked=np.all(np.asarray(existing_centers)==-10000,axis=1)
+		gated=(distances>gate)&~untracked[:,None]
+
+	if method=='hungarian':
+		if gated is None:
+			costs=distances
+		else:
+			# a gated pair costs more than all the other pairs together, so that the most pairs are matched within the gate
+			costs=np.where(gated,distances[~gated].sum()+1,distances)
+		indices_in_existing,indices_in_new=linear_sum_assignment(costs)
+		return [(i,j) for i,j in zip(indices_in_existing.tolist(),indices_in_new.tolist()) if gated is None or not gated[i,j]]
+
+	if method!='greedy':
+		raise ValueError('unknown tracking method '+repr(method))
+
+	dt_flattened=distances.flatten()
+	if gated is not None:
+		gated=gated.flatten().tolist()
+	unused_existing=[True]*existing_count
+	unused_new=[True]*new_count
+	pairs=[]
+	for idx in dt_flattened.argsort().tolist():
+		if gated is not None and gated[idx]:
+			continue
+		i,j=divmod(idx,new_count)
+		if unused_existing[i] and unused_new[j]:
+			unused_existing[i]=False
+			unused_new[j]=False
+			pairs.append((i,j))
+			if len(pairs)==min(existing_count,new_count):
+				break
+
+	return pairs
+
+
+def find_neighbors(centers,distance_threshold):
+
+	'''
+	This function is used to find the neighbors of each animal,
+	the other animals whose centers are closer than
+	distance_threshold (but not at the same position), with a
+	KD-tree instead of the distances between all the pairs.
+
+	return: a list of the sorted indices of the neighbors of each center
+	'''
+
+	centers=np.array(centers)
+	neighbors=[[] for _ in range(len(centers))]
+	if len(centers)<2:
+		return neighbors
+
+	threshold=distance_threshold**2
+	# the KD-tree distances are in float, so the candidate pairs are checked again with the exact squared distances
+	pairs=KDTree(centers).query_pairs(distance_threshold*(1+1e-6),output_type='ndarray')
+	if len(pairs)>0:
+		distances_squared=np.sum((centers[pairs[:,0]]-centers[pairs[:,1]])**2,axis=1)
+		for a,b in pairs[(distances_squared>0)&(distances_squared<threshold)].tolist():
+			neighbors[a].append(b)
+			neighbors[b].append(a)
+	for n in neighbors:
+		n.sort()
+
+	return neighbors
+
+
+def categorized_frame(contours,register_count,frame_count,length):
+
+	'''
+	This function is used to decide whether the behavior of an
+	animal in a frame is categorized: the animal was registered at
+	least 'length' frames before, is detected in the frame, and is
+	missing in at most half of the 'length' frames of the window
+	that ends with the frame. Both the streaming and the batch
+	categorization use it, so that they categorize the same windows.
+
+	contours: the per-frame contours of the animal, None for the frames that the animal is missing in
+	register_count: the frame count when the animal was registered, None if it never was
+	frame_count: the frame count of the frame
+	length: the duration (in frames) of the window
+
+	return: True if the behavior in the frame is categorized
+	'''
+
+	if register_count is None or frame_count<length+register_count or contours[frame_count] is None:
+		return False
+
+	check=0
+	for c in contours[frame_count-length+1:frame_count+1]:
+		if c is None:
+			check+=1
+
+	return check<=length/2
+
+
+def track_array(track,dimension=1):
+
+	'''
+	This function is used to convert the per-frame track of an
+	animal (a list of heights / centers, None for the frames that
+	the animal is missing in) into a float array with NaN for the
+	missing frames, for computing the behavior parameters with
+	sliding windows.
+
+	track: a list of numbers (dimension=1) or (x,y) coordinates (dimension=2), or None, or a Track of a TrackStore
+
+	return: an array of N (dimension=1) or N X 2 (dimension=2)
+	'''
+
+	if isinstance(track,Track):
+		return track.to_array()
+
+	if dimension==1:
+		array=np.full(len(track),np.nan)
+	else:
+		array=np.full((len(track),dimension),np.nan)
+	present=[n for n,value in enumerate(track) if value is not None]
+	if len(present)>0:
+		array[present]=[track[n] for n in present]
+
+	return array
+
+
+def sequential_sum(windows):
+
+	'''
+	This function is used to sum each window (the last axis)
+	from the first value to the last one, so that the sums are
+	exactly the same as adding up the values one by one in a
+	Python loop (np.sum adds them up in a different order).
+	'''
+
+	total=np.zeros(windows.shape[:-1])
+	for j in range(windows.shape[-1]):
+		total+=windows[...,j]
+
+	return total
+
+
+def window_length_parameters(heights,length,fps):
+
+	'''
+	This function is used to compute the 3 length parameters of
+	each frame over the 'length' frames ending at it: the fold
+	changes of the heights in the window relative to the height
+	of the frame (0 if either height is missing), their maximum
+	(magnitude), the maximum over the time to reach it (vigor),
+	and their sum over the window duration (intensity).
+
+	heights: the per-frame heights, NaN for missing frames (see 'track_array')
+	length: the number of frames in a window
+	fps: the frame rate
+
+	return: (magnitude,vigor,intensity), arrays indexed by frame, NaN for the frames without a complete window
+	'''
+
+	magnitude=np.full(len(heights),np.nan)
+	vigor=np.full(len(heights),np.nan)
+	intensity=np.full(len(heights),np.nan)
+
+	if len(heights)>=length:
+		windows=np.lib.stride_tricks.sliding_window_view(heights,length)
+		with np.errstate(invalid='ignore',divide='ignore'):
+			heights_diffs=np.abs(windows-windows[:,-1:])/windows
+		heights_diffs[np.isnan(heights_diffs)]=0.0
+		max_index=np.argmax(heights_diffs,axis=1)
+		magnitude[length-1:]=np.max(heights_diffs,axis=1)
+		vigor[length-1:]=magnitude[length-1:]/((length-max_index)/fps)
+		intensity[length-1:]=sequential_sum(heights_diffs)/(length/fps)
+
+	return (magnitude,vigor,intensity)
+
+
+def window_locomotion_parameters(centers,length,fps,calibrator=None):
+
+	'''
+	This function is used to compute the speed and the velocity
+	of each frame over the 'length' frames ending at it: the
+	distance traveled in the steps between the preceding 'length'
+	frames over the window duration (speed), and the maximum
+	displacement from a frame in the window to the frame over
+	the time to reach it (velocity, only when the animal is
+	present in the frame).
+
+	centers: the per-frame centers, NaN for missing frames (see 'track_array')
+	length: the number of frames in a window
+	fps: the frame rate
+	calibrator: if not None, the distances are divided by it
+
+	return: (speed,velocity,steps), speed and velocity are arrays indexed by frame (NaN for the frames they are not defined in),
+	steps[n] is the distance from frame n to frame n+1 (NaN if the animal is missing in either frame)
+	'''
+
+	speed=np.full(len(centers),np.nan)
+	velocity=np.full(len(centers),np.nan)
+
+	# the integer pixel distances, the same as math.dist
+	moves=np.diff(centers,axis=0)
+	steps=np.sqrt(moves[:,0]*moves[:,0]+moves[:,1]*moves[:,1])
+
+	if len(centers)>length:
+		if length>1:
+			windows=np.lib.stride_tricks.sliding_window_view(np.nan_to_num(steps,nan=0.0),length-1)[:len(centers)-length]
+			distance_traveled=sequential_sum(windows)
+		else:
+			distance_traveled=np.zeros(len(centers)-length)
+		if calibrator is not None:
+			distance_traveled=distance_traveled/calibrator
+		speed[length:]=distance_traveled/(length/fps)
+
+	if len(centers)>=length:
+		windows=np.lib.stride_tricks.sliding_window_view(centers,length,axis=0)
+		moves=windows-windows[:,:,-1:]
+		displacements=np.sqrt(moves[:,0]*moves[:,0]+moves[:,1]*moves[:,1])
+		displacements[np.isnan(displacements)]=0.0
+		max_index=np.argmax(displacements,axis=1)
+		displacement=np.max(displacements,axis=1)
+		if calibrator is not None:
+			displacement=displacement/calibrator
+		velocity[length-1:]=displacement/((length-max_index)/fps)
+		velocity[np.isnan(centers[:,0])]=np.nan
+
+	return (speed,velocity,steps)
+
+
+def window_acceleration(velocity,length,fps):
+
+	'''
+	This function is used to compute the acceleration of each
+	frame over the 'length' frames ending at it: the difference
+	between the maximum and the minimum velocity in the window
+	over the time between them. It is only defined when the
+	velocity is known in all the frames in the window and its
+	maximum and minimum are in different frames.
+
+	velocity: the per-frame velocities, NaN for unknown
+
+	return: an array indexed by frame, NaN for the frames it is not defined in
+	'''
+
+	acceleration=np.full(len(velocity),np.nan)
+
+	if len(velocity)>=length:
+		windows=np.lib.stride_tricks.sliding_window_view(velocity,length)
+		max_index=np.argmax(windows,axis=1)
+		min_index=np.argmin(windows,axis=1)
+		defined=~np.isnan(windows).any(axis=1)&(max_index!=min_index)
+		t=np.abs(max_index-min_index)[defined]/fps
+		acceleration[length-1:][defined]=(np.max(windows[defined],axis=1)-np.min(windows[defined],axis=1))/t
+
+	return acceleration
+
+
+def contour_mask(contour):
+
+	'''
+	This function is used to rasterize a filled contour into a
+	mask of its bounding box only, instead of a full frame.
+
+	return: (x,y,mask,area), (x,y) is the top-left corner of the
+	bounding box in the frame, area is the number of pixels in the mask
+	'''
 
-		if inners_list is not None:
-			background_std=np.zeros_like(frame)
-			if inners_length>0:
-				for inners in inners_list[n]:
-					cv2.drawContours(background_std,inners,-1,(255,255,255),-1)
-			backgrounds_std.append(background_std)
+	x,y,w,h=cv2.boundingRect(contour)
+	mask=np.zeros((h,w),dtype=np.uint8)
+	cv2.drawContours(mask,[contour],0,255,-1,offset=(-x,-y))
 
-		if n<length/4:
-			d=n*int((255*4/length))
-			cv2.drawContours(background_outlines,outlines,-1,(255,d,0),p_size)
-			if inners_length>0:
-				for inners in inners_list[n]:
-					cv2.drawContours(background_inners,inners,-1,(255,d,0),p_size)
-		elif n<length/2:
-			d=int((n-length/4)*(255*4/length))
-			cv2.drawContours(background_outlines,outlines,-1,(255,255,d),p_size)
-			if inners_length>0:
-				for inners in inners_list[n]:
-					cv2.drawContours(background_inners,inners,-1,(255,255,d),p_size)
-		elif n<3*length/4:
-			d=int((n-length/2)*(255*4/length))
-			cv2.drawContours(background_outlines,outlines,-1,(255,255-d,255),p_size)
-			if inners_length>0:
-				for inners in inners_list[n]:
-					cv2.drawContours(background_inners,inners,-1,(255,255-d,255),p_size)
-		else:
-			d=int((n-3*length/4)*(255*4/length))
-			cv2.drawContours(background_outlines,outlines,-1,(255-d,0,255),p_size)
-			if inners_length>0:
-				for inners in inners_list[n]:
-					cv2.drawContours(background_inners,inners,-1,(255-d,0,255),p_size)
+	return (x,y,mask,cv2.countNonZero(mask))
 
-		if inners_list is not None:
-			cv2.drawContours(background_outers,outlines,-1,(255,255,255),int(2*p_size))
 
-	outlines_image=background_outlines[y_bt:y_tp,x_lf:x_rt]
+def area_difference(mask_a,mask_b):
 
-	if inners_list is not None:
-		inners_image=background_inners[y_bt:y_tp,x_lf:x_rt]
-		outers_image=background_outers[y_bt:y_tp,x_lf:x_rt]
-		inners_image=cv2.subtract(inners_image,outers_image)
-		backgrounds_std=np.array(backgrounds_std,dtype='float32')
-		std_images=backgrounds_std[:,y_bt:y_tp,x_lf:x_rt]
-		std_image=std_images.std(0)
-		inners_image[std_image<std]=0
+	'''
+	This function is used to count the pixels that are in either
+	of two contour masks (see 'contour_mask') but not in both,
+	comparing the masks only where their bounding boxes overlap.
+	'''
 
-	if inners_list is not None:
-		pattern_image=cv2.add(inners_image,outlines_image)
+	(x_a,y_a,a,area_a)=mask_a
+	(x_b,y_b,b,area_b)=mask_b
+	x_lf=max(x_a,x_b)
+	x_rt=min(x_a+a.shape[1],x_b+b.shape[1])
+	y_bt=max(y_a,y_b)
+	y_tp=min(y_a+a.shape[0],y_b+b.shape[0])
+
+	if x_lf<x_rt and y_bt<y_tp:
+		overlap=cv2.bitwise_and(a[y_bt-y_a:y_tp-y_a,x_lf-x_a:x_rt-x_a],b[y_bt-y_b:y_tp-y_b,x_lf-x_b:x_rt-x_b])
+		intersection=cv2.countNonZero(overlap)
 	else:
-		pattern_image=outlines_image
+		intersection=0
 
-	return pattern_image
+	return area_a+area_b-2*intersection
 
 
-def generate_patternimage_interact(frame,outlines,other_outlines,inners=None,other_inners=None,std=0):
+def window_areal_parameters(contours,frames,length,fps):
 
 	'''
-	This function is used to generate pattern images
-	in 'interactive advanced' behavior mode.
-
-	other_outlines: the contours of animals / objects that are not the 'main character'
-	other_inners: the inner contours of animals / objects that are not the 'main character' when body parts are inlcuded
-	std: a integer between 0 and 255, higher std, less inners are included in the pattern images
+	This function is used to compute the 3 areal parameters of
+	some frames over the 'length' frames ending at each: the area
+	differences between the contour in the frame and each contour
+	in the window relative to the area of the latter, their
+	maximum (magnitude), the maximum over the time to reach it
+	(vigor), and their sum over the window duration (intensity).
+	Each contour is rasterized once into a mask of its bounding
+	box, which is kept while it is in the window.
+
+	contours: the per-frame contours, None for missing frames
+	frames: the indices of the frames to compute, in ascending order
+	length: the number of frames in a window
+	fps: the frame rate
+
+	return: (magnitude,vigor,intensity), arrays indexed by frame, NaN for the frames not computed or without a contour
 	'''
 
-	total_outlines=functools.reduce(operator.iconcat,[ol for ol in other_outlines if ol is not None],[])
-	total_outlines+=outlines
-	(y_bt,y_tp,x_lf,x_rt)=crop_frame(frame,total_outlines)
-
-	if inners is not None:
-		background_inners=np.zeros_like(frame)
-		background_outers=np.zeros_like(frame)
-		backgrounds_std=[]
+	magnitude=np.full(len(contours),np.nan)
+	vigor=np.full(len(contours),np.nan)
+	intensity=np.full(len(contours),np.nan)
+	masks={}
 
-	background_outlines=np.zeros_like(frame)
+	for n in frames:
 
-	length=len(outlines)
-	p_size=int(max(abs(y_bt-y_tp),abs(x_lf-x_rt))/150+1)
+		if contours[n] is None:
+			continue
 
-	for n,outline in enumerate(outlines):
+		window=range(n-length+1,n+1)
+		for k in [k for k in masks if k<window.start]:
+			del masks[k]
+		if n not in masks:
+			masks[n]=contour_mask(contours[n])
 
-		other_outline=other_outlines[n]
-		if len(other_outline)>0:
-			if other_outline[0] is not None:
-				cv2.drawContours(background_outlines,other_outline,-1,(150,150,150),p_size)
+		area_diffs=[]
+		for k in window:
+			if contours[k] is not None:
+				if k not in masks:
+					masks[k]=contour_mask(contours[k])
+				area_diffs.append(np.float64(area_difference(masks[n],masks[k]))/np.float64(masks[k][3]))
 
-		if outline is not None:
+		magnitude[n]=max(area_diffs)
+		vigor[n]=magnitude[n]/((length-np.argmax(area_diffs))/fps)
+		intensity[n]=sum(area_diffs)/(length/fps)
 
-			if inners is not None:
-				background_std=np.zeros_like(frame)
-				inner=inners[n]
-				other_inner=functools.reduce(operator.iconcat,[ir for ir in other_inners[n] if ir is not None],[])
-				if other_inner is not None:
-					cv2.drawContours(background_inners,other_inner,-1,(150,150,150),p_size)
-				if inner is not None:
-					cv2.drawContours(background_std,inner,-1,(255,255,255),-1)
-				if other_inner is not None:
-					cv2.drawContours(background_std,other_inner,-1,(255,255,255),-1)
-				backgrounds_std.append(background_std)
-			else:
-				inner=None
+	return (magnitude,vigor,intensity)
 
-			if n<length/4:
-				d=n*int((255*4/length))
-				cv2.drawContours(background_outlines,[outline],0,(255,d,0),p_size)
-				if inner is not None:
-					cv2.drawContours(background_inners,inner,-1,(255,d,0),p_size)
-			elif n<length/2:
-				d=int((n-length/4)*(255*4/length))
-				cv2.drawContours(background_outlines,[outline],0,(255,255,d),p_size)
-				if inner is not None:
-					cv2.drawContours(background_inners,inner,-1,(255,255,d),p_size)
-			elif n<3*length/4:
-				d=int((n-length/2)*(255*4/length))
-				cv2.drawContours(background_outlines,[outline],0,(255,255-d,255),p_size)
-				if inner is not None:
-					cv2.drawContours(background_inners,inner,-1,(255,255-d,255),p_size)
-			else:
-				d=int((n-3*length/4)*(255*4/length))
-				cv2.drawContours(background_outlines,[outline],0,(255-d,0,255),p_size)
-				if inner is not None:
-					cv2.drawContours(background_inners,inner,-1,(255-d,0,255),p_size)
 
-			if inners is not None:
-				cv2.drawContours(background_outers,[outline],0,(255,255,255),int(2*p_size))
-				if len(other_outline)>0:
-					if other_outline[0] is not None:
-						cv2.drawContours(background_outers,other_outline,-1,(150,150,150),int(2*p_size))
+def fill_parameter(values,frames,parameter,positive=False):
 
-	outlines_image=background_outlines[y_bt:y_tp,x_lf:x_rt]
+	'''
+	This function is used to write the values of a behavior
+	parameter in some frames into its per-frame list.
 
-	if inners is not None:
-		inners_image=background_inners[y_bt:y_tp,x_lf:x_rt]
-		outers_image=background_outers[y_bt:y_tp,x_lf:x_rt]
-		inners_image=cv2.subtract(inners_image,outers_image)
-		backgrounds_std=np.array(backgrounds_std,dtype='float32')
-		std_images=backgrounds_std[:,y_bt:y_tp,x_lf:x_rt]
-		std_image=std_images.std(0)
-		inners_image[std_image<std]=0
-		pattern_image=cv2.add(inners_image,outlines_image)
-	else:
-		pattern_image=outlines_image
+	values: the per-frame list of the parameter
+	frames: the indices of the frames to write
+	parameter: the parameter of each frame, an array indexed by frame
+	positive: if True, only write the values above 0 (NaN is never written)
+	'''
 
-	return pattern_image
+	for n,value in zip(frames,parameter[frames].tolist()):
+		if value>0 or (positive is False and not math.isnan(value)):
+			values[n]=value
 
 
 def plot_events(result_path,event_probability,time_points,names_and_colors,behavior_to_include,width=0,height=0):
@@ -1009,35 +2013,17 @@ def extract_frames(path_to_video,out_path,framewidth=None,start_t=0,duration=0,s
 		duration=full_duration
 	end_t=start_t+duration
 
-	frame_count=1
-	frame_count_generate=0
-
-	while True:
-
-		retval,frame=capture.read()
-		t=(frame_count)/fps
-
-		if frame is None:
-			break
-
-		if t>=end_t:
-			break
-
-		if t>=start_t:
-
-			if frame_count_generate%skip_redundant==0:
-
-				if framewidth is not None:
-					frameheight=int(frame.shape[0]*framewidth/frame.shape[1])
-					frame=cv2.resize(frame,(framewidth,frameheight),interpolation=cv2.INTER_AREA)
-
-				cv2.imwrite(os.path.join(out_path,video_name+'_'+str(frame_count_generate)+'.jpg'),frame)
+	capture.release()
+	first_frame=None
 
-			frame_count_generate+=1
+	# only every 'skip_redundant' frame is retrieved and resized
+	for frame_count,frame in FrameSource(path_to_video,framewidth=framewidth,start_t=start_t,end_t=end_t,skip=skip_redundant,decimals=None):
 
-		frame_count+=1
+		if first_frame is None:
+			first_frame=frame_count
+		frame_count_generate=frame_count-first_frame
 
-	capture.release()
+		cv2.imwrite(os.path.join(out_path,video_name+'_'+str(frame_count_generate)+'.jpg'),frame)
 
 	print('The image examples stored in: '+out_path)
 
@@ -1074,6 +2060,7 @@ def preprocess_video(
 	num_frames=int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
 	width=int(capture.get(cv2.CAP_PROP_FRAME_WIDTH))
 	height=int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT))
+	capture.release()
 
 	if framewidth is not None:
 		w_resize=int(framewidth)
@@ -1099,7 +2086,7 @@ def preprocess_video(
 		for start,end in time_windows:
 			added_name+='_'+str(start)+'-'+str(end)
 
-	dropped_frames=[]
+	dropped_frames=set()
 	if fps_new is not None:
 		if fps_new>=fps:
 			logger.warning('The target fps is equal or greater than the original fps, which is: %r.\nWill keep the original fps.', fps)
@@ -1108,27 +2095,23 @@ def preprocess_video(
 			drop_interval=fps/(fps-fps_new)
 			if num_frames>1:
 				num_dropped_frames=int(num_frames*(1-fps_new/fps))
-				dropped_frames=[round(drop_interval*i) for i in range(num_dropped_frames)]
+				dropped_frames={round(drop_interval*i) for i in range(num_dropped_frames)}
 	else:
 		fps_new=fps
 
 	writer=cv2.VideoWriter(os.path.join(out_folder,name+added_name+'_processed.avi'),cv2.VideoWriter_fourcc(*'MJPG'),int(fps_new),(w,h),True)
-	frame_count=0
 
-	while True:
-
-		ret,frame=capture.read()
-
-		if frame is None:
-			break
+	if framewidth is not None:
+		frames=FrameSource(path_to_video,framewidth=w_resize,frameheight=h_resize)
+	else:
+		frames=FrameSource(path_to_video)
 
-		frame_count+=1
+	for frame_count,frame in frames:
 
-		if frame_count-1 in dropped_frames:
+		if frame_count in dropped_frames:
 			continue
 
-		if framewidth is not None:
-			frame=cv2.resize(frame,(w_resize,h_resize),interpolation=cv2.INTER_AREA)
+		frame_count+=1
 
 		if crop_frame:
 			if framewidth is not None:
@@ -1158,57 +2141,368 @@ def preprocess_video(
 			writer.write(frame)
 
 	writer.release()
-	capture.release()
 
 	logger.info('The processed video(s) stored in: %r', out_folder)
 
 
-def parse_all_events_file(path_to_events):
+def events_to_arrays(event_probability,time_points):
 
 	'''
-	This function is used to parse an all_events.xlsx file and convert it into
-	a dict 'event_probability', a list 'time_points', and a list 'behavior_names'.
+	This function is used to convert the behavior events of all the
+	animals / objects ('event_probability', in the same format as
+	that returned by parse_all_events_file) into the arrays of a
+	typed schema:
+
+		time: float64 (frames), the time points
+		IDs: int64 (IDs), the IDs of the animals / objects
+		behavior_names: str (behaviors), the string table of the behavior names
+		behavior: int16 (IDs, frames), the index in behavior_names, -1 for 'NA'
+		probability: float32 (IDs, frames), -1 for 'NA'
+	'''
 
-	path_to_events: The path to the 'all_events.xlsx' file
+	IDs=list(event_probability)
+	behavior_names=sorted({event[0] for idx in IDs for event in event_probability[idx] if event[0]!='NA'})
+	behavior_index={behavior_name:i for i,behavior_name in enumerate(behavior_names)}
 
-	event_probability is a dictionary with the keys as the ID of each animal / object
-	and the values are lists of lists, where each sub-list has a length of 2 and is
-	in one of the following formats:
+	behavior=np.full((len(IDs),len(time_points)),-1,dtype=np.int16)
+	probability=np.full((len(IDs),len(time_points)),-1,dtype=np.float32)
+	for a,idx in enumerate(IDs):
+		for n,event in enumerate(event_probability[idx]):
+			if event[0]!='NA':
+				behavior[a,n]=behavior_index[event[0]]
+				probability[a,n]=event[1]
 
-		- ['NA', -1]
-		- [behavior, probability], where behavior is the name of the behavior
-		and probability is a float between 0 and 1.
+	return {'time':np.asarray(time_points,dtype=np.float64),'IDs':np.asarray(IDs,dtype=np.int64),
+		'behavior_names':np.asarray(behavior_names,dtype=np.str_),'behavior':behavior,'probability':probability}
+
+
+def events_from_arrays(arrays):
 
-	time_points is a list of floats containing the time points of the analysis duration.
 	'''
+	This function is used to convert the arrays made by events_to_arrays
+	back into the behavior events.
 
-	df=pd.read_excel(path_to_events)
+	return: (event_probability,time_points,behavior_names), see parse_all_events_file
+	'''
+
+	time_points=arrays['time'].tolist()
+	IDs=arrays['IDs'].tolist()
+	behavior_names=arrays['behavior_names'].tolist()
+	behavior=arrays['behavior']
+	# the shortest decimals that round-trip the float32 probabilities, so that 0.9 is read as 0.9
+	probability=arrays['probability'].astype(str).astype(np.float64).tolist()
 
 	event_probability={}
+	for a,idx in enumerate(IDs):
+		event_probability[idx]=[['NA',-1] if b<0 else [behavior_names[b],p] for b,p in zip(behavior[a].tolist(),probability[a])]
+
+	return (event_probability,time_points,sorted(behavior_names))
+
+
+def write_events_npz(path_to_file,event_probability,time_points):
+
+	'''
+	This function is used to store the behavior events of all the
+	animals / objects in a compressed .npz file, with the typed schema
+	of events_to_arrays.
+	'''
+
+	np.savez_compressed(path_to_file,**events_to_arrays(event_probability,time_points))
+
+
+def read_events_npz(path_to_file):
+
+	'''
+	This function is used to read the behavior events stored by
+	write_events_npz.
+
+	return: (event_probability,time_points,behavior_names), see parse_all_events_file
+	'''
+
+	with np.load(path_to_file) as data:
+		return events_from_arrays(data)
+
+
+def centers_to_arrays(animal_centers,time_points):
+
+	'''
+	This function is used to convert the centers of all the animals /
+	objects ({ID: [(x,y) or None for each frame]}) into the arrays of
+	a typed schema:
+
+		time: float64 (frames), the time points
+		IDs: int64 (IDs), the IDs of the animals / objects
+		centers: int32 (IDs, frames, 2), the (x,y) of the centers, 0 where not detected
+		detected: bool (IDs, frames), whether the animal / object is detected
+	'''
+
+	IDs=list(animal_centers)
+	centers=np.zeros((len(IDs),len(time_points),2),dtype=np.int32)
+	detected=np.zeros((len(IDs),len(time_points)),dtype=bool)
+	for a,idx in enumerate(IDs):
+		for n,center in enumerate(animal_centers[idx]):
+			if center is not None:
+				centers[a,n]=center
+				detected[a,n]=True
+
+	return {'time':np.asarray(time_points,dtype=np.float64),'IDs':np.asarray(IDs,dtype=np.int64),'centers':centers,'detected':detected}
+
+
+def centers_from_arrays(arrays):
+
+	'''
+	This function is used to convert the arrays made by centers_to_arrays
+	back into the centers.
+
+	return: (animal_centers,time_points), animal_centers is {ID: [(x,y) or None for each frame]}
+	'''
+
+	time_points=arrays['time'].tolist()
+	IDs=arrays['IDs'].tolist()
+	centers=arrays['centers'].tolist()
+	detected=arrays['detected']
+
+	animal_centers={}
+	for a,idx in enumerate(IDs):
+		animal_centers[idx]=[tuple(center) if found else None for center,found in zip(centers[a],detected[a].tolist())]
+
+	return (animal_centers,time_points)
+
+
+def write_centers_npz(path_to_file,animal_centers,time_points):
+
+	'''
+	This function is used to store the centers of all the animals /
+	objects in a compressed .npz file, with the typed schema of
+	centers_to_arrays.
+	'''
+
+	np.savez_compressed(path_to_file,**centers_to_arrays(animal_centers,time_points))
+
+
+def read_centers_npz(path_to_file):
+
+	'''
+	This function is used to read the centers stored by write_centers_npz.
+
+	return: (animal_centers,time_points), see centers_from_arrays
+	'''
+
+	with np.load(path_to_file) as data:
+		return centers_from_arrays(data)
+
+
+def write_parameters_npz(path_to_file,parameters,time_points):
+
+	'''
+	This function is used to store the frame-wise behavior parameters
+	({parameter_name: {ID: [value for each frame]}}) in a compressed
+	.npz file with a typed schema:
+
+		time: float64 (frames), the time points
+		IDs: int64 (IDs), the IDs of the animals / objects
+		each parameter_name: float64 (IDs, frames), NaN where not calculated
+	'''
+
+	arrays={}
+	IDs=[]
+	for parameter_name in parameters:
+		IDs=list(parameters[parameter_name])
+		arrays[parameter_name]=np.array([parameters[parameter_name][idx] for idx in IDs],dtype=np.float64).reshape(len(IDs),len(time_points))
+
+	np.savez_compressed(path_to_file,time=np.asarray(time_points,dtype=np.float64),IDs=np.asarray(IDs,dtype=np.int64),**arrays)
+
+
+def decode_event_cells(cells):
+
+	'''
+	This function is used to decode the cells of an ID column in an
+	all_events.xlsx file, like "['groom', 0.93]" or "['NA', -1]", in bulk
+	and without eval. The cells that do not look like that are decoded
+	one by one with ast.literal_eval, and those that are not events are
+	decoded as 'NA'.
+
+	return: (behaviors,probability), behaviors is a list of the behavior
+	names ('NA' for none), probability is a float64 array
+	'''
+
+	cells=pd.Series(cells,dtype=object).astype(str)
+	parts=cells.str.extract(r"^\[\s*(['\"])([^\\]*?)\1\s*,\s*(?:np\.\w+\()?([^()\s\]]+)\)?\s*\]$")
+	behaviors=parts[1].tolist()
+	probability=pd.to_numeric(parts[2],errors='coerce').to_numpy(dtype=np.float64)
+
+	for n in np.flatnonzero(parts[1].isna().to_numpy()):
+		try:
+			behavior,p=ast.literal_eval(cells.iat[n])
+			behaviors[n]=str(behavior)
+			probability[n]=float(p)
+		except (ValueError,TypeError,SyntaxError,MemoryError,RecursionError):
+			behaviors[n]='NA'
+			probability[n]=-1
+
+	return (behaviors,probability)
+
+
+def decode_center_cells(cells):
+
+	'''
+	This function is used to decode the cells of an ID column in an
+	all_centers.xlsx file, like "(120, 45)" or empty, in bulk and without eval.
+
+	return: (centers,detected), centers is an int32 array (frames, 2),
+	0 where not detected, detected is a bool array (frames)
+	'''
+
+	cells=pd.Series(cells,dtype=object).astype(str)
+	parts=cells.str.extract(r"^\(\s*(?:np\.\w+\()?(-?\d+)\)?\s*,\s*(?:np\.\w+\()?(-?\d+)\)?\s*\)$")
+	detected=parts[0].notna().to_numpy()
+
+	centers=np.zeros((len(cells),2),dtype=np.int32)
+	centers[detected]=parts[detected].to_numpy(dtype=np.int64)
+
+	return (centers,detected)
+
+
+def read_events_xlsx(path_to_events):
+
+	'''
+	This function is used to read an all_events.xlsx (or an
+	all_event_probability.xlsx) file into the arrays of the typed
+	schema of events_to_arrays.
+	'''
+
+	df=pd.read_excel(path_to_events)
+
 	time_points=[]
-	behavior_names=[]
+	decoded={}
 
 	for col_name,col in df.items():
-
 		if col_name=='time/ID':
-
 			time_points=[float(i) for i in col]
+		else:
+			decoded[int(col_name)]=decode_event_cells(col)
+
+	behavior_names=sorted({behavior for behaviors,_ in decoded.values() for behavior in behaviors if behavior!='NA'})
+
+	behavior=np.full((len(decoded),len(time_points)),-1,dtype=np.int16)
+	probability=np.full((len(decoded),len(time_points)),-1,dtype=np.float32)
+	for a,(behaviors,p) in enumerate(decoded.values()):
+		# 'NA' is not in behavior_names, so its code is -1
+		codes=pd.Categorical(behaviors,categories=behavior_names).codes
+		behavior[a]=codes
+		probability[a]=np.where(codes>=0,p,-1)
+
+	return {'time':np.asarray(time_points,dtype=np.float64),'IDs':np.asarray(list(decoded),dtype=np.int64),
+		'behavior_names':np.asarray(behavior_names,dtype=np.str_),'behavior':behavior,'probability':probability}
+
+
+def read_centers_xlsx(path_to_centers):
+
+	'''
+	This function is used to read an all_centers.xlsx file into the
+	arrays of the typed schema of centers_to_arrays.
+	'''
+
+	df=pd.read_excel(path_to_centers)
+
+	time_points=[]
+	IDs=[]
+	centers=[]
+	detected=[]
 
+	for col_name,col in df.items():
+		if col_name=='time/ID':
+			time_points=[float(i) for i in col]
 		else:
+			IDs.append(int(col_name))
+			centers_ID,detected_ID=decode_center_cells(col)
+			centers.append(centers_ID)
+			detected.append(detected_ID)
 
-			idx=int(col_name)
-			event_probability[idx]=[['NA',-1]]*len(time_points)
-			for n,i in enumerate(col):
-				event=eval(i)
-				behavior=event[0]
-				if behavior!='NA':
-					if behavior not in behavior_names:
-						behavior_names.append(behavior)
-					event_probability[idx][n]=event
+	return {'time':np.asarray(time_points,dtype=np.float64),'IDs':np.asarray(IDs,dtype=np.int64),
+		'centers':np.array(centers,dtype=np.int32).reshape(len(IDs),len(time_points),2),
+		'detected':np.array(detected,dtype=bool).reshape(len(IDs),len(time_points))}
+
+
+def cached_arrays(path_to_file,read):
+
+	'''
+	This function is used to read a spreadsheet into arrays with 'read',
+	and cache the arrays in '<path_to_file>.npz' next to the spreadsheet,
+	so that the spreadsheet is parsed again only after it changes.
+
+	read: a function that reads path_to_file into a dict of arrays
+	'''
+
+	path_to_cache=path_to_file+'.npz'
+	stat=os.stat(path_to_file)
+	source=np.array([stat.st_mtime_ns,stat.st_size],dtype=np.int64)
+
+	try:
+		with np.load(path_to_cache) as data:
+			if np.array_equal(data['source'],source):
+				return {key:data[key] for key in data.files if key!='source'}
+	except (OSError,KeyError,ValueError,zipfile.BadZipFile):
+		# no cache yet, or an unusable one that will be replaced
+		pass
+
+	arrays=read(path_to_file)
 
-	behavior_names.sort()
+	try:
+		path_to_temp=path_to_cache+'.'+str(os.getpid())+'.tmp'
+		with open(path_to_temp,'wb') as f:
+			np.savez_compressed(f,source=source,**arrays)
+		os.replace(path_to_temp,path_to_cache)
+	except OSError as e:
+		logger.debug('not caching %s: %s',path_to_file,e)
 
-	return (event_probability,time_points,behavior_names)
+	return arrays
+
+
+def parse_all_centers_file(path_to_centers):
+
+	'''
+	This function is used to parse an all_centers.xlsx file (or the
+	all_centers.npz file stored by write_centers_npz) and convert it
+	into a dict 'animal_centers' and a list 'time_points'. The parsed
+	all_centers.xlsx is cached in 'all_centers.xlsx.npz'.
+
+	animal_centers is a dictionary with the keys as the ID of each animal / object
+	and the values are lists of the centers (x,y), None where the animal / object
+	is not detected.
+	'''
+
+	if os.path.splitext(path_to_centers)[1].lower()=='.npz':
+		return read_centers_npz(path_to_centers)
+
+	return centers_from_arrays(cached_arrays(path_to_centers,read_centers_xlsx))
+
+
+def parse_all_events_file(path_to_events):
+
+	'''
+	This function is used to parse an all_events.xlsx file (or the all_events.npz
+	file stored by write_events_npz) and convert it into a dict 'event_probability',
+	a list 'time_points', and a list 'behavior_names'. The parsed all_events.xlsx
+	is cached in 'all_events.xlsx.npz', and the probabilities are kept as float32.
+
+	path_to_events: The path to the 'all_events.xlsx' / 'all_events.npz' file
+
+	event_probability is a dictionary with the keys as the ID of each animal / object
+	and the values are lists of lists, where each sub-list has a length of 2 and is
+	in one of the following formats:
+
+		- ['NA', -1]
+		- [behavior, probability], where behavior is the name of the behavior
+		and probability is a float between 0 and 1.
+
+	time_points is a list of floats containing the time points of the analysis duration.
+	'''
+
+	if os.path.splitext(path_to_events)[1].lower()=='.npz':
+		return read_events_npz(path_to_events)
+
+	return events_from_arrays(cached_arrays(path_to_events,read_events_xlsx))
 
 
 def calculate_distances(path_to_folder,filename,behavior_to_include,out_path):
@@ -1225,7 +2519,8 @@ def calculate_distances(path_to_folder,filename,behavior_to_include,out_path):
 	the animal.
 
 	path_to_folder: The path to the folder that stores the 'all_event_probability.xlsx',
-	'all_centers.xlsx', and 'Annotated video.avi'.
+	'all_centers.xlsx', and 'Annotated video.avi'. The .npz versions of the
+	spreadsheets are read instead if they exist.
 	filename: the name of the path_to_folder
 	behavior_to_include: the behaviors used in calculation
 	'''
@@ -1234,11 +2529,16 @@ def calculate_distances(path_to_folder,filename,behavior_to_include,out_path):
 	all_centers=[]
 	all_event_probability=[]
 
-	for i in os.listdir(path_to_folder):
-		if i.endswith('_centers.xlsx') or i.endswith('_centers.xls') or i.endswith('_centers.XLSX') or i.endswith('_centers.XLS'):
-			all_centers.append(i)
-		if i.endswith('_event_probability.xlsx') or i.endswith('_event_probability.xls') or i.endswith('_event_probability.XLSX') or i.endswith('_event_probability.XLS'):
-			all_event_probability.append(i)
+	files=sorted(os.listdir(path_to_folder))
+	for i in files:
+		name,extension=os.path.splitext(i)
+		if extension.lower() in ['.xlsx','.xls'] and name+'.npz' in files:
+			continue
+		if extension.lower() in ['.xlsx','.xls','.npz']:
+			if name.endswith('_centers'):
+				all_centers.append(i)
+			if name.endswith('_event_probability'):
+				all_event_probability.append(i)
 
 	if len(all_centers)>1:
 		for i in all_centers:
@@ -1251,65 +2551,46 @@ def calculate_distances(path_to_folder,filename,behavior_to_include,out_path):
 
 	for a,animal in enumerate(animals):
 
-		all_centers_df=pd.read_excel(os.path.join(path_to_folder,all_centers[a]))
-		all_events_probability_df=pd.read_excel(os.path.join(path_to_folder,all_event_probability[a]))
+		centers,time_points=parse_all_centers_file(os.path.join(path_to_folder,all_centers[a]))
+		event_probability,_,_=parse_all_events_file(os.path.join(path_to_folder,all_event_probability[a]))
 
-		centers={}
 		behavior_names={}
 		included_behaviors={}
 		start_centers={}
 		start_indices={}
-		frame_count=0
 		frame_index=None
 
-		for col_name,col in all_centers_df.items():
+		for idx in centers:
+			behavior_names[idx]=[]
+			included_behaviors[idx]=[]
+			start_centers[idx]={}
+			start_indices[idx]={}
 
-			if col_name=='time/ID':
-				time_points=[float(i) for i in col]
+		for idx in event_probability:
+			for n,event in enumerate(event_probability[idx]):
+				behavior=event[0]
+				if behavior!='NA':
+					if frame_index is None:
+						if behavior in behavior_to_include:
+							frame_index=n
+					if behavior not in behavior_names[idx]:
+						behavior_names[idx].append(behavior)
+						start_centers[idx][behavior]=centers[idx][n]
+						start_indices[idx][behavior]=n
+
+			if len(behavior_names[idx])<len(behavior_to_include):
+				included_behaviors[idx]=behavior_names[idx]
 			else:
-				idx=int(col_name)
-				centers[idx]=[]
-				behavior_names[idx]=[]
-				included_behaviors[idx]=[]
-				start_centers[idx]={}
-				start_indices[idx]={}
-				for i in col:
-					try:
-						value=eval(i)
-					except:
-						value=None
-					centers[idx].append(value)
-
-		for col_name,col in all_events_probability_df.items():
-
-			if col_name!='time/ID':
-				idx=int(col_name)
-				for n,i in enumerate(col):
-					event=eval(i)
-					behavior=event[0]
-					if behavior!='NA':
-						if frame_index is None:
-							if behavior in behavior_to_include:
-								frame_index=n
-						if behavior not in behavior_names[idx]:
-							behavior_names[idx].append(behavior)
-							start_centers[idx][behavior]=centers[idx][n]
-							start_indices[idx][behavior]=n
-
-				if len(behavior_names[idx])<len(behavior_to_include):
-					included_behaviors[idx]=behavior_names[idx]
-				else:
-					included_behaviors[idx]=behavior_to_include
+				included_behaviors[idx]=behavior_to_include
 
-		capture=cv2.VideoCapture(os.path.join(path_to_folder,'Annotated video.avi'))
-		while True:
-			ret,frame=capture.read()
+		annotated_video=FrameSource(os.path.join(path_to_folder,'Annotated video.avi'),decimals=None)
+		# seek to the frame after 'frame_index' instead of decoding the video from the beginning
+		annotated_video.start_t=(frame_index+2)/annotated_video.fps
+		for frame_count,frame in annotated_video:
 			if frame_count>frame_index:
 				break
-			if frame is None:
-				break
-			frame_count+=1
-		capture.release()
+		else:
+			frame=None
 
 		shortest_distances={}
 		traveling_distances={}
@@ -0,0 +1,367 @@
+'''
+Copyright (C)
+This program is free software: you can redistribute it and/or modify it under the terms of the GNU General Public License as published by the Free Software Foundation, either version 3 of the License, or (at your option) any later version.
+This program is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+You should have received a copy of the GNU General Public License along with this program. If not, see https://tldrlegal.com/license/gnu-general-public-license-v3-(gpl-3)#fulltext.
+
+For license issues, please contact:
+
+Dr. Bing Ye
+Life Sciences Institute
+University of Michigan
+210 Washtenaw Avenue, Room 5403
+Ann Arbor, MI 48109-2216
+USA
+
+Email: bingye@umich.edu
+'''
+
+
+# Standard library imports.
+from collections.abc import Sequence
+import logging
+import operator
+
+# Log the load of this module (by the module loader, on first import).
+# Intentionally positioning these statements before other imports, against the
+# guidance of PEP-8, to log the load before other imports log messages.
+logger = logging.getLogger(__name__)
+logger.debug('loading %s', __file__)
+
+# Related third party imports.
+import numpy as np
+
+
+class TrackStore():
+
+	'''
+	The per-frame tracks (centers, heights and contours) of the
+	animals / objects in a video, kept in preallocated NumPy arrays
+	instead of lists of Python objects:
+
+		centers: int32 (IDs, frames, 2), with a bool 'detected' mask
+		heights: float64 (IDs, frames), NaN where not detected
+		contours: a ragged buffer, the points of all the contours in one
+		(points, 2) array, with the offset and the number of points of the
+		contour in each (ID, frame), -1 points where there is none; the
+		points are int16 when the frames are small enough, and are read
+		back as int32 OpenCV contours
+
+	'centers', 'heights' and 'contours' are dict-like views {ID: track},
+	and each track can be indexed, sliced and iterated like the list
+	[value or None for each frame] it replaces. Slicing a track returns
+	a window of it (another Track) without copying.
+	'''
+
+	def __init__(self,frame_count,IDs=(),frame_size=None):
+
+		# frame_count: the number of frames in each track
+		# IDs: the IDs to register
+		# frame_size: (height,width) of the frames that the contours are in, None if unknown
+
+		self.frame_count=frame_count
+		self.rows={} # ID: the row of the ID in the arrays
+		self.row_count=0
+		self.center_data=np.zeros((0,frame_count,2),dtype=np.int32)
+		self.detected=np.zeros((0,frame_count),dtype=bool)
+		self.height_data=np.zeros((0,frame_count),dtype=np.float64)
+		self.contour_offsets=np.zeros((0,frame_count),dtype=np.int64)
+		self.contour_lengths=np.zeros((0,frame_count),dtype=np.int32)
+		if frame_size is not None and max(frame_size)<=np.iinfo(np.int16).max:
+			self.points=np.zeros((1024,2),dtype=np.int16)
+		else:
+			self.points=np.zeros((1024,2),dtype=np.int32)
+		self.point_count=0
+		self.centers=TrackField(self,'centers')
+		self.heights=TrackField(self,'heights')
+		self.contours=TrackField(self,'contours')
+
+		for ID in IDs:
+			self.add(ID)
+
+
+	def add(self,ID):
+
+		# ID: the ID to register, with empty tracks
+
+		if self.row_count==len(self.detected):
+			capacity=max(4,2*self.row_count)
+			self.center_data=grow(self.center_data,capacity,0)
+			self.detected=grow(self.detected,capacity,False)
+			self.height_data=grow(self.height_data,capacity,np.nan)
+			self.contour_offsets=grow(self.contour_offsets,capacity,0)
+			self.contour_lengths=grow(self.contour_lengths,capacity,-1)
+
+		self.rows[ID]=self.row_count
+		self.row_count+=1
+
+
+	def remove(self,ID):
+
+		# ID: the ID to deregister, the last row is moved into its row so that the rows stay contiguous
+
+		row=self.rows.pop(ID)
+		last=self.row_count-1
+		if row!=last:
+			for array in (self.center_data,self.detected,self.height_data,self.contour_offsets,self.contour_lengths):
+				array[row]=array[last]
+			for other,other_row in self.rows.items():
+				if other_row==last:
+					self.rows[other]=row
+					break
+		self.detected[last]=False
+		self.height_data[last]=np.nan
+		self.contour_lengths[last]=-1
+		self.row_count=last
+
+
+	def truncate(self,frame_count):
+
+		# frame_count: the number of frames to keep in each track
+
+		# no more IDs or contours are expected, so the arrays are cut to the registered IDs and the kept frames,
+		# and the point buffer keeps only the points of the contours that are still referenced
+		self.frame_count=min(self.frame_count,frame_count)
+		self.center_data=self.center_data[:self.row_count,:self.frame_count].copy()
+		self.detected=self.detected[:self.row_count,:self.frame_count].copy()
+		self.height_data=self.height_data[:self.row_count,:self.frame_count].copy()
+		self.contour_offsets=self.contour_offsets[:self.row_count,:self.frame_count].copy()
+		self.contour_lengths=self.contour_lengths[:self.row_count,:self.frame_count].copy()
+		self.compact()
+
+
+	def compact(self):
+
+		# move the points of the referenced contours to the front of the buffer, in order, dropping the replaced and removed ones
+
+		kept=self.contour_lengths>=0
+		offsets=self.contour_offsets[kept]
+		lengths=self.contour_lengths[kept].astype(np.int64)
+		new_offsets=np.cumsum(lengths)-lengths
+		point_count=int(lengths.sum())
+		self.points=self.points[np.repeat(offsets-new_offsets,lengths)+np.arange(point_count)]
+		self.contour_offsets[kept]=new_offsets
+		self.point_count=point_count
+
+
+	def get(self,kind,row,n):
+
+		# kind: 'centers', 'heights' or 'contours'
+		# row: the row of the ID in the arrays
+		# n: the frame
+
+		if kind=='centers':
+			if self.detected[row,n]:
+				return tuple(self.center_data[row,n].tolist())
+		elif kind=='heights':
+			height=self.height_data[row,n]
+			if height==height:
+				return float(height)
+		else:
+			length=int(self.contour_lengths[row,n])
+			if length>=0:
+				offset=int(self.contour_offsets[row,n])
+				return self.points[offset:offset+length].astype(np.int32).reshape(length,1,2)
+
+		return None
+
+
+	def set(self,kind,row,n,value):
+
+		# kind: 'centers', 'heights' or 'contours'
+		# row: the row of the ID in the arrays
+		# n: the frame
+		# value: the center (x,y), the height, or the contour, None for not detected
+
+		if kind=='centers':
+			if value is None:
+				self.detected[row,n]=False
+			else:
+				self.center_data[row,n]=value
+				self.detected[row,n]=True
+		elif kind=='heights':
+			self.height_data[row,n]=np.nan if value is None else value
+		else:
+			if value is None:
+				self.contour_lengths[row,n]=-1
+			else:
+				points=np.asarray(value).reshape(-1,2)
+				if self.point_count+len(points)>len(self.points):
+					self.points=grow(self.points,max(2*len(self.points),self.point_count+len(points)),0)
+				# a replaced contour is left unused in the buffer
+				self.points[self.point_count:self.point_count+len(points)]=points
+				self.contour_offsets[row,n]=self.point_count
+				self.contour_lengths[row,n]=len(points)
+				self.point_count+=len(points)
+
+
+	def to_array(self,kind,row,frames=slice(None)):
+
+		# kind: 'centers' or 'heights'
+		# row: the row of the ID in the arrays
+		# frames: the frames (a slice) of the track
+
+		# return: a float array of the track, N (heights) or N X 2 (centers), NaN for the frames that the animal is missing in
+
+		if kind=='centers':
+			array=self.center_data[row,frames].astype(np.float64)
+			array[~self.detected[row,frames]]=np.nan
+			return array
+		if kind=='heights':
+			return self.height_data[row,frames].copy()
+
+		raise ValueError('no array for '+repr(kind))
+
+
+def grow(array,capacity,fill):
+
+	'''
+	This function is used to enlarge the first axis of an array
+	to 'capacity', filling the new entries with 'fill'.
+	'''
+
+	grown=np.full((capacity,)+array.shape[1:],fill,dtype=array.dtype)
+	grown[:len(array)]=array
+
+	return grown
+
+
+class TrackField():
+
+	'''
+	A dict-like view {ID: Track} of one kind of tracks in a TrackStore.
+	'''
+
+	def __init__(self,store,kind):
+
+		self.store=store
+		self.kind=kind
+
+
+	def __getitem__(self,ID):
+
+		if ID not in self.store.rows:
+			raise KeyError(ID)
+
+		return Track(self.store,ID,self.kind)
+
+
+	def __contains__(self,ID):
+
+		return ID in self.store.rows
+
+
+	def __iter__(self):
+
+		return iter(list(self.store.rows))
+
+
+	def __len__(self):
+
+		return len(self.store.rows)
+
+
+	def keys(self):
+
+		return list(self.store.rows)
+
+
+	def values(self):
+
+		return [self[ID] for ID in self.store.rows]
+
+
+	def items(self):
+
+		return [(ID,self[ID]) for ID in self.store.rows]
+
+
+	def to_dict(self):
+
+		# return: {ID: [value or None for each frame]}, like the dict of lists this view replaces
+
+		return {ID:list(self[ID]) for ID in self.store.rows}
+
+
+class Track(Sequence):
+
+	'''
+	One track (the centers, heights or contours of one ID) in a
+	TrackStore, or a window (a range of frames) of it, which can be
+	used like the list [value or None for each frame] it replaces.
+	Slicing returns a window of the same track in O(1), which reads
+	the store when it is indexed or iterated.
+	'''
+
+	def __init__(self,store,ID,kind,frames=None):
+
+		# frames: the range of frames in the window, None for the whole track
+
+		self.store=store
+		self.ID=ID
+		self.kind=kind
+		self.frames=frames
+
+
+	def span(self):
+
+		# return: the range of frames of the track in the store
+
+		if self.frames is None:
+			return range(self.store.frame_count)
+
+		return self.frames
+
+
+	def __len__(self):
+
+		return len(self.span())
+
+
+	def frame(self,index):
+
+		try:
+			return self.span()[operator.index(index)]
+		except IndexError:
+			raise IndexError('track index out of range') from None
+
+
+	def __getitem__(self,index):
+
+		if isinstance(index,slice):
+			return Track(self.store,self.ID,self.kind,self.span()[index])
+
+		return self.store.get(self.kind,self.store.rows[self.ID],self.frame(index))
+
+
+	def __setitem__(self,index,value):
+
+		self.store.set(self.kind,self.store.rows[self.ID],self.frame(index),value)
+
+
+	def __iter__(self):
+
+		row=self.store.rows[self.ID]
+		for n in self.span():
+			yield self.store.get(self.kind,row,n)
+
+
+	def __eq__(self,other):
+
+		if isinstance(other,Sequence) and not isinstance(other,str):
+			return len(self)==len(other) and all(a==b for a,b in zip(self,other))
+
+		return NotImplemented
+
+
+	__hash__=None
+
+
+	def to_array(self):
+
+		# return: see TrackStore.to_array, the centers / heights in the window are read with basic slicing
+
+		frames=self.span()
+		stop=frames.stop if frames.stop>=0 else None
+
+		return self.store.to_array(self.kind,self.store.rows[self.ID],slice(frames.start,stop,frames.step))
@@ -2,6 +2,7 @@ import importlib
 import logging
 import os
 import re
+import subprocess
 import sys
 import time
 
@@ -107,6 +108,23 @@ def test_main_stale_labgym(monkeypatch):
 	# This unit test passes if __main__.main doesn't raise an exception.
 
 
+# The headless 'analyze' command must not load the GUI toolkit.
+def test_headless_import_skips_wx():
+	# Arrange
+	# a fresh interpreter, since this process may have loaded wx already
+	code = ('import sys; '
+		"sys.argv = ['LabGym', 'analyze', 'jobs.toml']; "
+		'from LabGym import __main__; '
+		"print('wx' in sys.modules, __main__.headless)")
+
+	# Act
+	result = subprocess.run([sys.executable, '-c', code],
+		capture_output=True, text=True, check=True)
+
+	# Assert
+	assert result.stdout.split()[-2:] == ['False', 'True']
+
+
 # from .exitstatus import exitstatus
 #
 # # Specify sys.argv before importing __main__.  Why?  Because the
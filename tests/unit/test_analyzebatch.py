@@ -0,0 +1,120 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+import pandas as pd
+
+from LabGym import analyzebatch
+
+
+def test_merge_results_pads_shorter_videos(tmp_path):
+	# Arrange
+	names_and_colors = {'walk': ['#ffffff', '#ff0000'], 'rest': ['#ffffff', '#0000ff']}
+	results = [
+		({0: [['walk', 0.9], ['rest', 0.8], ['NA', -1]]}, [0.0, 0.1, 0.2]),
+		({0: [['rest', 0.7]], 1: [['walk', 0.6]]}, [0.0]),
+	]
+
+	# Act
+	analyzebatch.merge_results(str(tmp_path), results, False, [], [], names_and_colors, list(names_and_colors))
+
+	# Assert
+	all_events = pd.read_excel(os.path.join(tmp_path, 'all_events.xlsx'), index_col=0)
+	assert list(all_events.index) == [0.0, 0.1, 0.2]
+	assert all_events.shape == (3, 3)
+	assert all_events.iloc[0, 1] == "['rest', 0.7]"
+	assert all_events.iloc[2, 2] == "['NA', -1]"
+
+
+def thread_pool(max_workers, mp_context=None, initializer=None, initargs=()):
+	# a stand-in for the process pool, whose workers share the recorded state below
+	return ThreadPoolExecutor(max_workers=max_workers)
+
+
+def test_run_batch_admits_videos_within_the_memory_budget(monkeypatch):
+	# Arrange
+	GB = 1024**3
+	estimates = [0.5, 0.4, 0.6, 2.0, 0.3]  # GB, the 4th video exceeds the budget on its own
+	durations = [0.3, 0.1, 0.2, 0.1, 0.05]  # so that the videos complete out of order
+	jobs = [('video%d.avi' % n, 'results', {'estimate': estimates[n] * GB, 'duration': durations[n]}) for n in range(5)]
+	lock = threading.Lock()
+	running = []
+	observed = []
+
+	def analyze_video(path_to_video, result_path, settings):
+		with lock:
+			running.append(settings['estimate'])
+			observed.append(list(running))
+		time.sleep(settings['duration'])
+		with lock:
+			running.remove(settings['estimate'])
+		return path_to_video
+
+	monkeypatch.setattr(analyzebatch, 'ProcessPoolExecutor', thread_pool)
+	monkeypatch.setattr(analyzebatch, 'analyze_video', analyze_video)
+	monkeypatch.setattr(analyzebatch, 'estimate_memory', lambda path_to_video, settings: settings['estimate'])
+
+	# Act
+	results = analyzebatch.run_batch(jobs, processes=3, memory_budget=1)
+
+	# Assert
+	assert results == ['video0.avi', 'video1.avi', 'video2.avi', 'video3.avi', 'video4.avi']
+	assert max(len(concurrent) for concurrent in observed) == 2
+	assert all(len(concurrent) == 1 or sum(concurrent) <= GB for concurrent in observed)
+	assert [2 * GB] in observed  # at least one video always runs
+
+
+def test_run_batch_limits_the_processes(monkeypatch):
+	# Arrange
+	jobs = [('video%d.avi' % n, 'results', {}) for n in range(6)]
+	lock = threading.Lock()
+	running = []
+	peak = []
+
+	def analyze_video(path_to_video, result_path, settings):
+		with lock:
+			running.append(path_to_video)
+			peak.append(len(running))
+		time.sleep(0.2)
+		with lock:
+			running.remove(path_to_video)
+		return path_to_video[::-1]
+
+	monkeypatch.setattr(analyzebatch, 'ProcessPoolExecutor', thread_pool)
+	monkeypatch.setattr(analyzebatch, 'analyze_video', analyze_video)
+	monkeypatch.setattr(analyzebatch, 'estimate_memory', lambda path_to_video, settings: 0)
+
+	# Act
+	results = analyzebatch.run_batch(jobs, processes=4)
+
+	# Assert
+	assert results == [job[0][::-1] for job in jobs]
+	assert max(peak) == 4
+
+
+def test_estimate_memory(tmp_path):
+	# Arrange
+	path = str(tmp_path / 'video.avi')
+	writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), 10, (64, 48), True)
+	for n in range(100):
+		writer.write(np.zeros((48, 64, 3), dtype=np.uint8))
+	writer.release()
+	settings = {'framewidth': None, 'duration': 0, 'use_detector': False, 'animal_number': 2, 'length': 15, 'single_pass': False,
+		'path_to_categorizer': 'categorizer', 'streaming_categorizer': False, 'behaviornames_and_colors': {'walk': None, 'rest': None},
+		'dim_conv': 32, 'dim_tconv': 16, 'channel': 1, 'animation_analyzer': True}
+
+	# Act
+	memory = analyzebatch.estimate_memory(path, settings)
+	single_pass = analyzebatch.estimate_memory(path, dict(settings, single_pass=True))
+	streaming = analyzebatch.estimate_memory(path, dict(settings, streaming_categorizer=True))
+	five_seconds = analyzebatch.estimate_memory(path, dict(settings, duration=5))
+
+	# Assert
+	frames = 1.5 * 1024**3 + (15 + 32) * 64 * 48 * 3
+	assert memory == frames + 100 * 2 * (32**2 * 3 + 15 * 16**2 * 4)
+	assert single_pass == memory + 2 * 1024**3
+	assert streaming == frames + 100 * 2 * 2 * 4
+	assert five_seconds == frames + 51 * 2 * (32**2 * 3 + 15 * 16**2 * 4)
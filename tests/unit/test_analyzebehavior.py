@@ -0,0 +1,138 @@
+import cv2
+import numpy as np
+import pytest
+
+from LabGym import analyzebehavior
+
+
+@pytest.fixture(scope="module")
+def animal_video_path(tmp_path_factory):
+	# 80 frames at 2 fps (40 s, longer than the 30 s window for estimating the animal size), two bright ellipses moving on a dark arena
+	path = str(tmp_path_factory.mktemp('videos') / 'animals.avi')
+	rng = np.random.default_rng(0)
+	writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), 2, (160, 120), True)
+	for i in range(80):
+		frame = np.full((120, 160, 3), 30, dtype=np.uint8)
+		cv2.rectangle(frame, (5, 5), (154, 114), (90, 90, 90), 2)
+		cv2.ellipse(frame, (30 + i, 40), (12, 6), (5 * i) % 180, 0, 360, (220, 220, 220), -1)
+		cv2.ellipse(frame, (130 - i, 85 - i // 3), (12, 6), (90 + 3 * i) % 180, 0, 360, (220, 220, 220), -1)
+		writer.write(cv2.add(frame, rng.integers(0, 6, frame.shape, dtype=np.uint8)))
+	writer.release()
+	return path
+
+
+names_and_colors = {'walk': ['#ffffff', '#ffffff'], 'rest': ['#000000', '#000000'], 'turn': ['#ff0000', '#ff0000']}
+
+
+class StubCategorizer():
+
+	# scores each window by the brightness of its animation and pattern image
+
+	def predict_on_batch(self, inputs):
+		animations, pattern_images = [np.asarray(x) for x in inputs]
+		a = animations.reshape(len(animations), -1).mean(1)
+		p = pattern_images.reshape(len(pattern_images), -1).mean(1)
+		return np.stack([p, 1 - p, 10 * a], 1).astype('float32')
+
+	def predict(self, inputs, batch_size=32):
+		return self.predict_on_batch(inputs)
+
+
+def prepare(path, results_path, buffer_budget=None, **kwargs):
+	# prepare the analysis of the two animals in the whole video
+	analyzer = analyzebehavior.AnalyzeAnimal()
+	analyzer.stream_batch_size = 7  # several micro-batches, the last one partial
+	if buffer_budget is not None:
+		analyzer.buffer_budget = buffer_budget
+	analyzer.prepare_analysis(path, str(results_path), 2, names_and_colors=names_and_colors, dim_tconv=8, dim_conv=8, duration=0, length=5, **kwargs)
+	return analyzer
+
+
+def analyze(path, results_path, **kwargs):
+	# prepare, acquire and craft the tracks of the two animals in the whole video
+	analyzer = prepare(path, results_path, **kwargs)
+	analyzer.acquire_information()
+	analyzer.craft_data()
+	return analyzer
+
+
+def test_streaming_categorization_matches_batch(monkeypatch, tmp_path, animal_video_path):
+	# Arrange
+	monkeypatch.setattr(analyzebehavior, 'load_categorizer', lambda path: StubCategorizer())
+	batch = analyze(animal_video_path, tmp_path / 'batch')
+	streaming = analyze(animal_video_path, tmp_path / 'streaming', streaming_categorizer='stub')
+
+	# Act
+	batch.categorize_behaviors('stub')
+	streaming.categorize_behaviors('stub')
+
+	# Assert
+	assert streaming.event_probability == batch.event_probability
+	assert any(event[0] != 'NA' for events in batch.event_probability.values() for event in events)
+	for behavior_name in names_and_colors:
+		assert streaming.all_behavior_parameters[behavior_name]['probability'] == batch.all_behavior_parameters[behavior_name]['probability']
+
+
+def test_single_pass_matches_two_passes(tmp_path, animal_video_path):
+	# Arrange
+	two_passes = analyze(animal_video_path, tmp_path / 'two_passes', ex_end=10)
+	replayed = prepare(animal_video_path, tmp_path / 'replayed', ex_end=10, single_pass=True)
+	redecoded = prepare(animal_video_path, tmp_path / 'redecoded', ex_end=10, single_pass=True, buffer_budget=1)
+
+	# the estimation stops after the 30 s window for the animal size, so the analysis replays the buffered frames
+	# and then continues decoding, unless the buffers exceed the budget and the frames are decoded again
+	assert 0 < len(replayed.replay_frames) < 80
+	assert redecoded.replay_frames is None
+
+	# Act
+	for analyzer in [replayed, redecoded]:
+		analyzer.acquire_information()
+		analyzer.craft_data()
+
+	# Assert
+	for analyzer in [replayed, redecoded]:
+		assert np.array_equal(analyzer.background, two_passes.background)
+		assert analyzer.animal_area == two_passes.animal_area
+		assert analyzer.all_time == two_passes.all_time
+		assert analyzer.animal_centers.to_dict() == two_passes.animal_centers.to_dict()
+		for ID in two_passes.animal_contours:
+			for contour, expected in zip(analyzer.animal_contours[ID], two_passes.animal_contours[ID]):
+				assert (contour is None and expected is None) or np.array_equal(contour, expected)
+
+
+def test_window_blobs_reuse_blobs_until_the_crop_box_changes(monkeypatch):
+	# Arrange
+	rng = np.random.default_rng(1)
+	frames = [rng.integers(0, 256, (60, 80, 3), dtype=np.uint8) for n in range(6)]
+	box = np.array([[[20, 10]], [[40, 10]], [[40, 30]], [[20, 30]]])
+	contours = [box, box, box, box, None, box * 2]  # the last contour widens the crop box
+	analyzer = analyzebehavior.AnalyzeAnimal()
+	analyzer.dim_tconv = 8
+	analyzer.channel = 3
+	extracted = []
+	extract = analyzebehavior.extract_blob_background
+	monkeypatch.setattr(analyzebehavior, 'extract_blob_background', lambda *args, **kwargs: extracted.append(1) or extract(*args, **kwargs))
+
+	def fresh(start):
+		# the blobs of all the frames in the window that starts with frame 'start', extracted without the cache
+		window = contours[start:start + 4]
+		return [np.zeros((8, 8, 3), dtype='uint8') if contour is None else cv2.resize(extract(frame, window, contour=contour, channel=3, background_free=True), (8, 8), interpolation=cv2.INTER_AREA)
+			for frame, contour in zip(frames[start:start + 4], window)]
+
+	# Act and assert: the first window extracts every blob
+	blobs = analyzer.window_blobs(0, frames[0:4], contours[0:4], 0)
+	assert len(extracted) == 4
+	assert all(np.array_equal(a, b) for a, b in zip(blobs, fresh(0)))
+
+	# Act and assert: the crop box is unchanged (frame 4 has no contour), so no blob is extracted
+	extracted.clear()
+	blobs = analyzer.window_blobs(0, frames[1:5], contours[1:5], 1)
+	assert len(extracted) == 0
+	assert all(np.array_equal(a, b) for a, b in zip(blobs, fresh(1)))
+
+	# Act and assert: the crop box changes, so every blob is extracted again
+	extracted.clear()
+	blobs = analyzer.window_blobs(0, frames[2:6], contours[2:6], 2)
+	assert len(extracted) == 3
+	assert all(np.array_equal(a, b) for a, b in zip(blobs, fresh(2)))
+	assert sorted(analyzer.blob_cache[0]) == [2, 3, 5]
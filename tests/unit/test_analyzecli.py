@@ -0,0 +1,94 @@
+import pandas as pd
+import pytest
+
+from LabGym import analyzecli
+
+
+@pytest.fixture
+def categorizer_path(tmp_path):
+	# a Categorizer folder with only its 'model_parameters.txt'
+	path = tmp_path / 'models' / 'walk_rest'
+	path.mkdir(parents=True)
+	parameters = {'classnames': ['walk', 'rest'], 'dim_conv': [32, 32], 'dim_tconv': [16, 16], 'channel': [3, 3], 'time_step': [2, 2],
+		'network': [2, 2], 'inner_code': [0, 0], 'std': [10, 10], 'background_free': [1, 1], 'behavior_kind': [0, 0], 'black_background': [1, 1]}
+	pd.DataFrame(parameters).to_csv(path / 'model_parameters.txt', index=False)
+	return path
+
+
+@pytest.fixture
+def jobfile(tmp_path):
+	# two videos with their start times coded in the file names
+	for name in ['b_n2_b5.avi', 'a_n1_b1.5.avi', 'notes.txt']:
+		(tmp_path / name).write_bytes(b'')
+	path = tmp_path / 'jobs.toml'
+	path.write_text(
+		f"result_path = '{tmp_path / 'results'}'\n"
+		f"videos = ['{tmp_path / '*.avi'}']\n"
+		"categorizer = 'walk_rest'\n"
+		"decode_t = true\n"
+		"decode_animalnumber = true\n"
+		"[settings]\n"
+		"framewidth = 320\n"
+		"ID_colors = [[0, 255, 0]]\n")
+	return path
+
+
+def test_make_jobs(tmp_path, categorizer_path, jobfile):
+	# Arrange
+	spec = analyzecli.read_jobfile(jobfile)
+
+	# Act
+	settings, jobs = analyzecli.make_jobs(spec, str(tmp_path / 'models'), str(tmp_path / 'detectors'))
+
+	# Assert
+	assert settings['path_to_categorizer'] == str(categorizer_path)
+	assert settings['behavior_to_include'] == ['walk', 'rest']
+	assert (settings['dim_conv'], settings['dim_tconv'], settings['channel'], settings['length']) == (32, 16, 3, 3)
+	assert (settings['animation_analyzer'], settings['include_bodyparts'], settings['background_free'], settings['black_background']) == (True, True, False, False)
+	assert settings['framewidth'] == 320
+	assert settings['ID_colors'] == [(0, 255, 0)]
+	assert [job[0] for job in jobs] == [str(tmp_path / 'a_n1_b1.5.avi'), str(tmp_path / 'b_n2_b5.avi')]
+	assert [(job[2]['t'], job[2]['animal_number']) for job in jobs] == [(1.5, 1), (5.0, 2)]
+	assert all(job[1] == str(tmp_path / 'results') for job in jobs)
+
+
+def test_read_jobfile_unknown_setting(tmp_path):
+	# Arrange
+	path = tmp_path / 'jobs.toml'
+	path.write_text("result_path = 'results'\nvideos = ['*.avi']\n[settings]\nframe_width = 320\n")
+
+	# Act, and assert raises(ValueError)
+	with pytest.raises(ValueError, match='frame_width'):
+		analyzecli.read_jobfile(path)
+
+
+def test_default_settings_cover_settings_names():
+	# Arrange
+	from LabGym.analyzebatch import settings_names
+
+	# Act
+	missing = set(settings_names) - set(analyzecli.default_settings)
+	unknown = set(analyzecli.default_settings) - set(settings_names)
+
+	# Assert
+	assert missing == set() and unknown == set()
+
+
+def test_analyze_reads_boolean_config_strings(monkeypatch, tmp_path, categorizer_path, jobfile):
+	# Arrange
+	_config = {'detectors': str(tmp_path / 'detectors'), 'models': str(tmp_path / 'models'), 'analysis_processes': '1',
+		'analysis_memory_budget': '0', 'binary_results': 'False', 'tracker': 'greedy', 'track_gate': '0', 'constants_cache': '', 'single_pass': '1',
+		'streaming_categorizer': 'yes'}
+	monkeypatch.setattr(analyzecli.config, 'get_config', lambda *args: {key: _config[key] for key in args})
+	batches = []
+	monkeypatch.setattr(analyzecli, 'run_batch', lambda jobs, processes, memory_budget: batches.append(jobs) or [])
+	monkeypatch.setattr(analyzecli, 'merge_results', lambda *args, **kwargs: None)
+
+	# Act
+	status = analyzecli.analyze(jobfile)
+
+	# Assert
+	assert status == 0
+	assert all(job[2]['binary_results'] is False for job in batches[0])
+	assert all(job[2]['single_pass'] is True for job in batches[0])
+	assert all(job[2]['streaming_categorizer'] is True for job in batches[0])
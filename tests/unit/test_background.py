@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+from LabGym.background import BackgroundEstimator
+
+
+def make_frames(count, seed=0):
+	# frames with a drifting illumination and a bright moving block
+	rng = np.random.default_rng(seed)
+	base = rng.integers(40, 200, (30, 40, 3)).astype(np.float32)
+	frames = []
+	for n in range(count):
+		frame = base * (1 + 0.3 * np.sin(n / 40)) + rng.normal(0, 8, base.shape)
+		frame[10:20, n % 30:n % 30 + 8] = 250
+		frames.append(np.clip(frame, 0, 255).astype(np.uint8))
+	return frames
+
+
+def windowed_reference(frames, animal_vs_bg):
+	# the per-pixel window means and checks computed on float copies of all the frames
+	frames = np.array(frames, dtype='float32')
+	means = []
+	checks = []
+	for n in range(0, len(frames) - 101, 30):
+		window = frames[n:n + 100]
+		mean = window.mean(0)
+		means.append(mean)
+		if animal_vs_bg == 2:
+			checks.append(abs(mean - frames.mean(0)) + window.std(0))
+		else:
+			checks.append(mean + window.std(0))
+	return np.uint8(np.take_along_axis(np.array(means), np.argsort(np.array(checks), axis=0), axis=0)[0])
+
+
+def add_all(frames, **kwargs):
+	estimator = BackgroundEstimator(**kwargs)
+	for frame in frames:
+		estimator.add(frame)
+	return estimator
+
+
+def test_stable_illumination_keeps_running_extremes():
+	# Arrange
+	frames = make_frames(50)
+
+	# Act
+	brighter = add_all(frames, stable_illumination=True, animal_vs_bg=0)
+	darker = add_all(frames, stable_illumination=True, animal_vs_bg=1)
+
+	# Assert
+	assert np.array_equal(brighter.background(), np.array(frames).min(0))
+	assert np.array_equal(darker.background(), np.array(frames).max(0))
+	assert add_all(frames[:3]).background() is None
+
+
+@pytest.mark.parametrize('animal_vs_bg', [0, 2])
+def test_windows_match_the_float_computation(animal_vs_bg):
+	# Arrange
+	frames = make_frames(200)
+
+	# Act
+	estimator = add_all(frames, stable_illumination=False, animal_vs_bg=animal_vs_bg)
+
+	# Assert
+	assert np.array_equal(estimator.background(), windowed_reference(frames, animal_vs_bg))
+	assert len(estimator.open_windows) <= 4
+
+
+def test_few_frames_use_the_median():
+	# Arrange
+	frames = make_frames(101)
+
+	# Act
+	estimator = add_all(frames, stable_illumination=False, animal_vs_bg=2)
+
+	# Assert
+	assert np.array_equal(estimator.background(), np.uint8(np.median(np.array(frames, dtype='float32'), axis=0)))
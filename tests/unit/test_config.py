@@ -81,3 +81,15 @@ def test_bad_configfile(monkeypatch):
 	# Assert
 	# SystemExit: Trouble reading user-specified configfile (/charlie/delta.yaml)
 	assert exitstatus(e.value) == 1
+
+
+# Boolean settings from environment variables arrive as strings.
+def test_as_bool():
+	# Arrange
+	values = [True, False, 0, 1, 'False', '0', 'no', 'off', '', 'True', ' 1 ', 'yes', 'ON']
+
+	# Act
+	result = [config.as_bool(value) for value in values]
+
+	# Assert
+	assert result == [True, False, False, True, False, False, False, False, False, True, True, True, True]
@@ -0,0 +1,142 @@
+import cv2
+import numpy as np
+import pytest
+
+from LabGym.framesource import FrameSource, read_frames_at
+
+
+@pytest.fixture
+def sample_video_path(tmp_path):
+	# 30 frames at 10 fps, frame i has a grey level of 8*i
+	path = str(tmp_path / 'sample.avi')
+	writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), 10, (64, 48), True)
+	for i in range(30):
+		writer.write(np.full((48, 64, 3), 8 * i, dtype=np.uint8))
+	writer.release()
+	return path
+
+
+def grey_level(frame):
+	return int(round(float(np.mean(frame)) / 8))
+
+
+def test_framesource_reads_all_frames(sample_video_path):
+	# Arrange
+	source = FrameSource(sample_video_path)
+
+	# Act
+	items = list(source)
+
+	# Assert
+	assert source.fps == 10
+	assert [frame_count for frame_count, frame in items] == list(range(30))
+	assert [grey_level(frame) for frame_count, frame in items] == list(range(30))
+
+
+def test_framesource_resizes_frames(sample_video_path):
+	# Act
+	items = list(FrameSource(sample_video_path, framewidth=32))
+
+	# Assert
+	assert all(frame.shape == (24, 32, 3) for frame_count, frame in items)
+
+
+def test_framesource_start_end_t(sample_video_path):
+	# Arrange
+	# the time point of frame i is (i+1)/fps, so [1.0, 2.0) is frames 9 to 18
+	source = FrameSource(sample_video_path, start_t=1.0, end_t=2.0)
+
+	# Act
+	items = list(source)
+
+	# Assert
+	assert [frame_count for frame_count, frame in items] == list(range(9, 19))
+	assert [grey_level(frame) for frame_count, frame in items] == list(range(9, 19))
+
+
+def test_framesource_skip(sample_video_path):
+	# Act
+	items = list(FrameSource(sample_video_path, start_t=0.5, skip=7))
+
+	# Assert
+	assert [frame_count for frame_count, frame in items] == [4, 11, 18, 25]
+
+
+def test_framesource_break_stops_thread(sample_video_path):
+	# Arrange
+	source = FrameSource(sample_video_path, queue_size=2)
+
+	# Act
+	for frame_count, frame in source:
+		if frame_count == 3:
+			break
+
+	# Assert
+	assert source.thread is None
+
+
+@pytest.mark.parametrize('start_t', [0.3, 1.0, 1.55, 2.5])
+def test_framesource_seek_matches_sequential_decoding(sample_video_path, start_t):
+	# Arrange
+	seeking = FrameSource(sample_video_path, start_t=start_t, seek=True, seek_margin=0)
+	sequential = FrameSource(sample_video_path, start_t=start_t, seek=False)
+
+	# Act
+	seeked_items = list(seeking)
+	sequential_items = list(sequential)
+
+	# Assert
+	assert [frame_count for frame_count, frame in seeked_items] == [frame_count for frame_count, frame in sequential_items]
+	assert all(np.array_equal(a, b) for (_, a), (_, b) in zip(seeked_items, sequential_items))
+
+
+class KeyframeCapture():
+	# a capture whose seeks land on the keyframe (every 8th frame) before the requested frame,
+	# while reporting the requested position, like the FFmpeg backend on some containers
+	video_capture = cv2.VideoCapture
+
+	def __init__(self, *args):
+		self.capture = self.video_capture(*args)
+		self.requested = None
+
+	def set(self, prop, value):
+		if prop == cv2.CAP_PROP_POS_FRAMES:
+			self.requested = int(value)
+			return self.capture.set(prop, value - value % 8)
+		return self.capture.set(prop, value)
+
+	def get(self, prop):
+		if prop == cv2.CAP_PROP_POS_FRAMES and self.requested is not None:
+			return self.requested
+		return self.capture.get(prop)
+
+	def __getattr__(self, name):
+		return getattr(self.capture, name)
+
+
+def test_framesource_detects_inaccurate_seeks(sample_video_path, monkeypatch):
+	# Arrange
+	monkeypatch.setattr(cv2, 'VideoCapture', KeyframeCapture)
+
+	# Act
+	items = list(FrameSource(sample_video_path, start_t=1.55, seek=True, seek_margin=2))
+	sampled = list(read_frames_at(sample_video_path, [3, 13, 29], max_grab=0))
+
+	# Assert
+	assert [frame_count for frame_count, frame in items] == list(range(15, 30))
+	assert [grey_level(frame) for frame_count, frame in items] == list(range(15, 30))
+	assert [grey_level(frame) for frame_count, frame in sampled] == [3, 13, 29]
+
+
+@pytest.mark.parametrize('max_grab', [0, 3, 100])
+def test_read_frames_at_seeks_and_grabs(sample_video_path, max_grab):
+	# Arrange
+	frame_counts = [0, 2, 3, 10, 11, 25, 29, 35]
+
+	# Act
+	items = list(read_frames_at(sample_video_path, frame_counts, framewidth=32, max_grab=max_grab))
+
+	# Assert
+	assert [frame_count for frame_count, frame in items] == [0, 2, 3, 10, 11, 25, 29]
+	assert [grey_level(frame) for frame_count, frame in items] == [0, 2, 3, 10, 11, 25, 29]
+	assert all(frame.shape == (24, 32, 3) for frame_count, frame in items)
@@ -0,0 +1,62 @@
+import os
+
+import pytest
+
+from LabGym import modelcache
+
+
+@pytest.fixture
+def model_paths(tmp_path, monkeypatch):
+	# three model folders, and an empty cache of 2 models
+	monkeypatch.setattr(modelcache, 'capacity', 2)
+	modelcache.clear()
+	paths = []
+	for name in ['a', 'b', 'c']:
+		path = tmp_path / name
+		path.mkdir()
+		(path / 'weights').write_text(name)
+		paths.append(str(path))
+	yield paths
+	modelcache.clear()
+
+
+def test_get_model_loads_once(model_paths):
+	# Arrange
+	loaded = []
+	loader = lambda path: loaded.append(path) or object()
+
+	# Act
+	first = modelcache.get_model('categorizer', model_paths[0], loader)
+	second = modelcache.get_model('categorizer', model_paths[0], loader)
+
+	# Assert
+	assert first is second
+	assert loaded == [model_paths[0]]
+
+
+def test_get_model_reloads_modified_model(model_paths):
+	# Arrange
+	loader = lambda path: object()
+	first = modelcache.get_model('categorizer', model_paths[0], loader)
+	weights = os.path.join(model_paths[0], 'weights')
+	os.utime(weights, (os.path.getatime(weights), os.path.getmtime(weights) + 10))
+
+	# Act
+	second = modelcache.get_model('categorizer', model_paths[0], loader)
+
+	# Assert
+	assert first is not second
+	assert len(modelcache.models) == 1
+
+
+def test_get_model_evicts_least_recently_used(model_paths):
+	# Arrange
+	loaded = []
+	loader = lambda path: loaded.append(os.path.basename(path)) or object()
+
+	# Act
+	for path in [model_paths[0], model_paths[1], model_paths[0], model_paths[2], model_paths[0], model_paths[1]]:
+		modelcache.get_model('categorizer', path, loader)
+
+	# Assert
+	assert loaded == ['a', 'b', 'c', 'b']
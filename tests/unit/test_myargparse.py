@@ -125,3 +125,84 @@ def test_enable_(monkeypatch):
 
 	# Assert
 	assert result == {'enable': {'F1': False, 'F2': True}}
+
+
+def test_parse_args_analyze(monkeypatch):
+	# Arrange
+	monkeypatch.setattr(sys, 'argv',
+		['cmd', '--configfile', 'analyze', 'analyze', 'jobs.toml'])
+
+	# Act
+	result = myargparse.parse_args()
+
+	# Assert
+	assert result == {'configfile': 'analyze', 'command': 'analyze',
+		'jobfile': 'jobs.toml'}
+
+
+# analyze takes exactly 1 arg, the jobfile
+def test_parse_args_analyze_without_jobfile(monkeypatch):
+	# Arrange
+	monkeypatch.setattr(sys, 'argv',
+		['cmd', 'analyze'])
+
+	# Act, and assert raises(SystemExit)
+	with pytest.raises(SystemExit,
+		match="cmd: bad usage -- 'analyze' takes 1 args, but 0 were found."
+			'\nUsage: ') as e:
+		result = myargparse.parse_args()
+
+	# Assert
+	assert exitstatus(e.value) == 1
+
+
+def test_get_command(monkeypatch):
+	# Arrange
+	monkeypatch.setattr(sys, 'argv',
+		['cmd', '--configfile', 'analyze', '-v', '--', 'analyze', 'jobs.toml'])
+
+	# Act
+	result = myargparse.get_command()
+
+	# Assert
+	assert result == 'analyze'
+
+
+def test_get_command_gui(monkeypatch):
+	# Arrange
+	monkeypatch.setattr(sys, 'argv',
+		['cmd', '--configfile', 'analyze', '--debug'])
+
+	# Act
+	result = myargparse.get_command()
+
+	# Assert
+	assert result is None
+
+
+def test_get_command_agrees_with_parse_args(monkeypatch):
+	# Arrange
+	values = [opt for opt, n in myargparse.options.items() if n == 1]
+
+	for opt in values:
+		monkeypatch.setattr(sys, 'argv', ['cmd', opt, 'analyze'])
+
+		# Act
+		command = myargparse.get_command()
+		result = myargparse.parse_args()
+
+		# Assert
+		assert command is None
+		assert 'command' not in result
+
+
+def test_help_analyze_is_aligned(monkeypatch, capsys):
+	# Arrange
+	monkeypatch.setattr(sys, 'argv', ['cmd', '--help'])
+
+	# Act
+	with pytest.raises(SystemExit):
+		myargparse.parse_args()
+
+	# Assert
+	assert '\n                        JOBFILE without the GUI' in capsys.readouterr().out
@@ -0,0 +1,597 @@
+import math
+
+import cv2
+import numpy as np
+import pandas as pd
+import pytest
+
+from LabGym import tools
+
+
+@pytest.fixture
+def frame_and_contours():
+	# a noisy frame with two polygons, one of them touching the frame border
+	rng = np.random.default_rng(0)
+	frame = rng.integers(0, 256, (120, 160, 3), dtype=np.uint8)
+	contours = [
+		np.array([[[40, 30]], [[70, 25]], [[80, 60]], [[55, 75]], [[35, 55]]], dtype=np.int32),
+		np.array([[[120, 90]], [[159, 100]], [[150, 119]], [[118, 112]]], dtype=np.int32),
+	]
+	return frame, contours
+
+
+def masked_reference(frame, contours, black_background):
+	# the full-frame float masking the blob helpers are expected to reproduce
+	mask = np.zeros_like(frame)
+	cv2.drawContours(mask, contours, -1, (255, 255, 255), -1)
+	masked_frame = frame * (mask / 255.0)
+	if black_background is False:
+		masked_frame[mask == 0] = 255
+	return masked_frame
+
+
+@pytest.mark.parametrize('channel', [1, 3])
+@pytest.mark.parametrize('black_background', [True, False])
+def test_extract_blob_background_matches_full_frame_masking(frame_and_contours, channel, black_background):
+	# Arrange
+	frame, contours = frame_and_contours
+	(y_bt, y_tp, x_lf, x_rt) = tools.crop_frame(frame, contours)
+	expected = masked_reference(frame, [contours[0]], black_background)[y_bt:y_tp, x_lf:x_rt]
+	expected = np.uint8(tools.exposure.rescale_intensity(expected, out_range=(0, 255)))
+	if channel == 1:
+		expected = tools.img_to_array(cv2.cvtColor(expected, cv2.COLOR_BGR2GRAY))
+
+	# Act
+	blob = tools.extract_blob_background(frame, contours, contour=contours[0], channel=channel, background_free=True, black_background=black_background)
+
+	# Assert
+	assert blob.dtype == expected.dtype
+	assert np.array_equal(blob, expected)
+
+
+@pytest.mark.parametrize('black_background', [True, False])
+def test_extract_blob_all_matches_full_frame_masking(frame_and_contours, black_background):
+	# Arrange
+	frame, contours = frame_and_contours
+	# a region smaller than the contours, so that they are cut by its borders
+	(y_bt, y_tp, x_lf, x_rt) = (40, 110, 50, 140)
+	expected = masked_reference(frame, contours, black_background)[y_bt:y_tp, x_lf:x_rt]
+	expected = np.uint8(tools.exposure.rescale_intensity(expected, out_range=(0, 255)))
+
+	# Act
+	blob = tools.extract_blob_all(frame, y_bt, y_tp, x_lf, x_rt, contours=contours, channel=3, background_free=True, black_background=black_background)
+
+	# Assert
+	assert np.array_equal(blob, expected)
+
+
+def test_generate_patternimage_matches_full_frame_rendering():
+	# Arrange
+	frame = np.zeros((200, 300, 3), dtype=np.uint8)
+	outlines = [cv2.ellipse2Poly((150 + 3 * i, 100), (30, 15), 10 * i, 0, 360, 10).reshape(-1, 1, 2) for i in range(8)]
+	(y_bt, y_tp, x_lf, x_rt) = tools.crop_frame(frame, outlines)
+	p_size = int(max(abs(y_bt - y_tp), abs(x_lf - x_rt)) / 150 + 1)
+	expected = np.zeros_like(frame)
+	colors = [(255, 0, 0), (255, 127, 0), (255, 255, 0), (255, 255, 127), (255, 255, 255), (255, 128, 255), (255, 0, 255), (128, 0, 255)]
+	for outline, color in zip(outlines, colors):
+		cv2.drawContours(expected, [outline], 0, color, p_size)
+	expected = expected[y_bt:y_tp, x_lf:x_rt]
+
+	# Act
+	pattern_image = tools.generate_patternimage(frame, outlines)
+
+	# Assert
+	assert np.array_equal(pattern_image, expected)
+
+
+def test_generate_patternimage_removes_static_inners():
+	# Arrange
+	frame = np.zeros((200, 300, 3), dtype=np.uint8)
+	outlines = [cv2.ellipse2Poly((150, 100), (60, 40), 0, 0, 360, 10).reshape(-1, 1, 2)] * 6
+	static_inner = cv2.ellipse2Poly((120, 100), (6, 6), 0, 0, 360, 30).reshape(-1, 1, 2)
+	inners = [[static_inner, cv2.ellipse2Poly((160 + 5 * i, 100), (6, 6), 0, 0, 360, 30).reshape(-1, 1, 2)] for i in range(6)]
+	(y_bt, y_tp, x_lf, x_rt) = tools.crop_frame(frame, outlines)
+
+	# Act
+	pattern_image = tools.generate_patternimage(frame, outlines, inners=inners, std=50)
+
+	# Assert
+	assert not pattern_image[100 - y_bt, 120 - x_lf].any()
+	assert pattern_image[100 - y_bt, 160 - x_lf:195 - x_lf].any()
+
+
+def test_suppress_duplicate_masks():
+	# Arrange
+	large = np.zeros((60, 80), dtype=np.uint8)
+	large[10:40, 10:40] = 1
+	inside = np.zeros((60, 80), dtype=np.uint8)
+	inside[15:35, 15:35] = 1
+	half_inside = np.zeros((60, 80), dtype=np.uint8)
+	half_inside[30:50, 30:50] = 1
+	separate = np.zeros((60, 80), dtype=np.uint8)
+	separate[45:55, 60:70] = 1
+	empty = np.zeros((60, 80), dtype=np.uint8)
+
+	# Act
+	exclusion_mask = tools.suppress_duplicate_masks([inside, large, half_inside, separate, empty, large.copy()])
+
+	# Assert
+	# only the mask mostly covered by a larger one is excluded, equally large duplicates are kept
+	assert exclusion_mask.tolist() == [True, False, False, False, False, False]
+
+
+@pytest.fixture
+def track():
+	# a track of integer centers and heights, with missing frames
+	rng = np.random.default_rng(1)
+	centers = [tuple(int(v) for v in rng.integers(0, 200, 2)) for n in range(40)]
+	heights = [int(v) for v in rng.integers(5, 40, 40)]
+	for n in [0, 7, 8, 21, 39]:
+		centers[n] = None
+		heights[n] = None
+	return centers, heights
+
+
+def test_window_length_parameters_match_frame_loop(track):
+	# Arrange
+	centers, heights = track
+	length, fps = 5, 30
+
+	# Act
+	magnitude, vigor, intensity = tools.window_length_parameters(tools.track_array(heights), length, fps)
+
+	# Assert
+	for n in range(length - 1, len(heights)):
+		diffs = [0.0 if h is None or heights[n] is None else abs(h - heights[n]) / h for h in heights[n - length + 1:n + 1]]
+		assert magnitude[n] == max(diffs)
+		assert vigor[n] == max(diffs) / ((length - np.argmax(diffs)) / fps)
+		assert intensity[n] == sum(diffs) / (length / fps)
+	assert np.isnan(magnitude[:length - 1]).all()
+
+
+def test_window_locomotion_parameters_match_frame_loop(track):
+	# Arrange
+	centers, heights = track
+	length, fps, calibrator = 5, 30, 12.5
+
+	# Act
+	speed, velocity, steps = tools.window_locomotion_parameters(tools.track_array(centers, dimension=2), length, fps, calibrator=calibrator)
+	acceleration = tools.window_acceleration(velocity, length, fps)
+
+	# Assert
+	for n in range(length, len(centers)):
+		distance_traveled = 0.0
+		for d in range(n - length, n - 1):
+			if centers[d] is not None and centers[d + 1] is not None:
+				distance_traveled += math.dist(centers[d + 1], centers[d])
+		assert speed[n] == distance_traveled / calibrator / (length / fps)
+		if centers[n] is None:
+			assert np.isnan(velocity[n])
+		else:
+			displacements = [0 if ct is None else math.dist(centers[n], ct) for ct in centers[n - length + 1:n + 1]]
+			assert velocity[n] == max(displacements) / calibrator / ((length - np.argmax(displacements)) / fps)
+		window = velocity[n - length + 1:n + 1]
+		if np.isnan(window).any() or np.argmax(window) == np.argmin(window):
+			assert np.isnan(acceleration[n])
+		else:
+			assert acceleration[n] == (max(window) - min(window)) / (abs(np.argmax(window) - np.argmin(window)) / fps)
+
+
+def test_window_areal_parameters_match_full_frame_masks():
+	# Arrange
+	frame = np.zeros((120, 160, 3), dtype=np.uint8)
+	contours = [cv2.ellipse2Poly((60 + 4 * n, 60), (20 + n, 10), 15 * n, 0, 360, 10).reshape(-1, 1, 2) for n in range(12)]
+	contours[5] = None
+	length, fps = 4, 10
+
+	# Act
+	magnitude, vigor, intensity = tools.window_areal_parameters(contours, list(range(length, 12)), length, fps)
+
+	# Assert
+	for n in range(length, 12):
+		if contours[n] is None:
+			assert np.isnan(magnitude[n])
+			continue
+		mask = cv2.cvtColor(cv2.drawContours(np.zeros_like(frame), [contours[n]], 0, (255, 255, 255), -1), cv2.COLOR_BGR2GRAY)
+		area_diffs = []
+		for ct in contours[n - length + 1:n + 1]:
+			if ct is not None:
+				prev_mask = cv2.cvtColor(cv2.drawContours(np.zeros_like(frame), [ct], 0, (255, 255, 255), -1), cv2.COLOR_BGR2GRAY)
+				area_diffs.append((np.sum(cv2.bitwise_xor(prev_mask, mask)) / 255) / (np.sum(prev_mask) / 255))
+		assert magnitude[n] == max(area_diffs)
+		assert vigor[n] == max(area_diffs) / ((length - np.argmax(area_diffs)) / fps)
+		assert intensity[n] == sum(area_diffs) / (length / fps)
+
+
+def test_events_npz_round_trip(tmp_path):
+	# Arrange
+	event_probability = {
+		0: [['walk', 0.75], ['NA', -1], ['rest', 0.5]],
+		3: [['NA', -1], ['rest', 0.25], ['rest', 1.0]],
+	}
+	time_points = [0.0, 0.1, 0.2]
+	path = str(tmp_path / 'all_event_probability.npz')
+
+	# Act
+	tools.write_events_npz(path, event_probability, time_points)
+	parsed = tools.parse_all_events_file(path)
+
+	# Assert
+	assert parsed == (event_probability, time_points, ['rest', 'walk'])
+	with np.load(path) as data:
+		assert data['behavior'].dtype == np.int16
+		assert data['probability'].dtype == np.float32
+
+
+def test_centers_npz_round_trip(tmp_path):
+	# Arrange
+	animal_centers = {0: [(10, 20), None, (12, 21)], 1: [None, (100, 5), (101, 6)]}
+	time_points = [0.0, 0.1, 0.2]
+	path = str(tmp_path / 'all_centers.npz')
+
+	# Act
+	tools.write_centers_npz(path, animal_centers, time_points)
+	parsed = tools.parse_all_centers_file(path)
+
+	# Assert
+	assert parsed == (animal_centers, time_points)
+
+
+def test_parse_all_events_file_decodes_and_caches_xlsx(tmp_path, monkeypatch):
+	# Arrange
+	event_probability = {
+		0: [['groom', 0.93], ['NA', -1], ["mom's", 0.5]],
+		1: [['NA', -1], ['groom', 0.25], ['rear', 1.0]],
+	}
+	time_points = [0.0, 0.1, 0.2]
+	path = str(tmp_path / 'all_events.xlsx')
+	pd.DataFrame(event_probability, index=time_points).to_excel(path, float_format='%.2f', index_label='time/ID')
+
+	# Act
+	parsed = tools.parse_all_events_file(path)
+	monkeypatch.setattr(tools.pd, 'read_excel', None)
+	cached = tools.parse_all_events_file(path)
+
+	# Assert
+	assert parsed == (event_probability, time_points, ['groom', "mom's", 'rear'])
+	assert cached == parsed
+
+
+def test_parse_all_centers_file_decodes_xlsx(tmp_path):
+	# Arrange
+	animal_centers = {0: [(10, 20), None, (12, 21)], 1: [None, (100, 5), (101, 6)]}
+	time_points = [0.0, 0.1, 0.2]
+	path = str(tmp_path / 'all_centers.xlsx')
+	pd.DataFrame(animal_centers, index=time_points).to_excel(path, index_label='time/ID')
+
+	# Act
+	parsed = tools.parse_all_centers_file(path)
+
+	# Assert
+	assert parsed == (animal_centers, time_points)
+	assert (tmp_path / 'all_centers.xlsx.npz').exists()
+
+
+def test_assign_tracks_greedy_matches_closest_pairs_first():
+	# Arrange
+	existing_centers = [(0, 0), (10, 0), (-10000, -10000)]
+	centers = [(9, 0), (4, 0)]
+
+	# Act
+	pairs = tools.assign_tracks(existing_centers, centers)
+
+	# Assert
+	# (10, 0) takes (9, 0) first, so (0, 0) is left with (4, 0)
+	assert pairs == [(1, 0), (0, 1)]
+
+
+def test_assign_tracks_hungarian_minimizes_total_distance():
+	# Arrange
+	existing_centers = [(0, 0), (6, 0)]
+	centers = [(5, 0), (11, 0)]
+
+	# Act
+	greedy = tools.assign_tracks(existing_centers, centers)
+	hungarian = tools.assign_tracks(existing_centers, centers, method='hungarian')
+
+	# Assert
+	# greedy matches (6, 0) to (5, 0) and leaves (0, 0) with (11, 0)
+	assert sorted(greedy) == [(0, 1), (1, 0)]
+	assert hungarian == [(0, 0), (1, 1)]
+
+
+@pytest.mark.parametrize('method', ['greedy', 'hungarian'])
+def test_assign_tracks_gate(method):
+	# Arrange
+	existing_centers = [(0, 0), (50, 50), (100, 0), (-10000, -10000)]
+	centers = [(2, 1), (101, 3), (300, 300)]
+
+	# Act
+	pairs = tools.assign_tracks(existing_centers, centers, method=method, gate=10)
+
+	# Assert
+	# (50, 50) is too far from (300, 300), which is left to the ID that is not registered yet
+	assert sorted(pairs) == [(0, 0), (2, 1), (3, 2)]
+
+
+def test_assign_tracks_unknown_method():
+	with pytest.raises(ValueError):
+		tools.assign_tracks([(0, 0)], [(1, 1)], method='nearest')
+
+
+def test_find_neighbors_matches_all_pairs():
+	# Arrange
+	rng = np.random.default_rng(2)
+	centers = [tuple(int(v) for v in c) for c in rng.integers(0, 300, (40, 2))]
+	centers[5] = centers[4]
+	centers_array = np.array(centers)
+	distances_squared = np.sum((centers_array[:, None] - centers_array) ** 2, axis=2)
+
+	for distance_threshold in [0, 25.0, 60.5, float('inf')]:
+		determine = np.logical_and(distances_squared > 0, distances_squared < distance_threshold ** 2)
+
+		# Act
+		neighbors = tools.find_neighbors(centers, distance_threshold)
+
+		# Assert
+		assert neighbors == [np.flatnonzero(row).tolist() for row in determine]
+
+
+@pytest.mark.parametrize('background_free,black_background,color_costar', [(True, True, False), (True, False, True), (False, True, False)])
+def test_extract_blob_interact_matches_full_frame(background_free, black_background, color_costar):
+	# Arrange
+	rng = np.random.default_rng(3)
+	frame = rng.integers(20, 200, (240, 320, 3), dtype=np.uint8)
+	frame[200:, 300:] = 250
+	masks = []
+	contours = []
+	for (x, y) in [(60, 60), (90, 70), (250, 180)]:
+		mask = np.zeros((240, 320), dtype=np.uint8)
+		cv2.ellipse(mask, (x, y), (25, 12), 20, 0, 360, 1, -1)
+		masks.append(mask)
+		cnts, _ = cv2.findContours(mask * 255, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE)
+		contours.append(cnts[0])
+	# a stray piece of the main character mask, outside its contour
+	masks[0][230:235, 5:10] = 1
+	(y_bt, y_tp, x_lf, x_rt) = tools.crop_frame(frame, [contours[1], contours[0]])
+	if background_free:
+		other_mask = masks[1]
+		blob = frame * cv2.cvtColor(masks[0], cv2.COLOR_GRAY2BGR)
+		if color_costar:
+			other_blob = frame * cv2.cvtColor(other_mask, cv2.COLOR_GRAY2BGR)
+		else:
+			other_blob = cv2.cvtColor(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) * other_mask, cv2.COLOR_GRAY2BGR)
+		blob = cv2.add(blob, other_blob)
+		if black_background is False:
+			blob[(masks[0] | other_mask) == 0] = 255
+		blob = np.uint8(tools.exposure.rescale_intensity(blob, out_range=(0, 255)))
+	else:
+		blob = np.uint8(tools.exposure.rescale_intensity(frame, out_range=(0, 255)))
+	cv2.drawContours(blob, [contours[0]], 0, (255, 0, 255), 2)
+	expected = blob[y_bt:y_tp, x_lf:x_rt]
+	bounds = [tools.mask_bounds(mask) for mask in masks]
+
+	# Act
+	blob = tools.extract_blob_interact(frame, masks, bounds, 0, [1], contours[0], y_bt, y_tp, x_lf, x_rt, background_free=background_free, black_background=black_background, color_costar=color_costar)
+
+	# Assert
+	assert np.array_equal(blob, expected)
+
+
+def test_tile_regions_cover_the_frame():
+	# Arrange
+	frame_shape = (300, 500)
+
+	# Act
+	regions = tools.tile_regions(frame_shape, 128, overlap=32)
+
+	# Assert
+	covered = np.zeros(frame_shape, dtype=bool)
+	for (left, right, top, bottom) in regions:
+		assert (right - left, bottom - top) == (128, 128)
+		covered[top:bottom, left:right] = True
+	assert covered.all()
+	assert tools.tile_regions((100, 120), 128) == [(0, 120, 0, 100)]
+
+
+def test_merge_region_detections_joins_animals_cut_by_tiles():
+	# Arrange
+	frame_mask = np.zeros((100, 200), dtype=np.uint8)
+	cv2.ellipse(frame_mask, (100, 50), (40, 10), 0, 0, 360, 1, -1)
+	other_mask = np.zeros((100, 200), dtype=np.uint8)
+	cv2.circle(other_mask, (20, 50), 8, 1, -1)
+	regions = [(0, 120, 0, 100), (80, 200, 0, 100)]
+	detections = []
+	for (left, right, top, bottom) in regions:
+		masks = [frame_mask[top:bottom, left:right], other_mask[top:bottom, left:right]]
+		masks = [m for m in masks if m.any()]
+		detections.append((np.array(masks), np.zeros(len(masks), dtype=np.int64), np.linspace(0.6, 0.9, len(masks), dtype=np.float32)))
+
+	# Act
+	masks, classes, scores = tools.merge_region_detections((100, 200), regions, detections)
+
+	# Assert
+	assert len(masks) == 2
+	assert np.array_equal(masks[0], frame_mask)
+	assert np.array_equal(masks[1], other_mask)
+	assert classes.tolist() == [0, 0]
+	assert scores[0] == np.float32(0.6)
+
+
+def test_propagate_masks_follows_a_moving_animal():
+	# Arrange
+	rng = np.random.default_rng(0)
+	texture = cv2.GaussianBlur(rng.integers(100, 256, (200, 200), dtype=np.uint8), (5, 5), 0)
+	mask = np.zeros((200, 200), dtype=np.uint8)
+	cv2.ellipse(mask, (80, 100), (30, 15), 20, 0, 360, 1, -1)
+	shift = np.float32([[1, 0, 5], [0, 1, 3]])
+	previous_frame = np.where(mask > 0, texture, 20).astype(np.uint8)
+	frame = cv2.warpAffine(previous_frame, shift, (200, 200), borderValue=20)
+	moved_mask = cv2.warpAffine(mask, shift, (200, 200), flags=cv2.INTER_NEAREST)
+
+	# Act
+	propagated = tools.propagate_masks(previous_frame, frame, mask[None])
+
+	# Assert
+	assert propagated.shape == (1, 200, 200)
+	overlap = np.count_nonzero(propagated[0] & moved_mask) / np.count_nonzero(propagated[0] | moved_mask)
+	assert overlap > 0.9
+
+
+def test_propagate_masks_rejects_unreliable_flow():
+	# Arrange
+	mask = np.zeros((200, 200), dtype=np.uint8)
+	cv2.circle(mask, (40, 100), 15, 1, -1)
+	previous_frame = np.where(mask > 0, 200, 20).astype(np.uint8)
+	frame = np.roll(previous_frame, 100, axis=1)
+
+	# Act
+	propagated = tools.propagate_masks(previous_frame, frame, mask[None])
+
+	# Assert
+	assert propagated is None
+	assert tools.propagate_masks(previous_frame, frame, np.zeros((1, 200, 200), dtype=np.uint8)) is None
+
+
+def test_sample_background_stops_once_it_converges(tmp_path, capsys):
+	# Arrange
+	# 600 frames at 30 fps, a bright square moving over a dark background with a gradient
+	path = str(tmp_path / 'moving.avi')
+	background = np.tile(np.linspace(20, 80, 64, dtype=np.uint8), (48, 1))[:, :, None].repeat(3, axis=2)
+	writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), 30, (64, 48), True)
+	for n in range(600):
+		frame = background.copy()
+		x = n % 54
+		frame[20:30, x:x + 10] = 250
+		writer.write(frame)
+	writer.release()
+
+	# Act
+	sampled = tools.sample_background(path, 400, min_samples=16)
+
+	# Assert
+	(background_normal, background_low, background_high, frame_initial) = sampled
+	assert cv2.absdiff(background_normal, background).max() <= 20
+	assert background_low is None and background_high is None
+	assert frame_initial.shape == (48, 64, 3)
+	sampled_count = int(capsys.readouterr().out.split('Background extracted from ')[1].split()[0])
+	assert 32 <= sampled_count < 400
+
+
+def test_cached_constants_are_reused_losslessly(tmp_path):
+	# Arrange
+	video = tmp_path / 'video.avi'
+	video.write_bytes(bytes(range(256)) * 1000)
+	rng = np.random.default_rng(0)
+	constants = (rng.integers(0, 256, (48, 64, 3), dtype=np.uint8), np.zeros((48, 64, 3), dtype=np.uint8), np.ones((48, 64, 3), dtype=np.uint8), 2, 123.25)
+	calls = []
+	def estimate():
+		calls.append(1)
+		return constants
+	parameters = {'delta': 1.2, 'ex_start': 0, 'ex_end': None}
+
+	# Act
+	first = tools.cached_constants(str(tmp_path / 'cache'), str(video), parameters, estimate)
+	second = tools.cached_constants(str(tmp_path / 'cache'), str(video), parameters, estimate)
+	tools.cached_constants(str(tmp_path / 'cache'), str(video), dict(parameters, ex_end=10), estimate)
+	video.write_bytes(bytes(range(256)) * 999 + bytes(255) + b'x')
+	tools.cached_constants(str(tmp_path / 'cache'), str(video), parameters, estimate)
+
+	# Assert
+	assert first is constants
+	assert len(calls) == 3
+	assert all(np.array_equal(a, b) for a, b in zip(second[:3], constants[:3]))
+	assert second[3] == 2 and type(second[3]) is int
+	assert second[4] == 123.25
+
+
+def test_find_stim_t_in_a_luminance_track():
+	# Arrange
+	luminance = np.full(300, 50.0, dtype=np.float32)
+	luminance[120:] = 80
+
+	# Act
+	stim_t = tools.find_stim_t(luminance, 30, 1.2)
+	unchanged = tools.find_stim_t(luminance[:120], 30, 1.2)
+
+	# Assert
+	assert stim_t == 121 / 30
+	assert unchanged is None
+
+
+def test_luminance_track_is_cached(tmp_path):
+	# Arrange
+	path = str(tmp_path / 'flash.avi')
+	writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), 30, (64, 48), True)
+	for n in range(90):
+		writer.write(np.full((48, 64, 3), 40 if n < 45 else 160, dtype=np.uint8))
+	writer.release()
+
+	# Act
+	first = tools.cached_luminance_track(str(tmp_path / 'cache'), path)
+	second = tools.cached_luminance_track(str(tmp_path / 'cache'), path)
+
+	# Assert
+	assert len(first) == 90
+	assert np.array_equal(first, second)
+	assert tools.find_stim_t(second, 30, 2) == 46 / 30
+
+
+@pytest.mark.parametrize('animal_vs_bg', [0, 1])
+def test_contour_frame_with_given_means(frame_and_contours, animal_vs_bg):
+	# Arrange
+	(frame, _) = frame_and_contours
+	background = np.full(frame.shape, 255 if animal_vs_bg == 1 else 0, dtype=np.uint8)
+	inverted = np.uint8(255 - frame) if animal_vs_bg == 1 else frame
+	inverted_background = np.uint8(255 - background) if animal_vs_bg == 1 else background
+
+	# Act
+	default = tools.contour_frame(frame, 2, inverted_background, inverted_background, inverted_background, 1.2, 10, animal_vs_bg=animal_vs_bg)
+	given = tools.contour_frame(frame, 2, inverted_background, inverted_background, inverted_background, 1.2, 10, animal_vs_bg=animal_vs_bg,
+		frame_mean=np.mean(inverted), background_mean=np.mean(inverted_background))
+
+	# Assert
+	assert default[1] == given[1]
+	assert all(np.array_equal(a, b) for a, b in zip(default[0], given[0]))
+
+
+def test_working_image_converts_only_when_asked(frame_and_contours):
+	# Arrange
+	(frame, _) = frame_and_contours
+
+	# Act
+	same = tools.working_image(frame)
+	small = tools.working_image(frame, segment_scale=0.5)
+	gray = tools.working_image(frame, segment_scale=0.25, segment_gray=True)
+
+	# Assert
+	assert same is frame
+	assert small.shape == (60, 80, 3)
+	assert gray.shape == (30, 40)
+
+
+@pytest.mark.parametrize('segment_gray', [False, True])
+def test_contour_frame_at_half_resolution_matches_full_resolution(segment_gray):
+	# Arrange
+	# two large animals on a noisy background
+	rng = np.random.default_rng(0)
+	background = np.uint8(np.clip(rng.normal(60, 5, (480, 640, 3)), 0, 255))
+	frame = background.copy()
+	cv2.ellipse(frame, (200, 150), (80, 30), 30, 0, 360, (200, 190, 180), -1)
+	cv2.ellipse(frame, (450, 320), (80, 30), -20, 0, 360, (200, 190, 180), -1)
+	working_background = tools.working_image(background, segment_scale=0.5, segment_gray=segment_gray)
+
+	# Act
+	full = tools.contour_frame(frame, 2, background, background, background, 10000, 7500, kernel=5)
+	half = tools.contour_frame(frame, 2, working_background, working_background, working_background, 10000, 7500, kernel=5, segment_scale=0.5, segment_gray=segment_gray)
+
+	# Assert
+	assert len(half[0]) == 2
+	for contour, center in zip(full[0], full[1]):
+		(index, half_center) = min(enumerate(half[1]), key=lambda x: math.dist(x[1], center))
+		full_mask = np.zeros(frame.shape[:2], dtype=np.uint8)
+		half_mask = np.zeros(frame.shape[:2], dtype=np.uint8)
+		cv2.drawContours(full_mask, [contour], 0, 1, -1)
+		cv2.drawContours(half_mask, [half[0][index]], 0, 1, -1)
+		assert (full_mask & half_mask).sum() / (full_mask | half_mask).sum() > 0.95
+		assert math.dist(half_center, center) <= 2
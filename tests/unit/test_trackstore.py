@@ -0,0 +1,98 @@
+import cv2
+import numpy as np
+
+from LabGym import tools
+from LabGym.trackstore import TrackStore
+
+
+def test_tracks_behave_like_lists():
+	# Arrange
+	store = TrackStore(5, IDs=[0, 1], frame_size=(120, 160))
+	contour = cv2.ellipse2Poly((60, 40), (20, 10), 30, 0, 360, 10).reshape(-1, 1, 2)
+	expected_centers = [None, (10, 20), None, (11, 22), None]
+
+	# Act
+	store.contours[1][3] = contour
+	store.centers[1][1] = (10, 20)
+	store.centers[1][3] = (11, 22)
+	store.heights[1][-2] = 14.5
+
+	# Assert
+	assert len(store.centers) == 2 and 1 in store.centers
+	assert list(store.centers[1]) == expected_centers
+	assert store.centers[1][1:4] == expected_centers[1:4]
+	assert store.heights[1][3] == 14.5 and store.heights[0][3] is None
+	assert store.contours[1][3].dtype == np.int32
+	assert np.array_equal(store.contours[1][3], contour)
+	assert cv2.contourArea(store.contours[1][3]) == cv2.contourArea(contour)
+	assert store.contours[1][2] is None
+	assert np.array_equal(tools.track_array(store.centers[1], dimension=2), tools.track_array(expected_centers, dimension=2), equal_nan=True)
+
+
+def test_add_remove_and_truncate():
+	# Arrange
+	store = TrackStore(6, frame_size=(120, 160))
+	for ID in range(7):
+		store.add(ID)
+		store.centers[ID][ID % 6] = (ID, ID)
+		store.contours[ID][ID % 6] = np.array([[[ID, 0]], [[ID, 5]], [[ID + 5, 5]]])
+
+	# Act
+	store.remove(3)
+	store.truncate(4)
+
+	# Assert
+	assert store.centers.keys() == [0, 1, 2, 4, 5, 6]
+	assert len(store.centers[6]) == 4
+	assert store.centers[6][0] == (6, 6)
+	assert store.centers.to_dict()[5] == [None, None, None, None]
+	assert store.contours[2][2][0].tolist() == [[2, 0]]
+	assert len(store.points) == store.point_count
+
+
+def test_large_frames_keep_int32_points():
+	# Arrange
+	store = TrackStore(2, IDs=[0], frame_size=(40000, 100))
+	contour = np.array([[[0, 39999]], [[10, 39999]], [[10, 39990]]], dtype=np.int32)
+
+	# Act
+	store.contours[0][0] = contour
+
+	# Assert
+	assert np.array_equal(store.contours[0][0], contour)
+
+
+def test_remove_and_truncate_compact_the_arrays():
+	# Arrange
+	store = TrackStore(4, IDs=[0, 1, 2], frame_size=(120, 160))
+	for ID in range(3):
+		store.heights[ID][1] = ID + 0.5
+		store.contours[ID][1] = np.array([[[ID, 0]], [[ID, 9]], [[ID + 9, 9]]])
+	store.contours[2][1] = np.array([[[7, 7]], [[8, 8]]])  # replaces a contour
+
+	# Act
+	store.remove(0)
+	store.truncate(3)
+
+	# Assert
+	assert store.row_count == 2 and store.height_data.shape == (2, 3)
+	assert store.heights[2][1] == 2.5 and store.heights[1][1] == 1.5
+	assert store.contours[2][1].tolist() == [[[7, 7]], [[8, 8]]]
+	assert store.contours[1][1].tolist() == [[[1, 0]], [[1, 9]], [[10, 9]]]
+	assert store.point_count == 5 and len(store.points) == 5
+
+
+def test_slices_are_windows_of_the_track():
+	# Arrange
+	store = TrackStore(10, IDs=[0], frame_size=(120, 160))
+	store.centers[0][4] = (4, 8)
+
+	# Act
+	window = store.centers[0][2:8]
+	store.centers[0][6] = (6, 12)
+
+	# Assert
+	assert len(window) == 6 and window[2] == (4, 8) and window[-2] == (6, 12)
+	assert window[1:4] == [None, (4, 8), None]
+	assert list(store.centers[0][8:2:-2]) == [None, (6, 12), (4, 8)]
+	assert np.array_equal(window.to_array(), tools.track_array(list(window), dimension=2), equal_nan=True)